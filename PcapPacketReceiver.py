@@ -3,6 +3,9 @@ PcapPacketReceiver.py
 Cody LaFlamme
 """
 import queue
+import threading
+import time
+import struct
 
 """
 if this program is executed by itself, it expects a file path input.
@@ -34,6 +37,29 @@ def main():
     
 ##############################################################################
 
+#pcap constants
+PCAP_MAGIC = 0xa1b2c3d4 #microsecond timestamps
+PCAP_MAGIC_NANOSECOND = 0xa1b23c4d #nanosecond timestamps (e.g. tcpdump --time-stamp-precision=nano)
+PCAP_HEADER_LENGTH = 24
+PCAP_RECORD_HEADER_LENGTH = 16
+LINKTYPE_USB_LINUX = 189 #linux usbmon, 48 byte header
+LINKTYPE_USBPCAP = 249 #windows USBPcap
+LINKTYPE_USB_LINUX_MMAPPED = 220 #linux usbmon, 64 byte header (what tcpdump and dumpcap capture from usbmonX)
+
+#struct format prefixes for each endianness
+STRUCT_BYTE_ORDER = {'little': '<', 'big': '>'}
+
+#usbmon transfer types are numbered like USBPcap's; these are the URB functions USBPcap reports for each of them
+URB_FUNCTION_CONTROL_TRANSFER = 0x08
+URB_FUNCTION_BULK_OR_INTERRUPT_TRANSFER = 0x09
+URB_FUNCTION_ISOCH_TRANSFER = 0x0A
+TRANSFER_ISOCHRONOUS = 0
+TRANSFER_INTERRUPT = 1
+TRANSFER_CONTROL = 2
+TRANSFER_BULK = 3
+USBMON_FUNCTIONS = {TRANSFER_ISOCHRONOUS: URB_FUNCTION_ISOCH_TRANSFER, TRANSFER_INTERRUPT: URB_FUNCTION_BULK_OR_INTERRUPT_TRANSFER,
+                    TRANSFER_CONTROL: URB_FUNCTION_CONTROL_TRANSFER, TRANSFER_BULK: URB_FUNCTION_BULK_OR_INTERRUPT_TRANSFER}
+
 class PacketBlock:
     """Protocol agnostic packet block. Contains header info and raw data."""
     def __init__(self, pBytes = None, endianness = 'little'):
@@ -68,24 +94,74 @@ class USBPacket:
         self.payload = b''
         
         if (blockDataBytes!=None):
-            self.IRP = blockDataBytes[2:10]
-            self.status     = int.from_bytes(blockDataBytes[10:14], endianness)
-            self.function   = int.from_bytes(blockDataBytes[14:16], endianness)
-            self.info       = int.from_bytes(blockDataBytes[16:17], endianness)
-            self.bus        = int.from_bytes(blockDataBytes[17:19], endianness)
-            self.address    = int.from_bytes(blockDataBytes[19:21], endianness)
-            self.endpoint   = int.from_bytes(blockDataBytes[21:22], endianness)
-            self.transfer_type = int.from_bytes(blockDataBytes[22:23], endianness)
-            self.data_length = int.from_bytes(blockDataBytes[23:27], endianness)
-            
-            if (self.transfer_type == 2):
-                self.transfer_stage = int.from_bytes(blockDataBytes[27:28], endianness)
-                if (self.data_length > 0):
-                    self.payload = blockDataBytes[28:28+self.data_length]
-            else:
-                self.transfer_stage = -1
-                if (self.data_length > 0):
-                    self.payload = blockDataBytes[27:27+self.data_length]
+            decode_usbpcap(blockDataBytes, endianness, self)
+
+######################################################
+##                 HEADER DECODERS                  ##
+######################################################
+#each decoder reads one link layer's packet header into a USBPacket, so everything downstream of the receiver works the
+#same whichever capture tool recorded the packets. decode(data, endianness, packet = None) fills in and returns packet
+#(a new USBPacket if None). to support another capture format, write a decoder and add it to DECODERS under its linktype.
+
+#USBPcap: header length, IRP id, status, URB function, info, bus, device address, endpoint, transfer type, data length
+USBPCAP_HEADER = {e: struct.Struct(prefix + "H8sIHBHHBBI") for e, prefix in STRUCT_BYTE_ORDER.items()}
+
+def decode_usbpcap(data, endianness = 'little', packet = None):
+    if packet is None:
+        packet = USBPacket()
+    header = USBPCAP_HEADER[endianness]
+    if len(data) < header.size:
+        return packet #truncated; leave the defaults
+    (header_length, packet.IRP, packet.status, packet.function, packet.info, packet.bus, packet.address,
+     packet.endpoint, packet.transfer_type, packet.data_length) = header.unpack_from(data)
+    if (packet.transfer_type == TRANSFER_CONTROL):
+        packet.transfer_stage = data[header.size] if len(data) > header.size else -1
+        header_length = max(header_length, header.size + 1)
+    else:
+        header_length = max(header_length, header.size)
+    if (packet.data_length > 0):
+        packet.payload = data[header_length:header_length+packet.data_length]
+    return packet
+
+#usbmon (struct mon_bin_hdr): URB id, event type, transfer type, endpoint, device address, bus, setup flag, data flag,
+#timestamp seconds & microseconds, status, URB length, captured length, setup packet. the 64 byte (mmapped) header adds
+#interval, start frame, transfer flags and iso descriptor count, which we don't use; data follows the header either way.
+USBMON_HEADER = {e: struct.Struct(prefix + "8scBBBHcBqiiII8s") for e, prefix in STRUCT_BYTE_ORDER.items()}
+USBMON_HEADER_LENGTH = 48
+USBMON_MMAPPED_HEADER_LENGTH = 64
+
+def decode_usbmon(data, endianness = 'little', packet = None, header_length = USBMON_HEADER_LENGTH):
+    #usbmon reports a transfer twice: 'S' when the host submits it, and 'C' when it completes (with the data of an IN
+    #transfer). USBPcap marks completions with info bit 0, so 'C' (and 'E', an error) events get info = 1.
+    #usbmon statuses are negative errnos (e.g. -EINPROGRESS on submission), so as with USBPcap, only 0 means success.
+    if packet is None:
+        packet = USBPacket()
+    header = USBMON_HEADER[endianness]
+    if len(data) < header.size:
+        return packet
+    (packet.IRP, event_type, packet.transfer_type, packet.endpoint, packet.address, packet.bus, flag_setup, _,
+     _, _, packet.status, _, packet.data_length, setup) = header.unpack_from(data)
+    packet.function = USBMON_FUNCTIONS.get(packet.transfer_type, 0)
+    packet.info = 0 if event_type == b'S' else 1
+    packet.payload = data[header_length:header_length+packet.data_length] if packet.data_length > 0 else b''
+    if (packet.transfer_type == TRANSFER_CONTROL):
+        #USBPcap reports control transfers in stages: the setup packet, then any data, then the status
+        if flag_setup == b'\x00':
+            packet.transfer_stage = 0
+            packet.payload = setup
+            packet.data_length = len(setup)
+        else:
+            packet.transfer_stage = 1 if packet.data_length > 0 else 2
+    return packet
+
+def decode_usbmon_mmapped(data, endianness = 'little', packet = None):
+    return decode_usbmon(data, endianness, packet, USBMON_MMAPPED_HEADER_LENGTH)
+
+DECODERS = {
+    LINKTYPE_USBPCAP: decode_usbpcap,
+    LINKTYPE_USB_LINUX: decode_usbmon,
+    LINKTYPE_USB_LINUX_MMAPPED: decode_usbmon_mmapped,
+}
 
 class PcapPacketReceiver:
     """    
@@ -97,6 +173,17 @@ class PcapPacketReceiver:
     if reading from a file.
     "halt_event" is a threading.event that can be set from another thread to
     tell the receiver's run() function to stop running (used when loop is true)
+    "stage_timer" is an optional profiling.StageTimer; if given, the time
+    spent parsing each packet is recorded under the "parse" stage.
+    "decoder" is the header decoder for the packets (see DECODERS). If None,
+    it is chosen by the linktype in the pcap file header; unknown linktypes
+    are read as USBPcap. The byte order and timestamp resolution also come
+    from the file header.
+    "address", if given, drops packets from other devices. USBPcap is told
+    which device to capture, but usbmon captures a whole bus.
+    While paused (pause(), until resume()), packets are still read from the
+    stream, so the capture tool never blocks on a full pipe, but they are
+    discarded without being decoded.
     
     Packets are assembled into a Queue of Packet objects. This Queue can be
     read from at any time (python Qs are thread safe).
@@ -114,34 +201,66 @@ class PcapPacketReceiver:
     naturally terminate otherwise). The queue can then be read when run()
     returns, and the given in_stream can be closed.
     """
-    def __init__(self, in_stream, loop=False, halt_event = None):
+    def __init__(self, in_stream, loop=False, halt_event = None, stage_timer = None, decoder = None, address = None):
         self.in_stream = in_stream
         self.q = queue.Queue()
         self.loop = loop
         self.halt_event = halt_event
+        self.stage_timer = stage_timer
+        self.decoder = decoder
+        self.address = address
+        self.linktype = None
+        self.endianness = 'little'
+        self.nanosecond = False
+        self.paused = threading.Event()
+    
+    def read_header(self, header):
+        #pcap file header: magic, version (2 2-byte values), timezone, timestamp accuracy, snap length, linktype
+        magic = int.from_bytes(header[0:4], 'little')
+        if magic in [PCAP_MAGIC, PCAP_MAGIC_NANOSECOND]:
+            self.endianness = 'little'
+        elif int.from_bytes(header[0:4], 'big') in [PCAP_MAGIC, PCAP_MAGIC_NANOSECOND]:
+            self.endianness = 'big'
+            magic = int.from_bytes(header[0:4], 'big')
+        self.nanosecond = magic == PCAP_MAGIC_NANOSECOND
+        self.linktype = int.from_bytes(header[20:24], self.endianness)
+        if self.decoder is None:
+            self.decoder = DECODERS.get(self.linktype, decode_usbpcap)
             
     def run(self):
         
-        #read first few bytes to consume pcap header (6 4-byte values)
-        #we don't use this information, and instead assume our data is little
-        #endian, and that timestamps have usec resolution
-        self.in_stream.read(6*4)
+        #read the pcap file header (6 4-byte values): byte order, timestamp resolution and linktype
+        self.read_header(self.in_stream.read(PCAP_HEADER_LENGTH))
+        record_header = struct.Struct(STRUCT_BYTE_ORDER[self.endianness] + "IIII")
 
-        pHeader = self.in_stream.read(4*4) #read first packet header: 4 4-byte values
+        pHeader = self.in_stream.read(PCAP_RECORD_HEADER_LENGTH) #read first packet header: 4 4-byte values
         
         while(self.halt_event==None or not self.halt_event.is_set()):
             while(pHeader != b'' and (self.halt_event==None or not self.halt_event.is_set())):
                 #loop until we've read every packet available
-                pLen = int.from_bytes(pHeader[8:12], 'little')
+                pLen = int.from_bytes(pHeader[8:12], self.endianness)
                 pData = self.in_stream.read(pLen)
-                block = PacketBlock(pHeader + pData)
-                block.packet = USBPacket(block.data)
+                if self.paused.is_set():
+                    pHeader = self.in_stream.read(PCAP_RECORD_HEADER_LENGTH)
+                    continue
+                if self.stage_timer is not None:
+                    t0 = time.perf_counter()
+                block = PacketBlock()
+                if len(pHeader) == PCAP_RECORD_HEADER_LENGTH: #if we have a full header
+                    block.ts_sec, block.ts_usec, block.incl_len, block.orig_len = record_header.unpack(pHeader)
+                    if self.nanosecond:
+                        block.ts_usec = block.ts_usec//1000
+                block.data = pData
+                block.packet = self.decoder(pData, self.endianness)
+                if self.stage_timer is not None:
+                    self.stage_timer.record("parse", time.perf_counter() - t0)
                 
                 #q cannot currently become full. we'll run out of memory first.  
-                self.q.put(block)
+                if self.address is None or block.packet.address == self.address:
+                    self.q.put(block)
                 #read header for next block.
                 #if empty, we wait for more (if loop) or finish execution.
-                pHeader = self.in_stream.read(4*4)
+                pHeader = self.in_stream.read(PCAP_RECORD_HEADER_LENGTH)
             if (self.loop == False):
                 break #I miss do-whiles
             if (self.halt_event.is_set()):
@@ -149,6 +268,15 @@ class PcapPacketReceiver:
         
     def halt(self):
         self.halt_event.set()
+    
+    def pause(self):
+        self.paused.set()
+    
+    def resume(self):
+        #packets queued before the pause are dropped too, so the next waveform is framed from fresh packets
+        while not self.q.empty():
+            self.q.get_nowait()
+        self.paused.clear()
 
 ##############################################################################
 
@@ -5,54 +5,67 @@ Created on Wed Oct 23 13:50:16 2019
 
 @author: Cody
 """
-#should launch USBPcap with arguments based on command line input.
-#uses a PcapPacketReceiver to process output from USBPcap.
+#should launch USBPcap (or tcpdump on usbmon, on linux) with arguments based on command line input.
+#uses a PcapPacketReceiver to process output from the capture tool (see capture_sources.py).
+#with -mp, the capture & framing run in a separate process instead, which hands waveforms over in shared memory (see waveform_ring.py).
 #notices waveforms that are transmitted and visualizes them.
 #waits for user to quit, then tells receiver to halt.
 
 """
 DEPENDENCIES
-- USBPcap installation
+- USBPcap installation (windows)
+- tcpdump, and the usbmon kernel module (linux; captures from usbmon need root or read access to /dev/usbmonX)
 - libusb-1.0.dll (for pyusb. needs to be found in system PATH. solves "No backend available" from pyusb)
-- matplotlib (in conda)
+- matplotlib (in conda; only needed with USE_MATPLOTLIB)
 - numpy (in conda)
-- curses (in pip, use "windows-curses" on windows)
-- pyformulas (in pip)
+- curses (in pip, use "windows-curses" on windows; only needed with USE_CURSES)
+- pyformulas (in pip; not needed with -headless)
     - pyaudio (required by pyformulas, in conda)
     - portaudio (required by pyformulas, in conda)
-- pygame (in pip)
+- pygame (in pip; not needed with -headless)
 - pyyaml (in conda)
-- pyusb (in pip)
+- pyusb (in pip; only needed to auto-detect the device)
 - scipy (conda)
 """
 ######################################################
 ##                    IMPORTS                       ##
 ######################################################
 #built in python modules
+import time
+STARTUP_TIME = time.perf_counter() #startup is timed from here, so the imports below are counted
 import sys
 import os
-import subprocess
+import socket
 from concurrent.futures import ThreadPoolExecutor
 import traceback
 import threading
-import time
+import queue
 from collections import deque
 
 #python libraries
 import numpy as np
-import curses
-import matplotlib.pyplot as plt
-import pyformulas as pf
-import pygame
-import yaml
-import usb
 import datetime as dt
 import re
 
 #homegrown code
 from PcapPacketReceiver import *
+import capture_sources
 import fault_detection
-import ui_elements as ui
+import panel_layout
+from profiling import StageTimer, StartupTimer, ProfileCapture
+from log_writer import LogWriter
+import binary_log
+import log_index
+import waveform_archive
+from waveform_framer import WaveformFramer, convert_waveform_region, convert_waveform_region_prototype
+import waveform_framer
+from curses_status import CursesStatus
+from handoff import LatestValue
+from dashboard import DashboardServer
+import fleet
+import scheduler
+#curses, pygame, pyformulas, pyusb (and ui_elements & waveform_plot, which use pygame) are slow to import, and not every
+#mode needs them; they are imported where they are first needed, so e.g. a headless restart doesn't wait on the GUI libraries
 
 ######################################################
 ##                   CONSTANTS                      ##
@@ -63,11 +76,28 @@ DEBUG_LOG = True
 DEBUG_VERIFICATION = False
 VERBOSE_LOGGING = False
 DEBUG_LAYOUT = True
+STAGE_TIMING = True #time each stage of the main loop; rolling percentiles are shown in curses and written to the debug log
+TIMING_REPORT_INTERVAL = 5 #seconds between stage timing reports
+PROFILE_DIR = "profiles" #cProfile captures (from the 'p' key or -profile argument) are dumped here
+PROFILE_SECONDS = 30 #length of a cProfile capture started with the 'p' key
+LOG_FLUSH_INTERVAL = 1.0 #seconds between flushes of logged waveforms to the output file
+LOG_FSYNC_INTERVAL = 10.0 #seconds between fsyncs of the output file; 0 syncs every flush, -1 never syncs
+FLEET_SPOOL_DIR = "fleet_spool" #fault events & waveforms for the fleet collector (-fleet) are spooled here until sent
+RING_POLL_INTERVAL = 0.005 #seconds the main loop waits for the capture process (-mp) when there is nothing else to do
+SCHEDULE_IDLE_POLL = 0.25 #seconds the main loop sleeps at a time between scheduled measurements; commands & keys are handled in between
+USE_MATPLOTLIB = False #plot waveforms with matplotlib (slow: a full figure redraw per waveform) instead of waveform_plot
+PLOT_FONT_SIZE = 14
+RENDER_FPS = 30 #the display is redrawn at most this often; acquisition & detection run at the full probe rate regardless
+STARTUP_BUDGET = 3.0 #seconds from launch until waveforms can be received; the startup timing report flags slower starts
 
 #FAULT_DETECTION_METHOD = fault_detection.METHOD_NONE
 FAULT_DETECTION_METHOD = fault_detection.METHOD_BLS_PEAKS
 #FAULT_DETECTION_METHOD = fault_detection.METHOD_LOW_PASS_PEAKS
 #FAULT_DETECTION_METHOD = fault_detection.METHOD_BLS_DEVIATION_CORRECTION
+#FAULT_DETECTION_METHOD = fault_detection.METHOD_DICTIONARY_LEARNING #also selected by -dictionary
+DICTIONARY_PATH = "dictionary.npy" #atoms learned by dictionary_learning.py, for METHOD_DICTIONARY_LEARNING
+CALIBRATION_PATH = "calibration.json" #feet per sample & zero index fitted by calibration.py; loaded at startup if it exists
+COARSE_TO_FINE_DETECTION = False #search for faults on the raw grid, and only interpolate around candidates (also enabled by -coarse)
 
 
 SCREEN_SIZE = SCREEN_X, SCREEN_Y = 800, 480
@@ -91,6 +121,8 @@ CONNECTOR_COLOR = COLOR_RED
 
 PANEL_SCALE = 1/15
 PANEL_PADDING = (50, 50)
+STRING_PADDING = 20 #pixels between parallel strings
+ARRAY_MAX_HEIGHT_RATIO = 0.8 #arrays taller than this fraction of the visual area are scaled down to fit
 WIRE_WIDTH = 2
 PANEL_SCREEN_X_RATIO = 1/2+1/8
 CONNECTOR_SIZE = 5
@@ -100,8 +132,8 @@ CONNECTOR_WIDTH = WIRE_WIDTH
 ##                 DEVICE SUPPORT                   ##
 ######################################################
 
-DEVICE_PROTOTYPE = 0 #such as the UF lab's PCB SSTDR
-DEVICE_COMMERCIAL = 1 #such as the commercial devices available at the U and livewire
+DEVICE_PROTOTYPE = waveform_framer.DEVICE_PROTOTYPE #such as the UF lab's PCB SSTDR
+DEVICE_COMMERCIAL = waveform_framer.DEVICE_COMMERCIAL #such as the commercial devices available at the U and livewire
 
 ######################################################
 ##               STATE DEFINITION                   ##
@@ -112,18 +144,50 @@ class MonitorState:
     def __init__(self):
         self.logging = False #is the system recording data?
         self.measurement_counter = 0 #the number of measurements to take before stopping logging (if 0, never stop)
+        self.scheduled_count = 0 #waveforms still to be logged for the scheduled measurement(s) that are due
         self.log_number = 0 #the current log number (groups like measurements by assigning all the same number)
         self.session_number = 0 #the current session number (increases by 1 every time the software is launched & pointed at the same file)
         self.file_has_header = False #has the system yet to write the frst data row? (if so, write the header row in addition to data)
         self.last_log_time = dt.datetime.now()
-        self.next_log_time = dt.datetime.now()
+        self.next_log_time = None #of the next scheduled measurement, if any
         self.device_class = None
+
+#struct for the results of processing one waveform, handed from the acquisition thread to the render loop
+class DisplayFrame:
+    def __init__(self, feet, plot_y, bls, ylim, markers, fault, fault_locations, fault_string):
+        self.feet = feet #distance axis of the plot
+        self.plot_y = plot_y #processed waveform, or BLS if a baseline is set
+        self.bls = bls #True if plot_y is the BLS
+        self.ylim = ylim
+        self.markers = markers #distances to mark on the plot
+        self.fault = fault #(fault type, distance in feet) from the detector
+        self.fault_locations = fault_locations #panel_layout.FaultLocation for every string the fault could be on
+        self.fault_string = fault_string
+
+######################################################
+##                    COMMANDS                      ##
+######################################################
+
+#fake enum of commands sent from the render loop (key presses) to the acquisition thread
+COMMAND_SET_BASELINE = 0
+COMMAND_TOGGLE_LOGGING = 1
+COMMAND_RECORD_TERMINAL = 2
+COMMAND_SET_TERMINAL = 3
+COMMAND_THRESHOLD_DOWN = 4
+COMMAND_THRESHOLD_UP = 5
+COMMAND_WINDOW_MEASUREMENT = 6
+COMMAND_NEXT_LOG = 7
+COMMAND_PROFILE = 8
         
 def main(cscreen = None):
     ######################################################
     ##                    STARTUP                       ##
     ######################################################
     
+    #time each startup step; the report is logged once startup is done
+    startup_timer = StartupTimer(STARTUP_TIME, STARTUP_BUDGET)
+    startup_timer.lap("imports")
+    
     #default values
     arg_filter = None
     arg_address = None
@@ -131,13 +195,30 @@ def main(cscreen = None):
     file_mode = False
     output_path = "SSTDR_waveforms.csv"
     yaml_path = 'default.yaml'
-    time_interval = -1
+    time_interval = -1 #if set, log one waveform every this many seconds (aligned to the clock); same as -schedule interval:N
+    schedule_specs = [] #scheduled measurements (see scheduler.py), e.g. "burst:1h:10"; waveforms are logged when they are due
+    idle = False #if set (-idle), the pipeline is idle between scheduled measurements: no fault detection, display, dashboard or fleet events until the next one
+    location = None #(latitude, longitude), for daylight schedules
     debug_log_path = 'log.txt'
+    pcap_path = None #if set, packets are read from this pcap file (or stdin, if '-') instead of from USBPcap/usbmon
+    capture = capture_sources.DEFAULT_CAPTURE #live capture tool: USBPcap on windows, tcpdump on usbmon on linux
+    device_class = None #only needed with -pcap; otherwise the device class is found while auto-detecting the device
+    coarse_to_fine = COARSE_TO_FINE_DETECTION
+    detection_method = FAULT_DETECTION_METHOD
+    dictionary_path = DICTIONARY_PATH
+    calibration_path = CALIBRATION_PATH
+    profile_seconds = 0 #if >0, record a cProfile of the main loop for this many seconds after startup
+    dashboard_port = None #if set, serve a live dashboard (dashboard.py) on this port
+    fleet_address = None #if set, send fault events (and sampled waveforms) to the fleet collector (fleet.py) at this (host, port)
+    unit_id = socket.gethostname() #identifies this unit to the fleet collector
+    fleet_waveform_interval = fleet.DEFAULT_WAVEFORM_INTERVAL #seconds between waveforms sent to the fleet collector; 0 sends none
+    headless = False #if set, there is no pygame display or plot window; the curses console (and dashboard) remain
+    multiprocess = False #if set, packets are parsed & framed by a separate capture process (capture_sources.RingCapture), leaving this one's GIL to detection & rendering
     baseline_indices = [0]
     terminal_indices = [0]
     
     #read cmd line arguments
-    valid_args = ['-yaml', 'y', '-filter', '-f', '-address', '-a', '-file', '-out', '-o', '-curses', '-c', '-no-curses', '-nc', '-interval', '-i', '-t', '-bli','-tli','-ti']
+    valid_args = ['-yaml', 'y', '-filter', '-f', '-address', '-a', '-file', '-out', '-o', '-curses', '-c', '-no-curses', '-nc', '-interval', '-i', '-t', '-bli','-tli','-ti', '-pcap', '-device', '-profile', '-dictionary', '-dashboard', '-capture', '-fleet', '-unit', '-fleet-waveforms', '-schedule', '-location', '-calibration']
     args = {}
     skip = False
     for i,arg in enumerate(sys.argv):
@@ -163,6 +244,40 @@ def main(cscreen = None):
             terminal_indices = [int(x) for x in value.split(',')]
         elif arg in ['-out', '-o']:
             output_path = value
+        elif arg in ['-pcap']:
+            pcap_path = value
+        elif arg in ['-capture']:
+            capture = capture_sources.CAPTURE_NAMES[value.lower()]
+        elif arg in ['-dictionary']:
+            detection_method = fault_detection.METHOD_DICTIONARY_LEARNING
+            dictionary_path = value
+        elif arg in ['-calibration']:
+            calibration_path = value
+        elif arg in ['-coarse']:
+            coarse_to_fine = True
+        elif arg in ['-headless']:
+            headless = True
+        elif arg in ['-mp']:
+            multiprocess = True
+        elif arg in ['-idle']:
+            idle = True
+        elif arg in ['-profile']:
+            profile_seconds = float(value)
+        elif arg in ['-dashboard']:
+            dashboard_port = int(value)
+        elif arg in ['-fleet']:
+            host, _, port = value.rpartition(':') if ':' in value else (value, '', str(fleet.DEFAULT_PORT))
+            fleet_address = (host, int(port))
+        elif arg in ['-unit']:
+            unit_id = value
+        elif arg in ['-fleet-waveforms']:
+            fleet_waveform_interval = float(value)
+        elif arg in ['-device']:
+            device_class = DEVICE_PROTOTYPE if value.lower() == 'prototype' else DEVICE_COMMERCIAL
+        elif arg in ['-schedule']:
+            schedule_specs.append(value)
+        elif arg in ['-location']:
+            location = scheduler.parse_location(value)
         elif arg in ['-interval', '-i', '-t']:
             try:
                 time_interval = int(value)
@@ -180,6 +295,12 @@ def main(cscreen = None):
         #    USE_CURSES = False
         #    skip = False
     
+    #measurement schedules; without any, every waveform is processed (and logged while logging is on)
+    schedules = [scheduler.parse_schedule(spec, location) for spec in schedule_specs]
+    if time_interval != -1:
+        schedules.append(scheduler.IntervalSchedule(time_interval))
+    measurement_scheduler = scheduler.Scheduler(schedules) if len(schedules) > 0 else None
+    
     #repotr session start & info in log
     if DEBUG_LOG:
         debug_log(debug_log_path, "===========================================================================")
@@ -187,13 +308,23 @@ def main(cscreen = None):
         debug_log(debug_log_path, "===========================================================================")
         debug_log(debug_log_path, "Yaml path: "+yaml_path)
         debug_log(debug_log_path, "Data input file: "+("N/A" if not file_mode else input_path))
+        debug_log(debug_log_path, "Pcap input file: "+("N/A" if pcap_path is None else pcap_path))
         debug_log(debug_log_path, "Output file: "+output_path)
         debug_log(debug_log_path, "Time interval: "+str(time_interval))
+        debug_log(debug_log_path, "Schedules: "+("N/A" if len(schedules) == 0 else "; ".join([schedule.describe() for schedule in schedules])))
+        debug_log(debug_log_path, "Idle between measurements: "+str(idle and measurement_scheduler is not None))
+        debug_log(debug_log_path, "Headless: "+str(headless))
+        debug_log(debug_log_path, "Capture process: "+str(multiprocess and not file_mode))
+    startup_timer.lap("arguments")
     #prepare usb sniffing
     #create logging state
     state = MonitorState()
-    if not file_mode and (arg_filter is None or arg_address is None):
+    if pcap_path is not None:
+        #reading a recorded (or simulated) capture; there is no device to find. assume a commercial device unless told otherwise
+        state.device_class = DEVICE_COMMERCIAL if device_class is None else device_class
+    elif not file_mode and (arg_filter is None or arg_address is None):
         #auto-detect an SSTDR device. depending on the device, determine the device class (which influences data extraction)
+        import usb
         #try to find prototype device
         sstdr_device = usb.core.find(idVendor=0x067b, idProduct=0x2303)
         if sstdr_device is not None:
@@ -206,36 +337,35 @@ def main(cscreen = None):
         if sstdr_device is None:
             print("Error: Could not automatically find SSTDR device. Either restart it or provide filter/address manually.")
             return
-        arg_filter  = sstdr_device.bus
+        arg_filter  = sstdr_device.bus #with usbmon, the filter is the bus number
         arg_address = sstdr_device.address
     
-    usb_path = "C:\\Program Files\\USBPcap\\USBPcapCMD.exe"
-    usb_args = [usb_path, "-d", "\\\\.\\USBPcap" + str(arg_filter), "--devices", str(arg_address), "-o", "-"]
-    
     if DEBUG_LOG:
         debug_log(debug_log_path, "Opened device: Filter "+str(arg_filter)+", Address "+str(arg_address))
         debug_log(debug_log_path, "Device Class: "+str(state.device_class))
+    startup_timer.lap("device")
     
-    #prepare output file for logging
-    with open(output_path, "a+") as out_f:
-        out_f.seek(0,0)
-        first_char = out_f.read(1)
-        if (first_char == ''):
-            #file did not exist or is empty. write header row; set session/log index to 0
-            state.file_has_header = False
-            state.session_number = 0
-            state.log_number = 0
-        else:
-            #file was not empty. jump almost to end, read last line, extract session index
-            #"read up until start of last line" code from S.O. user Trasp: https://stackoverflow.com/questions/3346430/what-is-the-most-efficient-way-to-get-first-and-last-line-of-a-text-file/3346788
-            with open(output_path, "rb") as f:
-                f.seek(-2, os.SEEK_END)     # Jump to the second last byte.
-                while f.read(1) != b"\n":   # Until EOL is found...
-                    f.seek(-2, os.SEEK_CUR) # ...jump back the read byte plus one more.
-                last = f.readline()         # Read last line as bytes.
-            state.file_has_header = True
-            state.session_number = 1+int(chr(int.from_bytes(last.split(b',')[0],'little'))) #assumes little endian, and that session index is present in column 0 (as will be standard in the future)
-            state.log_number = 0
+    #prepare output file for logging: the log's index gives the last session number without scanning the file
+    output_index = log_index.load_index(output_path)
+    last_session = output_index.last_session()
+    state.file_has_header = last_session is not None
+    state.session_number = 0 if last_session is None else last_session+1
+    state.log_number = 0
+    startup_timer.lap("log index")
+    
+    #load panel layout. fault locations are found from it even when headless
+    try:
+        array_layout = panel_layout.load_layout(yaml_path)
+    except:
+        print("Error: invalid layout yaml file.")
+        print("Exception:")
+        print('='*40)
+        traceback.print_exc(file=sys.stdout)
+        print('='*40)
+        if DEBUG_LOG:
+            debug_log(debug_log_path, "Error: invalid layout yaml file.")
+        return
+    startup_timer.lap("layout")
 
     #set up scanning interface in curses (cscreen = curses screen)
     print("Opening scanner interface...")
@@ -244,6 +374,8 @@ def main(cscreen = None):
         cscreen.nodelay(True)
         if (file_mode):
             cscreen.addstr(0,0,"Playing back input file: '" + input_path +"'...")
+        elif (pcap_path is not None):
+            cscreen.addstr(0,0,"Reading capture: '" + pcap_path +"'...")
         else:
             cscreen.addstr(0,0,"Scanning on filter " + str(arg_filter) + ", address " + str(arg_address) + "...")
         cscreen.addstr(1,0,"Press 'q' to stop.")
@@ -252,218 +384,291 @@ def main(cscreen = None):
     else:
         print("Scanning on filter " + str(arg_filter) + ", address " + str(arg_address) + "...")
     
-    if (not file_mode):
-        #open USBPcap, throwing all output onto a pipe
-        usb_fd_r, usb_fd_w = os.pipe()
-        usbpcap_process = subprocess.Popen(usb_args, stdout=usb_fd_w)
-        #start receiving usbpcap output and organizing it into packets
-        usb_stream = os.fdopen(usb_fd_r, "rb")
-        #set up receiver to process raw USB bytestream
+    #per-stage timing of the acquisition loop, and on-demand cProfile captures
+    stage_timer = StageTimer(enabled=STAGE_TIMING)
+    profile_capture = ProfileCapture(PROFILE_DIR, PROFILE_SECONDS)
+    
+    #logged waveforms are written to the output file by a background thread
+    log_writer = LogWriter(output_path, output_index, flush_interval=LOG_FLUSH_INTERVAL, fsync_interval=LOG_FSYNC_INTERVAL)
+    log_writer.start()
+    
+    #live dashboard for remote viewers; they render it themselves, in a browser
+    dashboard = None
+    if dashboard_port is not None:
+        dashboard = DashboardServer(dashboard_port)
+        dashboard.start()
+        if DEBUG_LOG:
+            debug_log(debug_log_path, "Serving dashboard on port "+str(dashboard_port))
+    
+    #fault events (and sampled waveforms) for the fleet collector; spooled to disk, and sent by a background thread
+    fleet_client = None
+    if fleet_address is not None:
+        fleet_client = fleet.FleetClient(fleet_address, unit_id, FLEET_SPOOL_DIR, fleet_waveform_interval)
+        fleet_client.start()
+        if DEBUG_LOG:
+            debug_log(debug_log_path, "Sending to fleet collector "+fleet_address[0]+":"+str(fleet_address[1])+" as unit '"+unit_id+"'")
+    startup_timer.lap("log writer")
+    
+    if not file_mode and multiprocess:
+        #the capture process reads the packets and frames waveforms; they are read back out of a shared memory ring
+        ring_capture = capture_sources.RingCapture(pcap_path, capture, arg_filter, arg_address, state.device_class)
+        ring_capture.start()
+        if DEBUG_LOG:
+            debug_log(debug_log_path, "Capturing from: "+ring_capture.description)
+    elif not file_mode:
+        #read packets from a pcap file, from stdin (e.g. piped from sstdr_simulator.py), or from the live capture tool's output
+        capture_source = capture_sources.open_source(pcap_path, capture, arg_filter, arg_address)
+        if DEBUG_LOG:
+            debug_log(debug_log_path, "Capturing from: "+capture_source.description)
+        #set up receiver to process raw USB bytestream. usbmon captures the whole bus, so other devices' packets are dropped
         halt_threads = threading.Event()
-        receiver = PcapPacketReceiver(usb_stream, loop=True, halt_event=halt_threads)
+        address = arg_address if (pcap_path is None and capture == capture_sources.CAPTURE_USBMON) else None
+        receiver = PcapPacketReceiver(capture_source.stream, loop=True, halt_event=halt_threads, stage_timer=stage_timer, address=address)
+    startup_timer.lap("capture")
         
     #prepare deque for waveform visualization; only stores a few of the most recently received waveforms. appended entries cycle out old ones
     #larger deque -> more maximum latency between visualization and actual system state
     #smaller deque -> not sure why this would be a problem (something about losing information if packets aren't received constantly)
     wf_deque = deque(maxlen=1)
     
-    #prepare to visualize waveforms
-    fig = plt.figure()
-    plot_window = pf.screen(title='SSTDR Correlation Waveform')
-    
     ######################################################
     ##                  PYGAME SETUP                    ##
     ######################################################
 
-    #initializing pygame
-    pygame.init()
-    pscreen = pygame.display.set_mode(SCREEN_SIZE)
-    pygame.display.set_caption("PV Fault Scanner")
+    if not headless:
+        import pygame
+        import pyformulas as pf
+        import ui_elements as ui
+        from waveform_plot import WaveformPlot, Waterfall
+        
+        #prepare to visualize waveforms
+        if USE_MATPLOTLIB:
+            import matplotlib.pyplot as plt
+            fig = plt.figure()
+        plot_window = pf.screen(title='SSTDR Correlation Waveform')
+        
+        #initializing pygame
+        pygame.init()
+        pscreen = pygame.display.set_mode(SCREEN_SIZE)
+        pygame.display.set_caption("PV Fault Scanner")
 
-    #loading assets, preparing pre-baked surfaces
-    FONT_PATH = os.path.join("Assets", "Titillium-Regular.otf")
-    TERMINAL_FONT = pygame.font.Font(FONT_PATH, 40)
-    STATUS_FONT = pygame.font.Font(FONT_PATH, 20)
+        #loading assets, preparing pre-baked surfaces
+        FONT_PATH = os.path.join("Assets", "Titillium-Regular.otf")
+        TERMINAL_FONT = pygame.font.Font(FONT_PATH, 40)
+        STATUS_FONT = pygame.font.Font(FONT_PATH, 20)
+        PLOT_FONT = pygame.font.Font(FONT_PATH, PLOT_FONT_SIZE)
+    
+        #waveform plot, drawn with pygame and shown in the pyformulas window
+        waveform_plot = WaveformPlot(PLOT_FONT, "Distance (feet)", "Correlation With Reflection")
+        #history of the plotted trace as a scrolling heatmap, so intermittent faults don't flash by unnoticed. 'h' toggles it
+        waterfall = Waterfall(PLOT_FONT, "Distance (feet)")
 
-    panel_surf = pygame.image.load(os.path.join("Assets", "PV_panel_CharlesMJames_CC.jpg"))
-    panel_surf = pygame.transform.scale(panel_surf, (int(panel_surf.get_width()*PANEL_SCALE), int(panel_surf.get_height()*PANEL_SCALE)))
-    panel_rect = panel_surf.get_rect()
+        panel_surf = pygame.image.load(os.path.join("Assets", "PV_panel_CharlesMJames_CC.jpg"))
+        panel_surf = pygame.transform.scale(panel_surf, (int(panel_surf.get_width()*PANEL_SCALE), int(panel_surf.get_height()*PANEL_SCALE)))
+        panel_rect = panel_surf.get_rect()
 
-    #grass_surf = pygame.image.load(os.path.join("Assets", "grass.png"))
-    #grass_rect = grass_surf.get_rect()
+        #grass_surf = pygame.image.load(os.path.join("Assets", "grass.png"))
+        #grass_rect = grass_surf.get_rect()
 
-    hazard_surf = pygame.image.load(os.path.join("Assets", "hazard.png"))
-    hazard_rect = hazard_surf.get_rect()
+        hazard_surf = pygame.image.load(os.path.join("Assets", "hazard.png"))
 
-    bg_surf = pygame.Surface(pscreen.get_size())
-    bg_surf.convert()
-    bg_rect = bg_surf.get_rect()
-    bg_surf.fill(BG_COLOR)
+        bg_surf = pygame.Surface(pscreen.get_size())
+        bg_surf.convert()
+        bg_rect = bg_surf.get_rect()
+        bg_surf.fill(BG_COLOR)
     
-    line_surf = pygame.Surface((SCREEN_X, BORDER_WIDTH))
-    line_surf.fill(COLOR_ORANGE)
-    line_rect = line_surf.get_rect()
-    line_rect.y = VISUAL_Y - BORDER_WIDTH - int(BORDER_PADDING/2)
-    bg_surf.blit(line_surf, line_rect)
-    line_surf.fill(COLOR_BLUE)
-    line_rect.move_ip(0, BORDER_WIDTH + BORDER_PADDING)
-    bg_surf.blit(line_surf, line_rect)
-
-    text_surf = STATUS_FONT.render("Scanning at 24MHz...", True, COLOR_WHITE)
-    text_rect = text_surf.get_rect()
-    text_rect.move_ip(3,3)
-    bg_surf.blit(text_surf, text_rect)
-
-    text_surf = STATUS_FONT.render("Selected Array Layout: " + yaml_path, True, COLOR_WHITE)
-    text_rect = text_surf.get_rect()
-    text_rect.x = 3
-    text_rect.bottom = VISUAL_Y - BORDER_WIDTH - int(0.5*BORDER_PADDING) - 3
-    bg_surf.blit(text_surf, text_rect)
-
-    #load panel layout
-    panel_layout, connector_ds, panel_length = load_panel_layout(yaml_path)
-    panel_cols = panel_rows = 0
-    try:
-        N = len(connector_ds) #number of connectors; = (panel count)+1
-        P = N-1 #number of panels
-        H = int(P/2)-1 #H for half; the number of panels in one row
-        if (panel_layout['layout'] == 'loop'):
-            panel_rows = 2
-            panel_cols = int(P/2+0.5)
-            r = 0
-            PANEL_COORDS = [(c*(PANEL_PADDING[0] + panel_rect.w), r*(PANEL_PADDING[1] + panel_rect.h)) for c in range(0,H+1)] #pixel coordinates for panels in top row
-            CONNECTOR_COORDS = [(x - PANEL_PADDING[0],y) for x,y in PANEL_COORDS] #pixel coordinates of MC-4 connectors for top row; just bisects the panel padding
-            
-            #WIRE_COORDS.append((panel_rect.center[0] + array_rect.topleft[0], panel_rect.center[1] + array_rect.topleft[1])) #places wire nodes at each panel center
-
-            if (P%2 == 1):
-                #add odd panel
-                r = 0.5
-                new_panel_coord = ((H+1)*(PANEL_PADDING[0] + panel_rect.w), r*(PANEL_PADDING[1] + panel_rect.h)) #central panel for odd panel counts
-                PANEL_COORDS = PANEL_COORDS + [new_panel_coord]
-                #add connectors diagonally positioned before & after odd panel
-                CONNECTOR_COORDS = CONNECTOR_COORDS + [(new_panel_coord[0] - PANEL_PADDING[0], new_panel_coord[1] - PANEL_PADDING[1]/2**0.5)]
-                CONNECTOR_COORDS = CONNECTOR_COORDS + [(new_panel_coord[0] - PANEL_PADDING[0], new_panel_coord[1] + PANEL_PADDING[1]/2**0.5)]
-            else:
-                #add connector coord vertically between the top & bottom panels
-                CONNECTOR_COORDS = CONNECTOR_COORDS + [(PANEL_COORDS[-1][0], PANEL_COORDS[-1][1]+0.5*PANEL_PADDING[1])]
-            r = 1
-            bottom_panel_coords = [(c*(PANEL_PADDING[0] + panel_rect.w), r*(PANEL_PADDING[1] + panel_rect.h)) for c in range(H,-1,-1)] #pixel coordinates for panels in bottom row
-            bottom_connector_coords = [(x - PANEL_PADDING[0], y) for x,y in bottom_panel_coords] #pixel coordinates of MC-4 connectors for bottom row; just bisects the panel padding
-            if (P%2 == 1):
-                #amend first connector from the bottom row to be diagonally positioned (we placed a diagonal one earlier, just remove the first one
-                #bottom_connector_coords = bottom_connector_coords[1:]
-                pass
-            PANEL_COORDS = PANEL_COORDS + bottom_panel_coords
-            CONNECTOR_COORDS= CONNECTOR_COORDS+ bottom_connector_coords
-            
-        elif(panel_layout['layout'] == 'home-run'):
-            panel_rows = 1
-            panel_cols = N
-            r = 0
-            PANEL_COORDS = [(c*(PANEL_PADDING[0] + panel_rect.w), r*(PANEL_PADDING[1] + panel_rect.h)) for c in range(0,N)] #one long row, with a home-run leading all the way back
-            CONNECTOR_COORDS = [(x - PANEL_PADDING[0]/2+array_rect.topleft[0],y+array_rect.topleft[1]) for x,y in PANEL_COORDS] #pixel coordinates of MC-4 connectors for top row; just bisects the panel padding
-        else:
-            raise Exception("Error: unknown layout field in layout yaml file.")
-    except:
-        print("Error: invalid layout yaml file.")
-        print("Exception:")
-        print('='*40)
-        traceback.print_exc(file=sys.stdout)
-        print('='*40)
-        if DEBUG_LOG:
-            debug_log(debug_log_path, "Error: invalid layout yaml file.")
-        return
+        line_surf = pygame.Surface((SCREEN_X, BORDER_WIDTH))
+        line_surf.fill(COLOR_ORANGE)
+        line_rect = line_surf.get_rect()
+        line_rect.y = VISUAL_Y - BORDER_WIDTH - int(BORDER_PADDING/2)
+        bg_surf.blit(line_surf, line_rect)
+        line_surf.fill(COLOR_BLUE)
+        line_rect.move_ip(0, BORDER_WIDTH + BORDER_PADDING)
+        bg_surf.blit(line_surf, line_rect)
+
+        text_surf = STATUS_FONT.render("Scanning at 24MHz...", True, COLOR_WHITE)
+        text_rect = text_surf.get_rect()
+        text_rect.move_ip(3,3)
+        bg_surf.blit(text_surf, text_rect)
+
+        text_surf = STATUS_FONT.render("Selected Array Layout: " + yaml_path, True, COLOR_WHITE)
+        text_rect = text_surf.get_rect()
+        text_rect.x = 3
+        text_rect.bottom = VISUAL_Y - BORDER_WIDTH - int(0.5*BORDER_PADDING) - 3
+        bg_surf.blit(text_surf, text_rect)
+
+        #place the panels & connectors of every string. parallel strings are stacked vertically, and scaled down if they don't fit
+        panel_padding = PANEL_PADDING
+        string_pixels = [layout_string_pixels(string, panel_rect.w, panel_rect.h, panel_padding) for string in array_layout.strings]
+        stack_height = sum([rows for _,_,_,rows in string_pixels])*(panel_rect.h + panel_padding[1]) + STRING_PADDING*(len(string_pixels)-1)
+        if stack_height > VISUAL_Y*ARRAY_MAX_HEIGHT_RATIO:
+            scale = VISUAL_Y*ARRAY_MAX_HEIGHT_RATIO/stack_height
+            panel_surf = pygame.transform.scale(panel_surf, (int(panel_rect.w*scale), int(panel_rect.h*scale)))
+            panel_rect = panel_surf.get_rect()
+            panel_padding = (PANEL_PADDING[0]*scale, PANEL_PADDING[1]*scale)
+            string_pixels = [layout_string_pixels(string, panel_rect.w, panel_rect.h, panel_padding) for string in array_layout.strings]
+        string_ys = [] #y offset of each string on the array surface
+        y = 0
+        for _,_,_,rows in string_pixels:
+            string_ys.append(y)
+            y = y + rows*(panel_rect.h + panel_padding[1]) + STRING_PADDING
     
-    #array surface, panels are blitted onto this
-    ARRAY_SIZE = (panel_cols*(panel_rect.w + PANEL_PADDING[0]), panel_rows*(panel_rect.h + PANEL_PADDING[1]))
-    array_surf = pygame.Surface(ARRAY_SIZE, pygame.SRCALPHA)
-    array_surf.convert()
+        #array surface, panels are blitted onto this
+        panel_cols = max([cols for _,_,cols,_ in string_pixels])
+        ARRAY_SIZE = (int(panel_cols*(panel_rect.w + panel_padding[0])), int(y - STRING_PADDING))
+        array_surf = pygame.Surface(ARRAY_SIZE, pygame.SRCALPHA)
+        array_surf.convert()
     
-    for p in PANEL_COORDS:
-        panel_rect.topleft = p
-        array_surf.blit(panel_surf, panel_rect)
-
-    array_rect = array_surf.get_rect()
-    array_rect.center = (int(SCREEN_X*PANEL_SCREEN_X_RATIO), int(VISUAL_Y/2))
-
-    #draw wires onto background surface
-    WIRE_COORDS = []
-    for p in PANEL_COORDS:
-        panel_rect.topleft = p
-        WIRE_COORDS.append((panel_rect.center[0] + array_rect.topleft[0], panel_rect.center[1] + array_rect.topleft[1])) #places wire nodes at each panel center
-    WIRE_COORDS.insert(0,(0,WIRE_COORDS[0][1]))#insert wire nodes at x=0 and same y as first & last panels in string
-    WIRE_COORDS.append((0,WIRE_COORDS[-1][1]))
-    pygame.draw.lines(bg_surf, WIRE_COLOR, False, WIRE_COORDS, WIRE_WIDTH)
-
-    #draw connectors onto background surface
-    #update connector coords to align with array surface
-    CONNECTOR_COORDS = [(x+array_rect.topleft[0]+panel_rect.width/2, y+array_rect.topleft[1]+panel_rect.height/2) for x,y in CONNECTOR_COORDS]
-    for x,y in CONNECTOR_COORDS:
-        pygame.draw.circle(bg_surf, CONNECTOR_COLOR, (x,y), CONNECTOR_SIZE, width=CONNECTOR_WIDTH)
-    #then append 0 and end points to the connector coords. We want these for positioning but we don't want to draw them.
-    CONNECTOR_COORDS.insert(0,(0,CONNECTOR_COORDS[0][1]))#insert wire nodes at x=0 and same y as first & last panels in string
-    CONNECTOR_COORDS.append((0,CONNECTOR_COORDS[-1][1]))
+        for (PANEL_COORDS,_,_,_), sy in zip(string_pixels, string_ys):
+            for x,y in PANEL_COORDS:
+                panel_rect.topleft = (x, y+sy)
+                array_surf.blit(panel_surf, panel_rect)
+
+        array_rect = array_surf.get_rect()
+        array_rect.center = (int(SCREEN_X*PANEL_SCREEN_X_RATIO), int(VISUAL_Y/2))
+
+        for string, (PANEL_COORDS, CONNECTOR_COORDS,_,_), sy in zip(array_layout.strings, string_pixels, string_ys):
+            #draw wires onto background surface
+            WIRE_COORDS = [(x+array_rect.topleft[0]+panel_rect.width/2, y+sy+array_rect.topleft[1]+panel_rect.height/2) for x,y in PANEL_COORDS] #places wire nodes at each panel center
+            WIRE_COORDS.insert(0,(0,WIRE_COORDS[0][1]))#insert wire nodes at x=0 and same y as first & last panels in string
+            WIRE_COORDS.append((0,WIRE_COORDS[-1][1]))
+            pygame.draw.lines(bg_surf, WIRE_COLOR, False, WIRE_COORDS, WIRE_WIDTH)
+
+            #draw connectors onto background surface
+            #update connector coords to align with array surface
+            CONNECTOR_COORDS = [(x+array_rect.topleft[0]+panel_rect.width/2, y+sy+array_rect.topleft[1]+panel_rect.height/2) for x,y in CONNECTOR_COORDS]
+            for x,y in CONNECTOR_COORDS:
+                pygame.draw.circle(bg_surf, CONNECTOR_COLOR, (x,y), CONNECTOR_SIZE, width=CONNECTOR_WIDTH)
+            #then add 0 and end points to the connector coords. We want these for positioning but we don't want to draw them.
+            string.set_connector_pixels([(0,CONNECTOR_COORDS[0][1])] + CONNECTOR_COORDS + [(0,CONNECTOR_COORDS[-1][1])])
     
     
-    term_surf = pygame.Surface((SCREEN_X, TERMINAL_Y - int(BORDER_PADDING/2) - BORDER_WIDTH))
-    term_surf.fill(TERMINAL_COLOR)
-    term_rect = term_surf.get_rect()
-    term_rect.bottom = SCREEN_Y
-
-    #define buttons
-    button_outer_p = 5
-    measure_b = ui.Button("Measure", STATUS_FONT, take_window_measurement)
-    measure_b.move(SCREEN_X-measure_b.size_x-button_outer_p, button_outer_p)
-    log_b = ui.Button("Toggle Logging",  STATUS_FONT, toggle_logging)
-    log_b.move(SCREEN_X-log_b.size_x-button_outer_p, button_outer_p*2+measure_b.size_y)
+        term_surf = pygame.Surface((SCREEN_X, TERMINAL_Y - int(BORDER_PADDING/2) - BORDER_WIDTH))
+        term_surf.fill(TERMINAL_COLOR)
+        term_rect = term_surf.get_rect()
+        term_rect.bottom = SCREEN_Y
+
+        #define buttons
+        button_outer_p = 5
+        measure_b = ui.Button("Measure", STATUS_FONT, take_window_measurement)
+        measure_b.move(SCREEN_X-measure_b.size_x-button_outer_p, button_outer_p)
+        log_b = ui.Button("Toggle Logging",  STATUS_FONT, toggle_logging)
+        log_b.move(SCREEN_X-log_b.size_x-button_outer_p, button_outer_p*2+measure_b.size_y)
+        
+        KEY_COMMANDS = {
+            pygame.K_b: COMMAND_SET_BASELINE,
+            pygame.K_l: COMMAND_TOGGLE_LOGGING,
+            pygame.K_a: COMMAND_RECORD_TERMINAL,
+            pygame.K_t: COMMAND_SET_TERMINAL,
+            pygame.K_LEFT: COMMAND_THRESHOLD_DOWN,
+            pygame.K_RIGHT: COMMAND_THRESHOLD_UP,
+            pygame.K_w: COMMAND_WINDOW_MEASUREMENT,
+            pygame.K_i: COMMAND_NEXT_LOG,
+            pygame.K_p: COMMAND_PROFILE,
+        }
+    startup_timer.lap("gui")
     
     ######################################################
     ##              FAULT DETECTION SETUP               ##
     ######################################################
 
-    detector = fault_detection.Detector(FAULT_DETECTION_METHOD)
+    detector = fault_detection.Detector(detection_method, coarse_to_fine)
+    if detection_method == fault_detection.METHOD_DICTIONARY_LEARNING:
+        detector.load_dictionary(dictionary_path)
+        if DEBUG_LOG:
+            debug_log(debug_log_path, "Loaded dictionary: "+dictionary_path+" ("+str(len(detector.dictionary))+" atoms)")
+    if os.path.exists(calibration_path):
+        detector.load_calibration(calibration_path)
+        if DEBUG_LOG:
+            debug_log(debug_log_path, "Loaded calibration: "+calibration_path+" ("+str(detector.feet_per_sample)+" feet per sample, zero index "+str(detector.zero_index)+")")
     #detector = fault_detection.Detector(fault_detection.METHOD_NONE)
-    fault = (fault_detection.FAULT_NONE, 0)
-    terminal_waveform = None
-    
-    first_timestamp = None
-    first_time_played = None
-    input_row_index = 0
+    startup_timer.lap("detector")
     if file_mode:
-        input_data = fault_detection.read_csv_ungrouped(input_path)
+        if binary_log.is_binary_path(input_path):
+            input_data = binary_log.read_ungrouped(input_path)
+        elif waveform_archive.is_archive_path(input_path):
+            input_data = waveform_archive.read_ungrouped(input_path)
+        else:
+            input_data = fault_detection.read_csv_ungrouped(input_path)
+        startup_timer.lap("input file")
+    
+    startup_string = "Startup ms: " + startup_timer.report()
+    if DEBUG_LOG:
+        debug_log(debug_log_path, startup_string)
+    if not(cscreen is None):
+        cscreen.addstr(11,0,startup_string[:cscreen.getmaxyx()[1]-1])
+        cscreen.refresh()
+    else:
+        print(startup_string)
     
     ######################################################
     ##                      LOOP                        ##
     ######################################################
     
-    #set up threads:
-    #first child thread: receives and interprets packets using receiver.run()
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        if not file_mode:
-            rec_thread = executor.submit(receiver.run)
+    #acquisition, framing, detection and logging run in their own thread, at full probe rate.
+    #the main thread only renders: it draws the latest frame published by the acquisition thread at up to RENDER_FPS,
+    #and hands key presses & button clicks back to the acquisition thread as commands, so a slow display never delays
+    #dequeueing packets.
+    quit_event = threading.Event() #set by 'q' in curses, closing the window, or an error in either thread
+    latest_frame = LatestValue() #DisplayFrame of the most recently processed waveform
+    commands = queue.Queue() #COMMAND_* values (or button functions) for the acquisition thread
+    render_timer = StageTimer(enabled=STAGE_TIMING)
+    
+    def acquisition_loop():
+        curses_status = CursesStatus(cscreen) #status lines are written a few times a second, not per waveform
+        fault = (fault_detection.FAULT_NONE, 0)
+        last_fault_string = None
+        terminal_waveform = None
+        wf = None #most recently processed waveform
+        packet_time = 0.0 #capture timestamp of the most recent packet (or waveform, with -mp)
+        first_timestamp = None
+        first_time_played = None
+        input_row_index = 0
+        next_timing_report = time.monotonic() + TIMING_REPORT_INTERVAL
+        first_frame = True #report how long after launch the first waveform was ready
+        pipeline_awake = True #False while idle between scheduled measurements (-idle only): packets are discarded unread, and the loop sleeps
         
-        if state.device_class == DEVICE_PROTOTYPE:
-            valid_waveform_prefix = b'\xaa\xaa\xaa\xad\x00\xbf' #valid waveform regions start with this pattern
-            device_endpoint = 0x83
-        else:
-            valid_waveform_prefix = b'\x7F\xF2\x7F\xF3\x7F\xF1\xFE\xFE\x01\x01' #valid waveform regions start with this pattern (kingston devices)
-            device_endpoint = 0x86
+        #assembles waveform regions out of the payloads of received packets
+        framer = WaveformFramer(state.device_class)
         
-        payloadString = b'' #concatenated bytes from all unprocessed packets
-        processStartIndex = 0 #the index at which the currently considered payload string starts (inclusive).
-        processEndIndex = 0 #the index at which the currently considered payload string ends (exclusive).
-        byteCount = 0
-        MAX_BYTECOUNT = 512*4 #flush payloadString after reaching a buffer of this size 
+        if profile_seconds > 0:
+            profile_capture.start(profile_seconds)
         
         try:
-            while(True):
+            while not quit_event.is_set():
+                stage_timer.start()
+                #scheduled measurements: log waveforms when one is due. with -idle, the pipeline is woken for it, and otherwise
+                #sleeps; it stays awake while logging by hand. without -idle, faults are monitored continuously in between
+                if measurement_scheduler is not None:
+                    due = measurement_scheduler.poll(time.time())
+                    if due > 0:
+                        state.scheduled_count += due
+                    if due > 0 or state.next_log_time is None:
+                        next_time = measurement_scheduler.next_time()
+                        state.next_log_time = None if next_time is None else dt.datetime.fromtimestamp(next_time)
+                    awake = not idle or state.scheduled_count > 0 or state.logging
+                    if awake != pipeline_awake:
+                        pipeline_awake = awake
+                        if not file_mode and not awake:
+                            if multiprocess:
+                                ring_capture.pause()
+                            else:
+                                receiver.pause()
+                        elif not file_mode:
+                            #start from fresh packets, so logged waveforms were measured after the measurement was due
+                            if multiprocess:
+                                ring_capture.resume()
+                            else:
+                                receiver.resume()
+                            framer.flush()
+                            wf_deque.clear()
+                
                 #take packet from Q, process in some way
-                if file_mode:
+                if file_mode and pipeline_awake:
                     state.log_number = int(input_data[input_row_index][1])
                     if input_row_index in baseline_indices:
                         detector.set_baseline(input_data[input_row_index][3:])
-                    if input_row_index in terminal_indices and FAULT_DETECTION_METHOD == fault_detection.METHOD_BLS_DEVIATION_CORRECTION:
+                    if input_row_index in terminal_indices and detection_method == fault_detection.METHOD_BLS_DEVIATION_CORRECTION:
                         detector.set_terminal(input_data[input_row_index][3:])
                     if input_row_index == 0:
                         first_time_played = time.time()
@@ -471,6 +676,7 @@ def main(cscreen = None):
                     if True:#time.time() - first_time_played >= input_data[input_row_index+1][2] - first_timestamp:
                         input_row_index = input_row_index + 1
                     wf_deque.append(np.array(input_data[input_row_index][3:]))
+                    packet_time = input_data[input_row_index][2]
                     time.sleep(0.25)
                 """
                 goal is to identify shape of data in intermittent test, and have this
@@ -479,288 +685,375 @@ def main(cscreen = None):
                 bytes, and either shown for visualization (pyplot?) or fed to matlab
                 for processing (which is the ultimate goal).
                 """
-                if not file_mode and receiver.q.empty() == False:
+                if not file_mode and multiprocess and pipeline_awake:
+                    #waveforms framed by the capture process, in order
+                    item = ring_capture.next()
+                    if item is not None:
+                        packet_time, wf = item
+                        wf_deque.append(wf.astype(int)) #the ring holds int16; detection & baselines expect the framer's ints
+                        curses_status.set(7, "Received waveform at timestamp: " + str(packet_time))
+                    elif len(wf_deque) == 0:
+                        quit_event.wait(RING_POLL_INTERVAL) #nothing to do; don't spin on the ring
+                    stage_timer.lap("ring read")
+                
+                elif not file_mode and pipeline_awake and receiver.q.empty() == False:
                     pBlock = receiver.q.get()
+                    packet_time = pBlock.ts_sec + 0.000001*pBlock.ts_usec
                     #commented out because this printing was very very slow, and ruined realtime
                     #if not(cscreen is None):
                         #cscreen.addstr(5,0,"Received packet at timestamp: " + str(pBlock.ts_sec + 0.000001*pBlock.ts_usec)) #show some packet data so it's clear the scanner is working
                         #cscreen.refresh()
                     
-                    #if received packet may be in a waveform region of the stream:
-                    #criteria: input (to host) from device endpoint and function == URB_FUNCTION_BULK_OR_INTERRUPT_TRANSFER
-                    if (pBlock.packet.endpoint == device_endpoint and pBlock.packet.function == 0x09 and pBlock.packet.info == 1 and pBlock.packet.status == 0):
-                        #if block has a payload:
+                    feed_result = framer.feed(pBlock)
+                    if feed_result == waveform_framer.FEED_OVERFLOW:
+                        if DEBUG_LOG and VERBOSE_LOGGING:
+                            debug_log(debug_log_path,"Buffer overfull, flushing buffer!")
+                    elif feed_result == waveform_framer.FEED_APPENDED:
+                        if DEBUG_LOG and VERBOSE_LOGGING:
+                            debug_log(debug_log_path, "Received payload")
                         p = pBlock.packet.payload
-                        l = len(p)
-                        if (state.device_class == DEVICE_PROTOTYPE or (state.device_class == DEVICE_COMMERCIAL and l == 512)): #all data seems to come in blocks of 512 for comm. devices
-                            if byteCount + l > MAX_BYTECOUNT:
-                                #if buffer overflowing, flush
-                                payloadString = p
-                                byteCount = l
-                                processStartIndex = 0
-                                processEndIndex = 0
-                                if DEBUG_LOG and VERBOSE_LOGGING:
-                                    debug_log(debug_log_path,"Buffer overfull, flushing buffer!")
-                            else:
-                                #else, append payload to buffer
-                                payloadString = payloadString + p
-                                byteCount = byteCount + l
-                                #XXX
-                                if DEBUG_LOG and VERBOSE_LOGGING:
-                                    debug_log(debug_log_path, "Received payload")
-                                if ((l==1 and p==valid_waveform_prefix[0]) or (l>1 and p[0] == valid_waveform_prefix[0]) or (valid_waveform_prefix[0] in p)):
-                                    if DEBUG_LOG and DEBUG_VERIFICATION:
-                                        debug_log(debug_log_path,"Received start of waveform prefix")
-                                        debug_log(debug_log_path,"Starting payload: " + str(p))
-                                        debug_log(debug_log_path,"New payload string: " + str(payloadString))
-                        elif byteCount > 0:
-                            #received packet from the device, but it's not valid; need to flush the buffer.
-                            
-                            if DEBUG_LOG and VERBOSE_LOGGING:
-                                debug_log(debug_log_path, "Received invalid payload, discarding it and flushing buffer")
-                            if USE_CURSES:
-                                cscreen.addstr(7,0,"Flushed buffer at: "+str(pBlock.ts_sec + 0.000001*pBlock.ts_usec))
-                                cscreen.refresh()
-                            payloadString = b''
-                            processStartIndex = 0
-                            processEndIndex = 0
-                            byteCount = 0
-                        
-                    else: #if we received an unwanted payload, ignore it.
-                        pass
+                        if (framer.prefix[0] in p):
+                            if DEBUG_LOG and DEBUG_VERIFICATION:
+                                debug_log(debug_log_path,"Received start of waveform prefix")
+                                debug_log(debug_log_path,"Starting payload: " + str(p))
+                                debug_log(debug_log_path,"New payload string: " + str(framer.payload_string))
+                    elif feed_result == waveform_framer.FEED_FLUSHED:
+                        #received packet from the device, but it's not valid; the framer flushed its buffer.
+                        if DEBUG_LOG and VERBOSE_LOGGING:
+                            debug_log(debug_log_path, "Received invalid payload, discarding it and flushing buffer")
+                        if USE_CURSES:
+                            curses_status.set(7, "Flushed buffer at: "+str(pBlock.ts_sec + 0.000001*pBlock.ts_usec))
                         
                     #XXX
                     if DEBUG_LOG and VERBOSE_LOGGING and DEBUG_VERIFICATION:
-                        debug_log(debug_log_path, "Payload string: "+str(payloadString))
+                        debug_log(debug_log_path, "Payload string: "+str(framer.payload_string))
+                    stage_timer.lap("framing")
                 
-                elif not file_mode and byteCount > 0:
+                elif not file_mode and pipeline_awake and framer.byte_count > 0:
                     #data is waiting in buffer, and we have time to process it
-                    #check if we've started processing a waveform yet
-                    if processEndIndex == 0: #if we haven't started processing a waveform yet
-                        prefixStartIndex = payloadString.find(valid_waveform_prefix)
-                        if prefixStartIndex != -1:
-                            #waveform prefix found.
-                            processStartIndex = prefixStartIndex
-                            processEndIndex = processStartIndex + len(valid_waveform_prefix)
-                    #if we've started a waveform, check if we can finish one
-                    if processEndIndex > 0:
-                        nextPrefixIndex = payloadString[processEndIndex:].find(valid_waveform_prefix)
-                        if nextPrefixIndex != -1:
-                            #we found the next waveform's prefix!
-                            processEndIndex = nextPrefixIndex + processEndIndex
-                            #prepare this waveform
-                            if state.device_class == DEVICE_PROTOTYPE:
-                                wf = process_waveform_region_prototype(payloadString[processStartIndex:processEndIndex],cscreen)
-                            else:
-                                wf = process_waveform_region(payloadString[processStartIndex:processEndIndex],cscreen)
-                            #push this waveform into the deque.
-                            wf_deque.append(wf)
-                            if not(cscreen is None):
-                                #show that we've received a waveform
-                                cscreen.addstr(7,0,"Received waveform at timestamp: " + str(pBlock.ts_sec + 0.000001*pBlock.ts_usec))
-                                cscreen.refresh()
-                            #prepare to process the next waveform
-                            payloadString = payloadString[processEndIndex:]
-                            byteCount = len(payloadString)
-                            processStartIndex = 0
-                            processEndIndex = processStartIndex + len(valid_waveform_prefix)
+                    region = framer.next_region()
+                    if region is not None:
+                        #prepare this waveform
+                        if state.device_class == DEVICE_PROTOTYPE:
+                            wf = process_waveform_region_prototype(region,cscreen)
                         else:
-                            #no end to this waveform was found. sit on it.
-                            pass
+                            wf = process_waveform_region(region,cscreen)
+                        #push this waveform into the deque.
+                        wf_deque.append(wf)
+                        #show that we've received a waveform
+                        curses_status.set(7, "Received waveform at timestamp: " + str(packet_time))
+                    stage_timer.lap("framing")
                 
                 if len(wf_deque) > 0: #either we're in file mode or the queue is empty; pop a waveform from the deque if any are ready (deque has max size, oldest entries are popped out when pushing if at max length)
                     time_log = False
-                    if time_interval == -1 or dt.datetime.now() > state.next_log_time:
-                        if time_interval != -1:
-                            time_log = True
-                            state.last_log_time = dt.datetime.now()
-                            state.next_log_time = dt.datetime.now() + dt.timedelta(seconds=time_interval)
-                        #q was empty, we have some extra time to visualize things
-                        wf = np.array(wf_deque.popleft())
-                        if (state.logging or time_log):
-                            #write row with session index, log index, timestamp, and measured waveform.
-                            with open(output_path, "a") as f:
-                                #write header if needed
-                                if not state.file_has_header:
-                                    state.file_has_header = True
-                                    f.write("session_number,log_number,timestamp,waveform\n")
-                                f.write(str(state.session_number)+","+str(state.log_number)+","+str(pBlock.ts_sec + 0.000001*pBlock.ts_usec)+","+str(list(wf))[1:-1]+'\n') #1:-1 for brackets
-                            if state.measurement_counter > 0:
-                                state.measurement_counter -= 1
-                                if state.measurement_counter == 0:
-                                    state.logging = False    
-                                    state.log_number += 1
+                    if state.scheduled_count > 0:
+                        time_log = True
+                        state.scheduled_count -= 1
+                        state.last_log_time = dt.datetime.now()
+                    #q was empty, we have some extra time to process things
+                    wf = np.array(wf_deque.popleft())
+                    if (state.logging or time_log):
+                        #queue row with session index, log index, timestamp, and measured waveform. the log writer thread writes the header if needed
+                        state.file_has_header = True
+                        log_writer.write(state.session_number, state.log_number, packet_time, wf)
+                        if state.measurement_counter > 0:
+                            state.measurement_counter -= 1
+                            if state.measurement_counter == 0:
+                                state.logging = False    
+                                state.log_number += 1
+                        stage_timer.lap("csv write")
+                    stage_timer.start()
                     
-                    ###################################################################################################################################
-                    #       PYFORMULAS: visualize waveform
-                    ###################################################################################################################################
+                    fault = detector.detect_faults(wf)
+                    stage_timer.lap("detect")
                     
-                    #some code from https://stackoverflow.com/questions/40126176/fast-live-plotting-in-matplotlib-pyplot
-                    plt.clf()
-                    plt.xlabel("Distance (feet)")
-                    plt.ylabel("Correlation With Reflection")
-                    plt.gcf().subplots_adjust(left=0.15)
-                
+                    #find the fault on every string it could be on; the layout's connector distances are sorted, so this is a bisection per string
+                    if fault[0] != fault_detection.FAULT_NONE:
+                        fault_locations = array_layout.locate(fault[1]) #fault distance in feet, before correcting for panel electrical length
+                        fault_name = fault_detection.get_fault_name(fault[0])
+                        fault_string = panel_layout.describe_fault(fault_name, fault_locations, len(array_layout.strings) > 1)
+                    else:
+                        fault_locations = []
+                        fault_string = "System OK"
+                    if DEBUG_LOG and fault_string != last_fault_string:
+                        debug_log(debug_log_path, fault_string)
+                    if fleet_client is not None:
+                        if fault_string != last_fault_string:
+                            fleet_client.event(time.time(), fault[0], fault[1], fault_string)
+                        fleet_client.waveform(time.time(), wf, state.session_number, state.log_number)
+                    last_fault_string = fault_string
+                    
+                    #hand the results to the render loop. it may skip frames; detection and logging never wait for it
+                    feet = detector.feet_vector
                     if detector.raw_baseline is None:
-                        #plt.plot(fault_detection.FEET_VECTOR, wf_i/max(abs(wf_i)))
-                        plt.plot(fault_detection.SPLINE_FEET_VECTOR-detector.spline_feet_offset, detector.last_processed_waveform)
-                        #plt.ylim((-1,1))
-                        plt.ylim((-(2**15), 2**15))
-                        plt.xlim((fault_detection.SPLINE_FEET_VECTOR[0]-detector.spline_feet_offset, fault_detection.SPLINE_FEET_VECTOR[-1]-detector.spline_feet_offset))
+                        plot_y = detector.last_processed_waveform
+                        ylim = (-(2**15), 2**15)
+                        markers = []
                     else:
                         #plot BLS
-                        ylim = ((-2**16,2**16))
-                        bls = detector.last_processed_waveform - detector.processed_baseline
-                        max_f = fault_detection.SPLINE_FEET_VECTOR[np.argmax(bls)]-detector.spline_feet_offset
-                        plt.plot(fault_detection.SPLINE_FEET_VECTOR-detector.spline_feet_offset, bls)
-                        plt.plot([max_f, max_f], ylim)
-                        #plt.ylim((-1,1))
-                        plt.ylim(ylim)
-                        plt.xlim((fault_detection.SPLINE_FEET_VECTOR[0]-detector.spline_feet_offset, fault_detection.SPLINE_FEET_VECTOR[-1]-detector.spline_feet_offset))
-                    
-                    fig.canvas.draw()
-                    image = np.frombuffer(fig.canvas.tostring_rgb(), dtype=np.uint8)
-                    image = image.reshape(fig.canvas.get_width_height()[::-1] + (3,))
-                    plot_window.update(image)
-                    
+                        plot_y = detector.last_processed_waveform - detector.processed_baseline
+                        ylim = (-2**16, 2**16)
+                        markers = [feet[np.argmax(plot_y)]]
+                    latest_frame.set(DisplayFrame(feet, plot_y, detector.raw_baseline is not None, ylim, markers, fault, fault_locations, fault_string))
+                    if first_frame:
+                        first_frame = False
+                        first_string = "First waveform ready " + str(int((time.perf_counter() - STARTUP_TIME)*1000)) + " ms after launch"
+                        if DEBUG_LOG:
+                            debug_log(debug_log_path, first_string)
+                        curses_status.set(12, first_string)
+                    if dashboard is not None:
+                        dashboard.publish(feet, {"waveform": detector.last_processed_waveform, "bls": None if detector.raw_baseline is None else plot_y}, ylim, markers, fault_string)
+                    stage_timer.lap("publish")
+                
+                ###################################################################################################################################
+                #       COMMANDS: key presses & button clicks from the render loop
+                ###################################################################################################################################
+                while not commands.empty():
+                    command = commands.get()
+                    if callable(command):
+                        command(state) #button function
+                    elif command == COMMAND_SET_BASELINE and wf is not None:
+                        detector.set_baseline(wf)#set baseline
+                    elif command == COMMAND_TOGGLE_LOGGING:
+                        toggle_logging(state)
+                    elif command == COMMAND_RECORD_TERMINAL and wf is not None:
+                        terminal_waveform = wf #record waveform representing a disconnect at the panel terminal
+                    elif command == COMMAND_SET_TERMINAL and wf is not None:
+                        if (terminal_waveform is None): terminal_waveform = wf
+                        detector.set_terminal(terminal_waveform)#set terminal points based on recorded terminal waveform and current BLSDT
+                    elif command == COMMAND_THRESHOLD_DOWN:
+                        detector.bls_deviation_thresh = detector.bls_deviation_thresh - 0.01 #adjust deviation threshold for peak location
+                    elif command == COMMAND_THRESHOLD_UP:
+                        detector.bls_deviation_thresh = detector.bls_deviation_thresh + 0.01
+                    elif command == COMMAND_WINDOW_MEASUREMENT:
+                        take_window_measurement(state)
+                    elif command == COMMAND_NEXT_LOG:
+                        state.log_number += 1
+                    elif command == COMMAND_PROFILE:
+                        profile_capture.start() #record a cProfile of the acquisition loop
+                
+                ###################################################################################################################################
+                #       PROFILING: report stage timings, finish cProfile captures
+                ###################################################################################################################################
+                prof_path = profile_capture.poll()
+                if prof_path is not None:
+                    if DEBUG_LOG:
+                        debug_log(debug_log_path, "Saved profile to: "+prof_path)
+                    curses_status.set(10, "Saved profile to: "+prof_path)
+                if STAGE_TIMING and time.monotonic() >= next_timing_report:
+                    next_timing_report = time.monotonic() + TIMING_REPORT_INTERVAL
+                    timing_string = "Stage ms p50/p95: " + stage_timer.report()
+                    if not file_mode and multiprocess:
+                        timing_string = timing_string + "  " + ring_capture.report()
+                    elif not file_mode:
+                        timing_string = timing_string + "  queue " + str(receiver.q.qsize())
+                    timing_string = timing_string + "  " + log_writer.report()
+                    if not headless:
+                        timing_string = timing_string + "  render " + render_timer.report()
+                    if dashboard is not None:
+                        timing_string = timing_string + "  " + dashboard.report()
+                    if fleet_client is not None:
+                        timing_string = timing_string + "  " + fleet_client.report()
+                    if measurement_scheduler is not None:
+                        timing_string = timing_string + "  " + measurement_scheduler.report()
+                    if DEBUG_LOG:
+                        debug_log(debug_log_path, timing_string)
+                    curses_status.set(9, timing_string)
+                    if profile_capture.active():
+                        curses_status.set(10, "Recording profile, "+str(int(profile_capture.time_left()))+" s left...")
+                
+                ###################################################################################################################################
+                #       CURSES: status lines, check for quit
+                ###################################################################################################################################
+                curses_status.poll()
+                if not(cscreen is None):
+                    c = cscreen.getch()
+                    if (c == ord('p')):
+                        profile_capture.start() #record a cProfile of the acquisition loop
+                    if (c == ord('q')):
+                        cscreen.addstr(0,0,"Quitting: Terminating scanner...")
+                        cscreen.refresh()
+                        quit_event.set()
+                
+                #nothing to do until the next scheduled measurement; sleep, waking now and then for commands & keys
+                if not pipeline_awake:
+                    quit_event.wait(min(SCHEDULE_IDLE_POLL, measurement_scheduler.time_until(time.time())))
+        except:
+            print("Exception Occurred:")
+            print('='*40)
+            traceback.print_exc(file=sys.stdout)
+            print('='*40)
+        finally:
+            #stop the scanner, whichever thread asked to quit
+            quit_event.set()
+            profile_capture.stop() #dump a profile that is still being recorded
+            if not file_mode:
+                if not(cscreen is None):
+                    cscreen.addstr(0,0, "Stopped scanner. Waiting for threads...")
+                    cscreen.refresh()
+                if multiprocess:
+                    ring_capture.close() #stops the capture process, which stops the capture tool
+                else:
+                    receiver.halt()
+                    #while(rec_thread.running()):
+                    #    pass
+                    capture_source.close() #also stops the capture tool, if we launched one
+                #executor.shutdown() #performed implicitly by "with" statement
+            if not(cscreen is None):
+                cscreen.addstr(0,0, "Finished. Exiting...")
+                cscreen.refresh()
+    
+    #set up threads:
+    #first child thread: receives and interprets packets using receiver.run() (with -mp, the capture process does this instead)
+    #second child thread: acquisition_loop(), described above, unless headless; then the main thread runs it
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        if not file_mode and not multiprocess:
+            rec_thread = executor.submit(receiver.run)
+        if headless:
+            acquisition_loop()
+        else:
+            acq_thread = executor.submit(acquisition_loop)
+            
+            clock = pygame.time.Clock()
+            frame_version = 0
+            frame = None
+            show_waterfall = False #the plot window shows the waterfall instead of the latest trace
+            plot_stale = False #the plot window needs redrawing
+            #only the parts of the screen that change are redrawn; text is only rendered when it changes
+            screen_layers = ui.LayeredScreen(pscreen)
+            terminal_text = ui.TextCache(TERMINAL_FONT, TEXT_COLOR)
+            status_text = ui.TextCache(STATUS_FONT, COLOR_WHITE)
+            fault_text_surf = terminal_text.render("System OK")
+            hazard_rects = []
+            try:
+                while not quit_event.is_set():
+                    render_timer.start()
                     ###################################################################################################################################
-                    #       PYGAME: fault visualization & event queue
+                    #       PYGAME: event queue. anything that changes the scanner's state is done by the acquisition thread
                     ###################################################################################################################################
-                    fault = detector.detect_faults(wf)
-                    
                     for event in pygame.event.get():
                         if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
-                            pygame.display.quit()
-                            pygame.quit()
+                            quit_event.set()
                         if event.type == pygame.MOUSEBUTTONUP:
                             for button in ui.Button.buttons:
                                 if (button.rect.collidepoint(pygame.mouse.get_pos())):
-                                    button.function(state)
-                        if event.type == pygame.KEYDOWN:
-                            if event.key == pygame.K_b:
-                                detector.set_baseline(wf)#set baseline
-                            elif event.key == pygame.K_l:
-                                toggle_logging(state)
-                            elif event.key == pygame.K_a:
-                                terminal_waveform = wf #record waveform representing a disconnect at the panel terminal
-                            elif event.key == pygame.K_t:
-                                if (terminal_waveform is None): terminal_waveform = wf
-                                detector.set_terminal(terminal_waveform)#set terminal points based on recorded terminal waveform and current BLSDT
-                            elif event.key == pygame.K_LEFT:
-                                detector.bls_deviation_thresh = detector.bls_deviation_thresh - 0.01 #adjust deviation threshold for peak location
-                            elif event.key == pygame.K_RIGHT:
-                                detector.bls_deviation_thresh = detector.bls_deviation_thresh + 0.01
-                            elif event.key == pygame.K_w:
-                                take_window_measurement(state)
-                            elif event.key == pygame.K_i:
-                                state.log_number += 1
-                                
-                    #per-frame logic here
-                    is_fault = (fault[0] != fault_detection.FAULT_NONE)
-                    fault_d_f = fault[1] #fault distance in feet, before correcting for panel electrical length
+                                    commands.put(button.function)
+                        if event.type == pygame.KEYDOWN and event.key in KEY_COMMANDS:
+                            commands.put(KEY_COMMANDS[event.key])
+                        if event.type == pygame.KEYDOWN and event.key == pygame.K_h:
+                            show_waterfall = not show_waterfall
+                            plot_stale = True
+                        if event.type == pygame.VIDEOEXPOSE:
+                            screen_layers.redraw_all() #window was uncovered or restored
+                    render_timer.lap("events")
+                
+                    version, new_frame = latest_frame.get()
+                    if version != frame_version:
+                        frame_version = version
+                        frame = new_frame
+                        #one waterfall row is added every WATERFALL_ROW_INTERVAL, whether or not the waterfall is shown
+                        if waterfall.add(frame.feet, frame.plot_y, (frame.feet[0], frame.feet[-1]), frame.ylim, frame.bls) or not show_waterfall:
+                            plot_stale = True
                     
-                    if (is_fault):
-                        d = 0
-                        px = CONNECTOR_COORDS[0][0]
-                        py = CONNECTOR_COORDS[0][1]
-                        hazard_point = CONNECTOR_COORDS[-1]
-                        
-                        #determine the index of the first connector after the fault
-                        for i in range(N):
-                            if (connector_ds[i] > fault_d_f):
-                                break
-                        #i is now the index of the first connector junction AFTER the fault. if i=0, it means the fault is between the SSTDR and the first connector.
-                        #if i is len(connector_ds), it means no connector is after the fault: it is between the final connector and the SSTDR.
-                        
-                        #get the distance from the SSTDR positive lead to the pre-fault connector. distance is in feet
-                        if i == 0:
-                            pre_d = 0
-                        else:
-                            pre_d = connector_ds[i-1]
-                        #get the distance from the SSTDR positive lead to the post-fault node
-                        if i == N:
-                            post_d = connector_ds[-1] + panel_layout['home_cable_length'] #point in feet at final SSTDR terminal
+                        #fault visualization
+                        hazard_rects = []
+                        for location in frame.fault_locations:
+                            hazard_rects.append(hazard_surf.get_rect(center = location.pixel))
+                        fault_text_surf = terminal_text.render(frame.fault_string)
+                
+                    if plot_stale and frame is not None:
+                        plot_stale = False
+                        ###################################################################################################################################
+                        #       PYFORMULAS: visualize waveform
+                        ###################################################################################################################################
+                        xlim = (frame.feet[0], frame.feet[-1])
+                        if show_waterfall:
+                            waterfall.draw()
+                            image = waterfall.pixels()
+                        elif USE_MATPLOTLIB:
+                            #some code from https://stackoverflow.com/questions/40126176/fast-live-plotting-in-matplotlib-pyplot
+                            plt.clf()
+                            plt.xlabel("Distance (feet)")
+                            plt.ylabel("Correlation With Reflection")
+                            plt.gcf().subplots_adjust(left=0.15)
+                            plt.plot(frame.feet, frame.plot_y)
+                            for max_f in frame.markers:
+                                plt.plot([max_f, max_f], frame.ylim)
+                            plt.ylim(frame.ylim)
+                            plt.xlim(xlim)
+                            fig.canvas.draw()
+                            image = np.frombuffer(fig.canvas.tostring_rgb(), dtype=np.uint8)
+                            image = image.reshape(fig.canvas.get_width_height()[::-1] + (3,))
                         else:
-                            post_d = connector_ds[i]          
-                        #get PIXEL locations of pre-fault and post-fault points, then calculate PIXEL location of fault point
-                        pre_x, pre_y = CONNECTOR_COORDS[i] #CONNECTOR_COORDS has an extra point at i=0 (where x=0), so this chooses the point of the panel/terminal BEFORE the fault
-                        post_x, post_y = CONNECTOR_COORDS[i+1] #certainly safe; CONNECTOR_COORDS has two more points than PANEL_COORDS. chooses the point AFTER the fault
-                        hsr = (fault_d_f - pre_d)/(post_d - pre_d) #hazard step ratio: ratio at which the fault lies in between post point and pre point, s.t. fault_d = pre_d + hsr*(post_d - pre_d)
-                        step = ((post_x-pre_x)**2 + (post_y-pre_y)**2)**0.5 #distance IN PIXELS between post and pre points
-                        hazard_rect.center = (pre_x + hsr*(post_x-pre_x), pre_y + hsr*(post_y-pre_y))
-                        
-                        #subtract from distance to account for panel length; only want to report cable length
-                        fault_cable_location = fault_d_f - panel_length*i
-                        
-                        fault_name = fault_detection.get_fault_name(fault[0])
-                        fault_text_surf = TERMINAL_FONT.render(fault_name + " located at " + str(round(fault_cable_location,3)) + " feet", True, TEXT_COLOR)
-                    else:
-                        fault_text_surf = TERMINAL_FONT.render("System OK", True, TEXT_COLOR)
+                            #axes are only redrawn when the distance axis moves (e.g. a new baseline changes the zero index)
+                            waveform_plot.draw(frame.feet, frame.plot_y, xlim, frame.ylim, frame.markers)
+                            image = waveform_plot.pixels()
+                        render_timer.lap("plot draw")
+                        plot_window.update(image)
+                        render_timer.lap("plot window")
+                
+                    ###################################################################################################################################
+                    #       PYGAME: fault visualization
+                    ###################################################################################################################################
                     fault_text_rect = fault_text_surf.get_rect()
                     fault_text_rect.center = term_rect.center
-                    
+                
                     #param_text_surf = STATUS_FONT.render("BLS deviation threshold:" + str(detector.bls_deviation_thresh), True, COLOR_WHITE)
                     #param_text_surf = STATUS_FONT.render("LPF Cutoff Frequency: 6 MHz", True, COLOR_WHITE) #TODO don't hard code this, allow for live control of cutoff frequency
-                    param_text_surf = STATUS_FONT.render("Current Log Number: "+str(state.log_number), True, COLOR_WHITE)
+                    param_text_surf = status_text.render("Current Log Number: "+str(state.log_number))
                     param_text_rect = param_text_surf.get_rect()
                     param_text_rect.bottomright = (SCREEN_X-3, VISUAL_Y - BORDER_WIDTH - int(0.5*BORDER_PADDING) - 3)
-                    
+                
                     logging_string = "Logging to '"+output_path+"'..." if state.logging else "Not logging."
-                    logging_text_surf = STATUS_FONT.render(logging_string, True, COLOR_WHITE)
+                    logging_text_surf = status_text.render(logging_string)
                     logging_text_rect = logging_text_surf.get_rect()
                     logging_text_rect.bottomright = param_text_rect.topright
-                    
-                    if time_interval != -1:
-                        timer_string = "Next log time: "+state.next_log_time.strftime("%H:%M:%S")
-                        timer_text_surf = STATUS_FONT.render(timer_string, True, COLOR_WHITE)
+                
+                    if measurement_scheduler is not None:
+                        timer_string = "Next log time: "+("none" if state.next_log_time is None else state.next_log_time.strftime("%H:%M:%S"))
+                        timer_text_surf = status_text.render(timer_string)
                         timer_text_rect = timer_text_surf.get_rect()
                         timer_text_rect.bottomright = logging_text_rect.topright
-                    
-                    #buttons: fill with color depending on context
+                
+                    #buttons: fill with color depending on context. a button is only redrawn when its highlight changes
                     mousepos = pygame.mouse.get_pos()
                     for button in ui.Button.buttons:
                         hovered = button.rect.collidepoint(mousepos)
-                        button.set_highlight(hovered)
-                    
-                    #drawing
-                    pscreen.blit(bg_surf, bg_rect)
-                    pscreen.blit(term_surf, term_rect)
-                    pscreen.blit(fault_text_surf, fault_text_rect)
-                    pscreen.blit(param_text_surf, param_text_rect)
-                    pscreen.blit(logging_text_surf, logging_text_rect)
-                    if time_interval != -1:
-                        pscreen.blit(timer_text_surf, timer_text_rect)
-                    pscreen.blit(array_surf, array_rect)
-                    for button in ui.Button.buttons:
-                        pscreen.blit(button.surf, button.rect)
-                    if (is_fault):
-                        pscreen.blit(hazard_surf, hazard_rect)
-                    pygame.display.flip()
+                        if button.set_highlight(hovered):
+                            screen_layers.mark_dirty(button.rect)
                 
-                ###################################################################################################################################
-                #       CURSES: Check for quit
-                ###################################################################################################################################
-                if not(cscreen is None):
-                    c = cscreen.getch()
-                    if (c == ord('q')):
-                        cscreen.addstr(0,0,"Quitting: Terminating scanner...")
-                        cscreen.refresh()                
-                        usbpcap_process.terminate()                
-                        cscreen.addstr(0,0, "Stopped scanner. Waiting for threads...")
-                        cscreen.refresh()
-                        receiver.halt()
-                        #while(rec_thread.running()):
-                        #    pass
-                        usb_stream.close()
-                        #executor.shutdown() #performed implicitly by "with" statement
-                        cscreen.addstr(0,0, "Finished. Exiting...")
-                        break
-        except:
-            print("Exception Occurred:")
-            print('='*40)
-            traceback.print_exc(file=sys.stdout)
-            print('='*40)
-            
+                    #drawing, in order from back to front
+                    layers = [("background", bg_surf, bg_rect), ("terminal", term_surf, term_rect), ("fault text", fault_text_surf, fault_text_rect)]
+                    layers.append(("param text", param_text_surf, param_text_rect))
+                    layers.append(("logging text", logging_text_surf, logging_text_rect))
+                    if measurement_scheduler is not None:
+                        layers.append(("timer text", timer_text_surf, timer_text_rect))
+                    layers.append(("array", array_surf, array_rect))
+                    for i, button in enumerate(ui.Button.buttons):
+                        layers.append(("button "+str(i), button.surf, button.rect))
+                    for i, hazard_rect in enumerate(hazard_rects):
+                        layers.append(("hazard "+str(i), hazard_surf, hazard_rect))
+                    screen_layers.draw(layers)
+                    render_timer.lap("pygame")
+                
+                    #cap the frame rate; the time left over is given to the other threads
+                    clock.tick(RENDER_FPS)
+            except:
+                print("Exception Occurred:")
+                print('='*40)
+                traceback.print_exc(file=sys.stdout)
+                print('='*40)
+            finally:
+                quit_event.set()
+                acq_thread.result() #wait for the acquisition thread to stop the scanner
+                pygame.display.quit()
+                pygame.quit()
+    log_writer.close() #write out any waveforms still queued
+    if dashboard is not None:
+        dashboard.stop()
+    if fleet_client is not None:
+        fleet_client.close() #anything not sent in time stays spooled for the next session
+    
     print("All done. :)")
 
 def debug_log(debug_log_path, str):
@@ -783,11 +1076,11 @@ def take_window_measurement(state):
     if state.logging:
         state.log_number += 1
     state.logging = True
-    state.measurement_counter = 10 #counts down to zero
+    state.measurement_counter = scheduler.WINDOW_MEASUREMENT_COUNT #counts down to zero
 
 def process_waveform_region(pString,cscreen = None):
     #TODO alter this depending on the device class
-    prefix_len = 20 #bytes
+    prefix_len = waveform_framer.COMMERCIAL_HEADER_LENGTH #bytes
     if not cscreen is None and DEBUG_VERIFICATION:
         cscreen.addstr(8,4,"Waveform prefix: "+str(pString[0:prefix_len]))
         cscreen.refresh()
@@ -804,68 +1097,51 @@ def process_waveform_region_prototype(pString,cscreen = None):
         cscreen.refresh()
     elif DEBUG_VERIFICATION:
         print("Prefix: "+str(pString[0:6])+'\n')
-    waveform = convert_waveform_region_prototype(pString)[6:-1]
+    waveform = convert_waveform_region_prototype(pString)[waveform_framer.PROTOTYPE_HEADER_SAMPLES:-1]
     #we can do anything with this waveform
     return waveform
 
-def convert_waveform_region_prototype(pString):
-    """takes a bytestring of arbitrary length, converts it into little-endian int16s. ignores trailing odd bytes"""
-    N = len(pString)
-    Nh = int(N/2)
-    concat = [0]*Nh
-    for i in range(Nh):
-        vl = pString[2*i] #indexing with a scalar returns an integer
-        vr = pString[2*i+1]
-        #combine , little endian
-        value = ((vr<<8)+vl)
-        #convert to signed integer
-        if (value & 0x8000 != 0):
-            value = value - 2**16
-        concat[i] = value
-    return concat
-
-def convert_waveform_region(pString):
-    """takes a bytestring of arbitrary length, converts it into big-endian int16s. ignores trailing odd bytes"""
-    N = len(pString)
-    Nh = int(N/2)
-    concat = [0]*Nh
-    for i in range(Nh):
-        vl = pString[2*i] #indexing with a scalar returns an integer
-        vr = pString[2*i+1]
-        #combine , big endian
-        value = ((vl<<8)+vr)
-        #convert to signed integer
-        if (value & 0x8000 != 0):
-            value = value - 2**16
-        concat[i] = value
-    return concat
-
-def load_panel_layout(yfile_path):
-    #load panel layout file, determine panel locations along wire
-    try:
-        with open(yfile_path, "r") as f:
-            data = yaml.safe_load(f)
-        panel_series = data[0]
-        N = panel_series['panel_count'] #TODO: only loads 0th series. for multi-series systems, this should be changed
-        connector_ds = [0]*(N+1) #init empty array. connector_ds is distance in feet from the SSTDR to each MC-4 connector, accounting for module length, module cables & leading cables
-        connector_ds[0] = panel_series['header_cable_length'] + panel_series['panel_cable_length']
-        for i in range(1,N):
-            connector_ds[i] = connector_ds[i-1] + 2*panel_series['panel_cable_length'] + panel_series['panel_electrical_length']
-        #returns tuple:
-        #   panel_series: layout dictionary directly loaded from .yaml
-        #   connector_ds: list of connector distances from SSTDR, in feet
-        #   panel length: electrical length of panels
-        return (panel_series, connector_ds, panel_series['panel_electrical_length'])
-        
-    except:
-        print("Exception Occurred:")
-        print('='*40)
-        traceback.print_exc(file=sys.stdout)
-        print('='*40)
-        return None
+def layout_string_pixels(string, panel_w, panel_h, padding):
+    #places the panels & MC-4 connectors of one string (a panel_layout.StringLayout) on screen, relative to the top left of the string.
+    #returns tuple:
+    #   PANEL_COORDS: pixel coordinates of the top left of each panel, in wiring order
+    #   CONNECTOR_COORDS: pixel coordinates of each connector (one more than panels), relative to panel top left corners
+    #   panel_cols, panel_rows: size of the string in panels
+    P = string.panel_count #number of panels
+    H = int(P/2)-1 #H for half; the number of panels in one row
+    if (string.layout == panel_layout.LAYOUT_LOOP):
+        panel_rows = 2
+        panel_cols = int(P/2+0.5)
+        r = 0
+        PANEL_COORDS = [(c*(padding[0] + panel_w), r*(padding[1] + panel_h)) for c in range(0,H+1)] #pixel coordinates for panels in top row
+        CONNECTOR_COORDS = [(x - padding[0],y) for x,y in PANEL_COORDS] #pixel coordinates of MC-4 connectors for top row; just bisects the panel padding
+        if (P%2 == 1):
+            #add odd panel
+            r = 0.5
+            new_panel_coord = ((H+1)*(padding[0] + panel_w), r*(padding[1] + panel_h)) #central panel for odd panel counts
+            PANEL_COORDS = PANEL_COORDS + [new_panel_coord]
+            #add connectors diagonally positioned before & after odd panel
+            CONNECTOR_COORDS = CONNECTOR_COORDS + [(new_panel_coord[0] - padding[0], new_panel_coord[1] - padding[1]/2**0.5)]
+            CONNECTOR_COORDS = CONNECTOR_COORDS + [(new_panel_coord[0] - padding[0], new_panel_coord[1] + padding[1]/2**0.5)]
+        else:
+            #add connector coord vertically between the top & bottom panels
+            CONNECTOR_COORDS = CONNECTOR_COORDS + [(PANEL_COORDS[-1][0], PANEL_COORDS[-1][1]+0.5*padding[1])]
+        r = 1
+        bottom_panel_coords = [(c*(padding[0] + panel_w), r*(padding[1] + panel_h)) for c in range(H,-1,-1)] #pixel coordinates for panels in bottom row
+        bottom_connector_coords = [(x - padding[0], y) for x,y in bottom_panel_coords] #pixel coordinates of MC-4 connectors for bottom row; just bisects the panel padding
+        PANEL_COORDS = PANEL_COORDS + bottom_panel_coords
+        CONNECTOR_COORDS = CONNECTOR_COORDS + bottom_connector_coords
+    else:
+        panel_rows = 1
+        panel_cols = P
+        r = 0
+        PANEL_COORDS = [(c*(padding[0] + panel_w), r*(padding[1] + panel_h)) for c in range(0,P)] #one long row, with a home-run leading all the way back
+        CONNECTOR_COORDS = [(c*(padding[0] + panel_w) - padding[0]/2, r) for c in range(0,P+1)] #pixel coordinates of MC-4 connectors; just bisects the panel padding
+    return (PANEL_COORDS, CONNECTOR_COORDS, panel_cols, panel_rows)
 
 if (__name__ == '__main__'):
     if USE_CURSES:
+        import curses
         curses.wrapper(main)
     else:
         main()
@@ -0,0 +1,155 @@
+#binary_log.py
+#fixed-width binary waveform log format, an optional alternative to the csv logs written by SSTDR_USB.
+#a csv row is ~600 bytes of text that must be parsed again on every load; a binary record is 200 bytes and is read by
+#memory mapping the file, without parsing.
+#
+#file layout (little endian):
+#   header, 32 bytes: magic b'SSTDRWFL', u16 format version, u16 samples per waveform, u32 record size, 16 reserved bytes
+#   records, back to back: i32 session_number, i32 log_number, f64 timestamp, i16 x samples per waveform
+#a truncated final record (e.g. from a power loss while writing) is ignored by the reader.
+#
+#conversion, command line arguments:
+#   python binary_log.py [input path] [output path]
+#   the direction is chosen by extension: a BINARY_EXTENSION input is converted to csv, anything else is converted to binary.
+#
+#example: python binary_log.py SSTDR_waveforms.csv SSTDR_waveforms.wfl
+
+import sys
+import os
+import numpy as np
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" [input path] [output path]"
+BINARY_EXTENSION = ".wfl"
+MAGIC = b'SSTDRWFL'
+VERSION = 1
+WAVEFORM_LENGTH = 92
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u2'), ('waveform_length', '<u2'), ('record_size', '<u4'), ('reserved', 'V16')])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+CSV_HEADER = "session_number,log_number,timestamp,waveform\n"
+CONVERT_CHUNK_ROWS = 10000 #rows converted at a time, bounds memory when converting large archives
+SAMPLE_MIN = np.iinfo(np.int16).min
+SAMPLE_MAX = np.iinfo(np.int16).max
+
+def record_dtype(waveform_length = WAVEFORM_LENGTH):
+    return np.dtype([('session_number', '<i4'), ('log_number', '<i4'), ('timestamp', '<f8'), ('waveform', '<i2', (waveform_length,))])
+
+RECORD_DTYPE = record_dtype()
+
+def is_binary_path(path):
+    return os.path.splitext(path)[1].lower() == BINARY_EXTENSION
+
+def header_bytes(waveform_length = WAVEFORM_LENGTH):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['waveform_length'] = waveform_length
+    header['record_size'] = record_dtype(waveform_length).itemsize
+    return header.tobytes()
+
+def read_header(f):
+    #reads and checks the header of an open binary log; returns the record dtype of the file
+    raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError("Not a binary waveform log: file is shorter than its header.")
+    header = np.frombuffer(raw, dtype=HEADER_DTYPE)[0]
+    if header['magic'] != MAGIC:
+        raise ValueError("Not a binary waveform log: bad magic.")
+    if header['version'] != VERSION:
+        raise ValueError("Unsupported binary waveform log version: "+str(header['version']))
+    dtype = record_dtype(int(header['waveform_length']))
+    if header['record_size'] != dtype.itemsize:
+        raise ValueError("Corrupt binary waveform log header: record size does not match waveform length.")
+    return dtype
+
+def pack_records(rows, waveform_length = WAVEFORM_LENGTH):
+    #rows: list of (session_number, log_number, timestamp, waveform). returns the bytes of their records
+    records = np.zeros(len(rows), dtype=record_dtype(waveform_length))
+    if len(rows) == 0:
+        return records.tobytes()
+    session_numbers, log_numbers, timestamps, wfs = zip(*rows)
+    wfs = np.array(wfs)
+    if wfs.size > 0 and (wfs.min() < SAMPLE_MIN or wfs.max() > SAMPLE_MAX):
+        raise ValueError("Waveform samples do not fit in int16.")
+    records['session_number'] = session_numbers
+    records['log_number'] = log_numbers
+    records['timestamp'] = timestamps
+    records['waveform'] = wfs
+    return records.tobytes()
+
+def open_log(path):
+    #returns the records of a binary log as a read-only structured array, memory mapped (nothing is read until indexed).
+    #fields: session_number, log_number, timestamp, waveform (shape (N, samples))
+    with open(path, "rb") as f:
+        dtype = read_header(f)
+    count = (os.path.getsize(path) - HEADER_SIZE)//dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+def read_ungrouped(path):
+    #same layout as fault_detection.read_csv_ungrouped: one int row per record, [session, log, timestamp, samples...]
+    records = open_log(path)
+    rows = np.empty((len(records), 3 + records.dtype['waveform'].shape[0]), dtype=int)
+    rows[:,0] = records['session_number']
+    rows[:,1] = records['log_number']
+    rows[:,2] = records['timestamp']
+    rows[:,3:] = records['waveform']
+    return rows
+
+######################################################
+##                   CONVERSION                     ##
+######################################################
+
+def csv_to_binary(csv_path, binary_path):
+    #returns the number of records written
+    count = 0
+    with open(csv_path, "r") as f_in, open(binary_path, "wb") as f_out:
+        f_in.readline() #header row
+        waveform_length = None
+        rows = []
+        for line in f_in:
+            if line.strip() == '':
+                continue
+            values = line.split(',')
+            if waveform_length is None:
+                waveform_length = len(values)-3
+                f_out.write(header_bytes(waveform_length))
+            rows.append((int(values[0]), int(values[1]), float(values[2]), np.array(values[3:], dtype=float)))
+            if len(rows) >= CONVERT_CHUNK_ROWS:
+                f_out.write(pack_records(rows, waveform_length))
+                count += len(rows)
+                rows = []
+        if waveform_length is None:
+            f_out.write(header_bytes())
+        elif len(rows) > 0:
+            f_out.write(pack_records(rows, waveform_length))
+            count += len(rows)
+    return count
+
+def binary_to_csv(binary_path, csv_path):
+    #returns the number of rows written. rows are formatted exactly as SSTDR_USB logs them
+    from log_writer import format_row
+    records = open_log(binary_path)
+    with open(csv_path, "w") as f:
+        f.write(CSV_HEADER)
+        for start in range(0, len(records), CONVERT_CHUNK_ROWS):
+            chunk = records[start:start+CONVERT_CHUNK_ROWS]
+            f.write(''.join([format_row(int(r['session_number']), int(r['log_number']), float(r['timestamp']), r['waveform']) for r in chunk]))
+    return len(records)
+
+def main():
+    if len(sys.argv) < 3:
+        print("Error: invalid input.")
+        print(USAGE_STRING)
+        return
+    in_path = sys.argv[1]
+    out_path = sys.argv[2]
+    if is_binary_path(in_path):
+        count = binary_to_csv(in_path, out_path)
+    else:
+        count = csv_to_binary(in_path, out_path)
+    print("Finished. Converted "+str(count)+" rows to: "+out_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#calibration.py
+#fits the propagation velocity (feet per sample) and zero index (sample index of the cable start) used by
+#fault_detection.Detector, from logged waveforms of opens & shorts at known distances, instead of working them out by hand
+#for every new cable (see the FEET_PER_SAMPLE history in fault_detection.py).
+#
+#each labeled log is reduced to its mean waveform, spline interpolated and baseline subtracted against its baseline log
+#(read_waveforms.spline_batch), and scaled to a peak of 1, so near and far faults count the same. a candidate
+#(feet per sample, zero index) predicts the spline index of every reference's reflection, by the detector's own
+#distance formula solved for the index; its score is the sum over the references of the BLS at those indices, signed
+#like the reflections (+ for opens, - for shorts). every candidate on a grid is scored against every reference at once,
+#by gathering a (feet per sample, zero index, reference) array out of the BLS matrix; the best is refined on a finer
+#grid around it.
+#
+#calibration file: json, with "feet_per_sample" and "zero_index" (samples, can be fractional), plus the fit's
+#"rms_error_feet", "references" and "created". SSTDR_USB loads it (Detector.load_calibration) at startup if it exists.
+#
+#command line arguments, can be provided in any order:
+#   -labels [path]   : csv of labeled logs, in dictionary_learning.py's format: "file,log_number,fault_type,distance,baseline_log".
+#                      logs labeled none are skipped (REQUIRED; at least 2 opens/shorts at different distances)
+#   -o [path]        : output calibration path (OPTIONAL, defaults to "calibration.json")
+#   -fps [min-max]   : feet per sample searched (OPTIONAL, defaults to 2.5-4.5)
+#   -zero [min-max]  : zero indices searched, in samples (OPTIONAL, defaults to 0-20)
+#   -lpf             : low pass filter the waveforms first, as METHOD_LOW_PASS_PEAKS does
+#
+#example: python calibration.py -labels NREL_labels.csv -o calibration.json
+
+import sys
+import json
+import numpy as np
+import datetime as dt
+
+import fault_detection as fd
+import read_waveforms
+import dictionary_learning
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" -labels [labeled log csv path] -o [out path; optional] -fps [min-max; optional] -zero [min-max; optional] -lpf"
+DEFAULT_CALIBRATION_PATH = "calibration.json"
+FPS_RANGE = (2.5, 4.5) #feet per sample; covers every cable measured so far
+ZERO_RANGE = (0.0, 20.0) #samples
+COARSE_STEPS = (201, 201) #grid points in (feet per sample, zero index) for the first search
+FINE_SPAN = 2 #the fine search covers this many coarse steps on either side of the coarse best
+FINE_STEPS = (81, 81)
+PEAK_WINDOW = 22 #spline samples (~2 raw samples, half a carrier period) searched around a predicted reflection for its peak
+SEARCH_CHUNK_ELEMENTS = 1 << 22 #candidates*references gathered at a time, to bound memory with many references
+
+def spline_index(distances, feet_per_sample, zero_index):
+    #spline index at which the detector puts a reflection at each distance; the inverse of
+    #units_per_sample*(index - spline_zero_index) in Detector.detect_faults. broadcasts over all three arguments
+    spline_zero_index = zero_index/fd.WAVEFORM_LENGTH*fd.SPLINE_LENGTH
+    units_per_sample = feet_per_sample*fd.WAVEFORM_LENGTH/fd.SPLINE_LENGTH
+    return spline_zero_index + distances/units_per_sample
+
+def distance(index, feet_per_sample, zero_index):
+    #the detector's distance for a reflection at a spline index
+    return feet_per_sample*fd.WAVEFORM_LENGTH/fd.SPLINE_LENGTH*(index - zero_index/fd.WAVEFORM_LENGTH*fd.SPLINE_LENGTH)
+
+def reference_bls(labels, low_pass = False):
+    #labels: list of (file path, log number, fault type, distance, baseline log number), as dictionary_learning.read_labels
+    #returns (BLS matrix, one normalized spline row per reference; signs, +1 for opens & -1 for shorts; distances)
+    files = {}
+    rows = []
+    signs = []
+    distances = []
+    for file_path, log_number, fault_type, fault_distance, baseline_log in labels:
+        if fault_type not in [fd.FAULT_OPEN, fd.FAULT_SHORT]:
+            continue
+        if file_path not in files:
+            log_numbers, wfs = read_waveforms.reduce_logs(read_waveforms.load_log(file_path), read_waveforms.PER_LOG_MEAN)
+            files[file_path] = (list(log_numbers), wfs)
+        log_numbers, wfs = files[file_path]
+        rows.append(wfs[log_numbers.index(log_number)] - wfs[log_numbers.index(baseline_log)])
+        signs.append(1 if fault_type == fd.FAULT_OPEN else -1)
+        distances.append(fault_distance)
+    if len(rows) == 0:
+        raise ValueError("no open or short references in the labels")
+    rows = np.array(rows)
+    if low_pass:
+        rows = read_waveforms.low_pass_filter_batch(rows, fd.LPF_CUTOFF_INDEX)
+    bls = read_waveforms.spline_batch(rows)
+    bls = bls/np.maximum(np.max(np.abs(bls), axis=1), 1e-12)[:,None]
+    return (bls, np.array(signs), np.array(distances, dtype=float))
+
+def sample_at(bls, indices):
+    #bls (references, L) linearly interpolated at fractional indices (..., references); 0 outside the waveform
+    length = bls.shape[1]
+    inside = (indices >= 0) & (indices <= length-1)
+    indices = np.clip(indices, 0, length-1)
+    lo = np.minimum(indices.astype(int), length-2)
+    frac = indices - lo
+    columns = np.arange(bls.shape[0])
+    values = bls[columns, lo]*(1-frac) + bls[columns, lo+1]*frac
+    return np.where(inside, values, 0)
+
+def score_grid(bls, signs, distances, fps_values, zero_values):
+    #(len(fps_values), len(zero_values)) scores: sum of signed BLS at every reference's predicted index
+    scores = np.empty((len(fps_values), len(zero_values)))
+    chunk = max(1, SEARCH_CHUNK_ELEMENTS//(len(zero_values)*len(distances)))
+    for start in range(0, len(fps_values), chunk):
+        fps = fps_values[start:start+chunk, None, None]
+        indices = spline_index(distances[None, None, :], fps, zero_values[None, :, None])
+        scores[start:start+chunk] = np.sum(sample_at(bls, indices)*signs, axis=2)
+    return scores
+
+def grid_search(bls, signs, distances, fps_range, zero_range, steps):
+    #returns (feet per sample, zero index, score) of the best candidate on the grid
+    fps_values = np.linspace(fps_range[0], fps_range[1], steps[0])
+    zero_values = np.linspace(zero_range[0], zero_range[1], steps[1])
+    scores = score_grid(bls, signs, distances, fps_values, zero_values)
+    i, j = np.unravel_index(np.argmax(scores), scores.shape)
+    return (fps_values[i], zero_values[j], scores[i, j])
+
+def locate(bls, signs, distances, feet_per_sample, zero_index):
+    #distance of each reference's (signed) BLS peak near its predicted index, by the fitted constants.
+    #nan for references predicted to lie past the end of the waveform
+    predicted = np.round(spline_index(distances, feet_per_sample, zero_index)).astype(int)
+    located = []
+    for row, sign, k in zip(bls, signs, predicted):
+        if k < 0 or k >= len(row):
+            located.append(np.nan)
+            continue
+        lo = max(0, k - PEAK_WINDOW)
+        hi = min(len(row), k + PEAK_WINDOW + 1)
+        located.append(distance(lo + np.argmax(sign*row[lo:hi]), feet_per_sample, zero_index))
+    return np.array(located)
+
+def calibrate(labels, fps_range = FPS_RANGE, zero_range = ZERO_RANGE, low_pass = False):
+    #returns the calibration (a dict, as saved by save_calibration)
+    bls, signs, distances = reference_bls(labels, low_pass)
+    if len(np.unique(distances)) < 2:
+        raise ValueError("need references at 2 or more distances to separate feet per sample from the zero index")
+    fps, zero, _ = grid_search(bls, signs, distances, fps_range, zero_range, COARSE_STEPS)
+    fps_step = (fps_range[1]-fps_range[0])/(COARSE_STEPS[0]-1)
+    zero_step = (zero_range[1]-zero_range[0])/(COARSE_STEPS[1]-1)
+    fps, zero, score = grid_search(bls, signs, distances, (fps - FINE_SPAN*fps_step, fps + FINE_SPAN*fps_step),
+                                   (zero - FINE_SPAN*zero_step, zero + FINE_SPAN*zero_step), FINE_STEPS)
+    errors = locate(bls, signs, distances, fps, zero) - distances
+    if np.all(np.isnan(errors)):
+        raise ValueError("every reference lies outside the waveform")
+    return {
+        "feet_per_sample": round(float(fps), 5),
+        "zero_index": round(float(zero), 4),
+        "rms_error_feet": round(float(np.sqrt(np.nanmean(errors**2))), 3),
+        "max_error_feet": round(float(np.nanmax(np.abs(errors))), 3),
+        "score": round(float(score/len(distances)), 4), #1 if every reference's peak is exactly where predicted
+        "references": len(distances),
+        "low_pass": low_pass,
+        "created": dt.datetime.now().isoformat(timespec='seconds'),
+        "errors_feet": [None if np.isnan(e) else round(float(e), 3) for e in errors], #None: past the end of the waveform
+    }
+
+def save_calibration(path, calibration):
+    with open(path, "w") as f:
+        json.dump(calibration, f, indent=4)
+
+def load_calibration(path):
+    #returns (feet per sample, zero index)
+    with open(path, "r") as f:
+        calibration = json.load(f)
+    return (float(calibration["feet_per_sample"]), float(calibration["zero_index"]))
+
+def parse_range(text):
+    #"2.5-4.5" -> (2.5, 4.5)
+    low, high = [float(x) for x in text.split('-')]
+    if high <= low:
+        raise ValueError("empty range")
+    return (low, high)
+
+def main():
+    out_path = DEFAULT_CALIBRATION_PATH
+    fps_range = FPS_RANGE
+    zero_range = ZERO_RANGE
+    try:
+        args = sys.argv
+        labels = dictionary_learning.read_labels(args[args.index('-labels')+1])
+        if '-o' in args:
+            out_path = args[args.index('-o')+1]
+        if '-fps' in args:
+            fps_range = parse_range(args[args.index('-fps')+1])
+        if '-zero' in args:
+            zero_range = parse_range(args[args.index('-zero')+1])
+        low_pass = '-lpf' in args
+    except:
+        print("Error: invalid input.")
+        print(USAGE_STRING)
+        return
+
+    calibration = calibrate(labels, fps_range, zero_range, low_pass)
+    for key in ["feet_per_sample", "zero_index", "rms_error_feet", "max_error_feet", "score", "references"]:
+        print(key + ": " + str(calibration[key]))
+    outside = calibration["errors_feet"].count(None)
+    if outside > 0:
+        print("Warning: "+str(outside)+" reference(s) lie past the end of the waveform with these constants")
+    save_calibration(out_path, calibration)
+    print("Finished. Wrote calibration to: "+out_path)
+
+if __name__ == '__main__':
+    main()
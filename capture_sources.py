@@ -0,0 +1,309 @@
+#capture_sources.py
+#where SSTDR_USB's packets come from: a capture tool run as a subprocess (USBPcapCMD on windows, tcpdump on linux's
+#usbmon), a recorded pcap file, or stdin. every source is just a binary stream of pcap data for a PcapPacketReceiver,
+#which picks the header decoder (USBPcap or usbmon) from the capture's linktype, so nothing downstream of the receiver
+#needs to know which tool recorded the packets.
+#
+#run by itself, summarizes a capture: the linktype, packets per device & endpoint, and waveforms framed for a device class.
+#with -ring, it is the capture process of SSTDR_USB's -mp mode instead (see RingCapture): it frames waveforms into a
+#shared memory WaveformRing until the ring's reader tells it to stop.
+#command line arguments, can be provided in any order:
+#   -pcap [path]    : pcap file to read, or '-' for stdin (REQUIRED unless -bus is given)
+#   -bus [n]        : capture live from this bus instead (usbmon on linux, the USBPcap filter number on windows)
+#   -address [n]    : only count packets from this device address (OPTIONAL; needed with -bus on windows)
+#   -capture [tool] : 'usbpcap' or 'usbmon' (OPTIONAL, defaults to usbpcap on windows & usbmon elsewhere)
+#   -device [name]  : 'commercial' or 'prototype' (OPTIONAL, defaults to commercial)
+#   -n [count]      : stop after this many packets (OPTIONAL, defaults to reading the whole capture)
+#   -ring [name]    : frame waveforms into this shared memory ring, until told to stop (OPTIONAL)
+#
+#recording a usbmon capture on linux, for testing: sudo modprobe usbmon; sudo tcpdump -i usbmon1 -w probe.pcap
+#(dumpcap and wireshark also work, but write pcapng unless given -F pcap)
+
+import sys
+import os
+import time
+import struct
+import signal
+import subprocess
+
+import PcapPacketReceiver as ppr
+import waveform_framer
+from waveform_ring import WaveformRing
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" -pcap [path or '-'] -bus [n] -address [n] -capture [usbpcap|usbmon] -device [commercial|prototype] -n [count] -ring [name]"
+
+#fake enum of live capture tools
+CAPTURE_USBPCAP = 0 #USBPcapCMD, on windows
+CAPTURE_USBMON = 1 #tcpdump on a usbmon interface, on linux
+DEFAULT_CAPTURE = CAPTURE_USBPCAP if os.name == 'nt' else CAPTURE_USBMON
+CAPTURE_NAMES = {'usbpcap': CAPTURE_USBPCAP, 'usbmon': CAPTURE_USBMON}
+
+USBPCAP_PATH = "C:\\Program Files\\USBPcap\\USBPcapCMD.exe"
+TCPDUMP_PATH = "tcpdump"
+RING_EOF_POLL = 0.05 #seconds the ring capture process waits for a recorded capture to grow, once it has read all of it
+RING_STOP_TIMEOUT = 2.0 #seconds the capture process gets to exit by itself, before it is terminated
+
+def usbpcap_command(arg_filter, arg_address, path = USBPCAP_PATH):
+    return [path, "-d", "\\\\.\\USBPcap" + str(arg_filter), "--devices", str(arg_address), "-o", "-"]
+
+def usbmon_command(bus, path = TCPDUMP_PATH):
+    #usbmon captures the whole bus; the receiver can drop other devices' packets (see PcapPacketReceiver's address).
+    #-U writes out every packet as soon as it is captured, instead of whenever tcpdump's buffer fills
+    return [path, "-i", "usbmon" + str(bus), "-U", "-s", "0", "-w", "-"]
+
+class CaptureSource:
+    """
+    A binary stream of pcap data, and whatever needs cleaning up after it.
+
+    Usage:
+    open one of FileSource(path), StdinSource() or ProcessSource(args) (or
+    use open_source()), give source.stream to a PcapPacketReceiver, and call
+    source.close() once the receiver has halted. source.description says
+    where the packets come from, for status messages.
+    """
+    def __init__(self, stream, description):
+        self.stream = stream
+        self.description = description
+
+    def close(self):
+        self.stream.close()
+
+class FileSource(CaptureSource):
+    #a recorded (or simulated) capture. a receiver with loop=True keeps reading it as it grows
+    def __init__(self, path):
+        CaptureSource.__init__(self, open(path, "rb"), "capture '" + path + "'")
+
+class StdinSource(CaptureSource):
+    #a capture piped in, e.g. from sstdr_simulator.py or from tcpdump on another machine over ssh
+    def __init__(self):
+        CaptureSource.__init__(self, sys.stdin.buffer, "capture on stdin")
+
+    def close(self):
+        pass #stdin belongs to the process, not to us
+
+class ProcessSource(CaptureSource):
+    #a capture tool that writes pcap data to its stdout; it is terminated on close()
+    def __init__(self, args):
+        self.process = subprocess.Popen(args, stdout=subprocess.PIPE)
+        CaptureSource.__init__(self, self.process.stdout, "'" + os.path.basename(args[0]) + "'")
+
+    def close(self):
+        self.process.terminate()
+        self.stream.close()
+        self.process.wait()
+
+def open_source(pcap_path = None, capture = DEFAULT_CAPTURE, arg_filter = None, arg_address = None):
+    #a recorded capture if pcap_path is given ('-' for stdin), otherwise a live capture with the given tool.
+    #arg_filter is the USBPcap filter number for USBPcap, and the bus number for usbmon
+    if pcap_path == '-':
+        return StdinSource()
+    elif pcap_path is not None:
+        return FileSource(pcap_path)
+    elif capture == CAPTURE_USBMON:
+        return ProcessSource(usbmon_command(arg_filter))
+    else:
+        return ProcessSource(usbpcap_command(arg_filter, arg_address))
+
+def read_record(stream, n, ring):
+    #n bytes of the capture, waiting for more while a recorded capture is at its end. None once the ring says to stop
+    data = b''
+    while len(data) < n:
+        more = stream.read(n - len(data))
+        if more:
+            data = data + more
+        elif ring.stopped():
+            return None
+        else:
+            time.sleep(RING_EOF_POLL)
+    return data
+
+def capture_to_ring(source, ring, device_class, address = None):
+    #the capture process's loop: decode packets from the source and write the waveforms they frame into the ring.
+    #packets are still read while the ring is paused, so the capture tool never blocks, but they aren't decoded
+    receiver = ppr.PcapPacketReceiver(source.stream, address=address)
+    header = read_record(source.stream, ppr.PCAP_HEADER_LENGTH, ring)
+    if header is None:
+        return
+    receiver.read_header(header)
+    record_header = struct.Struct(ppr.STRUCT_BYTE_ORDER[receiver.endianness] + "IIII")
+    fraction = 1e-9 if receiver.nanosecond else 1e-6
+    framer = waveform_framer.WaveformFramer(device_class)
+    resumes = ring.resumes()
+    while not ring.stopped():
+        header = read_record(source.stream, ppr.PCAP_RECORD_HEADER_LENGTH, ring)
+        if header is None:
+            break
+        ts_sec, ts_fraction, incl_len, orig_len = record_header.unpack(header)
+        data = read_record(source.stream, incl_len, ring)
+        if data is None or ring.paused():
+            continue
+        if ring.resumes() != resumes:
+            resumes = ring.resumes()
+            framer.flush() #drop the partial waveform from before the pause
+        block = ppr.PacketBlock()
+        block.packet = receiver.decoder(data, receiver.endianness)
+        if address is not None and block.packet.address != address:
+            continue
+        framer.feed(block)
+        region = framer.next_region()
+        while region is not None:
+            ring.write(ts_sec + fraction*ts_fraction, framer.region_to_waveform(region))
+            region = framer.next_region()
+
+class RingCapture:
+    """
+    Captures and frames waveforms in a separate process (this file, run
+    with -ring), which writes them into a shared memory WaveformRing, so
+    packet parsing doesn't hold the GIL of the process doing detection.
+
+    Usage:
+    capture = RingCapture(pcap_path, capture, arg_filter, arg_address,
+    device_class) takes the same arguments as open_source(); call start(),
+    then next() for each waveform in order, as (timestamp, samples), or None
+    if there's no new one yet. Waveforms overwritten before they were read
+    are skipped, and counted in capture.dropped. pause() and resume() work
+    like a PcapPacketReceiver's; close() stops the process and frees the
+    ring. A capture on stdin ('-') is read by the capture process directly.
+    """
+    def __init__(self, pcap_path = None, capture = DEFAULT_CAPTURE, arg_filter = None, arg_address = None, device_class = waveform_framer.DEVICE_COMMERCIAL):
+        self.args = [sys.executable, os.path.abspath(__file__), "-device", "prototype" if device_class == waveform_framer.DEVICE_PROTOTYPE else "commercial"]
+        if pcap_path is not None:
+            self.args += ["-pcap", pcap_path]
+            self.description = "capture on stdin" if pcap_path == '-' else "capture '" + pcap_path + "'"
+        else:
+            #the capture process drops other devices' packets, which only matters for usbmon; USBPcap captures just the one device
+            self.args += ["-bus", str(arg_filter), "-capture", "usbmon" if capture == CAPTURE_USBMON else "usbpcap"]
+            if arg_address is not None:
+                self.args += ["-address", str(arg_address)]
+            self.description = os.path.basename((usbmon_command(arg_filter) if capture == CAPTURE_USBMON else usbpcap_command(arg_filter, arg_address))[0])
+        self.description = self.description + " (capture process)"
+        self.ring = None
+        self.process = None
+        self.last_sequence = 0 #of the last waveform returned by next()
+        self.dropped = 0
+
+    def start(self):
+        self.ring = WaveformRing.create()
+        self.process = subprocess.Popen(self.args + ["-ring", self.ring.name])
+
+    def next(self):
+        while self.last_sequence < self.ring.sequence():
+            wanted = max(self.last_sequence + 1, self.ring.oldest())
+            self.dropped += wanted - self.last_sequence - 1
+            self.last_sequence = wanted
+            item = self.ring.read(wanted)
+            if item is not None:
+                return item
+            self.dropped += 1 #overwritten while it was being read
+        return None
+
+    def pause(self):
+        self.ring.pause()
+
+    def resume(self):
+        #waveforms framed before the pause are skipped, like a receiver's queued packets
+        self.last_sequence = self.ring.sequence()
+        self.ring.resume()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def report(self):
+        status = "ring " + str(self.ring.sequence() - self.last_sequence) + " behind, " + str(self.dropped) + " dropped"
+        return status if self.alive() else status + ", capture process exited"
+
+    def close(self):
+        if self.process is not None:
+            self.ring.stop()
+            try:
+                self.process.wait(RING_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.process.terminate() #e.g. still waiting on a capture tool that has nothing to send
+                self.process.wait()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring.unlink()
+
+def main():
+    pcap_path = None
+    bus = None
+    address = None
+    capture = DEFAULT_CAPTURE
+    device_class = waveform_framer.DEVICE_COMMERCIAL
+    count = 0
+    ring_name = None
+    try:
+        args = sys.argv
+        if '-pcap' in args:
+            pcap_path = args[args.index('-pcap')+1]
+        if '-bus' in args:
+            bus = int(args[args.index('-bus')+1])
+        if '-address' in args:
+            address = int(args[args.index('-address')+1])
+        if '-capture' in args:
+            capture = CAPTURE_NAMES[args[args.index('-capture')+1].lower()]
+        if '-device' in args:
+            device_class = waveform_framer.DEVICE_PROTOTYPE if args[args.index('-device')+1].lower() == 'prototype' else waveform_framer.DEVICE_COMMERCIAL
+        if '-n' in args:
+            count = int(args[args.index('-n')+1])
+        if '-ring' in args:
+            ring_name = args[args.index('-ring')+1]
+        if pcap_path is None and bus is None:
+            raise ValueError("no capture given")
+    except:
+        print("Error: invalid input.")
+        print(USAGE_STRING)
+        return
+
+    if ring_name is not None:
+        #terminating the capture process still stops the capture tool it launched
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        ring = WaveformRing.attach(ring_name)
+        source = open_source(pcap_path, capture, bus, address)
+        try:
+            capture_to_ring(source, ring, device_class, address)
+        except KeyboardInterrupt:
+            pass #ctrl-c reaches the whole process group; the reader is shutting down too
+        finally:
+            source.close()
+            ring.close()
+        return
+    
+    source = open_source(pcap_path, capture, bus, address)
+    receiver = ppr.PcapPacketReceiver(source.stream)
+    framer = waveform_framer.WaveformFramer(device_class)
+    endpoints = {} #(bus, address, endpoint) -> packet count
+    packets = 0
+    waveforms = 0
+    try:
+        #decode packets one at a time, so live captures are summarized as they go and -n stops them
+        receiver.read_header(source.stream.read(ppr.PCAP_HEADER_LENGTH))
+        print("Reading " + source.description + ": linktype " + str(receiver.linktype) + " (" + receiver.decoder.__name__ + ")")
+        while count == 0 or packets < count:
+            header = source.stream.read(ppr.PCAP_RECORD_HEADER_LENGTH)
+            if len(header) < ppr.PCAP_RECORD_HEADER_LENGTH:
+                break
+            data = source.stream.read(int.from_bytes(header[8:12], receiver.endianness))
+            packet = receiver.decoder(data, receiver.endianness)
+            if address is not None and packet.address != address:
+                continue
+            packets += 1
+            key = (packet.bus, packet.address, packet.endpoint)
+            endpoints[key] = endpoints.get(key, 0) + 1
+            block = ppr.PacketBlock()
+            block.packet = packet
+            framer.feed(block)
+            while framer.next_region() is not None:
+                waveforms += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+    print(str(packets) + " packets:")
+    for (bus, device, endpoint), n in sorted(endpoints.items()):
+        print("    bus " + str(bus) + ", address " + str(device) + ", endpoint " + hex(endpoint) + ": " + str(n))
+    print(str(waveforms) + " waveforms framed for " + ("prototype" if device_class == waveform_framer.DEVICE_PROTOTYPE else "commercial") + " devices")
+
+if __name__ == '__main__':
+    main()
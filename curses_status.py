@@ -0,0 +1,42 @@
+#curses_status.py
+#status lines of the SSTDR_USB curses console. kept apart from ui_elements so the console doesn't need pygame (e.g. when headless).
+
+import time
+
+#constants
+CURSES_UPDATE_INTERVAL = 0.2 #seconds between curses refreshes of status lines
+
+class CursesStatus:
+    """
+    Status lines of a curses screen, written at most every `interval` seconds.
+
+    Usage:
+    status = CursesStatus(cscreen); status.set(row, text) as often as
+    needed (e.g. per waveform); poll() once per loop writes the lines that
+    changed and refreshes the screen, if the interval has passed. flush()
+    writes them regardless. Only the latest text of each row is shown.
+    """
+    def __init__(self, cscreen, interval = CURSES_UPDATE_INTERVAL):
+        self.cscreen = cscreen
+        self.interval = interval
+        self.pending = {} #row -> text
+        self.next_update = 0
+
+    def set(self, row, text):
+        self.pending[row] = text
+
+    def poll(self):
+        if len(self.pending) > 0 and time.monotonic() >= self.next_update:
+            self.flush()
+
+    def flush(self):
+        if self.cscreen is None or len(self.pending) == 0:
+            self.pending = {}
+            return
+        width = self.cscreen.getmaxyx()[1]
+        for row, text in self.pending.items():
+            self.cscreen.addstr(row, 0, text[:width-1])
+            self.cscreen.clrtoeol()
+        self.cscreen.refresh()
+        self.pending = {}
+        self.next_update = time.monotonic() + self.interval
@@ -0,0 +1,345 @@
+#dashboard.py
+#serves a live dashboard of the scanner over http, so it can be watched from a browser anywhere on the network (e.g. a
+#control room) instead of only on the capture box's own screen. viewers render the plots themselves; the capture box
+#only encodes each frame once, however many viewers are connected.
+#
+#pages:
+#   /        : the dashboard (a canvas plot of the waveform and BLS, the fault status, and recent fault events)
+#   /stream  : server-sent events (text/event-stream). "frame" events carry plot updates, "fault" events fault changes
+#
+#frames are small: traces are downsampled to DASHBOARD_POINTS points (keeping the largest magnitude of each bin, so fault
+#peaks aren't smoothed away), quantized to int8, and sent as deltas: only the points that moved by more than
+#DELTA_DEADBAND steps since the last frame, as base64 index & value arrays. a full keyframe is sent every KEYFRAME_INTERVAL
+#seconds, whenever the plot's axes change, and to every viewer as it connects.
+#
+#command line: python dashboard.py [port]
+#   serves a demo stream of synthetic waveforms, for working on the page without a probe
+
+import sys
+import json
+import time
+import queue
+import base64
+import threading
+import traceback
+import http.server
+import numpy as np
+
+from handoff import LatestValue
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" [port; optional]"
+DEFAULT_PORT = 8050
+DEFAULT_HOST = "0.0.0.0" #all interfaces, so the dashboard can be reached from other machines
+DASHBOARD_FPS = 10 #frames sent to viewers per second, at most
+DASHBOARD_POINTS = 250 #points per trace
+QUANTIZATION_LEVELS = 127 #int8
+DELTA_DEADBAND = 1 #points that moved by this many quantization steps or fewer aren't resent
+KEYFRAME_INTERVAL = 5.0 #seconds between full frames, which also bound the error left by the deadband
+VIEWER_QUEUE_SIZE = 32 #messages waiting per viewer; a viewer that falls further behind is resynced with a keyframe
+HEARTBEAT_INTERVAL = 15.0 #seconds; keeps idle connections open, and notices viewers that went away
+FAULT_HISTORY = 20 #recent fault events sent to viewers as they connect
+
+def downsample_peaks(y, points = DASHBOARD_POINTS):
+    #keeps the largest magnitude value of each of `points` equal bins (the last few values are dropped if uneven)
+    y = np.asarray(y, dtype=float)
+    if len(y) <= points:
+        return y
+    bins = y[:len(y)//points*points].reshape(points, -1)
+    return bins[np.arange(points), np.argmax(np.abs(bins), axis=1)]
+
+def quantize(y, scale):
+    #y/scale in [-1, 1] to int8 steps
+    return np.clip(np.round(y/scale*QUANTIZATION_LEVELS), -QUANTIZATION_LEVELS, QUANTIZATION_LEVELS).astype(np.int8)
+
+def b64(array):
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode()
+
+def sse_message(event, data):
+    return ("event: " + event + "\ndata: " + json.dumps(data, separators=(',', ':')) + "\n\n").encode()
+
+class DashboardServer:
+    """
+    Streams the scanner's latest frames to browser viewers.
+
+    Usage:
+    dashboard = DashboardServer(port); dashboard.start(). The acquisition
+    loop calls publish(feet, traces, ylim, markers, fault_string) for every
+    processed waveform; traces is a dict of name -> trace (e.g. "waveform",
+    "bls"). publish() only replaces the latest value, so it never blocks; a
+    broadcaster thread encodes the latest frame at up to DASHBOARD_FPS and
+    hands it to every viewer's queue. Each viewer is served by its own
+    thread, so a slow viewer only falls behind (and is resynced) itself.
+    """
+    def __init__(self, port = DEFAULT_PORT, host = DEFAULT_HOST, fps = DASHBOARD_FPS):
+        self.port = port
+        self.host = host
+        self.fps = fps
+        self.latest = LatestValue()
+        self.viewers = [] #one message queue per connected viewer
+        self.lock = threading.Lock() #guards viewers & the sent state, so a new viewer's keyframe matches the deltas that follow
+        self.sent = {} #trace name -> quantized values viewers currently show
+        self.axes = None #(x0, x1, scale) of the sent traces
+        self.sequence = 0
+        self.last_keyframe_time = 0
+        self.fault_string = None
+        self.fault_events = [] #(time, fault string) of recent changes
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.server = None
+        self._stop = threading.Event()
+
+    def start(self):
+        class Handler(DashboardHandler):
+            dashboard = self
+        self.server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="DashboardServer", daemon=True).start()
+        threading.Thread(target=self.broadcast_loop, name="DashboardBroadcaster", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def publish(self, feet, traces, ylim, markers = (), fault_string = None):
+        self.latest.set((feet, traces, ylim, list(markers), fault_string, time.time()))
+
+    def viewer_count(self):
+        return len(self.viewers)
+
+    def report(self):
+        #one-line summary for the timing report
+        return "dashboard " + str(self.viewer_count()) + " viewers " + str(self.bytes_sent//1024) + " KiB sent"
+
+    ######################################################
+    ##                   ENCODING                       ##
+    ######################################################
+
+    def encode_frame(self, frame, now):
+        #returns the messages for one frame: an optional fault event, then the frame (a keyframe or delta). call with lock held
+        feet, traces, ylim, markers, fault_string, timestamp = frame
+        messages = []
+        if fault_string is not None and fault_string != self.fault_string:
+            self.fault_string = fault_string
+            self.fault_events = (self.fault_events + [(timestamp, fault_string)])[-FAULT_HISTORY:]
+            messages.append(sse_message("fault", {"t": timestamp, "fault": fault_string}))
+        scale = float(max(abs(ylim[0]), abs(ylim[1])))
+        axes = (float(feet[0]), float(feet[-1]), scale)
+        quantized = {name: quantize(downsample_peaks(y), scale) for name, y in traces.items() if y is not None}
+        keyframe = axes != self.axes or set(quantized) != set(self.sent) or now - self.last_keyframe_time >= KEYFRAME_INTERVAL
+        self.axes = axes
+        self.sequence += 1
+        data = {"seq": self.sequence, "t": timestamp, "x0": axes[0], "x1": axes[1], "scale": scale, "markers": markers, "traces": {}}
+        if keyframe:
+            self.sent = quantized
+            self.last_keyframe_time = now
+            messages.append(self.keyframe_message(timestamp, markers))
+            return messages
+        for name, q in quantized.items():
+            sent = self.sent[name]
+            changed = np.nonzero(np.abs(q.astype(int) - sent) > DELTA_DEADBAND)[0]
+            sent[changed] = q[changed]
+            data["traces"][name] = {"i": b64(changed.astype(np.uint16)), "v": b64(q[changed])}
+        messages.append(sse_message("frame", data))
+        return messages
+
+    def keyframe_message(self, timestamp = None, markers = ()):
+        #the traces as viewers currently show them, in full. call with lock held
+        if self.axes is None:
+            return None
+        data = {"seq": self.sequence, "t": timestamp, "x0": self.axes[0], "x1": self.axes[1], "scale": self.axes[2], "markers": list(markers), "key": True,
+            "traces": {name: {"v": b64(q)} for name, q in self.sent.items()}}
+        return sse_message("frame", data)
+
+    def broadcast_loop(self):
+        version = 0
+        last_markers = []
+        while not self._stop.is_set():
+            time.sleep(1/self.fps)
+            new_version, frame = self.latest.get()
+            if new_version == version or len(self.viewers) == 0:
+                continue
+            version = new_version
+            try:
+                with self.lock:
+                    messages = self.encode_frame(frame, time.monotonic())
+                    last_markers = frame[3]
+                    for viewer in list(self.viewers):
+                        for message in messages:
+                            self.enqueue(viewer, message, last_markers)
+                self.frames_sent += 1
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
+
+    def enqueue(self, viewer, message, markers = ()):
+        #a viewer whose queue is full has missed deltas: its backlog is replaced by a keyframe. call with lock held
+        try:
+            viewer.put_nowait(message)
+        except queue.Full:
+            while not viewer.empty():
+                viewer.get_nowait()
+            viewer.put_nowait(self.keyframe_message(None, markers))
+
+    def add_viewer(self):
+        viewer = queue.Queue(maxsize=VIEWER_QUEUE_SIZE)
+        with self.lock:
+            for timestamp, fault_string in self.fault_events:
+                viewer.put_nowait(sse_message("fault", {"t": timestamp, "fault": fault_string}))
+            keyframe = self.keyframe_message()
+            if keyframe is not None:
+                viewer.put_nowait(keyframe)
+            self.viewers.append(viewer)
+        return viewer
+
+    def remove_viewer(self, viewer):
+        with self.lock:
+            if viewer in self.viewers:
+                self.viewers.remove(viewer)
+
+class DashboardHandler(http.server.BaseHTTPRequestHandler):
+    dashboard = None #set by DashboardServer.start()
+
+    def do_GET(self):
+        if self.path == "/" or self.path.startswith("/?"):
+            page = DASHBOARD_PAGE.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(page)))
+            self.end_headers()
+            self.wfile.write(page)
+        elif self.path == "/stream":
+            self.stream()
+        else:
+            self.send_error(404)
+
+    def stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        viewer = self.dashboard.add_viewer()
+        try:
+            while not self.dashboard._stop.is_set():
+                try:
+                    message = viewer.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    message = b": heartbeat\n\n"
+                self.wfile.write(message)
+                self.wfile.flush()
+                self.dashboard.bytes_sent += len(message)
+        except (BrokenPipeError, ConnectionResetError, OSError):
+            pass #viewer went away
+        finally:
+            self.dashboard.remove_viewer(viewer)
+
+    def log_message(self, format, *args):
+        pass #don't print a line per request onto the curses screen
+
+DASHBOARD_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>PV Fault Scanner</title>
+<style>
+body { font-family: sans-serif; background: #808080; color: #e1e1e1; margin: 0; padding: 10px; }
+#status { background: #e1e1e1; color: #0a0a0a; font-size: 28px; padding: 10px; margin-bottom: 10px; }
+#plot { background: #ffffff; width: 100%; height: 60vh; }
+#events { font-size: 14px; margin-top: 10px; }
+</style>
+</head>
+<body>
+<div id="status">Connecting...</div>
+<canvas id="plot"></canvas>
+<div id="events"></div>
+<script>
+var LEVELS = 127;
+var COLORS = {waveform: "#1f77b4", bls: "#2ca02c"};
+var traces = {}, frame = null, events = [];
+function decode(text, type) {
+    var raw = atob(text), bytes = new Uint8Array(raw.length);
+    for (var i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+    return new type(bytes.buffer);
+}
+function draw() {
+    var canvas = document.getElementById("plot"), ctx = canvas.getContext("2d");
+    canvas.width = canvas.clientWidth; canvas.height = canvas.clientHeight;
+    var w = canvas.width, h = canvas.height;
+    ctx.clearRect(0, 0, w, h);
+    ctx.strokeStyle = "#dcdcdc"; ctx.beginPath(); ctx.moveTo(0, h/2); ctx.lineTo(w, h/2); ctx.stroke();
+    if (frame === null) return;
+    ctx.fillStyle = "#000000"; ctx.font = "12px sans-serif";
+    for (var k = 0; k <= 5; k++) {
+        var ft = frame.x0 + (frame.x1-frame.x0)*k/5;
+        ctx.fillText(ft.toFixed(0) + " ft", k/5*(w-40), h-4);
+    }
+    for (var name in traces) {
+        var v = traces[name];
+        ctx.strokeStyle = COLORS[name] || "#000000"; ctx.lineWidth = 2; ctx.beginPath();
+        for (var i = 0; i < v.length; i++) {
+            var x = i/(v.length-1)*w, y = h/2 - v[i]/LEVELS*h/2;
+            if (i == 0) ctx.moveTo(x, y); else ctx.lineTo(x, y);
+        }
+        ctx.stroke();
+    }
+    ctx.strokeStyle = "#ff7f0e";
+    frame.markers.forEach(function(m) {
+        var x = (m-frame.x0)/(frame.x1-frame.x0)*w;
+        ctx.beginPath(); ctx.moveTo(x, 0); ctx.lineTo(x, h); ctx.stroke();
+    });
+}
+var source = new EventSource("/stream");
+source.addEventListener("frame", function(e) {
+    var data = JSON.parse(e.data);
+    if (data.key) traces = {};
+    for (var name in data.traces) {
+        var t = data.traces[name];
+        if (data.key || !(name in traces)) { traces[name] = decode(t.v, Int8Array).slice(); continue; }
+        var idx = decode(t.i, Uint16Array), val = decode(t.v, Int8Array);
+        for (var i = 0; i < idx.length; i++) traces[name][idx[i]] = val[i];
+    }
+    frame = data;
+    window.requestAnimationFrame(draw);
+});
+source.addEventListener("fault", function(e) {
+    var data = JSON.parse(e.data);
+    document.getElementById("status").textContent = data.fault;
+    events.unshift(new Date(data.t*1000).toLocaleString() + ": " + data.fault);
+    events = events.slice(0, 20);
+    document.getElementById("events").innerHTML = events.join("<br>");
+});
+source.onerror = function() { document.getElementById("status").textContent = "Disconnected; reconnecting..."; };
+</script>
+</body>
+</html>
+"""
+
+def main():
+    #demo: a synthetic waveform with a fault that comes and goes
+    port = DEFAULT_PORT
+    if len(sys.argv) > 1:
+        try:
+            port = int(sys.argv[1])
+        except ValueError:
+            print("Error: invalid input.")
+            print(USAGE_STRING)
+            return
+    dashboard = DashboardServer(port)
+    dashboard.start()
+    print("Serving dashboard on http://localhost:"+str(port)+"/ (demo data). Press Ctrl+C to stop.")
+    feet = np.linspace(0, 293.5, 1000)
+    baseline = 20000*np.exp(-feet/60)*np.cos(feet/4)
+    try:
+        i = 0
+        while True:
+            fault = (i//50) % 2 == 1
+            bls = np.random.normal(0, 300, len(feet)) + (15000*np.exp(-((feet-120)/3)**2) if fault else 0)
+            dashboard.publish(feet, {"waveform": baseline + bls, "bls": bls}, (-2**16, 2**16), [120] if fault else [], "Open fault located at 120 feet" if fault else "System OK")
+            time.sleep(0.05)
+            i += 1
+    except KeyboardInterrupt:
+        dashboard.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#dictionary_learning.py
+#dictionary learning fault detection (fault_detection.METHOD_DICTIONARY_LEARNING).
+#offline, a dictionary of atoms is learned from labeled logged waveforms: every atom is a baseline-subtracted waveform shape
+#labeled with the fault type and distance it represents. online, each baseline-subtracted waveform is sparse coded against
+#the dictionary with batched orthogonal matching pursuit (Batch-OMP, Rubinstein et al. 2008): the atom carrying the
+#most energy locates the reflection, its polarity there gives the fault type, and the atoms of that type give the distance.
+#
+#dictionary file: a single float32 .npy array of shape (atoms, 2+92). column 0 is the fault type, column 1 the fault
+#distance in feet, the rest is the unit-norm atom. it is small, and np.load(mmap_mode='r') maps it without reading it.
+#
+#training, command line arguments, can be provided in any order:
+#   -labels [path] : csv of labeled logs, with header "file,log_number,fault_type,distance,baseline_log" (required)
+#                    fault_type is none, open or short; distance is in feet; baseline_log is the log number of a healthy
+#                    measurement in the same file
+#   -o [path]      : output dictionary path (OPTIONAL, defaults to "dictionary.npy")
+#   -k [count]     : atoms learned per labeled log (OPTIONAL, defaults to 2)
+#
+#example: python dictionary_learning.py -labels NREL_labels.csv -o NREL_dictionary.npy
+
+import sys
+import csv
+import numpy as np
+
+import fault_detection
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" -labels [labeled log csv path] -o [out path; optional] -k [atoms per log; optional]"
+DEFAULT_DICTIONARY_PATH = "dictionary.npy"
+DEFAULT_ATOMS_PER_LABEL = 2
+DEFAULT_SPARSITY = 2 #atoms used to code each waveform
+LABEL_COLUMNS = 2 #fault type, distance
+MIN_SINGULAR_VALUE_RATIO = 0.2 #learned atoms must carry at least this fraction of the strongest component of their labeled group
+GRAM_REGULARIZATION = 1e-9 #keeps the small Gram systems solvable when atoms are nearly parallel
+POLARITY_WINDOW = 3 #samples on either side of the strongest atom's peak searched for the reflection's peak, whose sign gives the fault type
+
+FAULT_TYPES = {'none': fault_detection.FAULT_NONE, 'open': fault_detection.FAULT_OPEN, 'short': fault_detection.FAULT_SHORT}
+
+######################################################
+##                   DICTIONARY                     ##
+######################################################
+
+class Dictionary:
+    """
+    Atoms and labels of a learned dictionary, with the Gram matrix of the
+    atoms precomputed for Batch-OMP.
+
+    atoms: (K, L) array of unit-norm atoms (a view into the memory mapped file
+    when loaded with load_dictionary)
+    fault_types, distances: (K,) labels of each atom
+    """
+    def __init__(self, data):
+        self.data = data
+        self.fault_types = np.asarray(data[:,0]).astype(int)
+        self.distances = np.asarray(data[:,1], dtype=float)
+        self.atoms = data[:,LABEL_COLUMNS:]
+        self.gram = np.asarray(self.atoms @ self.atoms.T, dtype=float)
+        self.gram[np.diag_indices_from(self.gram)] += GRAM_REGULARIZATION
+        #for classify(): the sample with the largest magnitude in each atom, and the atoms of each fault type
+        self.peak_indices = np.argmax(np.abs(np.asarray(self.atoms, dtype=float)), axis=1)
+        self.type_atoms = {fault_type: np.flatnonzero(self.fault_types == fault_type) for fault_type in np.unique(self.fault_types)}
+
+    def __len__(self):
+        return self.data.shape[0]
+
+    def encode(self, X, sparsity = DEFAULT_SPARSITY):
+        return batch_omp(self.atoms, X, sparsity, self.gram)
+
+    def classify(self, X, sparsity = DEFAULT_SPARSITY):
+        #classifies a batch of baseline-subtracted waveforms, (B, L).
+        #open & short atoms at nearby distances are near-negatives of each other (half a carrier period apart, a short
+        #looks like an open), so neither the label nor the coefficient sign of the best atom reliably gives the type.
+        #instead: the strongest atom of a pursuit over every atom locates the reflection (or says there is none, if it is
+        #a FAULT_NONE atom); the polarity of the waveform's largest sample near that atom's peak gives the fault type,
+        #and a pursuit over only that type's atoms gives the distance.
+        #returns (fault types, distances), each of shape (B,)
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        B = X.shape[0]
+        rows = np.arange(B)
+        indices, coefs = self.encode(X, sparsity)
+        top_atoms = indices[rows, np.argmax(np.abs(coefs), axis=1)]
+        window = self.peak_indices[top_atoms][:,None] + np.arange(-POLARITY_WINDOW, POLARITY_WINDOW+1)
+        window = np.clip(window, 0, X.shape[1]-1)
+        peaks = X[rows[:,None], window][rows, np.argmax(np.abs(X[rows[:,None], window]), axis=1)]
+        fault_types = np.where(peaks > 0, fault_detection.FAULT_OPEN, fault_detection.FAULT_SHORT)
+        fault_types[self.fault_types[top_atoms] == fault_detection.FAULT_NONE] = fault_detection.FAULT_NONE
+        distances = np.zeros(B)
+        for fault_type in [fault_detection.FAULT_OPEN, fault_detection.FAULT_SHORT]:
+            selected = np.flatnonzero(fault_types == fault_type)
+            atoms = self.type_atoms.get(fault_type)
+            if len(selected) == 0 or atoms is None:
+                continue
+            type_indices, type_coefs = batch_omp(self.atoms[atoms], X[selected], sparsity, self.gram[atoms[:,None], atoms[None,:]], positive = True)
+            #average of the distances of the selected atoms, weighted by coefficient. atoms of opposite polarity, and atoms
+            #peaking away from the strongest one (coding something else, e.g. noise or another reflection), are ignored
+            weights = np.maximum(type_coefs, 0)
+            weights[np.sum(weights, axis=1) == 0, 0] = 1
+            peaks = self.peak_indices[atoms][type_indices]
+            strongest = peaks[np.arange(len(selected)), np.argmax(weights, axis=1)]
+            weights[np.abs(peaks - strongest[:,None]) > POLARITY_WINDOW] = 0
+            distances[selected] = np.sum(weights*self.distances[atoms][type_indices], axis=1)/np.sum(weights, axis=1)
+        return (fault_types, distances)
+
+def save_dictionary(path, atoms, fault_types, distances):
+    data = np.zeros((len(atoms), LABEL_COLUMNS + atoms.shape[1]), dtype=np.float32)
+    data[:,0] = fault_types
+    data[:,1] = distances
+    data[:,LABEL_COLUMNS:] = atoms
+    np.save(path, data)
+
+def load_dictionary(path):
+    return Dictionary(np.load(path, mmap_mode='r'))
+
+######################################################
+##                   BATCH-OMP                      ##
+######################################################
+
+def batch_omp(D, X, sparsity, G = None, positive = False):
+    #codes every row of X (B, L) with at most `sparsity` atoms of D (K, L, unit-norm rows).
+    #positive: select atoms by their (signed) correlation with the residual instead of its magnitude, so atoms that
+    #match the signal only when negated are not chosen.
+    #uses only the correlations D x and the Gram matrix G = D D^T, so the per-iteration cost doesn't depend on L,
+    #and all signals in the batch are coded together.
+    #returns (indices, coefs): (B, sparsity) arrays of selected atoms and their coefficients
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    if G is None:
+        G = D @ D.T + GRAM_REGULARIZATION*np.eye(D.shape[0])
+    B = X.shape[0]
+    sparsity = min(sparsity, D.shape[0])
+    rows = np.arange(B)[:,None]
+    alpha0 = X @ np.asarray(D, dtype=float).T #(B, K) correlations of every signal with every atom
+    alpha = alpha0.copy()
+    indices = np.zeros((B, sparsity), dtype=int)
+    coefs = np.zeros((B, sparsity))
+    for s in range(sparsity):
+        a = alpha.copy() if positive else np.abs(alpha)
+        a[rows, indices[:,:s]] = -np.inf #never reselect an atom
+        indices[:,s] = np.argmax(a, axis=1)
+        I = indices[:,:s+1]
+        G_II = G[I[:,:,None], I[:,None,:]] #(B, s+1, s+1)
+        coefs[:,:s+1] = np.linalg.solve(G_II, alpha0[rows, I][...,None])[...,0]
+        alpha = alpha0 - np.einsum('bks,bs->bk', G[:,I].transpose(1,0,2), coefs[:,:s+1])
+    return (indices, coefs)
+
+######################################################
+##                    TRAINING                      ##
+######################################################
+
+def learn_atoms(bls, n_atoms):
+    #principal atoms of one labeled group of baseline-subtracted waveforms (n, L): the leading right singular vectors,
+    #signed to correlate positively with the group mean so the atom has the polarity of the labeled fault.
+    #components much weaker than the first are measurement noise, not fault shape, and are dropped
+    _, sv, vt = np.linalg.svd(np.asarray(bls, dtype=float), full_matrices=False)
+    n_atoms = min(n_atoms, int(np.sum(sv >= MIN_SINGULAR_VALUE_RATIO*sv[0])))
+    atoms = vt[:n_atoms]
+    mean = np.mean(bls, axis=0)
+    signs = np.sign(atoms @ mean)
+    signs[signs == 0] = 1
+    return atoms*signs[:,None]
+
+def train_dictionary(labels, atoms_per_label = DEFAULT_ATOMS_PER_LABEL):
+    #labels: list of (file path, log number, fault type, distance, baseline log number)
+    #returns (atoms, fault types, distances)
+    files = {}
+    atoms = []
+    fault_types = []
+    distances = []
+    for file_path, log_number, fault_type, distance, baseline_log in labels:
+        if file_path not in files:
+            rows = fault_detection.load_csv(file_path)
+            files[file_path] = (rows, fault_detection.group_logs(rows))
+        rows, groups = files[file_path]
+        baseline = np.mean(fault_detection.get_log(rows, groups, baseline_log)[:,fault_detection.LOG_COLUMNS:], axis=0)
+        bls = fault_detection.get_log(rows, groups, log_number)[:,fault_detection.LOG_COLUMNS:] - baseline
+        group_atoms = learn_atoms(bls, min(atoms_per_label, len(bls)))
+        atoms.append(group_atoms)
+        fault_types += [fault_type]*len(group_atoms)
+        distances += [distance]*len(group_atoms)
+    return (np.concatenate(atoms), np.array(fault_types), np.array(distances))
+
+def read_labels(labels_path):
+    labels = []
+    with open(labels_path, "r") as f:
+        reader = csv.reader(f)
+        for row in reader:
+            if (reader.line_num == 1): continue
+            labels.append((row[0].strip(), int(row[1]), FAULT_TYPES[row[2].strip().lower()], float(row[3]), int(row[4])))
+    return labels
+
+def main():
+    out_path = DEFAULT_DICTIONARY_PATH
+    atoms_per_label = DEFAULT_ATOMS_PER_LABEL
+    if '-labels' not in sys.argv:
+        print("Error: invalid input.")
+        print(USAGE_STRING)
+        return
+    labels_path = sys.argv[sys.argv.index('-labels')+1]
+    if '-o' in sys.argv:
+        out_path = sys.argv[sys.argv.index('-o')+1]
+    if '-k' in sys.argv:
+        atoms_per_label = int(sys.argv[sys.argv.index('-k')+1])
+
+    atoms, fault_types, distances = train_dictionary(read_labels(labels_path), atoms_per_label)
+    save_dictionary(out_path, atoms, fault_types, distances)
+    print("Finished. Wrote "+str(len(atoms))+" atoms to: "+out_path)
+
+if __name__ == '__main__':
+    main()
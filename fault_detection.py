@@ -2,7 +2,6 @@
 #a collection of fault detection methods and constants for PV array fault detection
 #in several cases, an enum would be more appropriate, but the python implementation of enums is headache-inducing
 
-import scipy.signal
 import scipy.interpolate
 import numpy as np
 import csv
@@ -14,10 +13,17 @@ FEET_PER_SAMPLE = 3.19013 #calculated manually from Florida test after ~2 years
 
 SPLINE_FEET_PER_SAMPLE = FEET_PER_SAMPLE*92/SPLINE_LENGTH
 SPLINE_FEET_VECTOR = np.arange(0,SPLINE_LENGTH)*SPLINE_FEET_PER_SAMPLE
+WAVEFORM_LENGTH = 92 #samples in a waveform received from the SSTDR
+SPLINE_X = np.linspace(0, WAVEFORM_LENGTH-1, SPLINE_LENGTH) #sample position of each spline point
+COARSE_WINDOW = 6 #in coarse-to-fine detection, samples on either side of a candidate that are re-interpolated
+COARSE_CANDIDATE_RATIO = 0.7 #a raw sample can see as little as cos(pi/4) of a peak on the 24MHz carrier, so coarse maxima this close to the largest are all refined
+COARSE_TO_FINE_TOLERANCE = 1 #in spline samples (~0.3 feet); coarse-to-fine distances stay this close to the full-spline method, unless a peak lies within a few counts of the deviation threshold
 FFT_SIZE = 1024
 LPF_CUTOFF_INDEX = FFT_SIZE//4 #fs = 24Mhz*4; cutoff frequency is equal to fs divided by the same factor that fft size is divided by
 LOW_PASS_FILTER = [1+0j if i < LPF_CUTOFF_INDEX else 0+0j for i in range(FFT_SIZE//2+1)] #ideal LPF to be applied in the frequency domain
 Z_INDEX_THRESHOLD = 10000
+LOG_COLUMNS = 3 #session_number, log_number, timestamp; the waveform follows in logged csv rows
+CSV_CHUNK_BYTES = 1 << 24 #bytes read at a time when streaming csv logs
 #FAULT_THRESHOLD = 50
 
 #constants representing fault type. returned by "detect_faults()"
@@ -55,6 +61,67 @@ def spline_interpolate(y, N = SPLINE_LENGTH):
     spl = scipy.interpolate.splev(x_i, tck)
     return spl
 
+def local_spline_interpolate(y, start, stop, window = COARSE_WINDOW):
+    #spline interpolates y only near the sample range [start, stop], using a few extra samples on either side.
+    #returns (spline indices, interpolated values) for the points of the full spline grid that lie in [start, stop].
+    #splines are linear in their data, so this closely matches spline_interpolate(y) there, at a fraction of the cost.
+    N = len(y)
+    lo = max(0, int(np.floor(start)) - window)
+    hi = min(N-1, int(np.ceil(stop)) + window)
+    x = np.arange(lo, hi+1)
+    tck = scipy.interpolate.splrep(x, y[lo:hi+1])
+    i_lo = max(0, int(np.ceil(start*(SPLINE_LENGTH-1)/(N-1))))
+    i_hi = min(SPLINE_LENGTH-1, int(np.floor(stop*(SPLINE_LENGTH-1)/(N-1))))
+    indices = np.arange(i_lo, i_hi+1)
+    return (indices, scipy.interpolate.splev(indices*(N-1)/(SPLINE_LENGTH-1), tck))
+
+def refine_peak(y, k, sign = 1):
+    #finds the spline index of the largest sign*y within one sample of the coarse peak at sample k.
+    #returns (spline index, interpolated value there)
+    indices, values = local_spline_interpolate(y, k-1, k+1)
+    i = np.argmax(sign*values)
+    return (indices[i], values[i])
+
+def find_peaks(x):
+    #indices of local maxima, like scipy.signal.find_peaks(x)[0] with no conditions: samples larger than both neighbors,
+    #and the middle (rounded down) of flat peaks. the ends are never peaks.
+    #done here with numpy; importing scipy.signal costs more startup time than the rest of scipy that we use
+    x = np.asarray(x)
+    if len(x) < 3:
+        return np.zeros(0, dtype=np.intp)
+    rising = x[1:] > x[:-1]
+    if not np.any(x[1:] == x[:-1]):
+        #no flat regions (the usual case for interpolated waveforms): a peak rises from the left and falls to the right
+        return np.flatnonzero(rising[:-1] & (x[2:] < x[1:-1])) + 1
+    #runs of equal values; a run is a peak if it is higher than the runs on both sides of it
+    starts = np.flatnonzero(np.concatenate([[True], x[1:] != x[:-1]]))
+    ends = np.concatenate([starts[1:], [len(x)]]) - 1
+    values = x[starts]
+    peak_runs = np.flatnonzero((values[1:-1] > values[:-2]) & (values[1:-1] > values[2:])) + 1
+    return (starts[peak_runs] + ends[peak_runs])//2
+
+def coarse_peaks(y):
+    #locates maxima of |y| on the raw grid. |y| swings at twice the carrier frequency, which the raw grid cannot resolve,
+    #so maxima and minima of y are searched separately. returns (sample indices, signs), sorted by index
+    padded = np.concatenate([[-np.inf], y, [-np.inf]]) #padded so peaks at the ends count, as they can on the spline grid
+    maxima = find_peaks(padded) - 1
+    padded = np.concatenate([[-np.inf], -y, [-np.inf]])
+    minima = find_peaks(padded) - 1
+    locs = np.concatenate([maxima, minima])
+    signs = np.concatenate([np.ones(len(maxima)), -np.ones(len(minima))])
+    order = np.argsort(locs, kind='stable')
+    return (locs[order], signs[order])
+
+def refine_deviation(y, start, j, threshold):
+    #finds the first spline index at which |y| reaches threshold, given that sample j is the first sample that does.
+    #the spline can reach the threshold between samples that are below it, so the search starts a sample before start,
+    #the first sample that comes within COARSE_CANDIDATE_RATIO of the threshold.
+    indices, values = local_spline_interpolate(y, start-1, j)
+    above = np.flatnonzero(np.abs(values) >= threshold)
+    if len(above) == 0:
+        return indices[-1]
+    return indices[above[0]]
+
 def read_csv(file_path):
     rows = {}
     with open(file_path, "r") as f:
@@ -92,6 +159,69 @@ def read_wfs(file_path):
             wfs[i].append(row)
     return wfs
 
+#vectorized loaders: parse a whole log (or chunks of one) straight into one array, rather than an array per row.
+#rows are [session_number, log_number, timestamp, samples...]; float64 keeps fractional timestamps, and is exact for samples.
+def parse_csv_block(data, columns = 3+WAVEFORM_LENGTH):
+    #parses complete csv rows (bytes, without the header row) into an (N, columns) float array.
+    #blank rows and rows with the wrong number of fields (e.g. cut short by a crash) are skipped
+    lines = [line for line in data.split(b'\n') if line.strip() != b'']
+    if len(lines) == 0:
+        return np.zeros((0, columns))
+    fields = [line.split(b',', LOG_COLUMNS) for line in lines]
+    sample_text = b','.join([f[LOG_COLUMNS] for f in fields if len(f) > LOG_COLUMNS]).decode()
+    samples = np.fromstring(sample_text, dtype=np.int64, sep=',') #one C-level parse for every sample in the block
+    if len(samples) != len(lines)*(columns-LOG_COLUMNS):
+        #some rows are malformed; keep only rows with the right number of fields, then parse again
+        lines = [line for line in lines if line.count(b',') == columns-1]
+        return parse_csv_block(b'\n'.join(lines), columns) if len(lines) > 0 else np.zeros((0, columns))
+    rows = np.empty((len(lines), columns))
+    rows[:,:LOG_COLUMNS] = np.array([f[:LOG_COLUMNS] for f in fields], dtype=float)
+    rows[:,LOG_COLUMNS:] = samples.reshape(len(lines), columns-LOG_COLUMNS)
+    return rows
+
+def load_csv(file_path):
+    #returns every row of a log as one (N, 3+92) float array
+    with open(file_path, "rb") as f:
+        f.readline() #header row
+        return parse_csv_block(f.read())
+
+def iter_csv_chunks(file_path, chunk_bytes = CSV_CHUNK_BYTES):
+    #yields (n, 3+92) float arrays of consecutive rows, reading about chunk_bytes of the file at a time;
+    #memory use is bounded by the chunk size, so logs larger than RAM can be streamed
+    with open(file_path, "rb") as f:
+        f.readline() #header row
+        remainder = b''
+        while True:
+            block = f.read(chunk_bytes)
+            if block == b'':
+                break
+            block = remainder + block
+            end = block.rfind(b'\n')+1 #rows are parsed once complete; the partial last row is kept for the next block
+            remainder = block[end:]
+            rows = parse_csv_block(block[:end])
+            if len(rows) > 0:
+                yield rows
+        if remainder.strip() != b'':
+            rows = parse_csv_block(remainder)
+            if len(rows) > 0:
+                yield rows
+
+def group_logs(rows):
+    #group index of the rows of a loaded log, by log number (column 1), instead of a dict of lists:
+    #returns (log_numbers, order, bounds); the rows of log_numbers[k] are rows[order[bounds[k]:bounds[k+1]]], in file order
+    order = np.argsort(rows[:,1], kind='stable')
+    log_numbers, starts = np.unique(rows[order,1].astype(int), return_index=True)
+    bounds = np.append(starts, len(rows))
+    return (log_numbers, order, bounds)
+
+def get_log(rows, groups, log_number):
+    #rows of one log number, using the index from group_logs
+    log_numbers, order, bounds = groups
+    k = np.searchsorted(log_numbers, log_number)
+    if k == len(log_numbers) or log_numbers[k] != log_number:
+        return rows[:0]
+    return rows[order[bounds[k]:bounds[k+1]]]
+
 def remove_spikes(wf, bl):
     #there are annoying small-amplitude (~250) spikes in the data received via USB.
     #these small spikes are significant enough to mess up Mashad's method, as they are
@@ -125,8 +255,12 @@ def low_pass_filter(wf):
     return wf_filtered
 
 class Detector:
-    def __init__(self, method = METHOD_BLS_PEAKS):
+    #coarse_to_fine: if True, baseline subtraction, deviation search and peak finding are done on the raw 92 sample grid,
+    #and only a small window around each candidate is spline interpolated to find sub-sample locations.
+    #distances stay within COARSE_TO_FINE_TOLERANCE spline samples of the full-spline method at a fraction of the cost.
+    def __init__(self, method = METHOD_BLS_PEAKS, coarse_to_fine = False):
         #constants
+        self.feet_per_sample = FEET_PER_SAMPLE #replaced by load_calibration()
         self.units_per_sample = FEET_PER_SAMPLE*92/SPLINE_LENGTH #convert feet per sample for spline length
         self.bls_deviation_thresh = 0.10 #(B)ase(L)ine (S)ubtraction deviation threshold: percent variations smaller than this in the baseline-subtracted waveform will be ignored
         self.fault_threshold = 45
@@ -135,31 +269,68 @@ class Detector:
         self.raw_baseline = None
         self.last_processed_waveform = np.zeros(SPLINE_LENGTH) #stores the last evaluated waveform, processed in whatever way required for fault detection (not used in this class, just used for plotting from outside)
         self.method = method
+        self.coarse_to_fine = coarse_to_fine
+        self.coarse_baseline = None #baseline on the raw grid, processed as required by the method (coarse-to-fine only)
+        self.spline_baseline_max = 0
+        self.dictionary = None #learned dictionary (METHOD_DICTIONARY_LEARNING only), see dictionary_learning.py
+        self.dictionary_sparsity = 2 #atoms used to code each waveform
         self.terminal_dev_index = 0
         self.terminal_peak_index = 0
         self.terminal_pulse_width = 0
         self.zero_index = 0
         self.spline_zero_index = 0
         self.spline_feet_offset = 0
+        self.calibrated_zero_index = None #if set (by load_calibration), used instead of the zero index found in the baseline
+        self.feet_vector = SPLINE_FEET_VECTOR #distance of each spline sample from the cable start, for plotting
     
     #takes as input a waveform from a healthy system
     def set_baseline(self, bl):
         self.raw_baseline = np.array(bl)
         #self.zero_index = np.argmax(self.baseline) #commented out b/c in some cases the cable reflection is actually greater...
         locs = np.argwhere(bl > Z_INDEX_THRESHOLD)
-        if len(locs > 0):
+        if self.calibrated_zero_index is not None:
+            self.zero_index = self.calibrated_zero_index
+        elif len(locs > 0):
             self.zero_index = locs[0][0] #argwhere returns an array of arrays representing index sets; we want the first index "set" which is one index, so we take the first element of it
         else:
             self.zero_index = 0
-        self.spline_zero_index = self.zero_index/92*SPLINE_LENGTH
-        self.spline_feet_offset = self.spline_zero_index * SPLINE_FEET_PER_SAMPLE
+        self.set_zero_index(self.zero_index)
         if (self.method == METHOD_LOW_PASS_PEAKS):
             #apply low-pass filter to baseline before interpolating.
-            self.processed_baseline = spline_interpolate(low_pass_filter(bl))
+            self.coarse_baseline = low_pass_filter(bl)
         else:
-            #interpolate.
-            self.processed_baseline = spline_interpolate(bl)
+            self.coarse_baseline = np.array(bl, dtype=float)
+        #interpolate.
+        self.processed_baseline = spline_interpolate(self.coarse_baseline)
+        self.spline_baseline_max = max(self.processed_baseline)
         
+    #sets the (raw sample) index of the cable start, and the spline index & feet offset that follow from it
+    def set_zero_index(self, zero_index):
+        self.zero_index = zero_index
+        self.spline_zero_index = self.zero_index/92*SPLINE_LENGTH
+        self.spline_feet_offset = self.spline_zero_index * self.units_per_sample
+        self.feet_vector = np.arange(0,SPLINE_LENGTH)*self.units_per_sample - self.spline_feet_offset
+    
+    #distance in feet of a spline index, for the BLS methods. uncalibrated, this subtracts the zero index in raw samples,
+    #as it always has (FEET_PER_SAMPLE was fitted by hand against that formula); calibration.py fits feet per sample and
+    #the zero index for the spline grid formula, so with a calibration the spline zero index is subtracted
+    def index_to_feet(self, index):
+        if self.calibrated_zero_index is None:
+            return self.units_per_sample*(index-self.zero_index)
+        return self.units_per_sample*(index-self.spline_zero_index)
+    
+    #loads feet per sample and the zero index fitted by calibration.py, in place of FEET_PER_SAMPLE and the baseline's zero index
+    def load_calibration(self, path):
+        import calibration #imported here; calibration imports this module
+        self.feet_per_sample, self.calibrated_zero_index = calibration.load_calibration(path)
+        self.units_per_sample = self.feet_per_sample*92/SPLINE_LENGTH
+        self.set_zero_index(self.calibrated_zero_index)
+    
+    #loads a dictionary learned by dictionary_learning.py, for METHOD_DICTIONARY_LEARNING
+    def load_dictionary(self, path):
+        import dictionary_learning #imported here; dictionary_learning imports this module
+        self.dictionary = dictionary_learning.load_dictionary(path)
+    
     #takes as input a waveform with a disconnect just before any solar panels (the "panel terminal", commonly called A+)
     def set_terminal(self, waveform):
         #locate first non-sidelobe peak in raw waveform, find P(A) and D(A) as in Mashad's method (BLS_DEVIATION_CORRECTION)
@@ -175,7 +346,7 @@ class Detector:
         print("dev index: ", dev_index)
         if (dev_index >= len(wf)-1): return
         #need to locate peak in raw waveform
-        locs = scipy.signal.find_peaks(wf)[0]
+        locs = find_peaks(wf)
         locs = list(filter(lambda x: x >= dev_index, locs))
         print("found peaks", locs)
         #set internal values
@@ -194,6 +365,22 @@ class Detector:
             self.last_processed_waveform = spline_interpolate(waveform)
             return fault
         
+        #dictionary learning: sparse code the raw grid BLS against learned atoms; the strongest atom gives fault type and location
+        if self.method == METHOD_DICTIONARY_LEARNING:
+            wf = np.array(waveform, dtype=float)
+            #for plotting only: cheap linear interpolation onto the spline grid
+            self.last_processed_waveform = np.interp(SPLINE_X, np.arange(len(wf)), wf)
+            if (self.dictionary is None): return fault
+            bls = wf - self.raw_baseline
+            if (np.max(np.abs(bls)) < self.bls_deviation_thresh*self.spline_baseline_max): return fault
+            fault_types, distances = self.dictionary.classify(bls, self.dictionary_sparsity)
+            if fault_types[0] != FAULT_NONE:
+                fault = (fault_types[0], distances[0])
+            return fault
+        
+        if self.coarse_to_fine:
+            return self.detect_faults_coarse_to_fine(waveform)
+        
         #newest method: low pass filter, then peak location, with correction based on panel electrical length
         if self.method == METHOD_LOW_PASS_PEAKS:
             if (self.raw_baseline is None): return fault
@@ -219,7 +406,7 @@ class Detector:
             for dev_index in range(len(self.processed_baseline)):
                 if (abs_bls[dev_index] >= self.bls_deviation_thresh*max(self.processed_baseline)): break
             if (dev_index == len(wf)-1): return fault
-            locs = scipy.signal.find_peaks(abs_bls)[0]
+            locs = find_peaks(abs_bls)
             locs = list(filter(lambda x: x >= dev_index, locs))
             fault_index = locs[1] #index 0 is a sidelobe
             if (bls[fault_index] > 0):
@@ -227,7 +414,7 @@ class Detector:
             else:
                 fault_type = FAULT_SHORT
             
-            fault = (fault_type, self.units_per_sample*(fault_index-self.zero_index))
+            fault = (fault_type, self.index_to_feet(fault_index))
         
         #Mashad's method: uses width of pulse from disconnect at panel terminal to correct other disconnect locations
         if self.method == METHOD_BLS_DEVIATION_CORRECTION:
@@ -241,12 +428,64 @@ class Detector:
                 if (abs_bls[dev_index] >= self.bls_deviation_thresh*max(self.processed_baseline)): break
             if (dev_index >= len(wf)-1): return fault
             #determine type of fault using sign of BLS peak; need to locate BLS peak
-            locs = scipy.signal.find_peaks(abs_bls)[0]
+            locs = find_peaks(abs_bls)
             locs = list(filter(lambda x: x >= dev_index, locs))
             peak_index = locs[1] #index 0 is a sidelobe
             if (bls[peak_index] > 0):
                 fault_type = FAULT_OPEN
             else:
                 fault_type = FAULT_SHORT
-            fault = (fault_type, self.units_per_sample*(dev_index + self.terminal_pulse_width-self.zero_index))
+            fault = (fault_type, self.index_to_feet(dev_index + self.terminal_pulse_width))
+        return fault
+    
+    #same as detect_faults(), but searches the raw grid and only interpolates around candidates (see COARSE_TO_FINE_TOLERANCE)
+    def detect_faults_coarse_to_fine(self, waveform):
+        fault = (FAULT_NONE, 0)
+        if self.method == METHOD_LOW_PASS_PEAKS:
+            wf = low_pass_filter(waveform)
+        else:
+            wf = np.array(waveform, dtype=float)
+        #for plotting only: cheap linear interpolation onto the spline grid. plotted BLS is relative to the spline baseline.
+        self.last_processed_waveform = np.interp(SPLINE_X, np.arange(len(wf)), wf)
+        bls = wf - self.coarse_baseline
+        
+        if self.method == METHOD_LOW_PASS_PEAKS:
+            #refine every coarse maximum that could be the true (between-sample) maximum; keep the largest
+            if (np.max(bls) < COARSE_CANDIDATE_RATIO*self.fault_threshold): return fault #no refined peak can reach the threshold
+            locs = find_peaks(np.concatenate([[-np.inf], bls, [-np.inf]])) - 1
+            locs = locs[bls[locs] >= COARSE_CANDIDATE_RATIO*np.max(bls)]
+            if len(locs) == 0: return fault
+            fault_index, fault_value = max((refine_peak(bls, k) for k in locs), key=lambda p: p[1])
+            if (fault_value >= self.fault_threshold):
+                #fault detected. set fault info. DOES NOT CORRECT FOR PANEL LENGTH.
+                fault = (FAULT_OPEN, self.units_per_sample*(fault_index-self.spline_zero_index))
+            return fault
+        
+        #deviation search on the raw grid, refined to the spline grid
+        threshold = self.bls_deviation_thresh*self.spline_baseline_max
+        abs_bls = np.abs(bls)
+        above = np.flatnonzero(abs_bls >= threshold)
+        if len(above) == 0: return fault
+        start = np.argmax(abs_bls >= COARSE_CANDIDATE_RATIO*threshold)
+        dev_index = refine_deviation(bls, start, above[0], threshold)
+        #peak finding on the raw grid; refine the first two peaks at or after the deviation (index 0 is a sidelobe)
+        locs, signs = coarse_peaks(bls)
+        peaks = []
+        for k, sign in zip(locs, signs):
+            if k < start-1: continue
+            peak_index, peak_value = refine_peak(bls, k, sign)
+            if peak_index >= dev_index:
+                peaks.append((peak_index, peak_value))
+                if len(peaks) == 2: break
+        if len(peaks) < 2: return fault
+        peak_index, peak_value = peaks[1]
+        if (peak_value > 0):
+            fault_type = FAULT_OPEN
+        else:
+            fault_type = FAULT_SHORT
+        
+        if self.method == METHOD_BLS_PEAKS:
+            fault = (fault_type, self.index_to_feet(peak_index))
+        elif self.method == METHOD_BLS_DEVIATION_CORRECTION:
+            fault = (fault_type, self.index_to_feet(dev_index + self.terminal_pulse_width))
         return fault
@@ -0,0 +1,688 @@
+#fleet.py
+#collects fault events (and sampled waveforms) from many field units in one place, so the status of a whole fleet can
+#be seen without copying log files around. each unit's SSTDR_USB runs a FleetClient (-fleet host:port); one machine runs
+#the collector (python fleet.py -collect).
+#
+#every record a unit produces is appended to a local spool file first, so nothing is lost while the link is down. the
+#spool is one stream per unit, and records are identified by their byte offset in it. a sender thread ships the spool to
+#the collector in batches (zlib compressed), and the collector acknowledges the offset it has stored up to; on every
+#(re)connect the collector says which offset to resume from, so batches cut off by a dropped link are resent, and
+#batches the collector already has are skipped. unit ids must be unique.
+#
+#protocol: TCP; every message is a frame: 4 byte body length, 1 byte message type (MSG_*), body. offsets are 8 bytes.
+#   HELLO  (unit -> collector): json {"unit": unit id, "protocol": PROTOCOL_VERSION}
+#   RESUME (collector -> unit): offset to resume the unit's stream from
+#   BATCH  (unit -> collector): start offset, uncompressed length, then the zlib compressed records
+#   ACK    (collector -> unit): offset the unit's stream is now stored up to
+#records: 4 byte body length, 1 byte kind (RECORD_*), 8 byte timestamp, body.
+#   event   : json {"fault": fault type, "feet": distance, "text": description}, sent whenever the unit's status changes
+#   waveform: session number, log number (4 bytes each), then int32 samples
+#
+#the collector keeps a directory per unit: events.csv, waveforms.csv (in the SSTDR_USB log layout) and state.json (the
+#stored offset), plus events.csv with every unit's events. one thread serves each connected unit.
+#
+#command line arguments, can be provided in any order:
+#   -collect [port]     : run the collector on this port (OPTIONAL, defaults to DEFAULT_PORT)
+#   -dir [path]         : the collector's output directory (OPTIONAL, defaults to "fleet")
+#   -simulate [units]   : instead, run this many simulated units, as stand-ins for field units when testing a collector
+#   -connect [host:port]: collector the simulated units send to (OPTIONAL, defaults to localhost)
+#   -spool [path]       : spool directory of the simulated units (OPTIONAL, defaults to "fleet_spool")
+#   -seconds [s]        : how long the simulated units run (OPTIONAL, defaults to 60)
+#   -rate [hz]          : events per second from each simulated unit (OPTIONAL, defaults to 1)
+#   -prefix [text]      : simulated unit ids are the prefix and a number (OPTIONAL, defaults to "unit")
+#
+#example: python fleet.py -collect 8060
+#         python fleet.py -simulate 100 -connect localhost:8060 -seconds 30
+
+import sys
+import os
+import re
+import json
+import time
+import zlib
+import queue
+import socket
+import struct
+import threading
+import traceback
+import socketserver
+import numpy as np
+
+from log_writer import CSV_HEADER, format_row
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" -collect [port] -dir [path] | -simulate [units] -connect [host:port] -spool [path] -seconds [s] -rate [hz] -prefix [text]"
+DEFAULT_PORT = 8060
+DEFAULT_HOST = "0.0.0.0" #all interfaces, so units can reach the collector from anywhere on the network
+DEFAULT_COLLECTOR_DIR = "fleet"
+DEFAULT_SPOOL_DIR = "fleet_spool"
+PROTOCOL_VERSION = 1
+ZLIB_LEVEL = 6
+
+FRAME_HEADER = struct.Struct(">IB") #body length, message type
+OFFSET = struct.Struct(">Q")
+BATCH_HEADER = struct.Struct(">QI") #start offset, uncompressed length of the records
+RECORD_HEADER = struct.Struct("<IBd") #body length, record kind, timestamp
+WAVEFORM_HEADER = struct.Struct("<II") #session number, log number
+MAX_FRAME_BYTES = 16*2**20 #larger frames are taken to be garbage, and the connection is dropped
+
+#fake enum of message types
+MSG_HELLO = 0
+MSG_RESUME = 1
+MSG_BATCH = 2
+MSG_ACK = 3
+
+#fake enum of record kinds
+RECORD_EVENT = 0
+RECORD_WAVEFORM = 1
+
+#client constants
+DEFAULT_WAVEFORM_INTERVAL = 60.0 #seconds between waveforms a unit sends; 0 sends none
+CLIENT_QUEUE_SIZE = 4096 #records waiting for the spool; when full, new records are dropped (and counted) rather than blocking
+BATCH_BYTES = 64*1024 #send a batch once this much is unsent...
+BATCH_INTERVAL = 2.0 #...or the oldest unsent record is this many seconds old
+MAX_BATCH_BYTES = 2**20 #uncompressed records per batch, at most
+HEARTBEAT_INTERVAL = 30.0 #an empty batch is sent if nothing was sent for this long, so the collector knows the unit is up
+RECONNECT_MIN = 1.0 #seconds before reconnecting after a failure; doubles with every failure...
+RECONNECT_MAX = 60.0 #...up to this
+SOCKET_TIMEOUT = 15.0
+SPOOL_MAX_BYTES = 256*2**20 #unsent bytes kept; past this, waveforms are dropped (events are always kept)
+SPOOL_COMPACT_BYTES = 2**20 #the spool file is emptied when everything in it is acknowledged and it has grown this large
+CLOSE_TIMEOUT = 5.0 #seconds close() waits for unsent records to be acknowledged; the rest stay spooled for next time
+
+#collector constants
+CONNECTION_TIMEOUT = 3*HEARTBEAT_INTERVAL #units that send nothing for this long are disconnected
+LISTEN_BACKLOG = 512 #a whole fleet reconnects at once after the collector restarts
+STATUS_INTERVAL = 10.0 #seconds between status summaries printed by the collector
+UNIT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$") #unit ids name the collector's unit directories
+FAULT_NONE = 0 #fault_detection's fault types; not imported, so the collector (and simulated units) don't need scipy
+FAULT_OPEN = 1
+EVENTS_HEADER = "timestamp,fault_type,fault_distance,description\n"
+FLEET_EVENTS_HEADER = "timestamp,unit,fault_type,fault_distance,description\n"
+
+######################################################
+##                   PROTOCOL                       ##
+######################################################
+
+def send_frame(sock, msg_type, body = b''):
+    sock.sendall(FRAME_HEADER.pack(len(body), msg_type) + body)
+
+def recv_exact(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if chunk == b'':
+            raise ConnectionError("connection closed")
+        data += chunk
+    return bytes(data)
+
+def recv_frame(sock):
+    #returns (message type, body)
+    length, msg_type = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))
+    if length > MAX_FRAME_BYTES:
+        raise ConnectionError("frame of "+str(length)+" bytes is too large")
+    return (msg_type, recv_exact(sock, length))
+
+def encode_event(timestamp, fault_type, distance, description):
+    body = json.dumps({"fault": int(fault_type), "feet": float(distance), "text": description}).encode()
+    return RECORD_HEADER.pack(len(body), RECORD_EVENT, timestamp) + body
+
+def encode_waveform(timestamp, wf, session_number = 0, log_number = 0):
+    body = WAVEFORM_HEADER.pack(session_number, log_number) + np.asarray(wf, dtype='<i4').tobytes()
+    return RECORD_HEADER.pack(len(body), RECORD_WAVEFORM, timestamp) + body
+
+def record_boundary(data, limit):
+    #length of the whole records at the start of data that fit within limit bytes (at least one record, if there is one)
+    position = 0
+    while position + RECORD_HEADER.size <= len(data):
+        end = position + RECORD_HEADER.size + RECORD_HEADER.unpack_from(data, position)[0]
+        if end > len(data) or (end > limit and position > 0):
+            break
+        position = end
+    return position
+
+def iter_records(data):
+    #yields (kind, timestamp, body) of every whole record in data
+    position = 0
+    while position + RECORD_HEADER.size <= len(data):
+        length, kind, timestamp = RECORD_HEADER.unpack_from(data, position)
+        start = position + RECORD_HEADER.size
+        if start + length > len(data):
+            break
+        yield (kind, timestamp, data[start:start+length])
+        position = start + length
+
+######################################################
+##                     CLIENT                       ##
+######################################################
+
+class FleetClient:
+    """
+    Sends a unit's fault events and sampled waveforms to a fleet collector.
+
+    Usage:
+    client = FleetClient((host, port), unit_id); client.start(). Call
+    event(timestamp, fault type, distance, description) whenever the unit's
+    status changes, and waveform(timestamp, wf) with every waveform; only
+    one waveform per waveform_interval is kept. Neither call blocks: records
+    are queued for a sender thread, which appends them to the unit's spool
+    file and sends them to the collector in batches. While the collector
+    can't be reached, records stay spooled (across restarts, too). close()
+    stops the sender after giving unsent records CLOSE_TIMEOUT seconds to
+    go out.
+    """
+    def __init__(self, address, unit_id, spool_dir = DEFAULT_SPOOL_DIR, waveform_interval = DEFAULT_WAVEFORM_INTERVAL):
+        if not UNIT_ID_PATTERN.match(unit_id):
+            raise ValueError("Invalid unit id: '"+unit_id+"' (letters, digits, '_', '.' and '-' only)")
+        self.address = address
+        self.unit_id = unit_id
+        self.spool_path = os.path.join(spool_dir, unit_id + ".spool")
+        self.state_path = os.path.join(spool_dir, unit_id + ".json")
+        self.waveform_interval = waveform_interval
+        self.next_waveform_time = 0
+        self.q = queue.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.spool = None
+        self.base = 0 #stream offset of the first byte in the spool file
+        self.end = 0 #stream offset of the end of the spool file
+        self.sent = 0 #stream offset the collector has acknowledged
+        self.empty_at_start = False #the spool file was empty when opened, so its saved base may be behind (see compact)
+        self.oldest_unsent_time = None
+        self.last_send_time = 0
+        self.sock = None
+        self.next_connect_time = 0
+        self.reconnect_delay = RECONNECT_MIN
+        self.dropped = 0 #records discarded because the queue or the spool was full
+        self.bytes_sent = 0 #compressed
+        self.error = None #exception that stopped the sender thread, if any
+        self.thread = None
+        self._closing = threading.Event()
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.spool_path) or ".", exist_ok=True)
+        self.open_spool()
+        self.thread = threading.Thread(target=self.run, name="FleetClient", daemon=True)
+        self.thread.start()
+
+    def event(self, timestamp, fault_type, distance, description):
+        self.put(encode_event(timestamp, fault_type, distance, description))
+
+    def waveform(self, timestamp, wf, session_number = 0, log_number = 0):
+        #returns True if the waveform was kept
+        if self.waveform_interval <= 0 or time.monotonic() < self.next_waveform_time:
+            return False
+        self.next_waveform_time = time.monotonic() + self.waveform_interval
+        self.put(encode_waveform(timestamp, wf, session_number, log_number))
+        return True
+
+    def put(self, record):
+        try:
+            self.q.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def connected(self):
+        return self.sock is not None
+
+    def unsent_bytes(self):
+        return self.end - self.sent
+
+    def report(self):
+        #one-line summary for the timing report
+        return ("fleet " + ("connected" if self.connected() else "offline") + " " + str(self.unsent_bytes()//1024) + " KiB unsent "
+                + str(self.bytes_sent//1024) + " KiB sent" + (" " + str(self.dropped) + " dropped" if self.dropped > 0 else ""))
+
+    def close(self, timeout = CLOSE_TIMEOUT):
+        #returns True if every record was acknowledged
+        self._closing.set()
+        if self.thread is not None:
+            self.thread.join(timeout + SOCKET_TIMEOUT)
+        return self.q.empty() and self.unsent_bytes() == 0
+
+    ######################################################
+    ##                     SPOOL                        ##
+    ######################################################
+
+    def open_spool(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.base = json.load(f)["base"]
+        self.spool = open(self.spool_path, "a+b")
+        #a crash may have left part of a record at the end; it was never sent, so it is dropped
+        self.spool.seek(0)
+        size = record_boundary(self.spool.read(), float('inf'))
+        self.spool.truncate(size)
+        self.end = self.base + size
+        self.sent = self.base #until the collector says otherwise
+        self.empty_at_start = size == 0
+        if size > 0:
+            self.oldest_unsent_time = time.monotonic()
+
+    def save_state(self):
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"base": self.base}, f)
+        os.replace(temp_path, self.state_path)
+
+    def spool_records(self, records):
+        #appends queued records to the spool. past SPOOL_MAX_BYTES unsent, waveforms are dropped
+        data = []
+        unsent = self.unsent_bytes()
+        for record in records:
+            if unsent > SPOOL_MAX_BYTES and record[4] == RECORD_WAVEFORM: #byte 4 of the record header is its kind
+                self.dropped += 1
+                continue
+            data.append(record)
+            unsent += len(record)
+        if len(data) == 0:
+            return
+        data = b''.join(data)
+        self.spool.write(data)
+        self.spool.flush()
+        self.end += len(data)
+        if self.oldest_unsent_time is None:
+            self.oldest_unsent_time = time.monotonic()
+
+    def read_batch(self):
+        #whole records from the spool, starting at the sent offset
+        self.spool.seek(self.sent - self.base)
+        data = self.spool.read(MAX_BATCH_BYTES)
+        size = record_boundary(data, MAX_BATCH_BYTES)
+        if size == 0 and len(data) >= RECORD_HEADER.size:
+            #a single record larger than a batch is sent whole
+            size = RECORD_HEADER.size + RECORD_HEADER.unpack_from(data)[0]
+            data = data + self.spool.read(size - len(data))
+        return data[:size]
+
+    def compact(self):
+        #once everything spooled is acknowledged, the spool file starts over (its offsets carry on from the end).
+        #the file is emptied before the new base is saved: a crash in between leaves an empty spool at the old base,
+        #which connect() renumbers. the other way round, the acknowledged records would be resent under new offsets
+        if self.sent == self.end and self.end - self.base >= SPOOL_COMPACT_BYTES:
+            self.spool.truncate(0)
+            self.base = self.end
+            self.save_state()
+
+    ######################################################
+    ##                    SENDING                       ##
+    ######################################################
+
+    def connect(self):
+        sock = socket.create_connection(self.address, timeout=SOCKET_TIMEOUT)
+        try:
+            send_frame(sock, MSG_HELLO, json.dumps({"unit": self.unit_id, "protocol": PROTOCOL_VERSION}).encode())
+            msg_type, body = recv_frame(sock)
+            if msg_type != MSG_RESUME:
+                raise ConnectionError("expected RESUME, got message type "+str(msg_type))
+        except:
+            sock.close()
+            raise
+        offset = OFFSET.unpack(body)[0]
+        if offset > self.end or (self.empty_at_start and offset > self.base):
+            #the collector has more of this unit's stream than the spool does (e.g. the spool was deleted, or compact()
+            #was cut short); the spooled records, all new since the spool was opened, are renumbered to carry on from there
+            size = self.end - self.base
+            self.base = offset
+            self.end = offset + size
+            self.save_state()
+        self.empty_at_start = False
+        #the collector may have lost what it acknowledged; whatever is still spooled is resent
+        self.sent = max(offset, self.base)
+        self.sock = sock
+        self.reconnect_delay = RECONNECT_MIN
+        self.last_send_time = 0 #say hello with a batch (or a heartbeat) straight away
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.next_connect_time = time.monotonic() + self.reconnect_delay
+        self.reconnect_delay = min(self.reconnect_delay*2, RECONNECT_MAX)
+
+    def send_batch(self):
+        records = self.read_batch()
+        start = self.sent
+        compressed = zlib.compress(records, ZLIB_LEVEL)
+        send_frame(self.sock, MSG_BATCH, BATCH_HEADER.pack(start, len(records)) + compressed)
+        msg_type, body = recv_frame(self.sock)
+        if msg_type != MSG_ACK or OFFSET.unpack(body)[0] < start + len(records):
+            raise ConnectionError("batch at offset "+str(start)+" was not acknowledged")
+        self.sent = start + len(records)
+        self.bytes_sent += FRAME_HEADER.size + BATCH_HEADER.size + len(compressed)
+        self.last_send_time = time.monotonic()
+        self.oldest_unsent_time = None if self.sent == self.end else self.last_send_time
+        self.compact()
+
+    def batch_due(self, now):
+        unsent = self.unsent_bytes()
+        if unsent >= BATCH_BYTES or self._closing.is_set():
+            return unsent > 0
+        if unsent > 0 and now - self.oldest_unsent_time >= BATCH_INTERVAL:
+            return True
+        return now - self.last_send_time >= HEARTBEAT_INTERVAL
+
+    def run(self):
+        close_deadline = None
+        try:
+            while True:
+                #spool whatever was queued, waiting briefly for more when there's nothing else to do
+                records = []
+                try:
+                    records.append(self.q.get(timeout=0.1 if self.connected() and not self.batch_due(time.monotonic()) else 0.01))
+                    while True:
+                        records.append(self.q.get_nowait())
+                except queue.Empty:
+                    pass
+                self.spool_records(records)
+
+                now = time.monotonic()
+                if self._closing.is_set():
+                    if close_deadline is None:
+                        close_deadline = now + CLOSE_TIMEOUT
+                    if (self.q.empty() and self.unsent_bytes() == 0) or now >= close_deadline:
+                        break
+                if not self.connected() and now >= self.next_connect_time:
+                    try:
+                        self.connect()
+                    except OSError:
+                        self.disconnect()
+                if self.connected() and self.batch_due(now):
+                    try:
+                        self.send_batch()
+                    except OSError:
+                        self.disconnect()
+                elif not self.connected():
+                    time.sleep(0.05)
+        except Exception as e:
+            self.error = e
+            traceback.print_exc(file=sys.stdout)
+        finally:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+            if self.spool is not None:
+                self.spool.close()
+
+######################################################
+##                    COLLECTOR                     ##
+######################################################
+
+class UnitStore:
+    """
+    The collector's copy of one unit's stream: its events and waveforms,
+    written as they arrive, and the offset stored up to.
+
+    Usage:
+    store(start, records) with every batch; it returns the offset to
+    acknowledge. Records before the stored offset (a batch resent after a
+    dropped link) are skipped. Only one connection's batch is stored at a
+    time.
+    """
+    def __init__(self, collector, unit_id):
+        self.collector = collector
+        self.unit_id = unit_id
+        self.directory = os.path.join(collector.directory, unit_id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.state_path = os.path.join(self.directory, "state.json")
+        self.lock = threading.Lock()
+        self.next_offset = 0
+        self.events = 0
+        self.waveforms = 0
+        self.last_event = None #(timestamp, fault type, description)
+        self.last_seen = None
+        self.connection = None #socket of the connection currently serving this unit
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            self.next_offset = state["next_offset"]
+            self.events = state["events"]
+            self.waveforms = state["waveforms"]
+            self.last_event = state["last_event"]
+
+    def save_state(self):
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"next_offset": self.next_offset, "events": self.events, "waveforms": self.waveforms, "last_event": self.last_event}, f)
+        os.replace(temp_path, self.state_path)
+
+    def store(self, start, records):
+        with self.lock:
+            self.last_seen = time.time()
+            end = start + len(records)
+            if end <= self.next_offset:
+                return self.next_offset #already stored
+            if start > self.next_offset:
+                print("Unit "+self.unit_id+": gap in stream, bytes "+str(self.next_offset)+" to "+str(start)+" were never received")
+                skip = 0
+            else:
+                skip = self.next_offset - start
+            event_rows = []
+            waveform_rows = []
+            for kind, timestamp, body in iter_records(records[skip:]):
+                if kind == RECORD_EVENT:
+                    event = json.loads(body)
+                    text = event["text"].replace('"', "'")
+                    event_rows.append(str(timestamp)+","+str(event["fault"])+","+str(event["feet"])+',"'+text+'"\n')
+                    self.last_event = (timestamp, event["fault"], event["text"])
+                elif kind == RECORD_WAVEFORM:
+                    session_number, log_number = WAVEFORM_HEADER.unpack_from(body)
+                    waveform_rows.append(format_row(session_number, log_number, timestamp, np.frombuffer(body[WAVEFORM_HEADER.size:], dtype='<i4')))
+            if len(event_rows) > 0:
+                append_rows(os.path.join(self.directory, "events.csv"), EVENTS_HEADER, event_rows)
+                self.collector.add_events(self.unit_id, event_rows)
+            if len(waveform_rows) > 0:
+                append_rows(os.path.join(self.directory, "waveforms.csv"), CSV_HEADER, waveform_rows)
+            self.events += len(event_rows)
+            self.waveforms += len(waveform_rows)
+            self.next_offset = end
+            self.save_state()
+            return self.next_offset
+
+def append_rows(path, header, rows):
+    #rows are synced before the stored offset moves past them, so an acknowledged record survives a crash
+    with open(path, "a") as f:
+        if f.tell() == 0:
+            f.write(header)
+        f.write("".join(rows))
+        f.flush()
+        os.fsync(f.fileno())
+
+class FleetCollector:
+    """
+    Receives the streams of every unit in a fleet.
+
+    Usage:
+    collector = FleetCollector(port, directory); collector.start(). Each
+    connected unit is served by its own thread (see UnitHandler). status()
+    summarizes the fleet, and stop() disconnects every unit. A port of 0
+    picks a free port, available as collector.port once started.
+    """
+    def __init__(self, port = DEFAULT_PORT, directory = DEFAULT_COLLECTOR_DIR, host = DEFAULT_HOST):
+        self.port = port
+        self.host = host
+        self.directory = directory
+        self.units = {} #unit id -> UnitStore
+        self.lock = threading.Lock() #guards units, and the fleet-wide events file
+        self.bytes_received = 0
+        self.server = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        class Handler(UnitHandler):
+            collector = self
+        self.server = CollectorServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name="FleetCollector", daemon=True).start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        with self.lock:
+            units = list(self.units.values())
+        for unit in units:
+            connection = unit.connection
+            if connection is not None:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def get_unit(self, unit_id):
+        with self.lock:
+            if unit_id not in self.units:
+                self.units[unit_id] = UnitStore(self, unit_id)
+            return self.units[unit_id]
+
+    def add_events(self, unit_id, event_rows):
+        with self.lock:
+            append_rows(os.path.join(self.directory, "events.csv"), FLEET_EVENTS_HEADER, [row.replace(",", ","+unit_id+",", 1) for row in event_rows])
+
+    def status(self):
+        #(summary line, list of lines for units whose last event was a fault)
+        with self.lock:
+            units = list(self.units.values())
+        connected = sum(unit.connection is not None for unit in units)
+        summary = (str(len(units))+" units ("+str(connected)+" connected), "+str(sum(unit.events for unit in units))+" events, "
+                   +str(sum(unit.waveforms for unit in units))+" waveforms, "+str(self.bytes_received//1024)+" KiB received")
+        faults = []
+        for unit in sorted(units, key=lambda u: u.unit_id):
+            if unit.last_event is not None and unit.last_event[1] != FAULT_NONE:
+                faults.append(unit.unit_id+": "+unit.last_event[2]+" ("+time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(unit.last_event[0]))+")")
+        return (summary, faults)
+
+class CollectorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = LISTEN_BACKLOG
+
+class UnitHandler(socketserver.BaseRequestHandler):
+    collector = None #set by FleetCollector.start()
+
+    def handle(self):
+        sock = self.request
+        sock.settimeout(CONNECTION_TIMEOUT)
+        unit = None
+        try:
+            msg_type, body = recv_frame(sock)
+            hello = json.loads(body) if msg_type == MSG_HELLO else {}
+            unit_id = str(hello.get("unit", ""))
+            if not UNIT_ID_PATTERN.match(unit_id) or hello.get("protocol") != PROTOCOL_VERSION:
+                return
+            unit = self.collector.get_unit(unit_id)
+            #a unit that reconnects before its old connection timed out takes over from it
+            old_connection = unit.connection
+            unit.connection = sock
+            if old_connection is not None:
+                try:
+                    old_connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            with unit.lock:
+                send_frame(sock, MSG_RESUME, OFFSET.pack(unit.next_offset))
+            while True:
+                msg_type, body = recv_frame(sock)
+                if msg_type != MSG_BATCH:
+                    break
+                self.collector.bytes_received += FRAME_HEADER.size + len(body)
+                start, length = BATCH_HEADER.unpack_from(body)
+                records = zlib.decompress(body[BATCH_HEADER.size:])
+                if len(records) != length:
+                    break
+                send_frame(sock, MSG_ACK, OFFSET.pack(unit.store(start, records)))
+        except (OSError, ValueError, zlib.error, struct.error):
+            pass #unit went away, timed out or sent garbage; it will reconnect
+        finally:
+            if unit is not None and unit.connection is sock:
+                unit.connection = None
+
+######################################################
+##                  SIMULATED UNITS                 ##
+######################################################
+
+def simulate_units(address, n_units, spool_dir, seconds, rate, prefix = "unit"):
+    #runs n_units FleetClients from this process, each sending `rate` events per second (numbered, so a test can check
+    #that every one arrived exactly once) and a waveform per second. prints each unit's counts when done
+    rng = np.random.default_rng()
+    clients = [FleetClient(address, prefix + "%03d" % i, spool_dir, waveform_interval=1.0) for i in range(n_units)]
+    for client in clients:
+        client.start()
+    counts = [0]*n_units
+    waveforms = [0]*n_units
+    end_time = time.monotonic() + seconds
+    next_time = time.monotonic()
+    while time.monotonic() < end_time:
+        for i, client in enumerate(clients):
+            fault = rng.random() < 0.2
+            description = ("Open fault located at %.0f feet" % (rng.random()*300)) if fault else "System OK"
+            client.event(time.time(), FAULT_OPEN if fault else FAULT_NONE, 0, description + " (#" + str(counts[i]) + ")")
+            counts[i] += 1
+            if client.waveform(time.time(), rng.integers(-2**15, 2**15, 92)):
+                waveforms[i] += 1
+        next_time += 1/rate
+        time.sleep(max(0, next_time - time.monotonic()))
+    #give every unit the time it needs to catch up, rather than the usual CLOSE_TIMEOUT
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and not all(client.q.empty() and client.unsent_bytes() == 0 for client in clients):
+        time.sleep(0.2)
+    for i, client in enumerate(clients):
+        done = client.close()
+        print(client.unit_id + " " + str(counts[i]) + " events " + str(waveforms[i]) + " waveforms " + ("sent" if done else "UNSENT"))
+
+def main():
+    mode = None
+    port = DEFAULT_PORT
+    directory = DEFAULT_COLLECTOR_DIR
+    n_units = 0
+    address = ("localhost", DEFAULT_PORT)
+    spool_dir = DEFAULT_SPOOL_DIR
+    seconds = 60
+    rate = 1.0
+    prefix = "unit"
+    try:
+        args = sys.argv
+        if '-collect' in args:
+            mode = 'collect'
+            i = args.index('-collect')
+            if i+1 < len(args) and not args[i+1].startswith('-'):
+                port = int(args[i+1])
+        if '-dir' in args:
+            directory = args[args.index('-dir')+1]
+        if '-simulate' in args:
+            mode = 'simulate'
+            n_units = int(args[args.index('-simulate')+1])
+        if '-connect' in args:
+            host, _, connect_port = args[args.index('-connect')+1].rpartition(':')
+            address = (host or "localhost", int(connect_port))
+        if '-spool' in args:
+            spool_dir = args[args.index('-spool')+1]
+        if '-seconds' in args:
+            seconds = float(args[args.index('-seconds')+1])
+        if '-rate' in args:
+            rate = float(args[args.index('-rate')+1])
+        if '-prefix' in args:
+            prefix = args[args.index('-prefix')+1]
+        if mode is None:
+            raise ValueError("no mode given")
+    except:
+        print("Error: invalid input.")
+        print(USAGE_STRING)
+        return
+
+    if mode == 'simulate':
+        simulate_units(address, n_units, spool_dir, seconds, rate, prefix)
+        return
+    collector = FleetCollector(port, directory)
+    collector.start()
+    print("Collecting on port "+str(collector.port)+" into '"+directory+"'. Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(STATUS_INTERVAL)
+            summary, faults = collector.status()
+            print(time.strftime("[%H:%M:%S] ") + summary)
+            for line in faults:
+                print("    " + line)
+    except KeyboardInterrupt:
+        collector.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+#handoff.py
+#passes results between the SSTDR_USB acquisition thread and the render loop without either waiting on the other.
+
+class LatestValue:
+    """
+    Holds the most recent value published by one thread, for another thread
+    to pick up whenever it is ready. Older values are simply replaced, so a
+    slow reader never holds up the writer (and never sees a backlog).
+
+    Usage:
+    the writer calls set(value). The reader calls get(), which returns
+    (version, value); the version increases with every set(), so the reader
+    can tell whether anything new arrived since its last get(). (0, None)
+    until the first set().
+    No lock is needed with a single writer: set() replaces one attribute
+    with a new tuple, which is atomic in CPython.
+    """
+    def __init__(self):
+        self._item = (0, None)
+
+    def set(self, value):
+        self._item = (self._item[0] + 1, value)
+
+    def get(self):
+        return self._item
@@ -0,0 +1,206 @@
+#log_index.py
+#sidecar index for waveform logs (csv or binary_log), so that one session, log or time range can be read without loading
+#or scanning the whole file.
+#
+#the index of "SSTDR_waveforms.csv" is "SSTDR_waveforms.csv.idx", a small csv with one entry per run of consecutive rows
+#that share a session and log number (runs are split every MAX_ENTRY_ROWS rows, to keep time range queries tight):
+#   session_number,log_number,start_offset,end_offset,row_count,first_timestamp,last_timestamp
+#offsets are byte offsets into the log file. the index is kept up to date by log_writer.LogWriter, and is rebuilt or
+#caught up (only the rows past the last indexed offset are scanned) whenever it is loaded for a file it doesn't cover.
+#
+#command line: python log_index.py [log path]
+#   (re)builds the index of an existing log and prints a summary of its sessions
+
+import sys
+import os
+import numpy as np
+
+import binary_log
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" [log path]"
+INDEX_EXTENSION = ".idx"
+INDEX_HEADER = "session_number,log_number,start_offset,end_offset,row_count,first_timestamp,last_timestamp\n"
+MAX_ENTRY_ROWS = 1000
+
+class IndexEntry:
+    def __init__(self, session_number, log_number, start_offset, end_offset, row_count, first_timestamp, last_timestamp):
+        self.session_number = session_number
+        self.log_number = log_number
+        self.start_offset = start_offset
+        self.end_offset = end_offset
+        self.row_count = row_count
+        self.first_timestamp = first_timestamp
+        self.last_timestamp = last_timestamp
+
+    def to_row(self):
+        return ",".join([str(self.session_number), str(self.log_number), str(self.start_offset), str(self.end_offset), str(self.row_count), repr(self.first_timestamp), repr(self.last_timestamp)]) + '\n'
+
+class LogIndex:
+    """
+    Index of one log file.
+
+    Usage:
+    index = load_index(log_path) loads (building or catching up as needed)
+    the index. A writer calls add() for every row it appends and save()
+    after flushing the log. find() returns the entries matching a query;
+    read_rows() returns the rows themselves.
+    """
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.index_path = log_path + INDEX_EXTENSION
+        self.binary = binary_log.is_binary_path(log_path)
+        self.entries = []
+        self.data_start = 0 #offset of the first row, after the csv header row or binary header
+        self.end_offset = 0 #offset just past the last indexed row
+
+    def add(self, session_number, log_number, offset, size, timestamp):
+        #records a row of `size` bytes written at `offset`
+        last = self.entries[-1] if len(self.entries) > 0 else None
+        if last is not None and last.session_number == session_number and last.log_number == log_number and last.end_offset == offset and last.row_count < MAX_ENTRY_ROWS:
+            last.end_offset = offset + size
+            last.row_count += 1
+            last.last_timestamp = timestamp
+        else:
+            self.entries.append(IndexEntry(session_number, log_number, offset, offset + size, 1, timestamp, timestamp))
+        self.end_offset = offset + size
+
+    def save(self):
+        #writes to a temporary file first, so a crash never leaves a half-written index
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(INDEX_HEADER)
+            f.write(''.join([entry.to_row() for entry in self.entries]))
+        os.replace(tmp_path, self.index_path)
+
+    def last_session(self):
+        #highest session number in the log, or None if the log is empty
+        if len(self.entries) == 0:
+            return None
+        return max([entry.session_number for entry in self.entries])
+
+    def sessions(self):
+        return sorted(set([entry.session_number for entry in self.entries]))
+
+    def find(self, session_number = None, log_number = None, start_time = None, end_time = None):
+        #entries of rows in the given session and/or log, that may hold rows timestamped within [start_time, end_time]
+        return [entry for entry in self.entries
+            if (session_number is None or entry.session_number == session_number)
+            and (log_number is None or entry.log_number == log_number)
+            and (start_time is None or entry.last_timestamp >= start_time)
+            and (end_time is None or entry.first_timestamp <= end_time)]
+
+    def read_rows(self, session_number = None, log_number = None, start_time = None, end_time = None):
+        #returns only the requested rows, in the layout of fault_detection.read_csv_ungrouped: an int array of
+        #[session, log, timestamp, samples...] rows. only the byte ranges of matching entries are read.
+        entries = self.find(session_number, log_number, start_time, end_time)
+        rows = [read_entry(self.log_path, entry, self.binary) for entry in entries]
+        if len(rows) == 0:
+            return np.zeros((0, 3 + binary_log.WAVEFORM_LENGTH), dtype=int)
+        rows = np.concatenate(rows)
+        keep = np.ones(len(rows), dtype=bool)
+        if start_time is not None:
+            keep &= rows[:,2] >= start_time
+        if end_time is not None:
+            keep &= rows[:,2] <= end_time
+        return rows[keep].astype(int)
+
+    def catch_up(self):
+        #indexes rows past the last indexed offset (all rows, for a new index). returns the number of rows indexed
+        count = 0
+        if not os.path.exists(self.log_path) or os.path.getsize(self.log_path) == 0:
+            return count
+        if self.binary:
+            records = binary_log.open_log(self.log_path)
+            self.data_start = binary_log.HEADER_SIZE
+            size = records.dtype.itemsize
+            first = max(0, (self.end_offset - self.data_start)//size)
+            session_numbers = records['session_number'][first:].tolist()
+            log_numbers = records['log_number'][first:].tolist()
+            timestamps = records['timestamp'][first:].tolist()
+            for i in range(len(timestamps)):
+                self.add(session_numbers[i], log_numbers[i], self.data_start + (first+i)*size, size, timestamps[i])
+            return len(timestamps)
+        with open(self.log_path, "rb") as f:
+            if self.end_offset == 0:
+                self.data_start = len(f.readline()) #header row
+                offset = self.data_start
+            else:
+                offset = self.end_offset
+                f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break #row still being written
+                try:
+                    values = line.split(b',', 3)
+                    self.add(int(values[0]), int(values[1]), offset, len(line), float(values[2]))
+                    count += 1
+                except (ValueError, IndexError):
+                    pass #blank or incomplete row (e.g. cut short by a crash); not indexed
+                offset += len(line)
+        return count
+
+def read_entry(log_path, entry, binary = None):
+    #rows of one index entry, as a float array of [session, log, timestamp, samples...] rows
+    if binary is None:
+        binary = binary_log.is_binary_path(log_path)
+    with open(log_path, "rb") as f:
+        f.seek(entry.start_offset)
+        data = f.read(entry.end_offset - entry.start_offset)
+    if binary:
+        with open(log_path, "rb") as f:
+            dtype = binary_log.read_header(f)
+        records = np.frombuffer(data, dtype=dtype)
+        rows = np.empty((len(records), 3 + dtype['waveform'].shape[0]))
+        rows[:,0] = records['session_number']
+        rows[:,1] = records['log_number']
+        rows[:,2] = records['timestamp']
+        rows[:,3:] = records['waveform']
+        return rows
+    #every row has the same number of columns, so all values can be parsed at once and reshaped
+    values = np.array(data.replace(b'\n', b',').split(b',')[:-1], dtype=float)
+    return values.reshape(entry.row_count, -1)
+
+def read_index(log_path):
+    #reads an existing sidecar index as is; returns None if there is none
+    index = LogIndex(log_path)
+    if not os.path.exists(index.index_path):
+        return None
+    with open(index.index_path, "r") as f:
+        f.readline() #header row
+        for line in f:
+            if line.strip() == '':
+                continue
+            v = line.split(',')
+            index.entries.append(IndexEntry(int(v[0]), int(v[1]), int(v[2]), int(v[3]), int(v[4]), float(v[5]), float(v[6])))
+    if len(index.entries) > 0:
+        index.data_start = index.entries[0].start_offset
+        index.end_offset = index.entries[-1].end_offset
+    return index
+
+def load_index(log_path, save = True):
+    #loads the index of a log, building it if missing and catching up on rows written since it was last saved.
+    #an index that claims more rows than the log holds (e.g. the log was replaced) is rebuilt from scratch.
+    index = read_index(log_path)
+    log_size = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+    if index is None or index.end_offset > log_size:
+        index = LogIndex(log_path)
+    if index.catch_up() > 0 and save:
+        index.save()
+    return index
+
+def main():
+    if len(sys.argv) < 2:
+        print("Error: invalid input.")
+        print(USAGE_STRING)
+        return
+    log_path = sys.argv[1]
+    index = load_index(log_path)
+    for session_number in index.sessions():
+        entries = index.find(session_number)
+        logs = sorted(set([entry.log_number for entry in entries]))
+        print("Session "+str(session_number)+": "+str(sum([entry.row_count for entry in entries]))+" rows in "+str(len(logs))+" logs")
+    print("Finished. Wrote index: "+index.index_path)
+
+if __name__ == '__main__':
+    main()
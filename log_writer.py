@@ -0,0 +1,165 @@
+#log_writer.py
+#writes logged waveforms to the output csv from a background thread, so that disk latency (e.g. on SD-card-backed field
+#computers) never stalls acquisition or detection.
+#rows are queued by the main loop, formatted & written in batches by the writer thread, flushed on a size/time policy,
+#and fsynced at a configurable interval.
+#output paths ending in binary_log.BINARY_EXTENSION are written in the fixed-width binary log format instead of csv.
+#the log's sidecar index (log_index.py) is updated with every written row and saved after every flush.
+
+import os
+import time
+import queue
+import threading
+
+from profiling import StageTimer
+import binary_log
+import log_index
+
+#constants
+CSV_HEADER = "session_number,log_number,timestamp,waveform\n"
+DEFAULT_QUEUE_SIZE = 4096 #rows; when full, new rows are dropped (and counted) rather than blocking the main loop
+DEFAULT_BATCH_ROWS = 256 #flush after this many rows are written...
+DEFAULT_FLUSH_INTERVAL = 1.0 #...or this many seconds after the oldest unflushed row, whichever comes first
+DEFAULT_FSYNC_INTERVAL = 10.0 #seconds between fsyncs; 0 fsyncs on every flush, -1 never fsyncs
+
+def format_row(session_number, log_number, timestamp, wf):
+    #one csv row, in the layout read by fault_detection.read_csv. tolist() gives python ints, which print without numpy type names
+    return str(session_number)+","+str(log_number)+","+str(timestamp)+","+str(wf.tolist() if hasattr(wf, 'tolist') else list(wf))[1:-1]+'\n' #1:-1 for brackets
+
+class LogWriter:
+    """
+    Appends waveform rows to a csv file from a background thread.
+
+    Usage:
+    call start(), then write() for every logged waveform; write() only
+    enqueues and never blocks. call close() on shutdown to write and sync
+    everything still queued. The header row (or binary header) is written
+    first if the file is empty.
+    Queue depth (qsize()), dropped rows and write latency percentiles
+    (report()) can be shown by the caller.
+    If no index (log_index.LogIndex) is given, the log's index is loaded
+    (or built) when the writer starts.
+    """
+    def __init__(self, path, index = None, queue_size = DEFAULT_QUEUE_SIZE, batch_rows = DEFAULT_BATCH_ROWS, flush_interval = DEFAULT_FLUSH_INTERVAL, fsync_interval = DEFAULT_FSYNC_INTERVAL):
+        self.path = path
+        self.binary = binary_log.is_binary_path(path)
+        self.index = index
+        self.q = queue.Queue(maxsize=queue_size)
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.dropped = 0 #rows discarded because the queue was full
+        self.written = 0 #rows written to the file
+        self.timer = StageTimer() #latency of each batch write ("write") and flush ("flush")
+        self.error = None #exception that stopped the writer thread, if any
+        self.thread = None
+        self._closing = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="LogWriter", daemon=True)
+        self.thread.start()
+
+    def write(self, session_number, log_number, timestamp, wf):
+        #returns False if the row was dropped
+        try:
+            self.q.put_nowait((session_number, log_number, timestamp, wf))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def qsize(self):
+        return self.q.qsize()
+
+    def report(self):
+        #one-line summary of queue depth and write latency, in milliseconds
+        report = "log q " + str(self.qsize())
+        if self.dropped > 0:
+            report = report + " dropped " + str(self.dropped)
+        timings = self.timer.report()
+        if timings != '':
+            report = report + " " + timings
+        if self.error is not None:
+            report = report + " ERROR: " + str(self.error)
+        return report
+
+    def close(self, timeout = None):
+        #writes everything already queued, flushes, syncs and closes the file
+        if self.thread is None:
+            return
+        self._closing.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def run(self):
+        try:
+            if self.index is None:
+                self.index = log_index.load_index(self.path)
+            #csv rows are encoded here rather than by a text mode file, so their byte offsets are known for the index
+            with open(self.path, "ab") as f:
+                if f.tell() == 0:
+                    f.write(binary_log.header_bytes() if self.binary else CSV_HEADER.encode())
+                elif self.binary:
+                    with open(self.path, "rb") as f_check:
+                        dtype = binary_log.read_header(f_check) #don't append records to a file in another format
+                    #drop a record left incomplete by a crash, so new records stay aligned
+                    partial = (f.tell() - binary_log.HEADER_SIZE) % dtype.itemsize
+                    if partial != 0:
+                        f.truncate(f.tell() - partial)
+                        f.seek(0, os.SEEK_END)
+                else:
+                    #end a row left incomplete by a crash, so it isn't joined with the next row
+                    with open(self.path, "rb") as f_check:
+                        f_check.seek(-1, os.SEEK_END)
+                        if f_check.read(1) != b'\n':
+                            f.write(b'\n')
+                unflushed = 0
+                first_unflushed_time = None
+                last_fsync_time = time.monotonic()
+                while True:
+                    #gather a batch: wait for the first row, then take whatever else is queued
+                    batch = []
+                    try:
+                        batch.append(self.q.get(timeout=self.flush_interval/4))
+                        while len(batch) < self.batch_rows:
+                            batch.append(self.q.get_nowait())
+                    except queue.Empty:
+                        pass
+                    if len(batch) > 0:
+                        start = time.perf_counter()
+                        offset = f.tell()
+                        if self.binary:
+                            data = binary_log.pack_records(batch)
+                            sizes = [len(data)//len(batch)]*len(batch)
+                        else:
+                            rows = [format_row(*row).encode() for row in batch]
+                            data = b''.join(rows)
+                            sizes = [len(row) for row in rows]
+                        f.write(data)
+                        for (session_number, log_number, timestamp, _), size in zip(batch, sizes):
+                            self.index.add(session_number, log_number, offset, size, timestamp)
+                            offset += size
+                        self.timer.record("write", time.perf_counter() - start)
+                        self.written += len(batch)
+                        unflushed += len(batch)
+                        if first_unflushed_time is None:
+                            first_unflushed_time = time.monotonic()
+                    closing = self._closing.is_set() and self.q.empty()
+                    now = time.monotonic()
+                    if unflushed > 0 and (closing or unflushed >= self.batch_rows or now - first_unflushed_time >= self.flush_interval):
+                        start = time.perf_counter()
+                        f.flush()
+                        if self.fsync_interval >= 0 and (closing or now - last_fsync_time >= self.fsync_interval):
+                            os.fsync(f.fileno())
+                            last_fsync_time = now
+                        self.index.save()
+                        self.timer.record("flush", time.perf_counter() - start)
+                        unflushed = 0
+                        first_unflushed_time = None
+                    if closing:
+                        if self.fsync_interval >= 0:
+                            f.flush()
+                            os.fsync(f.fileno())
+                        break
+        except Exception as e:
+            self.error = e
@@ -1,96 +1,74 @@
 #pair_data.py
 
 #pairs environmental data to sstdr measurments based on timestamp
+#each sstdr waveform is paired with the nearest-in-time row of every environmental sensor, if one is within MAX_TIME_DIST.
 #command line arguments, can be provided in any order:
-#   -e [path] : provides path to environmental csv file (required)
-#   -s [path] : provide path to sstdr csv file (required)
+#   -e [path] : provides path to environmental csv file (required). repeat for several sensors; each path may be a
+#               glob pattern matching several files of one sensor (e.g. monthly exports), e.g. -e "roof_sensor_*.csv"
+#   -s [path] : provide path to sstdr csv file (required). binary logs (.wfl) and archives (.wfa) are also accepted
 #   -o [path] : provide name of output file (OPTIONAL, defaults to "paired_data.csv")
+#   -t [secs] : maximum time difference between a waveform and environment measurements (OPTIONAL, defaults to MAX_TIME_DIST)
+#   -follow   : follow mode (OPTIONAL). keeps running, tailing the sstdr log and environment files and appending newly
+#               matched pairs to the output as data arrives. stop with ctrl+c; a later run resumes where it left off
+#   -p [secs] : how often to check for new data in follow mode (OPTIONAL, defaults to FOLLOW_POLL_INTERVAL)
+#
+#follow mode notes:
+#   a waveform is only paired once every sensor has logged a row more than max_time_dist after it, so environment rows
+#   that are written late (within the tolerance) are still matched; the output is identical to a batch run over the same data.
+#   memory is bounded: only waveforms waiting for environment data, and the environment rows they could still match,
+#   are kept. if a sensor stops logging, waveforms beyond FOLLOW_MAX_PENDING are given up on (left unpaired).
+#   positions in every file are kept in [out path]+FOLLOW_STATE_EXTENSION, saved after every write to the output.
+#   csv and binary (.wfl) sstdr logs can be followed; archives (.wfa) can't, since they are written a chunk at a time.
 
 #imports
 import sys
+import os
 import csv
+import glob
+import json
+import time
+import bisect
 import traceback
 import numpy as np
 
+import fault_detection
+import binary_log
+import waveform_archive
+
 #constants
-USAGE_STRING = "Usage: python "+ sys.argv[0] +" -e [environment data csv path] -s [sstdr data csv path] -o [out path; optional]"
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" -e [environment data csv path] -s [sstdr data csv path] -o [out path; optional] -t [max time difference in seconds; optional] -follow [optional] -p [poll interval in seconds; optional]"
 MAX_TIME_DIST = 1 #in seconds. maximum amount of time difference between an sstdr waveform and a set of environment measurements
 SSTDR_WAVEFORM_LENGTH = 92
+ENV_SKIP_ROWS = 4 #two useless rows, the header row, and the unit row (we know what units are which)
+ENV_TIME_COLUMN = 2
+ENV_COLUMNS = [3,4,5,6] #only want to keep these entries from the env row. omitted entries are redundant formatted time strings
+ENV_HEADERS = ["illuminance (lux)", "(mw/cm2)", "temperature (degF)", "relative humidity(%)"]
+TIME_HEADER = "epoch time (seconds)"
+WAVEFORM_HEADER = "SSTDR correlation waveform"
+FOLLOW_POLL_INTERVAL = 5.0 #seconds between checks for new data in follow mode
+FOLLOW_MAX_PENDING = 100000 #waveforms kept waiting for environment data before the oldest are given up on
+FOLLOW_MAX_ENV_ROWS = 100000 #environment rows kept per sensor while waiting for waveforms (e.g. the sstdr log lags behind)
+FOLLOW_STATE_EXTENSION = ".follow"
 
 #functions
-def pair_data(env_path, sstdr_path, out_path):
+def pair_data(env_paths, sstdr_path, out_path, max_time_dist = MAX_TIME_DIST):
     try:
-        #open files
-        env_f = open(env_path,"r",encoding="latin-1")
-        sstdr_f = open(sstdr_path,"r",encoding="latin-1")
-        
-        env_reader = csv.reader(env_f)
-        sstdr_reader = csv.reader(sstdr_f)
-        
-        #setup: discarding boilerplate and reading headers
-        env_f.readline() #discard first two useless rows
-        env_f.readline()
-        env_f.readline() #discard header row
-        env_f.readline() #discard unit row (we know what units are which)
-        
-        #setup: write header line to out file
+        if isinstance(env_paths, str):
+            env_paths = [env_paths]
+        sensors = [read_env(expand_env_path(path)) for path in env_paths]
+        sstdr_times, wfs = read_sstdr(sstdr_path)
+
+        #join: index of the matching row of every sensor, for every waveform (-1 if none is close enough)
+        matches = [nearest_rows(sstdr_times, env_times, max_time_dist) for env_times, _ in sensors]
+        paired = np.all([m >= 0 for m in matches], axis=0) if len(matches) > 0 else np.zeros(len(sstdr_times), dtype=bool)
+
         with open(out_path,"w") as out_f:
-            out_f.write("epoch time (seconds),illuminance (lux),(mw/cm2),temperature (degF),relative humidity(%),SSTDR correlation waveform\n")
-        
-            #begin
-            prev_sstdr_time = 0 #in epoch time (seconds)
-            prev_sstdr_row = ''
-            for env_row in env_reader:
-                best_sstdr_row = ''
-                out_row = ''
-                found_pair = False
-                #assumes timestamps in env file are monotonically increasing. This is ok.
-                #convert env timestamp to double
-                env_time = convert_env_date_to_epoch(np.double(env_row[2]))
-                #for each next sstdr row:
-                header_row = True
-                for sstdr_row in sstdr_reader:
-                    if header_row:
-                        continue
-                    else:
-                        header_row = False
-                    #convert timestamp to double
-                    sstdr_time = np.double(sstdr_row[2])
-                    if (sstdr_time < env_time):
-                        #if less than: store and keep going
-                        prev_sstdr_time = sstdr_time
-                        prev_sstdr_row = sstdr_row
-                        continue
-                    elif (sstdr_time >= env_time):
-                        #if greater than: measure time distance from waveforms at lesser and greater times. use closest one.
-                        current_diff = abs(env_time-sstdr_time)
-                        prev_diff = abs(env_time-prev_sstdr_time)
-                        if (prev_diff > MAX_TIME_DIST and current_diff > MAX_TIME_DIST):
-                            #skip this environment row; we have no good sstdr waveform for it
-                            #found_pair = False
-                            break
-                        else:
-                            found_pair = True
-                            if (prev_diff < current_diff):
-                                best_sstdr_row = prev_sstdr_row
-                            else:
-                                best_sstdr_row = sstdr_row
-                            break
-                #assemble an output row with desired data
-                if (found_pair):
-                    out_row = best_sstdr_row[0] + ','
-                    for i in [3,4,5,6]: #only want to keep these entries from the env row. omitted entries are redundant formatted time strings
-                        out_row = out_row + env_row[i] + ','
-                    for i,s in enumerate(best_sstdr_row[3:]):
-                        out_row = out_row + s + ','
-                    out_row = out_row[:-1] + '\n' #replace comma at EOL with newline
-                    out_f.write(out_row)
-        
+            out_f.write(header_row(env_paths))
+            out_f.write(''.join(format_rows(sstdr_times[paired], wfs[paired], [(env_rows, m[paired]) for (_, env_rows), m in zip(sensors, matches)])))
+
         #done :)
-        sstdr_f.close()
-        env_f.close()
-        print("Finished. Wrote paired data to: "+out_path)
-        
+        print("Finished. Paired "+str(int(np.sum(paired)))+" of "+str(len(sstdr_times))+" waveforms. Wrote paired data to: "+out_path)
+
     except:
         print(USAGE_STRING)
         print("Exception:")
@@ -99,34 +77,399 @@ def pair_data(env_path, sstdr_path, out_path):
         print('='*40)
         #return
 
+def expand_env_path(path):
+    #a path, or a glob pattern of several files from the same sensor
+    paths = sorted(glob.glob(path))
+    if len(paths) == 0:
+        raise FileNotFoundError("No environment files match: "+path)
+    return paths
+
+def parse_env_rows(rows):
+    #returns (epoch times, rows): a float array, and the rows (lists of text entries) they belong to
+    min_length = max(ENV_COLUMNS)+1
+    rows = [env_row for env_row in rows if len(env_row) >= min_length]
+    try:
+        times = np.array([env_row[ENV_TIME_COLUMN] for env_row in rows], dtype=float)
+    except ValueError:
+        #boilerplate or header rows repeated in concatenated exports; drop rows without a numeric time
+        rows = [env_row for env_row in rows if is_number(env_row[ENV_TIME_COLUMN])]
+        times = np.array([env_row[ENV_TIME_COLUMN] for env_row in rows], dtype=float)
+    return (convert_env_date_to_epoch(times), rows)
+
+def is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+def read_env(paths):
+    #reads the environment files of one sensor. rows are sorted by time, so files can be given in any order
+    times = []
+    values = []
+    for path in paths:
+        with open(path,"r",encoding="latin-1") as env_f:
+            for i in range(ENV_SKIP_ROWS):
+                env_f.readline()
+            t, v = parse_env_rows(csv.reader(env_f))
+        times.append(t)
+        values += v
+    times = np.concatenate(times) if len(times) > 0 else np.zeros(0)
+    order = np.argsort(times, kind='stable')
+    return (times[order], [values[i] for i in order])
+
+def read_sstdr(path):
+    #returns (timestamps, waveforms) of a waveform log, as a float array and an (N, 92) int array, sorted by time
+    if binary_log.is_binary_path(path):
+        rows = binary_log.read_ungrouped(path)
+    elif waveform_archive.is_archive_path(path):
+        records = waveform_archive.ArchiveReader(path).read()
+        order = np.argsort(records['timestamp'], kind='stable')
+        return (records['timestamp'][order].astype(float), records['waveform'][order].astype(int))
+    else:
+        rows = fault_detection.load_csv(path)
+    order = np.argsort(rows[:,2], kind='stable')
+    return (rows[order,2].astype(float), rows[order,3:].astype(int))
+
+def nearest_rows(query_times, times, max_time_dist):
+    #for every query time, the index of the nearest of the sorted times, or -1 if it is further than max_time_dist.
+    #when two are equally near, the later one is used
+    if len(times) == 0:
+        return -np.ones(len(query_times), dtype=int)
+    after = np.searchsorted(times, query_times, side='left') #first time >= query time
+    before = np.clip(after-1, 0, len(times)-1)
+    after = np.clip(after, 0, len(times)-1)
+    before_diff = np.abs(query_times - times[before])
+    after_diff = np.abs(times[after] - query_times)
+    nearest = np.where(before_diff < after_diff, before, after)
+    nearest_diff = np.minimum(before_diff, after_diff)
+    return np.where(nearest_diff <= max_time_dist, nearest, -1)
+
+def header_row(env_paths):
+    #one set of environment columns per sensor; with several sensors, columns are labeled with the sensor's file (pattern) name
+    headers = [TIME_HEADER]
+    for path in env_paths:
+        label = "" if len(env_paths) == 1 else " ["+os.path.basename(path)+"]"
+        headers += [h + label for h in ENV_HEADERS]
+    return ",".join(headers + [WAVEFORM_HEADER]) + "\n"
+
+def format_rows(times, wfs, sensor_matches):
+    #assembles output rows: waveform time, the kept entries of each sensor's matching row, then the waveform.
+    #sensor_matches: list of (every row of a sensor, index of the matching row for every waveform)
+    wf_text = [",".join(map(str, wf)) for wf in wfs.tolist()]
+    rows = []
+    for j in range(len(times)):
+        row = [repr(float(times[j]))]
+        for env_rows, matches in sensor_matches:
+            env_row = env_rows[matches[j]]
+            row += [env_row[i] for i in ENV_COLUMNS]
+        rows.append(",".join(row) + "," + wf_text[j] + "\n")
+    return rows
+
+######################################################
+##                   FOLLOW MODE                    ##
+######################################################
+
+def follow_pairs(env_paths, sstdr_path, out_path, max_time_dist = MAX_TIME_DIST, poll_interval = FOLLOW_POLL_INTERVAL):
+    try:
+        if isinstance(env_paths, str):
+            env_paths = [env_paths]
+        follower = PairFollower(env_paths, sstdr_path, out_path, max_time_dist)
+        print("Following "+sstdr_path+"; appending pairs to "+out_path+". Press Ctrl+C to stop.")
+        while True:
+            written = follower.poll()
+            if written > 0:
+                print("Paired "+str(follower.paired_count)+" of "+str(follower.resolved_count)+" waveforms so far ("+str(len(follower.pending_times))+" waiting for environment data)")
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print("Stopped. Wrote paired data to: "+out_path)
+    except:
+        print(USAGE_STRING)
+        print("Exception:")
+        print('='*40)
+        traceback.print_exc(file=sys.stdout)
+        print('='*40)
+
+class FileTail:
+    """
+    Reads the complete lines appended to a file since the last read.
+
+    Usage:
+    tail = FileTail(path, offset); tail.read_lines() returns an
+    (offset, line) pair for every complete line past the offset, and moves
+    the offset past them. A line still being written is left for the next
+    read. A file that shrinks (replaced or truncated) is read from the start,
+    or from restart_offset (e.g. past a binary log's header).
+    """
+    def __init__(self, path, offset = 0, restart_offset = 0):
+        self.path = path
+        self.offset = offset
+        self.restart_offset = restart_offset
+
+    def read_bytes(self, multiple_of = 1):
+        #new bytes, as a whole number of `multiple_of`-byte records
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return b'' #not created yet
+        if size < self.offset:
+            self.offset = self.restart_offset
+        size -= (size - self.offset) % multiple_of
+        if size <= self.offset:
+            return b''
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(size - self.offset)
+        self.offset += len(data)
+        return data
+
+    def read_lines(self):
+        data = self.read_bytes()
+        start = self.offset - len(data) #after the read, which may have started over
+        end = data.rfind(b'\n')+1
+        self.offset -= len(data) - end #leave the incomplete last line in the file
+        lines = []
+        offset = start
+        for line in data[:end].split(b'\n')[:-1]:
+            lines.append((offset, line))
+            offset += len(line)+1
+        return lines
+
+class FollowedSensor:
+    """
+    The recent rows of one environment sensor, tailed from every file
+    matching its path (or glob pattern; new files are picked up as they appear).
+
+    Usage:
+    read() takes in new rows; `times` and `rows` hold the buffered rows
+    sorted by time, and `latest` the latest time ever seen. trim() drops rows
+    that no waveform can match anymore. resume_offsets() gives, for every
+    file, the offset to read from to rebuild the buffer after a restart.
+    """
+    def __init__(self, pattern, offsets = None):
+        self.pattern = pattern
+        self.tails = {path: FileTail(path, offset) for path, offset in (offsets or {}).items()}
+        self.times = []
+        self.rows = []
+        self.sources = [] #(path, offset) of every buffered row
+        self.latest = -np.inf
+
+    def read(self):
+        for path in glob.glob(self.pattern):
+            if path not in self.tails:
+                self.tails[path] = FileTail(path)
+        count = 0
+        for path, tail in self.tails.items():
+            lines = tail.read_lines()
+            if len(lines) == 0:
+                continue
+            #boilerplate, header and unit rows don't have a numeric time, and are dropped by parse_env_rows
+            rows = list(csv.reader([line.decode("latin-1") for _, line in lines]))
+            for row, (offset, _) in zip(rows, lines):
+                row.append(offset) #so the offset survives parse_env_rows' filtering; removed below
+            times, rows = parse_env_rows(rows)
+            for t, row in zip(times.tolist(), rows):
+                i = bisect.bisect_right(self.times, t) #rows usually arrive in order, so this is nearly always an append
+                self.times.insert(i, t)
+                self.rows.insert(i, row[:-1])
+                self.sources.insert(i, (path, row[-1]))
+                self.latest = max(self.latest, t)
+            count += len(rows)
+        return count
+
+    def trim(self, cutoff_time, max_rows = FOLLOW_MAX_ENV_ROWS):
+        #drops rows before cutoff_time, and the oldest rows beyond max_rows
+        drop = max(bisect.bisect_left(self.times, cutoff_time), len(self.times) - max_rows)
+        if drop > 0:
+            del self.times[:drop]
+            del self.rows[:drop]
+            del self.sources[:drop]
+
+    def resume_offsets(self):
+        offsets = {path: tail.offset for path, tail in self.tails.items()}
+        for path, offset in self.sources:
+            offsets[path] = min(offsets[path], offset)
+        return offsets
+
+class PairFollower:
+    """
+    Incrementally pairs a growing sstdr log with growing environment files.
+
+    Usage:
+    follower = PairFollower(env_paths, sstdr_path, out_path) resumes from
+    the state file next to the output if there is one (for the same inputs);
+    otherwise the output is started over. Each call to poll() reads new data,
+    appends any pairs that can be decided to the output, saves the state, and
+    returns the number of rows written.
+    """
+    def __init__(self, env_paths, sstdr_path, out_path, max_time_dist = MAX_TIME_DIST, max_pending = FOLLOW_MAX_PENDING):
+        if waveform_archive.is_archive_path(sstdr_path):
+            raise ValueError("Archives can't be followed; follow the csv or binary log they are made from: "+sstdr_path)
+        self.env_paths = env_paths
+        self.sstdr_path = sstdr_path
+        self.out_path = out_path
+        self.state_path = out_path + FOLLOW_STATE_EXTENSION
+        self.max_time_dist = max_time_dist
+        self.max_pending = max_pending
+        self.binary = binary_log.is_binary_path(sstdr_path)
+        self.record_dtype = None
+        #waveforms read but not yet paired, in log order
+        self.pending_times = []
+        self.pending_wfs = []
+        self.pending_offsets = []
+        self.last_sstdr_time = None
+        self.paired_count = 0
+        self.resolved_count = 0
+
+        state = self.load_state()
+        self.sstdr_tail = FileTail(sstdr_path, state['sstdr_offset'] if state is not None else 0, binary_log.HEADER_SIZE if self.binary else 0)
+        self.sensors = [FollowedSensor(path, state['env_offsets'][i] if state is not None else None) for i, path in enumerate(env_paths)]
+        #the output may have rows written after the state was last saved; they are dropped, and written again
+        out_size = state['out_size'] if state is not None else 0
+        with open(out_path, "ab") as out_f:
+            out_f.truncate(out_size)
+            if out_size == 0:
+                out_f.write(header_row(env_paths).encode())
+        self.out_size = os.path.getsize(out_path)
+
+    def load_state(self):
+        #returns the saved state, or None if there is none for these inputs
+        if not os.path.exists(self.state_path) or not os.path.exists(self.out_path):
+            return None
+        with open(self.state_path, "r") as f:
+            state = json.load(f)
+        if state.get('sstdr_path') != self.sstdr_path or state.get('env_paths') != self.env_paths or state['out_size'] > os.path.getsize(self.out_path):
+            return None
+        return state
+
+    def save_state(self):
+        state = {
+            'sstdr_path': self.sstdr_path,
+            'env_paths': self.env_paths,
+            'sstdr_offset': self.pending_offsets[0] if len(self.pending_offsets) > 0 else self.sstdr_tail.offset,
+            'env_offsets': [sensor.resume_offsets() for sensor in self.sensors],
+            'out_size': self.out_size,
+        }
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def read_sstdr(self):
+        #appends new waveforms to the pending list
+        if self.binary:
+            if os.path.exists(self.sstdr_path) and os.path.getsize(self.sstdr_path) < self.sstdr_tail.offset:
+                #the log was replaced by a shorter one (maybe while stopped): its header is read again, and its records from just past it
+                self.record_dtype = None
+                self.sstdr_tail.offset = 0
+            if self.record_dtype is None:
+                if not os.path.exists(self.sstdr_path) or os.path.getsize(self.sstdr_path) < binary_log.HEADER_SIZE:
+                    return
+                with open(self.sstdr_path, "rb") as f:
+                    self.record_dtype = binary_log.read_header(f)
+                self.sstdr_tail.offset = max(self.sstdr_tail.offset, binary_log.HEADER_SIZE)
+            data = self.sstdr_tail.read_bytes(self.record_dtype.itemsize)
+            start = self.sstdr_tail.offset - len(data)
+            records = np.frombuffer(data, dtype=self.record_dtype)
+            times = records['timestamp'].astype(float)
+            wfs = records['waveform'].astype(int)
+            offsets = start + self.record_dtype.itemsize*np.arange(len(records))
+        else:
+            #rows with the wrong number of fields (the header row, or a row cut short by a crash) are skipped
+            columns = 3 + SSTDR_WAVEFORM_LENGTH
+            lines = [(offset, line) for offset, line in self.sstdr_tail.read_lines() if line.count(b',') == columns-1]
+            rows = fault_detection.parse_csv_block(b'\n'.join([line for _, line in lines]), columns)
+            times = rows[:,2]
+            wfs = rows[:,3:].astype(int)
+            offsets = [offset for offset, _ in lines]
+        self.pending_times += times.tolist()
+        self.pending_wfs += list(wfs)
+        self.pending_offsets += [int(offset) for offset in offsets]
+        if len(times) > 0:
+            self.last_sstdr_time = float(times[-1])
+
+    def resolve(self):
+        #pairs the oldest waveforms whose environment rows are settled: every sensor has a row more than max_time_dist
+        #after them, so no row still to come could be nearer. returns the output rows
+        ready = 0
+        while ready < len(self.pending_times) and all([sensor.latest > self.pending_times[ready] + self.max_time_dist for sensor in self.sensors]):
+            ready += 1
+        ready = max(ready, len(self.pending_times) - self.max_pending) #bounded memory: stop waiting for a stalled sensor
+        if ready == 0:
+            return []
+        times = np.array(self.pending_times[:ready])
+        wfs = np.array(self.pending_wfs[:ready])
+        matches = [nearest_rows(times, np.array(sensor.times), self.max_time_dist) for sensor in self.sensors]
+        paired = np.all([m >= 0 for m in matches], axis=0)
+        rows = format_rows(times[paired], wfs[paired], [(sensor.rows, m[paired]) for sensor, m in zip(self.sensors, matches)])
+        del self.pending_times[:ready]
+        del self.pending_wfs[:ready]
+        del self.pending_offsets[:ready]
+        self.paired_count += int(np.sum(paired))
+        self.resolved_count += ready
+        return rows
+
+    def poll(self):
+        self.read_sstdr()
+        for sensor in self.sensors:
+            sensor.read()
+        rows = self.resolve()
+        #environment rows older than every waveform still to be paired can't match anything anymore
+        if len(self.pending_times) > 0:
+            cutoff = self.pending_times[0] - self.max_time_dist
+        elif self.last_sstdr_time is not None:
+            cutoff = self.last_sstdr_time - self.max_time_dist
+        else:
+            cutoff = -np.inf
+        for sensor in self.sensors:
+            sensor.trim(cutoff)
+        if len(rows) > 0:
+            data = ''.join(rows).encode()
+            with open(self.out_path, "ab") as out_f:
+                out_f.write(data)
+            self.out_size += len(data)
+        self.save_state()
+        return len(rows)
+
+######################################################
+##                      MAIN                        ##
+######################################################
 
 def main():
     valid_input = True
-    nargs = len(sys.argv)
-    if nargs < 5 or nargs > 7 or nargs % 2 == 0 : #arg 0 is file name; want 4-6 more. need odd count: options need arguments, so their contribution is even, plus file name
+    env_paths = [sys.argv[i+1] for i, arg in enumerate(sys.argv[:-1]) if arg == '-e']
+
+    #environmental data csv path(s)
+    if len(env_paths) == 0:
         valid_input = False
+
+    #sstdr csv path
+    if '-s' in sys.argv and sys.argv.index('-s')+1 < len(sys.argv):
+        sstdr_path = sys.argv[sys.argv.index('-s')+1]
     else:
-        #environmental data csv path
-        if '-e' in sys.argv:
-            env_path = sys.argv[sys.argv.index('-e')+1]
-        else:
-            valid_input = False
-        
-        #sstdr csv path        
-        if '-s' in sys.argv:
-            sstdr_path = sys.argv[sys.argv.index('-s')+1]
-        else:
-            valid_input = False
-        
-        #output csv path        
-        if '-o' in sys.argv:
-            out_path = sys.argv[sys.argv.index('-o')+1]
-        else:
-            out_path = "paired_data.csv"
-    
-    if valid_input:
-        pair_data(env_path, sstdr_path, out_path)
-        
+        valid_input = False
+
+    #output csv path
+    if '-o' in sys.argv:
+        out_path = sys.argv[sys.argv.index('-o')+1]
+    else:
+        out_path = "paired_data.csv"
+
+    #maximum time difference
+    max_time_dist = MAX_TIME_DIST
+    if '-t' in sys.argv:
+        max_time_dist = float(sys.argv[sys.argv.index('-t')+1])
+
+    #follow mode poll interval
+    poll_interval = FOLLOW_POLL_INTERVAL
+    if '-p' in sys.argv:
+        poll_interval = float(sys.argv[sys.argv.index('-p')+1])
+
+    if valid_input and '-follow' in sys.argv:
+        follow_pairs(env_paths, sstdr_path, out_path, max_time_dist, poll_interval)
+    elif valid_input:
+        pair_data(env_paths, sstdr_path, out_path, max_time_dist)
+
     else:
         print("Error: invalid input.")
         print(USAGE_STRING)
@@ -142,27 +485,11 @@ def convert_env_date_to_epoch(env_date):
     #return (env_date - 1 - 356*70 - 16) * 24 * 60 * 60
     #for some reason, the above calculations are still a day ahead, so I've subtracted an extra day, though I'm not sure why.
     #maybe the sensor thinks 1900 was a leap year? or maybe since a leap day hasn't happened yet in 2020, something's off... I think these would both make the math a day behind, though.
-    
+
     #FINALLY, the sensor has no concept of time zone. its time is set to the local time (Florida in january), but is actually supposed to be in GMT...
     #I think that's my fault, and I think it can be fixed later, but I don't want to corrupt temporally adjacent data at the moment, so I'm applying a quick hack and adding 5 hours to this time.
-    
+
     return (env_date - 25569)*86400+5*3600
 
 if __name__ == '__main__':
     main()
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
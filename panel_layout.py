@@ -0,0 +1,147 @@
+#panel_layout.py
+#compiles array layout .yaml files into sorted connector distance arrays, and maps fault distances onto strings and panels.
+#
+#each entry following '-' in a layout file is a string of panels connected in series; several entries are parallel strings.
+#a string can be described in any of three forms:
+#   implicit: header_cable_length, panel_cable_length, panel_count, and optionally panel_electrical_length and home_cable_length
+#   panel_steps: list of connector locations along the wire, each an offset in feet from the previous one
+#   panel_coords: list of connector locations along the wire, in feet from the SSTDR
+#in the two explicit forms, each location is the connector in front of a panel. if 'layout' is omitted, the last location
+#is the return point to the SSTDR (no panel is placed there) and the layout is assumed to be a loop.
+#in every form, the home cable is as long as the header cable unless home_cable_length is given; in the explicit forms,
+#the header cable is the first location minus panel_cable_length, unless header_cable_length is given.
+#
+#a layout is compiled once, when it is loaded; lookups then only bisect the compiled arrays.
+
+import bisect
+import yaml
+
+LAYOUT_LOOP = 'loop'
+LAYOUT_HOME_RUN = 'home-run'
+
+class FaultLocation:
+    """Where a fault distance falls on one string."""
+    def __init__(self, string, string_index, connector_index, ratio, cable_distance, pixel = None):
+        self.string = string #the StringLayout
+        self.string_index = string_index
+        self.connector_index = connector_index #index of the first connector after the fault; also the number of panels before it
+        self.ratio = ratio #where the fault lies between the connectors before and after it (0 to 1)
+        self.cable_distance = cable_distance #distance in feet, without the electrical length of the panels before the fault
+        self.pixel = pixel #screen location, if the UI has placed the string's connectors
+
+class StringLayout:
+    """
+    One series string of panels.
+
+    connector_ds: sorted distances in feet from the SSTDR to each MC-4
+    connector, accounting for module length, module cables & leading cables.
+    There is one more connector than there are panels.
+    """
+    def __init__(self, name, layout, connector_ds, home_cable_length, panel_electrical_length):
+        self.name = name
+        self.layout = layout
+        self.connector_ds = list(connector_ds)
+        self.panel_count = len(connector_ds)-1
+        self.home_cable_length = home_cable_length
+        self.panel_electrical_length = panel_electrical_length
+        self.total_length = self.connector_ds[-1] + home_cable_length #distance to the return point at the SSTDR
+        #distances of the points a fault can lie between: the SSTDR, every connector, and the return point
+        self.point_ds = [0] + self.connector_ds + [self.total_length]
+        self.point_pixels = None
+
+    def set_connector_pixels(self, connector_pixels):
+        #connector_pixels: screen coordinates of the SSTDR, every connector, then the return point (panel_count+3 points)
+        if len(connector_pixels) != len(self.point_ds):
+            raise ValueError("Expected "+str(len(self.point_ds))+" connector pixel coordinates, got "+str(len(connector_pixels)))
+        self.point_pixels = list(connector_pixels)
+
+    def locate(self, distance, string_index = 0):
+        #i is the index of the first connector junction AFTER the fault. if i=0, the fault is between the SSTDR and the first connector.
+        #if i is len(connector_ds), no connector is after the fault: it is between the final connector and the SSTDR.
+        i = bisect.bisect_right(self.connector_ds, distance)
+        pre_d = self.point_ds[i]
+        post_d = self.point_ds[i+1]
+        ratio = (distance - pre_d)/(post_d - pre_d) if post_d != pre_d else 0
+        pixel = None
+        if self.point_pixels is not None:
+            pre_x, pre_y = self.point_pixels[i]
+            post_x, post_y = self.point_pixels[i+1]
+            pixel = (pre_x + ratio*(post_x-pre_x), pre_y + ratio*(post_y-pre_y))
+        #subtract from distance to account for panel length; only want to report cable length
+        cable_distance = distance - self.panel_electrical_length*i
+        return FaultLocation(self, string_index, i, ratio, cable_distance, pixel)
+
+class ArrayLayout:
+    """All strings of an array, compiled from a layout file."""
+    def __init__(self, strings):
+        self.strings = strings
+
+    def locate(self, distance):
+        #returns a FaultLocation for every string long enough to hold the fault. parallel strings are indistinguishable to
+        #the SSTDR, so a fault may be on any of them. a fault beyond every string is placed on the longest string.
+        locations = [s.locate(distance, i) for i, s in enumerate(self.strings) if distance <= s.total_length]
+        if len(locations) == 0:
+            i = max(range(len(self.strings)), key=lambda i: self.strings[i].total_length)
+            locations = [self.strings[i].locate(distance, i)]
+        return locations
+
+def describe_fault(fault_name, locations, name_strings = False):
+    #one line description of a located fault, shared by the UI and the debug log
+    #e.g. "Open fault located at 120.5 feet" or, with name_strings, "Open fault located at 120.5 feet on string_0, string_1"
+    description = fault_name + " located at " + str(round(locations[0].cable_distance,3)) + " feet"
+    if name_strings:
+        description = description + " on " + ", ".join([location.string.name for location in locations])
+    return description
+
+def compile_string(entry, index = 0):
+    #compiles one yaml string entry into a StringLayout
+    name = entry.get('name', 'string_'+str(index))
+    layout = entry.get('layout')
+    panel_cable_length = entry.get('panel_cable_length', 0)
+    panel_electrical_length = entry.get('panel_electrical_length', 0)
+    return_d = None
+    if 'panel_count' in entry:
+        N = entry['panel_count']
+        step = 2*panel_cable_length + panel_electrical_length
+        first = entry['header_cable_length'] + panel_cable_length
+        connector_ds = [first + i*step for i in range(N+1)]
+    elif 'panel_steps' in entry or 'panel_coords' in entry:
+        if 'panel_steps' in entry:
+            ds = []
+            for step in entry['panel_steps']:
+                ds.append(step + (ds[-1] if ds else 0))
+        else:
+            ds = list(entry['panel_coords'])
+        if layout is None:
+            return_d = ds.pop() #last entry is the return point to the SSTDR
+        if len(ds) >= 2:
+            last_step = ds[-1] - ds[-2]
+        else:
+            last_step = 2*panel_cable_length + panel_electrical_length
+        connector_ds = ds + [ds[-1] + last_step] #connector after the final panel
+    else:
+        raise ValueError("Layout entry '"+str(name)+"' needs panel_count, panel_steps or panel_coords.")
+    #the home cable matches the header cable unless given; in the explicit forms, the header cable runs up to the panel
+    #cable in front of the first panel
+    header_cable_length = entry.get('header_cable_length', connector_ds[0] - panel_cable_length)
+    if return_d is not None:
+        home_cable_length = max(0, return_d - connector_ds[-1])
+    else:
+        home_cable_length = entry.get('home_cable_length', header_cable_length)
+    if layout is None:
+        layout = LAYOUT_LOOP
+    if layout not in [LAYOUT_LOOP, LAYOUT_HOME_RUN]:
+        raise ValueError("Error: unknown layout field in layout yaml file.")
+    if any(b < a for a, b in zip(connector_ds, connector_ds[1:])):
+        raise ValueError("Layout entry '"+str(name)+"' has connectors out of order.")
+    return StringLayout(name, layout, connector_ds, home_cable_length, panel_electrical_length)
+
+def compile_layout(data):
+    #data: list of string entries, as loaded from a layout yaml file
+    if isinstance(data, dict):
+        data = [data]
+    return ArrayLayout([compile_string(entry, i) for i, entry in enumerate(data)])
+
+def load_layout(yfile_path):
+    with open(yfile_path, "r") as f:
+        return compile_layout(yaml.safe_load(f))
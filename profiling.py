@@ -0,0 +1,158 @@
+#profiling.py
+#lightweight per-stage timing for the SSTDR_USB main loop, and on-demand cProfile captures.
+#a field engineer can record a profile with the 'p' key (or the -profile argument) and send us the dumped files.
+
+import os
+import time
+import cProfile
+import pstats
+import datetime as dt
+from collections import deque
+import numpy as np
+
+DEFAULT_WINDOW = 500 #number of recent timings kept per stage
+DEFAULT_PERCENTILES = (50, 95, 99)
+DEFAULT_PROFILE_SECONDS = 30
+PROFILE_REPORT_LINES = 40
+
+class StageTimer:
+    """
+    Keeps the most recent durations of each named stage of a loop, and
+    reports rolling percentiles.
+
+    Usage:
+    call start() at the top of the loop, then lap("stage name") after each
+    stage; a lap records the time since the previous lap (or start). Stages
+    that run elsewhere (e.g. in another thread) can call record() directly.
+    Recording is cheap (a perf_counter call and a deque append); percentiles
+    are only calculated when a report is requested.
+    """
+    def __init__(self, window = DEFAULT_WINDOW, enabled = True):
+        self.window = window
+        self.enabled = enabled
+        self.samples = {} #stage name -> deque of durations in seconds
+        self.order = [] #stage names, in the order they were first recorded
+        self.last_time = time.perf_counter()
+
+    def start(self):
+        self.last_time = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        if self.enabled:
+            self.record(stage, now - self.last_time)
+        self.last_time = now
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        if stage not in self.samples:
+            self.samples[stage] = deque(maxlen=self.window)
+            self.order.append(stage)
+        self.samples[stage].append(seconds)
+
+    def percentiles(self, stage, percentiles = DEFAULT_PERCENTILES):
+        #returns percentiles of recent durations of the stage, in seconds (or None if never recorded)
+        if stage not in self.samples or len(self.samples[stage]) == 0:
+            return None
+        return np.percentile(np.array(list(self.samples[stage])), percentiles) #copied first; another thread may be recording
+
+    def report(self, percentiles = (50, 95), separator = "  "):
+        #one-line summary, in milliseconds: "stage p50/p95" for every stage
+        entries = []
+        for stage in list(self.order):
+            p = self.percentiles(stage, percentiles)
+            if p is not None:
+                entries.append(stage + " " + "/".join("%.1f" % (v*1000) for v in p))
+        return separator.join(entries)
+
+    def clear(self):
+        for stage in self.samples:
+            self.samples[stage].clear()
+
+class StartupTimer:
+    """
+    Times each step of program startup once, against an overall budget.
+
+    Usage:
+    timer = StartupTimer(start) with the perf_counter() time the program
+    started (so module imports are counted), then lap("step name") after
+    each startup step. report() gives a one-line summary in milliseconds,
+    noting if the total went over the budget (in seconds).
+    """
+    def __init__(self, start = None, budget = None):
+        self.start = time.perf_counter() if start is None else start
+        self.budget = budget
+        self.last_time = self.start
+        self.steps = [] #(step name, seconds)
+
+    def lap(self, step):
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last_time))
+        self.last_time = now
+
+    def total(self):
+        return self.last_time - self.start
+
+    def over_budget(self):
+        return self.budget is not None and self.total() > self.budget
+
+    def report(self, separator = "  "):
+        entries = [step + " %.0f" % (seconds*1000) for (step, seconds) in self.steps]
+        total = "total %.0f ms" % (self.total()*1000)
+        if self.budget is not None:
+            total += " (budget %.0f ms%s)" % (self.budget*1000, ", OVER BUDGET" if self.over_budget() else "")
+        return separator.join(entries + [total])
+
+class ProfileCapture:
+    """
+    Records a cProfile of the calling thread for a fixed window of time, then
+    dumps it to disk: a .prof file (for pstats/snakeviz) and a .txt summary
+    sorted by cumulative time.
+
+    Usage:
+    call start() to begin a capture, and poll() once per loop iteration.
+    poll() returns the path of the dumped .prof file when the window ends,
+    and None otherwise. Only the thread that called start() is profiled.
+    """
+    def __init__(self, out_dir = ".", seconds = DEFAULT_PROFILE_SECONDS, prefix = "sstdr_profile"):
+        self.out_dir = out_dir
+        self.seconds = seconds
+        self.prefix = prefix
+        self.profiler = None
+        self.end_time = 0
+
+    def active(self):
+        return self.profiler is not None
+
+    def start(self, seconds = None):
+        if self.active():
+            return
+        if seconds is not None:
+            self.seconds = seconds
+        self.profiler = cProfile.Profile()
+        self.end_time = time.monotonic() + self.seconds
+        self.profiler.enable()
+
+    def time_left(self):
+        return max(0, self.end_time - time.monotonic()) if self.active() else 0
+
+    def poll(self):
+        if self.active() and time.monotonic() >= self.end_time:
+            return self.stop()
+        return None
+
+    def stop(self):
+        #stops the capture early (or on time), dumps it, and returns the path of the .prof file
+        if not self.active():
+            return None
+        self.profiler.disable()
+        os.makedirs(self.out_dir, exist_ok = True)
+        name = self.prefix + "_" + dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+        prof_path = os.path.join(self.out_dir, name + ".prof")
+        self.profiler.dump_stats(prof_path)
+        with open(os.path.join(self.out_dir, name + ".txt"), "w") as f:
+            stats = pstats.Stats(self.profiler, stream = f)
+            stats.sort_stats("cumulative").print_stats(PROFILE_REPORT_LINES)
+        self.profiler = None
+        return prof_path
@@ -1,87 +1,274 @@
 #read_waveforms.py
+#batch analysis of logged waveforms (e.g. from the NREL tests): low pass filtering, spline interpolation and baseline
+#subtraction of a whole log at once, as matrices with one waveform per row, instead of row by row.
+#
+#the filter is one rfft/irfft pass over the matrix (axis=1); the spline is a single matrix product, as interpolating
+#a fixed grid onto a fixed grid is linear in the samples (the operator is the same cubic spline as
+#fault_detection.spline_interpolate). baseline subtraction can use any row as the baseline.
+#the loaded, filtered and interpolated matrices are cached next to the log ("[log path].cache/"), keyed by the log's
+#size & modification time and the parameters of each step, so analysing the same dataset again is near-instant.
+#
+#usage as a library:
+#   analysis = WaveformAnalysis("NREL_sequence_canadian_2.csv")
+#   bls = analysis.bls(baseline_log = 4) #(logs, SPLINE_LENGTH) baseline subtractions, against log 4's waveform
+#   analysis.plot_bls(4, logs = range(2, 14), cable_length = 74.583)
+#
+#command line arguments, can be provided in any order:
+#   [log path]       : csv or binary log to analyse (REQUIRED)
+#   -baseline [n]    : log number of the baseline waveform (OPTIONAL, defaults to the first log)
+#   -logs [a-b,c]    : log numbers to plot (OPTIONAL, defaults to every log but the baseline)
+#   -per-log [mode]  : 'first' (first waveform of each log), 'mean', or 'all' (every row) (OPTIONAL, defaults to first)
+#   -fps [feet]      : feet per sample (OPTIONAL, defaults to NREL_FEET_PER_SAMPLE)
+#   -zero [index]    : sample index of the cable start (OPTIONAL, defaults to NREL_ZERO_INDEX)
+#   -cutoff [bin]    : low pass filter cutoff, in rfft bins (OPTIONAL, defaults to ANALYSIS_CUTOFF)
+#   -cable [feet]    : draw the cable end at this distance (OPTIONAL)
+#   -groups          : plot every waveform of every log, one figure per log, instead of the BLS
+#   -no-cache        : don't read or write the cache
+#
+#example: python read_waveforms.py NREL_sequence_canadian_2.csv -baseline 4 -logs 2-13 -cable 74.583
 
-#reads waveforms from NREL tests. returns grouped waveform lists.
+import sys
+import os
+import hashlib
+import numpy as np
+import scipy.interpolate
 
 import fault_detection as fd
-import matplotlib.pyplot as plt
-import numpy as np
+import binary_log
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" [log path] -baseline [n] -logs [a-b,c] -per-log [first|mean|all] -fps [feet] -zero [index] -cutoff [bin] -cable [feet] -groups -no-cache"
+NREL_FEET_PER_SAMPLE = 3.8479 #calculated manually from the second NREL test (fault_detection's is for the florida cable)
+NREL_ZERO_INDEX = 9 #in the second NREL test the cable end reflection is higher than the first reflection, so argmax won't do
+ANALYSIS_CUTOFF = fd.FFT_SIZE//4//4 #rfft bins kept by the low pass filter; sample rate 24MHz*4, center freq is 12MHz
+CACHE_EXTENSION = ".cache"
+
+#fake enum of ways to reduce each log to rows of the matrix
+PER_LOG_FIRST = 'first' #the first waveform of each log
+PER_LOG_MEAN = 'mean' #the average of each log's waveforms
+PER_LOG_ALL = 'all' #every row of the log, in file order
+
+_spline_operators = {} #(waveform length, spline length) -> spline operator
+
+def spline_operator(length = fd.WAVEFORM_LENGTH, spline_length = fd.SPLINE_LENGTH):
+    #(spline_length, length) matrix taking waveforms to their cubic (not-a-knot) spline, sampled like spline_interpolate
+    key = (length, spline_length)
+    if key not in _spline_operators:
+        x = np.arange(length)
+        x_i = np.linspace(0, length-1, spline_length)
+        _spline_operators[key] = scipy.interpolate.make_interp_spline(x, np.eye(length), k=3, axis=0)(x_i)
+    return _spline_operators[key]
+
+def spline_batch(wfs, spline_length = fd.SPLINE_LENGTH):
+    #spline_interpolate() of every row of a (N, samples) matrix, as one matrix product
+    wfs = np.asarray(wfs, dtype=float)
+    return wfs @ spline_operator(wfs.shape[1], spline_length).T
+
+def low_pass_filter_batch(wfs, cutoff = ANALYSIS_CUTOFF, fft_size = fd.FFT_SIZE):
+    #ideal low pass filter of every row: one rfft of the matrix, bins from cutoff up zeroed, one irfft
+    wfs = np.asarray(wfs, dtype=float)
+    spectrum = np.fft.rfft(wfs, fft_size, axis=1)
+    spectrum[:, cutoff:] = 0
+    return np.fft.irfft(spectrum, fft_size, axis=1)[:, :wfs.shape[1]]
+
+def baseline_subtract(wfs, baseline_index):
+    #BLS of every row against one row of the same matrix
+    return wfs - wfs[baseline_index]
+
+def feet_vector(zero_index = NREL_ZERO_INDEX, feet_per_sample = NREL_FEET_PER_SAMPLE, length = fd.WAVEFORM_LENGTH, spline_length = None):
+    #distance of each sample (or spline sample, if spline_length is given) from the cable start
+    if spline_length is None:
+        return (np.arange(length) - zero_index)*feet_per_sample
+    return (np.arange(spline_length) - zero_index/length*spline_length)*feet_per_sample*length/spline_length
+
+def load_log(path):
+    #every row of a csv or binary log, as one (N, 3+samples) float array: session_number, log_number, timestamp, samples
+    if binary_log.is_binary_path(path):
+        return binary_log.read_ungrouped(path).astype(float)
+    return fd.load_csv(path)
+
+def reduce_logs(rows, per_log = PER_LOG_FIRST):
+    #returns (log number of each row, (N, samples) waveform matrix)
+    if per_log == PER_LOG_ALL:
+        return (rows[:,1].astype(int), rows[:,fd.LOG_COLUMNS:])
+    log_numbers, order, bounds = fd.group_logs(rows)
+    if per_log == PER_LOG_MEAN:
+        sums = np.add.reduceat(rows[order,fd.LOG_COLUMNS:], bounds[:-1], axis=0)
+        return (log_numbers, sums/np.diff(bounds)[:,None])
+    return (log_numbers, rows[order[bounds[:-1]],fd.LOG_COLUMNS:])
+
+def cache_key(path, step, params):
+    #changes if the log is rewritten or appended to, or if any parameter of the step (or the steps before it) changes
+    stat = os.stat(path)
+    text = repr((os.path.abspath(path), stat.st_size, stat.st_mtime_ns, step, params))
+    return step + "-" + hashlib.sha1(text.encode()).hexdigest()[:16]
+
+def clear_cache(path):
+    cache_dir = path + CACHE_EXTENSION
+    if os.path.isdir(cache_dir):
+        for name in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, name))
+        os.rmdir(cache_dir)
+
+class WaveformAnalysis:
+    """
+    The waveforms of one log, reduced to one row per log (or every row),
+    low pass filtered and spline interpolated as matrices.
 
-cable_length = 74.583 #in feet
-panel_count = 26
-fft_size = 1024
-CUTOFF = fft_size//4//4 #sample rate 24Mhz*4, center freq is 12MHz
-
-#FEET_PER_SAMPLE = 3.6679 #194' cable in warm old florida
-FEET_PER_SAMPLE = 3.8479 #calculated manually from second NREL test
-FEET_PER_SPLINE_SAMPLE = FEET_PER_SAMPLE*92/1000
-
-#read waveforms from one of the files. group waveforms based on log number.
-#wfs_all = fd.read_wfs("NREL_sequence_LG_1.csv")
-wfs_all = fd.read_wfs("NREL_sequence_canadian_2.csv")
-bl_index = 4
-
-N = len(wfs_all)
-wfs_0 = np.zeros((N,92))
-for group in wfs_all:
-    wfs_0[group] = wfs_all[group][0]
-
-#calibrate distances based on cable length
-#zero_index = np.argmax(wfs_0[0]) #commented out b/c in second NREL test the cable end reflection is actually higher amplitude than first reflection
-zero_index = 9
-feet_vector = (np.arange(0,92)-zero_index)*FEET_PER_SAMPLE
-spline_feet_vector = (np.arange(0,1000)-zero_index/92*1000)*FEET_PER_SPLINE_SAMPLE
-
-wfs_process = wfs_0
-
-
-#low pass filter
-filter = np.zeros(fft_size//2+1,dtype=np.cdouble)
-filter[0:CUTOFF] = 1   #looks like: ----____________
-#filter = filter + np.flip(filter) #force symmetry: ----________---- #this is now done by using rfft
-
-wfs_rfft = np.zeros((N,fft_size//2+1),dtype=np.cdouble)
-wfs_filtered = np.zeros_like(wfs_process)
-for i,wf in enumerate(wfs_process):
-    wfs_rfft[i] = np.fft.rfft(wf, fft_size)
-    #wfs_fft[i] = wfs_fft[i] + np.conj(np.flip(wfs_fft[i])) #force conjugate symmetry for real reconstructed signal.... this shouldn't be necessary; our fully calculated fft should be conjugate symmetric anyways.
-    wfs_filtered[i] = np.fft.irfft(filter*wfs_rfft[i], fft_size)[0:len(wf)]
-wfs_process = wfs_filtered
-
-#spline interpolation
-wfs_i = np.zeros((N, 1000))
-for i,wf in enumerate(wfs_process):
-    wfs_i[i] = fd.spline_interpolate(wf)
-wfs_process = wfs_i
-
-
-#did just cables, negative lead, positive lead, full string, then disconnect sequence around the loop.
-bl = np.array(wfs_process[bl_index])
-bls = np.zeros((N, 1000))
-
-#plot baseline subtractions
-for r,row in enumerate(wfs_process):
-    if r > 1 and r <= 13:#panel_count/2+3:
-        bls[r] = np.array(row - bl)
-        plt.plot(spline_feet_vector, bls[r], label=str(r))
-#plt.plot([cable_length, cable_length],[-15000,15000],label='cable_end')
-plt.plot([cable_length, cable_length],[-1000,1000],label='cable_end')
-plt.legend()
-plt.show()
-
-def plot_bls():
-    #plot baseline subtractions
-    for r,row in enumerate(wfs_process):
-        if r > 1 and r <= 13:#panel_count/2+3:
-            bls[r] = np.array(row - bl)
-            plt.plot(spline_feet_vector, bls[r], label=str(r))
-    plt.plot([cable_length, cable_length],[-1000,1000],label='cable_end')
-    plt.legend()
-    plt.show()
-
-
-def plot_groups():
-    for group in wfs_all:
-        for wf in wfs_all[group]:
-            plt.plot(wf)
+    Usage:
+    analysis = WaveformAnalysis(path, ...); the matrices are computed (or
+    loaded from the cache) when first used: analysis.raw, .filtered and
+    .splined are (N, samples) arrays whose rows belong to the log numbers
+    in analysis.log_numbers. bls(baseline_log) subtracts one log's row from
+    every row, after filtering & interpolating unless processed=False.
+    row(log_number) gives the row index of a log. plot_bls() and
+    plot_groups() draw with matplotlib. cache=False skips the cache.
+    """
+    def __init__(self, path, per_log = PER_LOG_FIRST, feet_per_sample = NREL_FEET_PER_SAMPLE, zero_index = NREL_ZERO_INDEX,
+                 cutoff = ANALYSIS_CUTOFF, fft_size = fd.FFT_SIZE, spline_length = fd.SPLINE_LENGTH, cache = True):
+        self.path = path
+        self.per_log = per_log
+        self.feet_per_sample = feet_per_sample
+        self.zero_index = zero_index
+        self.cutoff = cutoff
+        self.fft_size = fft_size
+        self.spline_length = spline_length
+        self.cache = cache
+        self.cache_dir = path + CACHE_EXTENSION
+        self._matrices = {}
+
+    def cached(self, step, params, compute):
+        #a step's matrix: from memory, from the cache, or computed (and then cached)
+        if step in self._matrices:
+            return self._matrices[step]
+        cache_path = None
+        if self.cache:
+            cache_path = os.path.join(self.cache_dir, cache_key(self.path, step, params) + ".npy")
+            if os.path.exists(cache_path):
+                self._matrices[step] = np.load(cache_path)
+                return self._matrices[step]
+        matrix = compute()
+        if cache_path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = cache_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                np.save(f, matrix)
+            os.replace(temp_path, cache_path) #another analysis of the same log never sees a partial file
+        self._matrices[step] = matrix
+        return matrix
+
+    def load(self):
+        #log numbers and raw waveforms are cached together; column 0 holds the log numbers
+        def compute():
+            log_numbers, wfs = reduce_logs(load_log(self.path), self.per_log)
+            return np.column_stack((log_numbers, wfs))
+        return self.cached("raw", (self.per_log,), compute)
+
+    @property
+    def log_numbers(self):
+        return self.load()[:,0].astype(int)
+
+    @property
+    def raw(self):
+        return self.load()[:,1:]
+
+    @property
+    def filtered(self):
+        return self.cached("filtered", (self.per_log, self.cutoff, self.fft_size), lambda: low_pass_filter_batch(self.raw, self.cutoff, self.fft_size))
+
+    @property
+    def splined(self):
+        return self.cached("splined", (self.per_log, self.cutoff, self.fft_size, self.spline_length), lambda: spline_batch(self.filtered, self.spline_length))
+
+    def row(self, log_number):
+        #row index of the (first) row of a log number
+        rows = np.flatnonzero(self.log_numbers == log_number)
+        if len(rows) == 0:
+            raise KeyError("no log number " + str(log_number) + " in '" + self.path + "'")
+        return rows[0]
+
+    def bls(self, baseline_log = None, processed = True):
+        #baseline subtraction of every row, against the row of baseline_log (the first row if None)
+        wfs = self.splined if processed else self.raw
+        return baseline_subtract(wfs, 0 if baseline_log is None else self.row(baseline_log))
+
+    def feet(self, processed = True):
+        return feet_vector(self.zero_index, self.feet_per_sample, self.raw.shape[1], self.spline_length if processed else None)
+
+    def plot_bls(self, baseline_log = None, logs = None, cable_length = None):
+        import matplotlib.pyplot as plt
+        bls = self.bls(baseline_log)
+        feet = self.feet()
+        baseline_row = 0 if baseline_log is None else self.row(baseline_log)
+        for r, log_number in enumerate(self.log_numbers):
+            if (logs is None and r != baseline_row) or (logs is not None and log_number in logs):
+                plt.plot(feet, bls[r], label=str(log_number))
+        if cable_length is not None:
+            limit = np.abs(bls).max()
+            plt.plot([cable_length, cable_length], [-limit, limit], label='cable_end')
+        plt.xlabel("Distance (feet)")
+        plt.legend()
         plt.show()
-    
+
+    def plot_groups(self):
+        #every waveform of every log, one figure per log
+        import matplotlib.pyplot as plt
+        rows = load_log(self.path)
+        log_numbers, wfs = reduce_logs(rows, PER_LOG_ALL)
+        for log_number in np.unique(log_numbers):
+            for wf in wfs[log_numbers == log_number]:
+                plt.plot(wf)
+            plt.title("Log " + str(log_number))
+            plt.show()
+
+def parse_log_numbers(text):
+    #"2-13,15" -> [2, 3, ..., 13, 15]
+    numbers = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        numbers.extend(range(int(first), int(last if last else first) + 1))
+    return numbers
+
+def main():
+    path = None
+    baseline_log = None
+    logs = None
+    cable_length = None
+    groups = False
+    kwargs = {}
+    try:
+        args = sys.argv
+        path = args[1]
+        if path.startswith('-') or not os.path.exists(path):
+            raise ValueError("no log given")
+        if '-baseline' in args:
+            baseline_log = int(args[args.index('-baseline')+1])
+        if '-logs' in args:
+            logs = parse_log_numbers(args[args.index('-logs')+1])
+        if '-per-log' in args:
+            kwargs['per_log'] = args[args.index('-per-log')+1].lower()
+            if kwargs['per_log'] not in [PER_LOG_FIRST, PER_LOG_MEAN, PER_LOG_ALL]:
+                raise ValueError("unknown -per-log mode")
+        if '-fps' in args:
+            kwargs['feet_per_sample'] = float(args[args.index('-fps')+1])
+        if '-zero' in args:
+            kwargs['zero_index'] = float(args[args.index('-zero')+1])
+        if '-cutoff' in args:
+            kwargs['cutoff'] = int(args[args.index('-cutoff')+1])
+        if '-cable' in args:
+            cable_length = float(args[args.index('-cable')+1])
+        groups = '-groups' in args
+        kwargs['cache'] = '-no-cache' not in args
+    except:
+        print("Error: invalid input.")
+        print(USAGE_STRING)
+        return
+
+    analysis = WaveformAnalysis(path, **kwargs)
+    if groups:
+        analysis.plot_groups()
+    else:
+        analysis.plot_bls(baseline_log, logs, cable_length)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#scheduler.py
+#decides when SSTDR_USB takes its scheduled measurements. SSTDR_USB keeps monitoring for faults between them, unless
+#run with -idle: then the pipeline sits idle (the receiver discarding packets unread, the main loop asleep) between
+#measurements, instead of processing every waveform just to check the clock.
+#a probe can have several schedules at once; each is one of:
+#   interval : one waveform every period, aligned to local wall clock boundaries (15m -> :00, :15, :30, :45), so the
+#              measurement times never drift by the time it takes to process a waveform
+#   burst    : several consecutive waveforms every period (aligned the same way), like the 'Measure' button's window
+#   daylight : any of the above, but only between sunrise and sunset at the given location
+#
+#schedules are given as strings, e.g. "interval:15m", "interval:1h@5m" (5 minutes past every hour), "burst:1h:10",
+#"daylight:interval:5m". durations are seconds, or a number followed by s, m, h or d.
+#
+#run by itself, prints the upcoming measurement times of the given schedules.
+#command line arguments, can be provided in any order:
+#   -schedule [spec]     : a schedule; can be given more than once (REQUIRED)
+#   -location [lat,lon]  : degrees, north & east positive (REQUIRED for daylight schedules)
+#   -n [count]           : how many measurements to print (OPTIONAL, defaults to 10)
+#
+#example: python scheduler.py -schedule daylight:burst:1h:10 -schedule interval:15m -location 40.76,-111.89
+
+import sys
+import time
+import math
+import datetime as dt
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" -schedule [spec] -location [lat,lon] -n [count]"
+WINDOW_MEASUREMENT_COUNT = 10 #waveforms in a window measurement (the 'Measure' button), and the default burst length
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+SECONDS_PER_DAY = 86400
+SUN_ALTITUDE = -0.833 #degrees; the sun's center at sunrise & sunset, allowing for refraction and the sun's radius
+
+def parse_duration(text):
+    #seconds, from "900", "15m", "1.5h", ...
+    text = text.strip().lower()
+    if text[-1:] in DURATION_UNITS:
+        return float(text[:-1])*DURATION_UNITS[text[-1]]
+    return float(text)
+
+def parse_location(text):
+    latitude, longitude = [float(x) for x in text.split(',')]
+    return (latitude, longitude)
+
+def utc_offset(t):
+    #seconds east of UTC for local time at epoch time t (follows daylight saving time)
+    return time.localtime(t).tm_gmtoff
+
+def sun_times(day, latitude, longitude):
+    #(sunrise, sunset) as epoch times, for the solar day around noon of the given UTC day (days since the epoch).
+    #uses the sunrise equation (accurate to about a minute). returns (None, None) if the sun doesn't rise that day,
+    #and the whole day if it doesn't set
+    n = day + 2440587.5 - 2451545.0 + 0.0008 #days since J2000, at the start of the UTC day
+    n = math.ceil(n)
+    mean_noon = n - longitude/360
+    anomaly = (357.5291 + 0.98560028*mean_noon) % 360
+    m = math.radians(anomaly)
+    center = 1.9148*math.sin(m) + 0.02*math.sin(2*m) + 0.0003*math.sin(3*m)
+    ecliptic_longitude = math.radians((anomaly + center + 180 + 102.9372) % 360)
+    transit = 2451545.0 + mean_noon + 0.0053*math.sin(m) - 0.0069*math.sin(2*ecliptic_longitude)
+    declination = math.asin(math.sin(ecliptic_longitude)*math.sin(math.radians(23.4397)))
+    phi = math.radians(latitude)
+    cos_hour_angle = (math.sin(math.radians(SUN_ALTITUDE)) - math.sin(phi)*math.sin(declination))/(math.cos(phi)*math.cos(declination))
+    transit_time = (transit - 2440587.5)*SECONDS_PER_DAY
+    if cos_hour_angle > 1:
+        return (None, None) #polar night
+    if cos_hour_angle < -1:
+        return (transit_time - SECONDS_PER_DAY/2, transit_time + SECONDS_PER_DAY/2) #midnight sun
+    half_day = math.degrees(math.acos(cos_hour_angle))/360*SECONDS_PER_DAY
+    return (transit_time - half_day, transit_time + half_day)
+
+class IntervalSchedule:
+    """
+    A measurement of `count` waveforms every `period` seconds, at fixed
+    wall clock times: multiples of the period since local midnight (or
+    since the epoch, for periods longer than a day), plus `offset`.
+
+    Usage:
+    next_time(after) gives the first measurement time (epoch seconds)
+    strictly after `after`. A burst is an IntervalSchedule with count > 1.
+    """
+    def __init__(self, period, count = 1, offset = 0):
+        if period <= 0:
+            raise ValueError("schedule period must be positive")
+        self.period = period
+        self.count = count
+        self.offset = offset % period
+
+    def next_time(self, after):
+        local_offset = utc_offset(after) if self.period <= SECONDS_PER_DAY else 0
+        local = after + local_offset - self.offset
+        return (math.floor(local/self.period) + 1)*self.period - local_offset + self.offset
+
+    def describe(self):
+        return ("interval" if self.count == 1 else "burst of "+str(self.count)) + " every " + str(self.period) + " s" + ("" if self.offset == 0 else " + " + str(self.offset) + " s")
+
+class DaylightSchedule:
+    """
+    Another schedule's measurements, but only those between sunrise and
+    sunset at the given latitude & longitude (degrees, north & east
+    positive).
+
+    Usage:
+    DaylightSchedule(IntervalSchedule(900), 40.76, -111.89); next_time()
+    and count work like the wrapped schedule's.
+    """
+    def __init__(self, schedule, latitude, longitude):
+        self.schedule = schedule
+        self.count = schedule.count
+        self.latitude = latitude
+        self.longitude = longitude
+
+    def windows(self, t):
+        #daylight windows that could contain or follow time t, in order
+        day = math.floor(t/SECONDS_PER_DAY)
+        for d in range(day - 1, day + 3):
+            rise, set_ = sun_times(d, self.latitude, self.longitude)
+            if rise is not None:
+                yield (rise, set_)
+
+    def next_time(self, after):
+        t = self.schedule.next_time(after)
+        for _ in range(370): #a year of days; there are no daylight measurements in a polar night
+            for rise, set_ in self.windows(t):
+                if set_ < t:
+                    continue
+                if rise <= t:
+                    return t
+                t = self.schedule.next_time(rise - 1e-6) #first measurement of the next window; it may fall after sunset
+                break
+            else:
+                t = t + SECONDS_PER_DAY
+        return None
+
+    def describe(self):
+        return self.schedule.describe() + ", sunrise to sunset at " + str(self.latitude) + "," + str(self.longitude)
+
+def parse_schedule(spec, location = None):
+    #a schedule from its string form (see the top of this file); location is (latitude, longitude), for daylight schedules
+    kind, _, rest = spec.strip().lower().partition(':')
+    if kind == 'daylight':
+        if location is None:
+            raise ValueError("daylight schedule '"+spec+"' needs a location")
+        return DaylightSchedule(parse_schedule(rest, location), location[0], location[1])
+    if kind in ['interval', 'burst']:
+        fields = rest.split(':')
+        period, _, offset = fields[0].partition('@')
+        count = 1 if kind == 'interval' else WINDOW_MEASUREMENT_COUNT
+        if len(fields) > 1:
+            count = int(fields[1])
+        return IntervalSchedule(parse_duration(period), count, parse_duration(offset) if offset else 0)
+    raise ValueError("unknown schedule '"+spec+"'")
+
+class Scheduler:
+    """
+    Tracks when each of several schedules is next due.
+
+    Usage:
+    scheduler = Scheduler([parse_schedule("interval:15m"), ...]); then in
+    the main loop, poll(time.time()) returns how many waveforms to log now
+    (0 if nothing is due), and time_until(now) how long the loop can sleep
+    before the next measurement. Measurements missed while the loop was
+    busy are not caught up; each schedule just moves on to its next time.
+    """
+    def __init__(self, schedules, now = None):
+        if now is None:
+            now = time.time()
+        self.schedules = schedules
+        self.next_times = [schedule.next_time(now) for schedule in schedules]
+        self.taken = 0 #measurements started
+
+    def next_time(self):
+        #epoch time of the next measurement, or None if no schedule has any
+        times = [t for t in self.next_times if t is not None]
+        return min(times) if len(times) > 0 else None
+
+    def time_until(self, now):
+        t = self.next_time()
+        return math.inf if t is None else max(0.0, t - now)
+
+    def poll(self, now):
+        count = 0
+        for i, schedule in enumerate(self.schedules):
+            if self.next_times[i] is not None and self.next_times[i] <= now:
+                count += schedule.count
+                self.taken += 1
+                self.next_times[i] = schedule.next_time(now)
+        return count
+
+    def report(self):
+        t = self.next_time()
+        return "next measurement " + ("never" if t is None else dt.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")) + ", " + str(self.taken) + " taken"
+
+def main():
+    specs = []
+    location = None
+    count = 10
+    try:
+        args = sys.argv
+        for i, arg in enumerate(args):
+            if arg == '-schedule':
+                specs.append(args[i+1])
+        if '-location' in args:
+            location = parse_location(args[args.index('-location')+1])
+        if '-n' in args:
+            count = int(args[args.index('-n')+1])
+        schedules = [parse_schedule(spec, location) for spec in specs]
+        if len(schedules) == 0:
+            raise ValueError("no schedule given")
+    except:
+        print("Error: invalid input.")
+        print(USAGE_STRING)
+        return
+
+    for schedule in schedules:
+        print(schedule.describe())
+    scheduler = Scheduler(schedules)
+    for _ in range(count):
+        t = scheduler.next_time()
+        if t is None:
+            print("no more measurements")
+            break
+        n = scheduler.poll(t)
+        print(dt.datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S") + ": " + str(n) + " waveform" + ("" if n == 1 else "s"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+#sstdr_simulator.py
+#generates synthetic USBPcap captures of an SSTDR probe, for load testing without a physical probe.
+#the output matches what SSTDR_USB.py expects from USBPcapCMD: bulk-in transfers (function 0x09) from the device's
+#waveform endpoint, carrying waveform regions that start with the device's prefix. commercial devices send 512 byte transfers.
+#with -format usbmon, the same transfers are written as a linux usbmon capture (as tcpdump records from usbmonX) instead.
+#
+#command line arguments, can be provided in any order:
+#   -o [path]       : output file path, or '-' for stdout (OPTIONAL, defaults to "simulated.pcap")
+#   -device [name]  : 'commercial' or 'prototype' (OPTIONAL, defaults to commercial)
+#   -n [count]      : number of waveforms to generate; 0 generates forever (OPTIONAL, defaults to 1000)
+#   -rate [hz]      : waveforms per second (OPTIONAL, defaults to 10)
+#   -jitter [s]     : standard deviation of the waveform timing jitter, in seconds (OPTIONAL, defaults to 0)
+#   -junk [p]       : probability of inserting an unrelated packet before each transfer (OPTIONAL, defaults to 0)
+#   -corrupt [p]    : probability of corrupting each waveform frame (OPTIONAL, defaults to 0)
+#   -fault [spec]   : fault(s) to inject, as type:feet pairs separated by commas, e.g. "open:120,short:250" (OPTIONAL)
+#   -fault-every [n]: only inject the faults into every n-th waveform; others are healthy (OPTIONAL, defaults to 1)
+#   -truth [path]   : write a csv recording the true fault of every generated waveform (OPTIONAL)
+#   -seed [n]       : random seed (OPTIONAL)
+#   -realtime       : pace output at the requested rate instead of writing as fast as possible
+#   -format [name]  : 'usbpcap', 'usbmon' (64 byte headers) or 'usbmon48' (48 byte headers) (OPTIONAL, defaults to usbpcap)
+#
+#example, on linux: python sstdr_simulator.py -o - -rate 200 -fault open:120 -junk 0.1 | python SSTDR_USB.py -pcap -
+
+import sys
+import time
+import numpy as np
+
+import fault_detection
+import waveform_framer
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" -o [out path or '-'] -device [commercial|prototype] -n [count] -rate [hz] -jitter [s] -junk [p] -corrupt [p] -fault [type:feet,...] -fault-every [n] -truth [path] -seed [n] -realtime -format [usbpcap|usbmon|usbmon48]"
+WAVEFORM_LENGTH = 92
+TERMINAL_INDEX = 9 #sample index of the reflection from the SSTDR terminal (the detector's zero index)
+TERMINAL_AMPLITUDE = 20000
+CHIP_SAMPLES = 4 #samples per PN chip: 96MHz sample rate, 24MHz chip rate
+CARRIER_PERIOD = 4 #samples per period of the 24MHz sine carrier
+CABLE_END_FEET = 194 #distance to the reflection from the far end of the leader cables
+CABLE_END_AMPLITUDE = 3000
+FAULT_AMPLITUDE = 4000
+ATTENUATION_FEET = 1000 #reflections decay by a factor of e over this many feet of cable
+NOISE_STD = 20
+SPIKE_PROBABILITY = 0.02 #chance of the small 2-sample spikes seen in data received via USB (see fault_detection.remove_spikes)
+SPIKE_AMPLITUDE = 250
+PROTOTYPE_PACKET_LENGTH = 64
+
+#pcap/USBPcap constants
+PCAP_MAGIC = 0xa1b2c3d4
+LINKTYPE_USBPCAP = 249
+LINKTYPE_USB_LINUX = 189 #usbmon, 48 byte header
+LINKTYPE_USB_LINUX_MMAPPED = 220 #usbmon, 64 byte header
+USBPCAP_HEADER_LENGTH = 27
+USBPCAP_CONTROL_HEADER_LENGTH = 28
+URB_FUNCTION_CONTROL_TRANSFER = 0x08
+TRANSFER_CONTROL = 2
+TRANSFER_BULK = 3
+USBD_STATUS_STALL_PID = 0xC0000004
+USB_BUS = 1
+USB_ADDRESS = 5
+USBMON_HEADER_LENGTHS = {LINKTYPE_USB_LINUX: 48, LINKTYPE_USB_LINUX_MMAPPED: 64}
+EPIPE = 32 #usbmon reports a stall as -EPIPE
+FORMATS = {'usbpcap': LINKTYPE_USBPCAP, 'usbmon': LINKTYPE_USB_LINUX_MMAPPED, 'usbmon48': LINKTYPE_USB_LINUX}
+
+FAULT_NAMES = {'open': fault_detection.FAULT_OPEN, 'short': fault_detection.FAULT_SHORT}
+
+def reflection(position, amplitude, N = WAVEFORM_LENGTH):
+    #correlation of a sine-modulated PN sequence with its reflection: a triangle envelope one chip wide, on the carrier
+    x = np.arange(N) - position
+    return amplitude*np.maximum(0, 1-np.abs(x)/CHIP_SAMPLES)*np.cos(2*np.pi*x/CARRIER_PERIOD)
+
+def feet_to_index(feet):
+    return TERMINAL_INDEX + feet/fault_detection.FEET_PER_SAMPLE
+
+def make_waveform(faults = [], rng = None, noise = True):
+    #returns a 92 sample correlation waveform as an int array.
+    #faults: list of (fault type, distance in feet) tuples. opens reflect with positive sign, shorts with negative sign.
+    wf = reflection(TERMINAL_INDEX, TERMINAL_AMPLITUDE)
+    wf = wf + reflection(feet_to_index(CABLE_END_FEET), CABLE_END_AMPLITUDE*np.exp(-CABLE_END_FEET/ATTENUATION_FEET))
+    for fault_type, feet in faults:
+        sign = 1 if fault_type == fault_detection.FAULT_OPEN else -1
+        wf = wf + reflection(feet_to_index(feet), sign*FAULT_AMPLITUDE*np.exp(-feet/ATTENUATION_FEET))
+    if noise:
+        if rng is None:
+            rng = np.random.default_rng()
+        wf = wf + rng.normal(0, NOISE_STD, WAVEFORM_LENGTH)
+        if rng.random() < SPIKE_PROBABILITY:
+            i = rng.integers(1, WAVEFORM_LENGTH)
+            wf[i-1] += SPIKE_AMPLITUDE
+            wf[i] -= SPIKE_AMPLITUDE
+    return np.clip(np.round(wf), -2**15, 2**15-1).astype(int)
+
+def make_region(wf, device_class):
+    #packs a waveform into the bytes of a waveform region, as sent by the device
+    if device_class == waveform_framer.DEVICE_PROTOTYPE:
+        header = waveform_framer.PROTOTYPE_PREFIX + bytes(2*waveform_framer.PROTOTYPE_HEADER_SAMPLES - len(waveform_framer.PROTOTYPE_PREFIX))
+        return header + np.asarray(list(wf)+[0], dtype='<i2').tobytes() #prototype regions carry one trailing sample
+    else:
+        header = waveform_framer.COMMERCIAL_PREFIX + bytes(waveform_framer.COMMERCIAL_HEADER_LENGTH - len(waveform_framer.COMMERCIAL_PREFIX))
+        return header + np.asarray(wf, dtype='>i2').tobytes()
+
+def pcap_header(linktype = LINKTYPE_USBPCAP):
+    return (PCAP_MAGIC.to_bytes(4,'little') + (2).to_bytes(2,'little') + (4).to_bytes(2,'little')
+            + bytes(8) + (65535).to_bytes(4,'little') + linktype.to_bytes(4,'little'))
+
+def pcap_record(timestamp, data):
+    #returns the bytes of one pcap record: the record header, then data
+    ts_sec = int(timestamp)
+    ts_usec = int(round((timestamp - ts_sec)*1e6))
+    if ts_usec >= 1000000:
+        ts_sec += 1
+        ts_usec -= 1000000
+    return ts_sec.to_bytes(4,'little') + ts_usec.to_bytes(4,'little') + len(data).to_bytes(4,'little') + len(data).to_bytes(4,'little') + data
+
+def usbpcap_packet(timestamp, payload, endpoint, function = waveform_framer.URB_FUNCTION_BULK_OR_INTERRUPT_TRANSFER, info = 1, status = 0, transfer_type = TRANSFER_BULK, irp = 0):
+    #returns the bytes of one pcap record holding a USBPcap packet
+    header_length = USBPCAP_CONTROL_HEADER_LENGTH if transfer_type == TRANSFER_CONTROL else USBPCAP_HEADER_LENGTH
+    data = (header_length.to_bytes(2,'little') + irp.to_bytes(8,'little') + status.to_bytes(4,'little')
+            + function.to_bytes(2,'little') + bytes([info]) + USB_BUS.to_bytes(2,'little') + USB_ADDRESS.to_bytes(2,'little')
+            + bytes([endpoint]) + bytes([transfer_type]) + len(payload).to_bytes(4,'little'))
+    if transfer_type == TRANSFER_CONTROL:
+        data = data + b'\x01' #data stage
+    return pcap_record(timestamp, data + payload)
+
+def usbmon_packet(timestamp, payload, endpoint, function = waveform_framer.URB_FUNCTION_BULK_OR_INTERRUPT_TRANSFER, info = 1, status = 0, transfer_type = TRANSFER_BULK, irp = 0, linktype = LINKTYPE_USB_LINUX_MMAPPED):
+    #returns the bytes of one pcap record holding the usbmon event for the same transfer as usbpcap_packet():
+    #a completion ('C') for info = 1, or a submission ('S') otherwise. the function is implied by the transfer type
+    event_type = b'C' if info == 1 else b'S'
+    ts_sec = int(timestamp)
+    data = (irp.to_bytes(8,'little') + event_type + bytes([transfer_type, endpoint, USB_ADDRESS]) + USB_BUS.to_bytes(2,'little')
+            + b'-' + (b'\x00' if len(payload) > 0 else b'<') + ts_sec.to_bytes(8,'little', signed=True)
+            + int(round((timestamp - ts_sec)*1e6)).to_bytes(4,'little', signed=True)
+            + (0 if status == 0 else -EPIPE).to_bytes(4,'little', signed=True) + len(payload).to_bytes(4,'little') + len(payload).to_bytes(4,'little')
+            + bytes(8))
+    data = data + bytes(USBMON_HEADER_LENGTHS[linktype] - len(data)) #the 64 byte header's extra fields are zero for bulk transfers
+    return pcap_record(timestamp, data + payload)
+
+def parse_faults(spec):
+    #"open:120,short:250" -> [(FAULT_OPEN, 120.0), (FAULT_SHORT, 250.0)]
+    faults = []
+    for entry in spec.split(','):
+        name, feet = entry.split(':')
+        faults.append((FAULT_NAMES[name.strip().lower()], float(feet)))
+    return faults
+
+class ProbeSimulator:
+    """
+    Produces the pcap byte stream USBPcapCMD would produce while capturing an
+    SSTDR probe.
+
+    Usage:
+    declare a ProbeSimulator, write header() to the output, then write the
+    bytes returned by next_frame() once per waveform. Each call returns every
+    pcap record needed to deliver one waveform (and any junk packets), with
+    timestamps spaced according to rate and jitter. The fault injected into
+    the frame (or FAULT_NONE) is available afterwards in last_truth, as
+    (frame number, timestamp, fault type, distance in feet, corrupted).
+    """
+    def __init__(self, device_class = waveform_framer.DEVICE_COMMERCIAL, rate = 10, jitter = 0, junk = 0, corrupt = 0, faults = [], fault_every = 1, seed = None, start_time = None, linktype = LINKTYPE_USBPCAP):
+        self.device_class = device_class
+        self.linktype = linktype
+        self.prefix, self.endpoint = waveform_framer.get_device_constants(device_class)
+        self.packet_length = waveform_framer.COMMERCIAL_PACKET_LENGTH if device_class == waveform_framer.DEVICE_COMMERCIAL else PROTOTYPE_PACKET_LENGTH
+        self.rate = rate
+        self.jitter = jitter
+        self.junk = junk
+        self.corrupt = corrupt
+        self.faults = faults
+        self.fault_every = fault_every
+        self.rng = np.random.default_rng(seed)
+        self.start_time = time.time() if start_time is None else start_time
+        self.frame_number = 0
+        self.irp = 0
+        self.pending = b'' #stream bytes not yet sent; commercial devices only send whole transfers
+        self.last_truth = None
+
+    def header(self):
+        return pcap_header(self.linktype)
+
+    def packet(self, timestamp, payload, endpoint, **kwargs):
+        #one pcap record, in the capture format being simulated
+        if self.linktype == LINKTYPE_USBPCAP:
+            return usbpcap_packet(timestamp, payload, endpoint, **kwargs)
+        return usbmon_packet(timestamp, payload, endpoint, linktype = self.linktype, **kwargs)
+
+    def frame_time(self, n = None):
+        #nominal time of a frame, without jitter
+        return self.start_time + (self.frame_number if n is None else n)/self.rate
+
+    def junk_packet(self, timestamp):
+        #a packet SSTDR_USB should ignore, or (from the waveform endpoint) one that should make it flush its buffer
+        self.irp += 1
+        kind = self.rng.integers(0, 4)
+        if kind == 0:
+            #control transfer on the default endpoint
+            return self.packet(timestamp, bytes(8), 0x80, function = URB_FUNCTION_CONTROL_TRANSFER, transfer_type = TRANSFER_CONTROL, irp = self.irp)
+        elif kind == 1:
+            #host to device (out) transfer
+            return self.packet(timestamp, self.rng.bytes(int(self.rng.integers(1, 64))), self.endpoint & 0x7F, info = 0, irp = self.irp)
+        elif kind == 2:
+            #interrupt transfer from another endpoint
+            return self.packet(timestamp, self.rng.bytes(8), 0x81, irp = self.irp)
+        else:
+            #stalled transfer from the waveform endpoint
+            return self.packet(timestamp, b'', self.endpoint, status = USBD_STATUS_STALL_PID, irp = self.irp)
+
+    def corrupt_region(self, region):
+        kind = self.rng.integers(0, 3)
+        region = bytearray(region)
+        if kind == 0:
+            #flip some bits in the samples
+            for i in self.rng.integers(len(self.prefix), len(region), 4):
+                region[i] ^= 1 << int(self.rng.integers(0, 8))
+        elif kind == 1:
+            #damage the prefix, merging this frame into the previous one
+            region[int(self.rng.integers(0, len(self.prefix)))] ^= 0xFF
+        else:
+            #lose the end of the frame
+            region = region[:int(self.rng.integers(len(self.prefix), len(region)))]
+        return bytes(region)
+
+    def next_frame(self):
+        n = self.frame_number
+        timestamp = self.frame_time() + (self.rng.normal(0, self.jitter) if self.jitter > 0 else 0)
+        faults = self.faults if (self.faults and n % self.fault_every == 0) else []
+        region = make_region(make_waveform(faults, self.rng), self.device_class)
+        corrupted = self.corrupt > 0 and self.rng.random() < self.corrupt
+        if corrupted:
+            region = self.corrupt_region(region)
+        fault = faults[0] if faults else (fault_detection.FAULT_NONE, 0)
+        self.last_truth = (n, timestamp, fault[0], fault[1], corrupted)
+        self.frame_number += 1
+
+        #split the stream into transfers. commercial devices only send full transfers; leftover bytes go out with the next frame
+        self.pending = self.pending + region
+        out = []
+        while len(self.pending) >= self.packet_length or (self.device_class == waveform_framer.DEVICE_PROTOTYPE and len(self.pending) > 0):
+            if self.junk > 0 and self.rng.random() < self.junk:
+                out.append(self.junk_packet(timestamp))
+            payload = self.pending[:self.packet_length]
+            self.pending = self.pending[self.packet_length:]
+            self.irp += 1
+            out.append(self.packet(timestamp, payload, self.endpoint, irp = self.irp))
+        return b''.join(out)
+
+def generate_capture(n_waveforms, **kwargs):
+    #returns the bytes of a complete capture holding n_waveforms waveforms. keyword arguments are passed to ProbeSimulator.
+    simulator = ProbeSimulator(**kwargs)
+    frames = [simulator.header()] + [simulator.next_frame() for i in range(n_waveforms)]
+    #the last waveform is only complete once the next prefix arrives
+    frames.append(simulator.next_frame())
+    return b''.join(frames)
+
+def main():
+    out_path = "simulated.pcap"
+    truth_path = None
+    device_class = waveform_framer.DEVICE_COMMERCIAL
+    count = 1000
+    kwargs = {}
+    try:
+        args = sys.argv
+        if '-o' in args:
+            out_path = args[args.index('-o')+1]
+        if '-device' in args:
+            device_class = waveform_framer.DEVICE_PROTOTYPE if args[args.index('-device')+1].lower() == 'prototype' else waveform_framer.DEVICE_COMMERCIAL
+        if '-n' in args:
+            count = int(args[args.index('-n')+1])
+        if '-rate' in args:
+            kwargs['rate'] = float(args[args.index('-rate')+1])
+        if '-jitter' in args:
+            kwargs['jitter'] = float(args[args.index('-jitter')+1])
+        if '-junk' in args:
+            kwargs['junk'] = float(args[args.index('-junk')+1])
+        if '-corrupt' in args:
+            kwargs['corrupt'] = float(args[args.index('-corrupt')+1])
+        if '-fault' in args:
+            kwargs['faults'] = parse_faults(args[args.index('-fault')+1])
+        if '-fault-every' in args:
+            kwargs['fault_every'] = int(args[args.index('-fault-every')+1])
+        if '-seed' in args:
+            kwargs['seed'] = int(args[args.index('-seed')+1])
+        if '-truth' in args:
+            truth_path = args[args.index('-truth')+1]
+        if '-format' in args:
+            kwargs['linktype'] = FORMATS[args[args.index('-format')+1].lower()]
+        realtime = '-realtime' in args
+    except:
+        print("Error: invalid input.", file=sys.stderr)
+        print(USAGE_STRING, file=sys.stderr)
+        return
+
+    simulator = ProbeSimulator(device_class, **kwargs)
+    out_f = sys.stdout.buffer if out_path == '-' else open(out_path, "wb")
+    truth_f = open(truth_path, "w") if truth_path is not None else None
+    if truth_f is not None:
+        truth_f.write("frame_number,timestamp,fault_type,fault_distance,corrupted\n")
+    try:
+        out_f.write(simulator.header())
+        n = 0
+        while count == 0 or n <= count: #one extra frame; its prefix completes the last waveform
+            if realtime:
+                delay = simulator.frame_time() - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            out_f.write(simulator.next_frame())
+            if realtime:
+                out_f.flush()
+            if truth_f is not None and n < count:
+                truth_f.write(",".join(str(v) for v in simulator.last_truth)+'\n')
+            n += 1
+    except (BrokenPipeError, KeyboardInterrupt):
+        pass #reader went away, or user stopped us
+    finally:
+        if truth_f is not None:
+            truth_f.close()
+        if out_f is not sys.stdout.buffer:
+            out_f.close()
+
+if __name__ == '__main__':
+    main()
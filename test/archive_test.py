@@ -0,0 +1,97 @@
+#archive_test.py
+#checks that waveform archives (waveform_archive.py) give back exactly the rows written to them, for every codec and
+#reference mode, including when appending to an existing archive. then cuts an archive short, as a crash while
+#writing a chunk would, appends to it, and checks that every complete chunk and every appended row can still be read.
+#lastly, archives a csv log whose last row was cut short, and checks every complete row was archived.
+#
+#example: python test/archive_test.py
+
+import sys
+import os
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import binary_log
+import sstdr_simulator
+import waveform_archive
+from log_writer import CSV_HEADER, format_row
+
+CHUNK_ROWS = 25
+TRUNCATED_BYTES = [1, 5, 40, waveform_archive.CHUNK_HEADER_SIZE + 3] #cut into the last chunk's payload, or its header
+
+def make_records(n, session_number = 1, start_time = 1579000000.0, seed = 0):
+    rng = np.random.default_rng(seed)
+    records = np.zeros(n, dtype=binary_log.record_dtype(binary_log.WAVEFORM_LENGTH))
+    records['session_number'] = session_number
+    records['log_number'] = np.arange(n)//10
+    records['timestamp'] = start_time + 0.1*np.arange(n)
+    records['waveform'] = [sstdr_simulator.make_waveform([], rng) for _ in range(n)]
+    return records
+
+def write(path, records, codec = waveform_archive.CODEC_ZLIB, reference = waveform_archive.REFERENCE_PREVIOUS):
+    writer = waveform_archive.ArchiveWriter(path, codec, reference, CHUNK_ROWS)
+    writer.write_records(records)
+    writer.close()
+
+def read(path):
+    reader = waveform_archive.ArchiveReader(path)
+    records = reader.read()
+    reader.close()
+    return records
+
+def check(name, records, expected):
+    if len(records) == len(expected) and np.array_equal(records, expected):
+        return 0
+    print(name + ": read " + str(len(records)) + " rows, expected " + str(len(expected)) + ("" if len(records) != len(expected) else " (contents differ)"))
+    return 1
+
+def main():
+    failures = 0
+    first = make_records(110)
+    second = make_records(40, session_number = 2, start_time = 1579001000.0, seed = 1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for codec in [waveform_archive.CODEC_ZLIB, waveform_archive.CODEC_LZMA]:
+            for reference in [waveform_archive.REFERENCE_PREVIOUS, waveform_archive.REFERENCE_BASELINE]:
+                name = "codec %d, reference %d" % (codec, reference)
+                path = os.path.join(tmp_dir, "round_trip_%d_%d.wfa" % (codec, reference))
+                write(path, first, codec, reference)
+                failures += check(name, read(path), first)
+                write(path, second) #appending keeps the archive's codec & reference
+                failures += check(name + ", appended", read(path), np.concatenate([first, second]))
+
+        for cut in TRUNCATED_BYTES:
+            name = "truncated by %d bytes" % cut
+            path = os.path.join(tmp_dir, "truncated_%d.wfa" % cut)
+            write(path, first)
+            with open(path, "r+b") as f:
+                f.truncate(os.path.getsize(path) - cut)
+            kept = first[:len(first)//CHUNK_ROWS*CHUNK_ROWS] #the last (partial) chunk is lost
+            failures += check(name, read(path), kept)
+            write(path, second)
+            try:
+                failures += check(name + ", appended", read(path), np.concatenate([kept, second]))
+            except Exception as e:
+                failures += 1
+                print(name + ", appended: raised " + repr(e))
+
+        csv_path = os.path.join(tmp_dir, "truncated.csv")
+        with open(csv_path, "w") as f:
+            f.write(CSV_HEADER)
+            f.write(''.join([format_row(int(r['session_number']), int(r['log_number']), float(r['timestamp']), r['waveform']) for r in first]))
+        last_row = format_row(int(first[-1]['session_number']), int(first[-1]['log_number']), float(first[-1]['timestamp']), first[-1]['waveform'])
+        with open(csv_path, "r+b") as f:
+            f.truncate(os.path.getsize(csv_path) - len(last_row)//2) #the last row loses half its samples
+        archive_path = os.path.join(tmp_dir, "truncated_csv.wfa")
+        try:
+            waveform_archive.archive_log(csv_path, archive_path, chunk_rows = CHUNK_ROWS)
+            failures += check("csv with a truncated last row", read(archive_path), first[:-1])
+        except Exception as e:
+            failures += 1
+            print("csv with a truncated last row: raised " + repr(e))
+    print("PASSED" if failures == 0 else str(failures) + " FAILED")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
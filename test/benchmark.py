@@ -0,0 +1,340 @@
+#benchmark.py
+#repeatable timing benchmarks for the capture and fault detection hot paths.
+#results are saved as json (one file per git commit) so that regressions can be compared across commits.
+#
+#command line arguments, can be provided in any order:
+#   -k [text]       : only run (and set up) benchmarks whose name contains this text (OPTIONAL)
+#   -r [count]      : number of timing repeats per benchmark; the best repeat is reported (OPTIONAL, defaults to 5)
+#   -d [path]       : directory results are saved into (OPTIONAL, defaults to ".benchmarks" in the repository root)
+#   -save           : save results for the current commit
+#   -compare [a] [b]: compare saved results for commits (or result file names) a and b, then exit
+#
+#example: python test/benchmark.py -save
+#         python test/benchmark.py -compare 3cf9b1b HEAD
+
+import sys
+import os
+import io
+import json
+import time
+import timeit
+import tempfile
+import subprocess
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fault_detection as fd
+import waveform_framer
+import sstdr_simulator
+import dictionary_learning
+import binary_log
+import waveform_archive
+import read_waveforms
+import calibration
+from waveform_ring import WaveformRing
+from PcapPacketReceiver import PcapPacketReceiver
+
+#constants
+DEFAULT_RESULT_DIR = os.path.join(REPO_DIR, ".benchmarks")
+DEFAULT_REPEATS = 5
+CAPTURE_SIZES = [100, 1000, 10000] #waveforms per synthetic capture
+CSV_ROWS = 2000
+REGRESSION_RATIO = 1.10 #comparisons flag benchmarks that got slower by more than this factor
+
+######################################################
+##                 SYNTHETIC DATA                   ##
+######################################################
+
+def synthetic_waveform(fault_index = None, fault_sign = 1, seed = 0):
+    #a 92 sample correlation waveform, with an optional fault reflection at the given sample index
+    faults = []
+    if fault_index is not None:
+        fault_type = fd.FAULT_OPEN if fault_sign > 0 else fd.FAULT_SHORT
+        faults = [(fault_type, (fault_index - sstdr_simulator.TERMINAL_INDEX)*fd.FEET_PER_SAMPLE)]
+    return sstdr_simulator.make_waveform(faults, np.random.default_rng(seed))
+
+def synthetic_capture(n_waveforms, device_class = waveform_framer.DEVICE_COMMERCIAL, linktype = sstdr_simulator.LINKTYPE_USBPCAP):
+    #the bytes of a USBPcap (or usbmon) pcap capture holding n_waveforms waveforms, split into device-sized payloads
+    return sstdr_simulator.generate_capture(n_waveforms, device_class = device_class, seed = 0, start_time = 1579000000, linktype = linktype)
+
+def synthetic_csv(path, n_rows):
+    #writes a waveform log in the layout produced by SSTDR_USB. timestamps are whole seconds so that every reader (including read_csv, which parses all columns as ints) can load it
+    with open(path, "w") as f:
+        f.write("session_number,log_number,timestamp,waveform\n")
+        for i in range(n_rows):
+            wf = synthetic_waveform(seed = i)
+            f.write("0,"+str(i//10)+","+str(1579000000+i)+","+str(wf.tolist())[1:-1]+'\n')
+
+######################################################
+##                   BENCHMARKS                     ##
+######################################################
+
+def receive(capture):
+    receiver = PcapPacketReceiver(io.BytesIO(capture))
+    receiver.run()
+    return receiver
+
+def frame(blocks, device_class):
+    framer = waveform_framer.WaveformFramer(device_class)
+    wfs = []
+    for block in blocks:
+        framer.feed(block)
+        region = framer.next_region()
+        while region is not None:
+            wfs.append(framer.region_to_waveform(region))
+            region = framer.next_region()
+    return wfs
+
+def ring_transfer(wfs):
+    #writes waveforms through a shared memory ring and reads each back, as the -mp capture process and main loop do
+    ring = WaveformRing.create()
+    try:
+        for i, wf in enumerate(wfs):
+            ring.write(i, wf)
+            ring.read(ring.sequence())
+    finally:
+        ring.close()
+        ring.unlink()
+
+def detector_benchmark(method, coarse_to_fine = False, dictionary_path = None):
+    bl = synthetic_waveform()
+    wf = synthetic_waveform(fault_index = 40)
+    detector = fd.Detector(method, coarse_to_fine)
+    detector.set_baseline(bl)
+    if dictionary_path is not None:
+        detector.load_dictionary(dictionary_path)
+    if method == fd.METHOD_BLS_DEVIATION_CORRECTION:
+        detector.set_terminal(synthetic_waveform(fault_index = 20))
+    return lambda: detector.detect_faults(wf)
+
+def synthetic_dictionary(path):
+    #a dictionary learned from simulated opens and shorts every 6 feet, as dictionary_learning.py would learn from labeled logs
+    rng = np.random.default_rng(0)
+    bl = synthetic_waveform()
+    atoms, fault_types, distances = [], [], []
+    for fault_type in [fd.FAULT_OPEN, fd.FAULT_SHORT]:
+        for feet in np.arange(20, 240, 6.0):
+            bls = np.array([sstdr_simulator.make_waveform([(fault_type, feet)], rng) for i in range(10)]) - bl
+            group_atoms = dictionary_learning.learn_atoms(bls, dictionary_learning.DEFAULT_ATOMS_PER_LABEL)
+            atoms.append(group_atoms)
+            fault_types += [fault_type]*len(group_atoms)
+            distances += [feet]*len(group_atoms)
+    dictionary_learning.save_dictionary(path, np.concatenate(atoms), np.array(fault_types), np.array(distances))
+
+def plot_benchmark():
+    #draws a frame of the live waveform plot, and copies it out for the plot window. returns None if pygame isn't installed
+    try:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy") #no window is opened
+        import pygame
+        from waveform_plot import WaveformPlot
+    except ImportError:
+        return None
+    pygame.init()
+    plot = WaveformPlot(pygame.font.Font(os.path.join(REPO_DIR, "Assets", "Titillium-Regular.otf"), 14), "Distance (feet)", "Correlation With Reflection")
+    y = fd.spline_interpolate(synthetic_waveform(fault_index = 40))
+    xlim = (fd.SPLINE_FEET_VECTOR[0], fd.SPLINE_FEET_VECTOR[-1])
+    def draw():
+        plot.draw(fd.SPLINE_FEET_VECTOR, y, xlim, (-2**16, 2**16), [100])
+        return plot.pixels()
+    return draw
+
+class Fixtures:
+    """
+    Setup shared by several benchmarks (synthetic logs, a dictionary), built
+    the first time a benchmark asks for it and reused after that, so running
+    a few benchmarks with -k only builds what those benchmarks need.
+
+    Usage:
+    fixtures = Fixtures(tmp_dir); fixtures.csv_path() etc. write their
+    files into tmp_dir.
+    """
+    def __init__(self, tmp_dir):
+        self.tmp_dir = tmp_dir
+        self.cache = {}
+
+    def get(self, key, build):
+        if key not in self.cache:
+            self.cache[key] = build()
+        return self.cache[key]
+
+    def csv_path(self):
+        def build():
+            path = os.path.join(self.tmp_dir, "benchmark_waveforms.csv")
+            synthetic_csv(path, CSV_ROWS)
+            return path
+        return self.get("csv", build)
+
+    def rows(self):
+        return self.get("rows", lambda: fd.load_csv(self.csv_path()))
+
+    def dictionary_path(self):
+        def build():
+            path = os.path.join(self.tmp_dir, "benchmark_dictionary.npy")
+            synthetic_dictionary(path)
+            return path
+        return self.get("dictionary", build)
+
+    def binary_path(self):
+        def build():
+            path = os.path.join(self.tmp_dir, "benchmark_waveforms" + binary_log.BINARY_EXTENSION)
+            binary_log.csv_to_binary(self.csv_path(), path)
+            return path
+        return self.get("binary", build)
+
+def capture_benchmark(n, linktype = sstdr_simulator.LINKTYPE_USBPCAP):
+    capture = synthetic_capture(n, linktype = linktype)
+    return lambda: receive(capture)
+
+def framing_benchmark(device_class):
+    blocks = list(receive(synthetic_capture(CAPTURE_SIZES[1], device_class)).q.queue)
+    return lambda: frame(blocks, device_class)
+
+def ring_benchmark():
+    wfs = [np.array(synthetic_waveform(seed = i), dtype=np.int16) for i in range(CAPTURE_SIZES[1])]
+    return lambda: ring_transfer(wfs)
+
+def classify_benchmark(fixtures):
+    dictionary = dictionary_learning.load_dictionary(fixtures.dictionary_path())
+    bls_batch = np.array([synthetic_waveform(fault_index = 20+i%50, seed = i) for i in range(1000)]) - synthetic_waveform()
+    return lambda: dictionary.classify(bls_batch)
+
+def grid_search_benchmark():
+    reference_bls = read_waveforms.spline_batch([synthetic_waveform(fault_index = 15+i, fault_sign = 1-2*(i%2), seed = i) - synthetic_waveform() for i in range(50)])
+    reference_signs = 1 - 2*(np.arange(50)%2)
+    reference_distances = np.arange(6, 56)*fd.FEET_PER_SAMPLE
+    return lambda: calibration.grid_search(reference_bls, reference_signs, reference_distances, calibration.FPS_RANGE, calibration.ZERO_RANGE, calibration.COARSE_STEPS)
+
+def archive_benchmark(fixtures):
+    path = os.path.join(fixtures.tmp_dir, "benchmark_waveforms" + waveform_archive.ARCHIVE_EXTENSION)
+    waveform_archive.archive_log(fixtures.csv_path(), path)
+    archive_reader = waveform_archive.ArchiveReader(path)
+    return lambda: [len(records) for records in archive_reader.iter_chunks()]
+
+def get_benchmarks(fixtures):
+    #returns a list of (name, factory) pairs. a factory does the benchmark's setup, so it is not timed, and returns the
+    #callable to time (or None if the benchmark can't run here); factories are only called for the benchmarks selected
+    benchmarks = []
+    for n in CAPTURE_SIZES:
+        benchmarks.append(("receiver.run[%d wfs]" % n, lambda n=n: capture_benchmark(n)))
+    benchmarks.append(("receiver.run[usbmon, %d wfs]" % CAPTURE_SIZES[1], lambda: capture_benchmark(CAPTURE_SIZES[1], sstdr_simulator.LINKTYPE_USB_LINUX_MMAPPED)))
+    for device_class, name in [(waveform_framer.DEVICE_COMMERCIAL, "commercial"), (waveform_framer.DEVICE_PROTOTYPE, "prototype")]:
+        benchmarks.append(("framing[%s, %d wfs]" % (name, CAPTURE_SIZES[1]), lambda device_class=device_class: framing_benchmark(device_class)))
+    benchmarks.append(("waveform_ring[%d wfs]" % CAPTURE_SIZES[1], ring_benchmark))
+    #waveforms this small are cheap enough to build up front
+    region = sstdr_simulator.make_region(synthetic_waveform(), waveform_framer.DEVICE_COMMERCIAL)
+    benchmarks.append(("convert_waveform_region", lambda: lambda: waveform_framer.convert_waveform_region(region[waveform_framer.COMMERCIAL_HEADER_LENGTH:])))
+    benchmarks.append(("convert_waveform_region_prototype", lambda: lambda: waveform_framer.convert_waveform_region_prototype(region)))
+    wf = synthetic_waveform(fault_index = 40)
+    bl = synthetic_waveform()
+    benchmarks.append(("spline_interpolate", lambda: lambda: fd.spline_interpolate(wf)))
+    benchmarks.append(("low_pass_filter", lambda: lambda: fd.low_pass_filter(wf)))
+    benchmarks.append(("remove_spikes", lambda: lambda: fd.remove_spikes(wf, bl)))
+    for method, name in [(fd.METHOD_NONE, "none"), (fd.METHOD_BLS_PEAKS, "bls_peaks"), (fd.METHOD_BLS_DEVIATION_CORRECTION, "bls_deviation_correction"), (fd.METHOD_LOW_PASS_PEAKS, "low_pass_peaks")]:
+        benchmarks.append(("detect_faults[%s]" % name, lambda method=method: detector_benchmark(method)))
+        if method != fd.METHOD_NONE:
+            benchmarks.append(("detect_faults[%s, coarse_to_fine]" % name, lambda method=method: detector_benchmark(method, True)))
+    benchmarks.append(("detect_faults[dictionary_learning]", lambda: detector_benchmark(fd.METHOD_DICTIONARY_LEARNING, dictionary_path = fixtures.dictionary_path())))
+    benchmarks.append(("dictionary.classify[1000 wfs]", lambda: classify_benchmark(fixtures)))
+    benchmarks.append(("read_csv[%d rows]" % CSV_ROWS, lambda: lambda path=fixtures.csv_path(): fd.read_csv(path)))
+    benchmarks.append(("read_csv_ungrouped[%d rows]" % CSV_ROWS, lambda: lambda path=fixtures.csv_path(): fd.read_csv_ungrouped(path)))
+    benchmarks.append(("read_wfs[%d rows]" % CSV_ROWS, lambda: lambda path=fixtures.csv_path(): fd.read_wfs(path)))
+    benchmarks.append(("load_csv[%d rows]" % CSV_ROWS, lambda: lambda path=fixtures.csv_path(): fd.load_csv(path)))
+    benchmarks.append(("iter_csv_chunks[%d rows]" % CSV_ROWS, lambda: lambda path=fixtures.csv_path(): [len(rows) for rows in fd.iter_csv_chunks(path, 1 << 16)]))
+    benchmarks.append(("group_logs[%d rows]" % CSV_ROWS, lambda: lambda rows=fixtures.rows(): fd.group_logs(rows)))
+    benchmarks.append(("read_waveforms.filter+spline[%d rows]" % CSV_ROWS, lambda: lambda wfs=fixtures.rows()[:,fd.LOG_COLUMNS:]: read_waveforms.spline_batch(read_waveforms.low_pass_filter_batch(wfs))))
+    benchmarks.append(("read_waveforms.analysis[%d rows, cached]" % CSV_ROWS, lambda: lambda path=fixtures.csv_path(): read_waveforms.WaveformAnalysis(path, read_waveforms.PER_LOG_ALL).bls()))
+    benchmarks.append(("calibration.grid_search[50 refs]", grid_search_benchmark))
+    benchmarks.append(("binary_log.open_log[%d rows]" % CSV_ROWS, lambda: lambda path=fixtures.binary_path(): binary_log.open_log(path)['waveform'].sum()))
+    benchmarks.append(("binary_log.read_ungrouped[%d rows]" % CSV_ROWS, lambda: lambda path=fixtures.binary_path(): binary_log.read_ungrouped(path)))
+    benchmarks.append(("waveform_archive.iter_chunks[%d rows]" % CSV_ROWS, lambda: archive_benchmark(fixtures)))
+    benchmarks.append(("waveform_plot.draw", plot_benchmark))
+    return benchmarks
+
+def time_benchmark(fxn, repeats):
+    #returns (best, median) seconds per call
+    timer = timeit.Timer(fxn)
+    number, _ = timer.autorange() #enough calls per repeat to take at least 0.2 seconds
+    times = np.array(timer.repeat(repeat = repeats, number = number))/number
+    return (float(np.min(times)), float(np.median(times)))
+
+######################################################
+##                RESULT STORAGE                    ##
+######################################################
+
+def git_commit(rev = "HEAD"):
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", rev], cwd = REPO_DIR, capture_output = True, text = True, check = True).stdout.strip()
+    except Exception:
+        return None
+
+def result_path(result_dir, name):
+    #accepts a commit-ish or the name of a saved result file
+    if os.path.exists(os.path.join(result_dir, name)):
+        return os.path.join(result_dir, name)
+    commit = git_commit(name)
+    return os.path.join(result_dir, (commit if commit is not None else name) + ".json")
+
+def save_results(result_dir, results):
+    os.makedirs(result_dir, exist_ok = True)
+    commit = git_commit()
+    dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd = REPO_DIR, capture_output = True, text = True).stdout.strip() != ''
+    name = (commit if commit is not None else "nocommit") + ("-dirty" if dirty else "") + ".json"
+    path = os.path.join(result_dir, name)
+    with open(path, "w") as f:
+        json.dump({"commit": commit, "dirty": dirty, "time": time.time(), "python": sys.version.split()[0], "numpy": np.__version__, "results": results}, f, indent = 1)
+    return path
+
+def compare_results(result_dir, a, b):
+    with open(result_path(result_dir, a)) as f:
+        results_a = json.load(f)["results"]
+    with open(result_path(result_dir, b)) as f:
+        results_b = json.load(f)["results"]
+    print("%-55s %12s %12s %8s" % ("benchmark", a, b, "ratio"))
+    for name in results_a:
+        if name not in results_b:
+            continue
+        ta = results_a[name]["best"]
+        tb = results_b[name]["best"]
+        ratio = tb/ta
+        flag = "  SLOWER" if ratio > REGRESSION_RATIO else ("  faster" if ratio < 1/REGRESSION_RATIO else "")
+        print("%-55s %10.1fus %10.1fus %7.2fx%s" % (name, ta*1e6, tb*1e6, ratio, flag))
+
+######################################################
+##                      MAIN                        ##
+######################################################
+
+def main():
+    name_filter = None
+    repeats = DEFAULT_REPEATS
+    result_dir = DEFAULT_RESULT_DIR
+    if '-k' in sys.argv:
+        name_filter = sys.argv[sys.argv.index('-k')+1]
+    if '-r' in sys.argv:
+        repeats = int(sys.argv[sys.argv.index('-r')+1])
+    if '-d' in sys.argv:
+        result_dir = sys.argv[sys.argv.index('-d')+1]
+    if '-compare' in sys.argv:
+        i = sys.argv.index('-compare')
+        compare_results(result_dir, sys.argv[i+1], sys.argv[i+2])
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, factory in get_benchmarks(Fixtures(tmp_dir)):
+            if name_filter is not None and name_filter not in name:
+                continue
+            fxn = factory()
+            if fxn is None:
+                print("%-55s skipped" % name)
+                continue
+            best, median = time_benchmark(fxn, repeats)
+            results[name] = {"best": best, "median": median}
+            print("%-55s best %10.1fus   median %10.1fus" % (name, best*1e6, median*1e6))
+
+    if '-save' in sys.argv:
+        print("Saved results to: "+save_results(result_dir, results))
+
+if __name__ == '__main__':
+    main()
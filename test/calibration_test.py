@@ -0,0 +1,113 @@
+#calibration_test.py
+#simulates a calibration dataset for a cable whose feet per sample and zero index differ from fault_detection's defaults:
+#a log of healthy waveforms, then logs of opens and shorts at known distances. fits a calibration to it (calibration.py),
+#then checks that a Detector that loads the calibration locates other faults on the same cable at their true distances.
+#also checks that an uncalibrated Detector still reports the distances it always has: its formula subtracts the zero
+#index in raw samples from spline indices, which FEET_PER_SAMPLE was fitted by hand against, so it only changes when a
+#calibration is loaded.
+#
+#command line arguments, can be provided in any order:
+#   -fps [feet]     : true feet per sample of the simulated cable (OPTIONAL, defaults to 3.6)
+#   -zero [index]   : true sample index of the cable start (OPTIONAL, defaults to 10.4)
+#
+#example: python test/calibration_test.py -fps 3.8479 -zero 9
+
+import sys
+import os
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fault_detection
+import sstdr_simulator
+import calibration
+from log_writer import CSV_HEADER
+
+WAVEFORMS_PER_LOG = 5
+REFERENCES = [('open', 40), ('short', 75), ('open', 110), ('short', 150), ('open', 190), ('short', 230)]
+HELD_OUT = [(fault_detection.FAULT_OPEN, 60), (fault_detection.FAULT_SHORT, 130), (fault_detection.FAULT_OPEN, 205)]
+TOLERANCE_FEET = 2.0
+#(fault type, feet) METHOD_BLS_PEAKS reported for HELD_OUT before calibration support, on the default cable (seed 7)
+UNCALIBRATED_DISTANCES = [(fault_detection.FAULT_OPEN, 87.16711), (fault_detection.FAULT_SHORT, 157.89867), (fault_detection.FAULT_OPEN, 233.03262)]
+FAULT_AMPLITUDE = 8000 #strong enough that the sidelobe before each reflection crosses METHOD_BLS_PEAKS' deviation threshold, as that method expects
+
+def make_waveform(faults, feet_per_sample, zero_index, rng):
+    #sstdr_simulator.make_waveform, for a cable with other constants
+    x = lambda feet: zero_index + feet/feet_per_sample
+    wf = sstdr_simulator.reflection(zero_index, sstdr_simulator.TERMINAL_AMPLITUDE)
+    wf = wf + reflection_at(x(sstdr_simulator.CABLE_END_FEET), sstdr_simulator.CABLE_END_AMPLITUDE, sstdr_simulator.CABLE_END_FEET)
+    for fault_type, feet in faults:
+        sign = 1 if fault_type == fault_detection.FAULT_OPEN else -1
+        wf = wf + reflection_at(x(feet), sign*FAULT_AMPLITUDE, feet)
+    return np.round(wf + rng.normal(0, sstdr_simulator.NOISE_STD, len(wf))).astype(int)
+
+def reflection_at(position, amplitude, feet):
+    return sstdr_simulator.reflection(position, amplitude*np.exp(-feet/sstdr_simulator.ATTENUATION_FEET))
+
+def check_uncalibrated():
+    #returns the number of failures
+    rng = np.random.default_rng(7)
+    baseline = make_waveform([], fault_detection.FEET_PER_SAMPLE, sstdr_simulator.TERMINAL_INDEX, rng)
+    wfs = [make_waveform([fault], fault_detection.FEET_PER_SAMPLE, sstdr_simulator.TERMINAL_INDEX, rng) for fault in HELD_OUT]
+    failures = 0
+    for coarse_to_fine in [False, True]:
+        detector = fault_detection.Detector(fault_detection.METHOD_BLS_PEAKS, coarse_to_fine)
+        detector.set_baseline(baseline)
+        detected = [detector.detect_faults(wf) for wf in wfs]
+        for (fault_type, feet), expected in zip(detected, UNCALIBRATED_DISTANCES):
+            if fault_type != expected[0] or abs(feet - expected[1]) > 1e-4:
+                failures += 1
+                print("uncalibrated" + (", coarse-to-fine" if coarse_to_fine else "") + ": got " + str((fault_type, feet)) + ", expected " + str(expected))
+    return failures
+
+def main():
+    feet_per_sample = 3.6
+    zero_index = 10.4
+    args = sys.argv
+    if '-fps' in args:
+        feet_per_sample = float(args[args.index('-fps')+1])
+    if '-zero' in args:
+        zero_index = float(args[args.index('-zero')+1])
+    rng = np.random.default_rng(1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_path = os.path.join(tmp_dir, "calibration_log.csv")
+        labels_path = os.path.join(tmp_dir, "labels.csv")
+        calibration_path = os.path.join(tmp_dir, "calibration.json")
+        with open(log_path, "w") as f, open(labels_path, "w") as labels:
+            f.write(CSV_HEADER)
+            labels.write("file,log_number,fault_type,distance,baseline_log\n")
+            for log_number, reference in enumerate([None] + REFERENCES):
+                faults = [] if reference is None else [(sstdr_simulator.FAULT_NAMES[reference[0]], reference[1])]
+                for _ in range(WAVEFORMS_PER_LOG):
+                    f.write("1,"+str(log_number)+",0,"+",".join(str(x) for x in make_waveform(faults, feet_per_sample, zero_index, rng))+"\n")
+                if reference is not None:
+                    labels.write(log_path+","+str(log_number)+","+reference[0]+","+str(reference[1])+",0\n")
+
+        start = time.perf_counter()
+        result = calibration.calibrate(calibration.dictionary_learning.read_labels(labels_path))
+        print("Fit in %.3f s: %s feet per sample, zero index %s, reference rms error %s feet"
+              % (time.perf_counter() - start, result["feet_per_sample"], result["zero_index"], result["rms_error_feet"]))
+        calibration.save_calibration(calibration_path, result)
+
+        baseline = make_waveform([], feet_per_sample, zero_index, rng)
+        for name, load in [("default constants", False), ("calibrated", True)]:
+            detector = fault_detection.Detector(fault_detection.METHOD_BLS_PEAKS)
+            if load:
+                detector.load_calibration(calibration_path)
+            detector.set_baseline(baseline)
+            errors = []
+            for fault_type, feet in HELD_OUT:
+                detected = detector.detect_faults(make_waveform([(fault_type, feet)], feet_per_sample, zero_index, rng))
+                errors.append(abs(detected[1] - feet) if detected[0] == fault_type else np.inf)
+            print(name + ": held out fault errors " + ", ".join("%.2f" % e for e in errors) + " feet")
+        failures = check_uncalibrated()
+        if max(errors) > TOLERANCE_FEET:
+            failures += 1
+    print("PASSED" if failures == 0 else "FAILED")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#coarse_to_fine_test.py
+#checks that coarse-to-fine detection (Detector(..., coarse_to_fine=True)) gives the same results as the full spline
+#path: the same fault type, at distances within COARSE_TO_FINE_TOLERANCE spline samples, for healthy waveforms, waveforms
+#offset below the baseline (every BLS sample negative), and simulated opens & shorts along the cable.
+#
+#example: python test/coarse_to_fine_test.py
+
+import sys
+import os
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fault_detection as fd
+import sstdr_simulator
+
+METHODS = [("BLS_PEAKS", fd.METHOD_BLS_PEAKS), ("LOW_PASS_PEAKS", fd.METHOD_LOW_PASS_PEAKS)]
+NEGATIVE_OFFSETS = [50, 500, 1500] #below the BLS deviation threshold; a larger uniform offset leaves the BLS methods no peak to find
+FAULT_DISTANCES = range(30, 190, 20)
+
+def cases(baseline, rng):
+    #(name, waveform) pairs
+    yield ("healthy", sstdr_simulator.make_waveform([], rng))
+    for offset in NEGATIVE_OFFSETS:
+        yield ("baseline-%d" % offset, baseline - offset)
+    for fault_type, name in [(fd.FAULT_OPEN, "open"), (fd.FAULT_SHORT, "short")]:
+        for feet in FAULT_DISTANCES:
+            yield ("%s %d ft" % (name, feet), sstdr_simulator.make_waveform([(fault_type, feet)], rng))
+
+def main():
+    rng = np.random.default_rng(0)
+    baseline = sstdr_simulator.make_waveform([], rng)
+    tolerance = fd.COARSE_TO_FINE_TOLERANCE*fd.Detector().units_per_sample + 1e-9
+    failures = 0
+    total = 0
+    for method_name, method in METHODS:
+        full = fd.Detector(method)
+        coarse = fd.Detector(method, coarse_to_fine = True)
+        full.set_baseline(baseline)
+        coarse.set_baseline(baseline)
+        for name, wf in cases(baseline, rng):
+            total += 1
+            try:
+                expected = full.detect_faults(wf)
+                result = coarse.detect_faults(wf)
+            except Exception as e:
+                failures += 1
+                print(method_name + ", " + name + ": raised " + repr(e))
+                continue
+            if result[0] != expected[0] or abs(result[1] - expected[1]) > tolerance:
+                failures += 1
+                print(method_name + ", " + name + ": full " + str(expected) + ", coarse-to-fine " + str(result))
+    print(str(total) + " waveforms: " + ("PASSED" if failures == 0 else str(failures) + " FAILED"))
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#dictionary_test.py
+#trains a dictionary (dictionary_learning.py) from simulated logs of opens and shorts every 6 feet, labeled like a real
+#training set, then checks the fault type and distance it gives for held-out opens & shorts at random distances, both
+#with Dictionary.classify on a batch and through Detector (METHOD_DICTIONARY_LEARNING) one waveform at a time.
+#Detector reports no fault for reflections below its BLS deviation threshold; those are counted, but not as failures.
+#
+#command line arguments, can be provided in any order:
+#   -n [count]      : held-out waveforms (OPTIONAL, defaults to 200)
+#
+#example: python test/dictionary_test.py -n 500
+
+import sys
+import os
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fault_detection as fd
+import sstdr_simulator
+import dictionary_learning
+from log_writer import CSV_HEADER
+
+TRAINING_DISTANCES = np.arange(20, 240, 6.0)
+WAVEFORMS_PER_LOG = 10
+HELD_OUT_RANGE = (25, 235) #feet; inside the training distances
+MAX_ERROR_FEET = 3.0 #half the training step
+MEAN_ERROR_FEET = 1.5
+
+def write_training_set(tmp_dir, rng):
+    #a log of one healthy log (log 0) and a log per labeled fault, and its labels csv; returns the labels path
+    log_path = os.path.join(tmp_dir, "training.csv")
+    labels_path = os.path.join(tmp_dir, "labels.csv")
+    with open(log_path, "w") as f, open(labels_path, "w") as labels:
+        f.write(CSV_HEADER)
+        labels.write("file,log_number,fault_type,distance,baseline_log\n")
+        log_number = 0
+        for _ in range(WAVEFORMS_PER_LOG):
+            f.write("1,0,0,"+",".join(str(x) for x in sstdr_simulator.make_waveform([], rng))+"\n")
+        for name in ['open', 'short']:
+            for feet in TRAINING_DISTANCES:
+                log_number += 1
+                for _ in range(WAVEFORMS_PER_LOG):
+                    wf = sstdr_simulator.make_waveform([(sstdr_simulator.FAULT_NAMES[name], feet)], rng)
+                    f.write("1,"+str(log_number)+",0,"+",".join(str(x) for x in wf)+"\n")
+                labels.write(log_path+","+str(log_number)+","+name+","+str(feet)+",0\n")
+    return labels_path
+
+def main():
+    n = 200
+    if '-n' in sys.argv:
+        n = int(sys.argv[sys.argv.index('-n')+1])
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        labels_path = write_training_set(tmp_dir, rng)
+        dictionary_path = os.path.join(tmp_dir, "dictionary.npy")
+        atoms, fault_types, distances = dictionary_learning.train_dictionary(dictionary_learning.read_labels(labels_path))
+        dictionary_learning.save_dictionary(dictionary_path, atoms, fault_types, distances)
+        dictionary = dictionary_learning.load_dictionary(dictionary_path)
+        print("Trained "+str(len(dictionary))+" atoms")
+
+        baseline = sstdr_simulator.make_waveform([], rng)
+        true_types = np.where(np.arange(n) % 2 == 0, fd.FAULT_OPEN, fd.FAULT_SHORT)
+        true_distances = rng.uniform(HELD_OUT_RANGE[0], HELD_OUT_RANGE[1], n)
+        wfs = np.array([sstdr_simulator.make_waveform([(t, d)], rng) for t, d in zip(true_types, true_distances)])
+
+        detector = fd.Detector(fd.METHOD_DICTIONARY_LEARNING)
+        detector.set_baseline(baseline)
+        detector.load_dictionary(dictionary_path)
+        detected = np.array([detector.detect_faults(wf) for wf in wfs])
+        failures = 0
+        for name, (found_types, found_distances) in [("classify", dictionary.classify(wfs - baseline)), ("Detector", (detected[:,0], detected[:,1]))]:
+            missed = found_types == fd.FAULT_NONE
+            wrong_type = (found_types != true_types) & ~missed
+            errors = np.abs(found_distances - true_distances)[~wrong_type & ~missed]
+            print(name + ": " + str(np.sum(wrong_type)) + " of " + str(n) + " wrong fault type, " + str(np.sum(missed)) + " below threshold; distance error mean %.2f, max %.2f feet"
+                  % (np.mean(errors), np.max(errors)))
+            if name == "classify":
+                wrong_type |= missed #classify has no threshold
+            for i in np.flatnonzero(wrong_type)[:5]:
+                print("    " + fd.get_fault_name(true_types[i]) + " at %.1f ft reported as " % true_distances[i] + fd.get_fault_name(int(found_types[i])) + " at %.1f ft" % found_distances[i])
+            if np.any(wrong_type) or np.max(errors) > MAX_ERROR_FEET or np.mean(errors) > MEAN_ERROR_FEET:
+                failures += 1
+    print("PASSED" if failures == 0 else "FAILED")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
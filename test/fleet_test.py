@@ -0,0 +1,175 @@
+#fleet_test.py
+#runs a fleet collector against local processes standing in for field units (fleet.py -simulate), and checks that every
+#event each unit sent was stored exactly once. the collector is stopped partway through and restarted a little later, so
+#the units have to spool while it is down and resume where it left off. first, a unit is crashed partway through
+#compacting its spool, and restarted; every event it sent must still be stored exactly once.
+#
+#command line arguments, can be provided in any order:
+#   -p [count]      : unit processes (OPTIONAL, defaults to 10)
+#   -u [count]      : units per process (OPTIONAL, defaults to 30)
+#   -seconds [s]    : how long the units run (OPTIONAL, defaults to 20)
+#   -rate [hz]      : events per second per unit (OPTIONAL, defaults to 5)
+#
+#example: python test/fleet_test.py -p 10 -u 30
+
+import sys
+import os
+import re
+import time
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import fleet
+
+COMPACT_EVENTS = 5 #events sent before, and again after, the crash
+
+class Crash(Exception):
+    pass
+
+class SpoolFile:
+    #stands in for a client's spool file, so compact() can be crashed between its steps
+    def __init__(self, f, step):
+        self.f = f
+        self.step = step
+
+    def truncate(self, *args):
+        self.step()
+        return self.f.truncate(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+def stored_numbers(collector_dir, unit_id):
+    #the (#n) number of every event stored for a unit
+    path = os.path.join(collector_dir, unit_id, "events.csv")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [int(re.search(r"\(#(\d+)\)", line).group(1)) for line in f.readlines()[1:]]
+
+def check_compact_crash(tmp_dir):
+    #crashes a unit after the first of compact()'s two steps (emptying the spool file, saving the new base), restarts it,
+    #and checks every event it sent was stored exactly once. returns the number of failures
+    collector_dir = os.path.join(tmp_dir, "compact_collector")
+    spool_dir = os.path.join(tmp_dir, "compact_spool")
+    collector = fleet.FleetCollector(0, collector_dir, host="127.0.0.1")
+    collector.start()
+    address = ("127.0.0.1", collector.port)
+    compact_bytes = fleet.SPOOL_COMPACT_BYTES
+    fleet.SPOOL_COMPACT_BYTES = 1 #compact after every acknowledged batch
+    try:
+        client = fleet.FleetClient(address, "compact", spool_dir, waveform_interval=0)
+        #queued before start(), so they are all spooled before the first batch
+        for i in range(COMPACT_EVENTS):
+            client.event(time.time(), fleet.FAULT_NONE, 0, "System OK (#" + str(i) + ")")
+        steps = []
+        def step():
+            if len(steps) > 0:
+                steps.append(True)
+                if len(steps) == 3: #the second step inside compact()
+                    raise Crash()
+        real_compact = client.compact
+        real_save_state = client.save_state
+        def compact():
+            steps.append(True)
+            try:
+                real_compact()
+            finally:
+                del steps[:]
+        def save_state():
+            step()
+            real_save_state()
+        client.compact = compact
+        client.save_state = save_state
+        client.start()
+        client.spool = SpoolFile(client.spool, step)
+        client.thread.join(2*fleet.BATCH_INTERVAL + fleet.SOCKET_TIMEOUT)
+        if not isinstance(client.error, Crash):
+            print("compact crash: the unit didn't crash in compact() (" + repr(client.error) + ")")
+            return 1
+        print("compact crash: crashed, restarting the unit")
+
+        client = fleet.FleetClient(address, "compact", spool_dir, waveform_interval=0)
+        for i in range(COMPACT_EVENTS, 2*COMPACT_EVENTS):
+            client.event(time.time(), fleet.FAULT_NONE, 0, "System OK (#" + str(i) + ")")
+        client.start()
+        if not client.close():
+            print("compact crash: not every record was acknowledged after the restart")
+            return 1
+    finally:
+        fleet.SPOOL_COMPACT_BYTES = compact_bytes
+        collector.stop()
+    numbers = stored_numbers(collector_dir, "compact")
+    if numbers != list(range(2*COMPACT_EVENTS)):
+        print("compact crash: sent " + str(2*COMPACT_EVENTS) + " events, stored " + str(len(numbers)) + " (" + str(len(set(numbers))) + " distinct)")
+        return 1
+    print("compact crash: all " + str(2*COMPACT_EVENTS) + " events stored exactly once")
+    return 0
+
+def main():
+    processes = 10
+    units = 30
+    seconds = 20
+    rate = 5
+    args = sys.argv
+    if '-p' in args:
+        processes = int(args[args.index('-p')+1])
+    if '-u' in args:
+        units = int(args[args.index('-u')+1])
+    if '-seconds' in args:
+        seconds = float(args[args.index('-seconds')+1])
+    if '-rate' in args:
+        rate = float(args[args.index('-rate')+1])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        failures = check_compact_crash(tmp_dir)
+        collector_dir = os.path.join(tmp_dir, "collector")
+        collector = fleet.FleetCollector(0, collector_dir, host="127.0.0.1")
+        collector.start()
+        port = collector.port
+        print("Collector on port "+str(port)+"; starting "+str(processes)+" processes of "+str(units)+" units")
+        unit_processes = []
+        for p in range(processes):
+            command = [sys.executable, os.path.join(REPO_DIR, "fleet.py"), "-simulate", str(units), "-connect", "127.0.0.1:"+str(port),
+                       "-spool", os.path.join(tmp_dir, "spool"), "-seconds", str(seconds), "-rate", str(rate), "-prefix", "p%02du" % p]
+            unit_processes.append(subprocess.Popen(command, stdout=subprocess.PIPE, text=True))
+
+        #once every unit is sending, take the collector down for a while; the units spool, then resume once it is back
+        deadline = time.monotonic() + seconds/2
+        while len(collector.units) < processes*units and time.monotonic() < deadline:
+            time.sleep(0.1)
+        time.sleep(seconds/6)
+        print("Collector: " + collector.status()[0] + "; stopping it")
+        collector.stop()
+        time.sleep(seconds/3)
+        collector = fleet.FleetCollector(port, collector_dir, host="127.0.0.1")
+        collector.start()
+        print("Collector restarted")
+
+        sent = {} #unit id -> events sent
+        for process in unit_processes:
+            out, _ = process.communicate()
+            for line in out.splitlines():
+                unit_id, n_events, _, n_waveforms, _, status = line.split()
+                sent[unit_id] = int(n_events)
+                if status != "sent":
+                    print(unit_id + ": not every record was acknowledged")
+        print("Collector: " + collector.status()[0])
+        collector.stop()
+
+        unit_failures = 0
+        for unit_id, n_events in sorted(sent.items()):
+            numbers = stored_numbers(collector_dir, unit_id)
+            if numbers != list(range(n_events)):
+                unit_failures += 1
+                print(unit_id + ": sent " + str(n_events) + " events, stored " + str(len(numbers)) + " (" + str(len(set(numbers))) + " distinct)")
+        print(str(len(sent)) + " units, " + str(sum(sent.values())) + " events: " + ("all stored exactly once" if unit_failures == 0 else str(unit_failures) + " units FAILED"))
+        failures += unit_failures
+    print("PASSED" if failures == 0 else "FAILED")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
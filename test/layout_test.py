@@ -0,0 +1,55 @@
+#layout_test.py
+#checks that the three ways of describing a string in a layout file (implicit, panel_steps and panel_coords) compile to
+#the same layout: connectors, home cable, total length, and where faults are located on it. uses the strings of
+#small_panel_layout.yaml, which describe the same string in each form, and the same string with a return point instead
+#of a layout field.
+#
+#example: python test/layout_test.py
+
+import sys
+import os
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import panel_layout
+
+LAYOUT_PATH = os.path.join(REPO_DIR, "small_panel_layout.yaml")
+SAME_STRINGS = ["small_panels_implicit", "small_panels_steps", "small_panels_explicit"]
+FAULT_DISTANCES = [50, 196.9, 200, 214.5, 226.0, 300, 419, 425]
+TOLERANCE = 1e-6 #feet
+
+def describe(string):
+    #everything about a compiled string that should not depend on the form it was written in
+    values = list(string.connector_ds) + [string.home_cable_length, string.total_length]
+    for distance in FAULT_DISTANCES:
+        location = string.locate(distance)
+        values += [location.connector_index, location.cable_distance]
+    return values
+
+def same(a, b):
+    return len(a) == len(b) and all(abs(x - y) <= TOLERANCE for x, y in zip(a, b))
+
+def main():
+    strings = {string.name: string for string in panel_layout.load_layout(LAYOUT_PATH).strings}
+    expected = describe(strings[SAME_STRINGS[0]])
+    failures = 0
+    for name in SAME_STRINGS[1:]:
+        if not same(describe(strings[name]), expected):
+            failures += 1
+            print(name + ": total length " + str(strings[name].total_length) + ", connectors " + str(strings[name].connector_ds)
+                  + "; " + SAME_STRINGS[0] + " has " + str(strings[SAME_STRINGS[0]].total_length) + ", " + str(strings[SAME_STRINGS[0]].connector_ds))
+    #the explicit forms, with the return point to the SSTDR as their last location instead of a layout field
+    implicit = strings[SAME_STRINGS[0]]
+    coords = implicit.connector_ds[:-1] + [implicit.total_length]
+    for entry in [{'name': 'coords_return_point', 'panel_coords': coords},
+                  {'name': 'steps_return_point', 'panel_steps': [coords[0]] + [b - a for a, b in zip(coords, coords[1:])]}]:
+        string = panel_layout.compile_string(entry)
+        if not same(describe(string), expected):
+            failures += 1
+            print(entry['name'] + ": total length " + str(string.total_length) + ", expected " + str(implicit.total_length))
+    print("PASSED" if failures == 0 else str(failures) + " FAILED")
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
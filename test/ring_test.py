@@ -0,0 +1,83 @@
+#ring_test.py
+#checks that the capture process of SSTDR_USB's -mp mode (capture_sources.RingCapture) hands over the same waveforms,
+#through its shared memory ring, as framing the capture in this process does. then checks that a reader that falls
+#behind a small ring skips overwritten waveforms (counting them as dropped) instead of reading torn ones.
+#
+#example: python test/ring_test.py
+
+import sys
+import os
+import time
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PcapPacketReceiver as ppr
+import waveform_framer
+import sstdr_simulator
+import capture_sources
+from waveform_ring import WaveformRing
+
+def frame_in_process(path, device_class):
+    with open(path, "rb") as f:
+        receiver = ppr.PcapPacketReceiver(f)
+        receiver.run()
+    framer = waveform_framer.WaveformFramer(device_class)
+    waveforms = []
+    for block in list(receiver.q.queue):
+        framer.feed(block)
+        region = framer.next_region()
+        while region is not None:
+            waveforms.append((block.ts_sec + 1e-6*block.ts_usec, framer.region_to_waveform(region)))
+            region = framer.next_region()
+    return waveforms
+
+def compare_capture(path, device_class, expected):
+    capture = capture_sources.RingCapture(path, device_class = device_class)
+    capture.start()
+    received = []
+    deadline = time.monotonic() + 30
+    try:
+        while len(received) < len(expected) and time.monotonic() < deadline and capture.alive():
+            item = capture.next()
+            if item is None:
+                time.sleep(0.01)
+            else:
+                received.append(item)
+    finally:
+        capture.close()
+    matches = sum(abs(a[0] - b[0]) < 1e-6 and list(a[1]) == list(b[1]) for a, b in zip(received, expected))
+    ok = len(received) == len(expected) and matches == len(expected) and capture.dropped == 0
+    print("%d waveforms framed in process, %d received through the ring, %d match: %s" % (len(expected), len(received), matches, "OK" if ok else "FAILED"))
+    return ok
+
+def check_overrun():
+    #written & read in this process; attach() is for other processes
+    ring = WaveformRing.create(slots = 8, max_samples = 16)
+    try:
+        for i in range(20):
+            ring.write(i, np.full(16, i)) #sequence numbers 1-20; the 8 slots keep 13-20
+        oldest = ring.oldest()
+        ok = oldest == 13 and ring.read(12) is None and int(ring.read(13)[1][0]) == 12 and ring.read(20)[0] == 19
+    finally:
+        ring.close()
+        ring.unlink()
+    print("overwritten waveforms are skipped: " + ("OK" if ok else "FAILED"))
+    return ok
+
+def main():
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for device_class, name in [(waveform_framer.DEVICE_COMMERCIAL, "commercial"), (waveform_framer.DEVICE_PROTOTYPE, "prototype")]:
+            path = os.path.join(tmp_dir, name + ".pcap")
+            with open(path, "wb") as f:
+                f.write(sstdr_simulator.generate_capture(200, device_class = device_class, junk = 0.2, corrupt = 0.05, seed = 1))
+            print(name + ":")
+            ok = compare_capture(path, device_class, frame_in_process(path, device_class)) and ok
+    ok = check_overrun() and ok
+    print("ring matches" if ok else "RING FAILED")
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
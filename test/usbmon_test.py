@@ -0,0 +1,76 @@
+#usbmon_test.py
+#checks that linux usbmon captures decode to the same packets, and frame into the same waveforms, as USBPcap captures.
+#by default the captures are simulated (sstdr_simulator.py, once per format, with the same seed).
+#given a recorded capture instead (e.g. sudo tcpdump -i usbmon1 -w probe.pcap), it prints what was framed from it.
+#
+#example: python test/usbmon_test.py
+#         python test/usbmon_test.py probe.pcap [commercial|prototype]
+
+import sys
+import os
+import io
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PcapPacketReceiver as ppr
+import waveform_framer
+import sstdr_simulator
+
+FIELDS = ["endpoint", "function", "info", "bus", "address", "transfer_type", "payload"]
+
+def frame_capture(stream, device_class):
+    #returns (receiver, packets, waveform regions)
+    receiver = ppr.PcapPacketReceiver(stream)
+    receiver.run()
+    blocks = list(receiver.q.queue)
+    framer = waveform_framer.WaveformFramer(device_class)
+    regions = []
+    for block in blocks:
+        framer.feed(block)
+        region = framer.next_region()
+        while region is not None:
+            regions.append(region)
+            region = framer.next_region()
+    return (receiver, blocks, regions)
+
+def compare_formats(device_class, n_waveforms = 200):
+    results = {}
+    for linktype in [sstdr_simulator.LINKTYPE_USBPCAP, sstdr_simulator.LINKTYPE_USB_LINUX, sstdr_simulator.LINKTYPE_USB_LINUX_MMAPPED]:
+        capture = sstdr_simulator.generate_capture(n_waveforms, device_class = device_class, junk = 0.2, corrupt = 0.05, seed = 1, start_time = 1579000000, linktype = linktype)
+        results[linktype] = frame_capture(io.BytesIO(capture), device_class)
+    _, expected_blocks, expected_regions = results[sstdr_simulator.LINKTYPE_USBPCAP]
+    ok = True
+    for linktype in [sstdr_simulator.LINKTYPE_USB_LINUX, sstdr_simulator.LINKTYPE_USB_LINUX_MMAPPED]:
+        receiver, blocks, regions = results[linktype]
+        mismatches = 0
+        for expected, block in zip(expected_blocks, blocks):
+            for field in FIELDS:
+                if getattr(expected.packet, field) != getattr(block.packet, field):
+                    mismatches += 1
+            if (expected.ts_sec, expected.ts_usec) != (block.ts_sec, block.ts_usec) or (expected.packet.status == 0) != (block.packet.status == 0):
+                mismatches += 1
+        same = len(blocks) == len(expected_blocks) and mismatches == 0 and regions == expected_regions
+        ok = ok and same
+        print("linktype %d (%s): %d packets, %d mismatched fields, %d/%d waveforms match: %s" % (linktype, receiver.decoder.__name__, len(blocks), mismatches,
+              sum(a == b for a, b in zip(regions, expected_regions)), len(expected_regions), "OK" if same else "FAILED"))
+    return ok
+
+def main():
+    if len(sys.argv) >= 2:
+        device_class = waveform_framer.DEVICE_PROTOTYPE if len(sys.argv) >= 3 and sys.argv[2].lower() == 'prototype' else waveform_framer.DEVICE_COMMERCIAL
+        with open(sys.argv[1], "rb") as f:
+            receiver, blocks, regions = frame_capture(f, device_class)
+        print("linktype %d (%s): %d packets, %d waveforms" % (receiver.linktype, receiver.decoder.__name__, len(blocks), len(regions)))
+        for region in regions[:5]:
+            print(waveform_framer.convert_waveform_region(region[waveform_framer.COMMERCIAL_HEADER_LENGTH:]) if device_class == waveform_framer.DEVICE_COMMERCIAL
+                  else waveform_framer.convert_waveform_region_prototype(region)[waveform_framer.PROTOTYPE_HEADER_SAMPLES:-1])
+        return
+    ok = True
+    for device_class, name in [(waveform_framer.DEVICE_COMMERCIAL, "commercial"), (waveform_framer.DEVICE_PROTOTYPE, "prototype")]:
+        print(name + ":")
+        ok = compare_formats(device_class) and ok
+    print("all formats match" if ok else "FORMATS DIFFER")
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
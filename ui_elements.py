@@ -3,6 +3,9 @@
 
 import pygame
 
+#constants
+TEXT_CACHE_SIZE = 64 #rendered strings kept per TextCache; the cache is cleared when full
+
 class Button:
     #static list of all buttons, used for drawing/colission checking
     buttons = []
@@ -26,6 +29,7 @@ class Button:
         self.surf = pygame.Surface(self.size)
         self.text_surf = font.render(text, True, color_text)
         self.rect = pygame.Rect(x, y, self.size_x, self.size_y)
+        self.highlight = None
         self.set_highlight(False)
         
     def move(self, x, y):
@@ -33,8 +37,101 @@ class Button:
         self.rect.y = y
         
     def set_highlight(self, highlight=True):
+        #returns True if the button's surface changed (it is only redrawn when the highlight does)
+        highlight = bool(highlight)
+        if highlight == self.highlight:
+            return False
+        self.highlight = highlight
         if highlight:
             self.surf.fill(self.color_highlight)
         else:
             self.surf.fill(self.color_bg)
         self.surf.blit(self.text_surf,(self.text_padding, self.text_padding))
+        return True
+
+class TextCache:
+    """
+    Renders text in one font & color, reusing the surface rendered last time
+    the same text was asked for.
+
+    Usage:
+    cache = TextCache(font, color); surf = cache.render(text). Rendering
+    unchanged text every frame then costs a dictionary lookup, and returns
+    the same surface object, so LayeredScreen sees nothing changed.
+    """
+    def __init__(self, font, color, max_size = TEXT_CACHE_SIZE):
+        self.font = font
+        self.color = color
+        self.max_size = max_size
+        self.surfs = {}
+
+    def render(self, text):
+        surf = self.surfs.get(text)
+        if surf is None:
+            if len(self.surfs) >= self.max_size:
+                self.surfs.clear() #e.g. a timer or fault distance that keeps changing
+            surf = self.font.render(text, True, self.color)
+            self.surfs[text] = surf
+        return surf
+
+class LayeredScreen:
+    """
+    Draws a screen made of layered surfaces, updating only the areas that
+    changed since the previous frame.
+
+    Usage:
+    each frame, call draw(layers), where layers is a list of
+    (name, surface, rect) in drawing order. A layer is redrawn if its
+    surface or rect differs from the layer of the same name in the previous
+    frame, or if it has appeared or disappeared. Call mark_dirty(rect) for
+    a surface whose contents changed in place (e.g. a highlighted button).
+    The dirty areas are redrawn from every layer overlapping them, and only
+    they are sent to the display, with pygame.display.update(rects).
+    The first frame, and the frame after redraw_all(), flip the whole screen.
+    """
+    def __init__(self, screen):
+        self.screen = screen
+        self.last_layers = {}
+        self.dirty = []
+        self.full_redraw = True
+
+    def mark_dirty(self, rect):
+        self.dirty.append(pygame.Rect(rect))
+
+    def redraw_all(self):
+        self.full_redraw = True
+
+    def draw(self, layers):
+        #returns the list of updated rects
+        current = {}
+        for name, surf, rect in layers:
+            current[name] = (surf, pygame.Rect(rect))
+        dirty = self.dirty
+        self.dirty = []
+        if self.full_redraw:
+            for name, surf, rect in layers:
+                self.screen.blit(surf, rect)
+            pygame.display.flip()
+            self.full_redraw = False
+            self.last_layers = current
+            return [self.screen.get_rect()]
+        for name, (surf, rect) in current.items():
+            last = self.last_layers.get(name)
+            if last is None:
+                dirty.append(rect)
+            elif last[0] is not surf or last[1] != rect:
+                dirty.append(last[1])
+                dirty.append(rect)
+        for name, (surf, rect) in self.last_layers.items():
+            if name not in current:
+                dirty.append(rect)
+        self.last_layers = current
+        for area in dirty:
+            self.screen.set_clip(area)
+            for name, surf, rect in layers:
+                if area.colliderect(rect):
+                    self.screen.blit(surf, rect)
+        self.screen.set_clip(None)
+        if len(dirty) > 0:
+            pygame.display.update(dirty)
+        return dirty
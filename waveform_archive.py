@@ -0,0 +1,403 @@
+#waveform_archive.py
+#compressed long-term archive format for waveform logs.
+#consecutive waveforms differ very little, so each waveform is stored as its residual from a reference: the previous
+#row (REFERENCE_PREVIOUS) or the baseline of its session (REFERENCE_BASELINE; by default the first row of the session).
+#residuals are small ints, so they are zigzag encoded into the smallest unsigned width that fits them (often one byte),
+#byte-shuffled, and compressed in fixed-size chunks with zlib or lzma. every chunk is self-contained and holds rows of a single session, so any chunk can be decompressed
+#on its own: random access by time only decompresses the chunks that overlap the requested range.
+#
+#file layout (little endian):
+#   header, 16 bytes: magic b'SSTDRWFA', u16 format version, u16 samples per waveform, u8 codec, u8 reference mode, u16 reserved
+#   chunks, back to back (in REFERENCE_PREVIOUS mode, the reference row of a chunk is its first row): chunk header (CHUNK_HEADER_DTYPE), then its compressed payload:
+#       log number deltas (i32 x rows), timestamps XORed with the previous timestamp (u64 x rows), reference row
+#       (i32 x samples), zigzag encoded residuals (rows x samples), each byte-shuffled (all first bytes, then all second bytes...)
+#
+#conversion, command line arguments, can be provided in any order after the input & output paths:
+#   python waveform_archive.py [input path] [output path]
+#   -lzma       : compress with lzma instead of zlib (slower, smaller)
+#   -baseline   : reference each waveform to its session's first waveform instead of the previous waveform
+#   -chunk [N]  : rows per chunk (OPTIONAL, defaults to 1024)
+#   the direction is chosen by extension: an ARCHIVE_EXTENSION input is extracted to csv (or binary_log, by output
+#   extension); anything else (csv or binary_log) is archived.
+#
+#example: python waveform_archive.py SSTDR_waveforms.csv SSTDR_waveforms.wfa -lzma
+
+import sys
+import os
+import zlib
+import lzma
+import numpy as np
+
+import binary_log
+
+#constants
+USAGE_STRING = "Usage: python "+ sys.argv[0] +" [input path] [output path] -lzma -baseline -chunk [rows per chunk; optional]"
+ARCHIVE_EXTENSION = ".wfa"
+MAGIC = b'SSTDRWFA'
+VERSION = 1
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u2'), ('waveform_length', '<u2'), ('codec', 'u1'), ('reference', 'u1'), ('reserved', '<u2')])
+HEADER_SIZE = HEADER_DTYPE.itemsize
+CHUNK_HEADER_DTYPE = np.dtype([('payload_size', '<u4'), ('row_count', '<u4'), ('session_number', '<i4'), ('residual_size', 'u1'), ('reserved', 'V3'), ('first_timestamp', '<f8'), ('last_timestamp', '<f8')])
+CHUNK_HEADER_SIZE = CHUNK_HEADER_DTYPE.itemsize
+DEFAULT_CHUNK_ROWS = 1024
+
+CODEC_ZLIB = 0
+CODEC_LZMA = 1
+ZLIB_LEVEL = 6
+
+REFERENCE_PREVIOUS = 0
+REFERENCE_BASELINE = 1
+
+def is_archive_path(path):
+    return os.path.splitext(path)[1].lower() == ARCHIVE_EXTENSION
+
+def compress(data, codec):
+    if codec == CODEC_LZMA:
+        return lzma.compress(data)
+    return zlib.compress(data, ZLIB_LEVEL)
+
+def decompress(data, codec):
+    if codec == CODEC_LZMA:
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+def zigzag(a):
+    #signed to unsigned, interleaving positives & negatives (0, -1, 1, -2...) so small magnitudes have zero high bytes
+    a = a.astype(np.int64)
+    return ((a << 1) ^ (a >> 63)).astype(np.uint64)
+
+def unzigzag(z):
+    z = z.astype(np.uint64)
+    return ((z >> np.uint64(1)).astype(np.int64) ^ -(z & np.uint64(1)).astype(np.int64))
+
+def shuffle(a):
+    #bytes of an array, grouped by byte significance: small values leave long runs of identical high bytes
+    return np.ascontiguousarray(a).view(np.uint8).reshape(-1, a.dtype.itemsize).T.tobytes()
+
+def unshuffle(data, dtype, count):
+    dtype = np.dtype(dtype)
+    return np.frombuffer(data, dtype=np.uint8, count=count*dtype.itemsize).reshape(dtype.itemsize, count).T.copy().view(dtype).ravel()
+
+######################################################
+##                     WRITING                      ##
+######################################################
+
+class ArchiveWriter:
+    """
+    Appends waveforms to an archive, one compressed chunk at a time.
+
+    Usage:
+    call write() for every waveform, and close() when done; rows are kept
+    in memory until their chunk is full (or the session changes), so at
+    most chunk_rows rows are lost if the writer is not closed.
+    baselines can map session numbers to baseline waveforms for
+    REFERENCE_BASELINE; otherwise the first waveform of each session is used.
+    Appending to an existing archive keeps that archive's codec & reference,
+    and first cuts off a chunk left incomplete by a crash (see ArchiveReader),
+    so the new chunks don't end up after bytes no reader can skip.
+    """
+    def __init__(self, path, codec = CODEC_ZLIB, reference = REFERENCE_PREVIOUS, chunk_rows = DEFAULT_CHUNK_ROWS, waveform_length = binary_log.WAVEFORM_LENGTH, baselines = None):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.baselines = {} if baselines is None else dict(baselines)
+        self.rows = []
+        self.session_number = None
+        self.chunks_written = 0
+        self.bytes_written = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                header = read_header(f)
+                end = HEADER_SIZE
+                for _, _, end in iter_chunk_headers(f, os.path.getsize(path)):
+                    pass
+            self.codec = int(header['codec'])
+            self.reference = int(header['reference'])
+            self.waveform_length = int(header['waveform_length'])
+            self.f = open(path, "r+b")
+            self.f.truncate(end) #drop a partial chunk; appending after it would make every later chunk unreadable
+            self.f.seek(end)
+        else:
+            self.codec = codec
+            self.reference = reference
+            self.waveform_length = waveform_length
+            self.f = open(path, "wb")
+            self.f.write(header_bytes(waveform_length, codec, reference))
+
+    def write(self, session_number, log_number, timestamp, wf):
+        if self.session_number is not None and session_number != self.session_number:
+            self.flush_chunk()
+        self.session_number = session_number
+        if self.reference == REFERENCE_BASELINE and session_number not in self.baselines:
+            self.baselines[session_number] = np.array(wf)
+        self.rows.append((log_number, timestamp, wf))
+        if len(self.rows) >= self.chunk_rows:
+            self.flush_chunk()
+
+    def write_records(self, records):
+        #writes a binary_log structured array (e.g. from binary_log.open_log)
+        for record in records:
+            self.write(int(record['session_number']), int(record['log_number']), float(record['timestamp']), record['waveform'])
+
+    def flush_chunk(self):
+        if len(self.rows) == 0:
+            return
+        log_numbers = np.array([row[0] for row in self.rows], dtype='<i4')
+        timestamps = np.array([row[1] for row in self.rows], dtype='<f8')
+        wfs = np.array([row[2] for row in self.rows], dtype=np.int64)
+        if wfs.min() < binary_log.SAMPLE_MIN or wfs.max() > binary_log.SAMPLE_MAX:
+            raise ValueError("Waveform samples do not fit in int16.")
+        if self.reference == REFERENCE_BASELINE:
+            reference = np.array(self.baselines[self.session_number], dtype=np.int64)
+            residuals = wfs - reference
+        else:
+            #the first row of the chunk is the reference; every row is stored as its difference from the previous row
+            reference = wfs[0]
+            residuals = np.diff(wfs, axis=0, prepend=wfs[:1])
+        residuals = zigzag(residuals)
+        residual_dtype = np.dtype('<u8')
+        for dtype in ['<u1', '<u2', '<u4']:
+            if residuals.size == 0 or residuals.max() <= np.iinfo(dtype).max:
+                residual_dtype = np.dtype(dtype)
+                break
+        log_deltas = np.diff(log_numbers, prepend=np.int32(0)).astype('<i4')
+        timestamp_bits = timestamps.view('<u8')
+        timestamp_xors = timestamp_bits ^ np.concatenate([[np.uint64(0)], timestamp_bits[:-1]]).astype('<u8')
+        payload = b''.join([shuffle(log_deltas), shuffle(timestamp_xors), shuffle(reference.astype('<i4')), shuffle(residuals.astype(residual_dtype))])
+        payload = compress(payload, self.codec)
+        chunk_header = np.zeros(1, dtype=CHUNK_HEADER_DTYPE)
+        chunk_header['payload_size'] = len(payload)
+        chunk_header['row_count'] = len(self.rows)
+        chunk_header['session_number'] = self.session_number
+        chunk_header['residual_size'] = residual_dtype.itemsize
+        chunk_header['first_timestamp'] = timestamps[0]
+        chunk_header['last_timestamp'] = timestamps[-1]
+        self.f.write(chunk_header.tobytes())
+        self.f.write(payload)
+        self.chunks_written += 1
+        self.bytes_written += CHUNK_HEADER_SIZE + len(payload)
+        self.rows = []
+
+    def close(self):
+        self.flush_chunk()
+        self.f.close()
+
+def header_bytes(waveform_length, codec, reference):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['waveform_length'] = waveform_length
+    header['codec'] = codec
+    header['reference'] = reference
+    return header.tobytes()
+
+######################################################
+##                     READING                      ##
+######################################################
+
+def read_header(f):
+    raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError("Not a waveform archive: file is shorter than its header.")
+    header = np.frombuffer(raw, dtype=HEADER_DTYPE)[0]
+    if header['magic'] != MAGIC:
+        raise ValueError("Not a waveform archive: bad magic.")
+    if header['version'] != VERSION:
+        raise ValueError("Unsupported waveform archive version: "+str(header['version']))
+    return header
+
+def iter_chunk_headers(f, size):
+    #yields (payload offset, chunk header, end offset) of every complete chunk of an open archive, hopping over the
+    #payloads; stops at the first chunk cut short
+    offset = HEADER_SIZE
+    while offset + CHUNK_HEADER_SIZE <= size:
+        f.seek(offset)
+        chunk_header = np.frombuffer(f.read(CHUNK_HEADER_SIZE), dtype=CHUNK_HEADER_DTYPE)[0]
+        end = offset + CHUNK_HEADER_SIZE + int(chunk_header['payload_size'])
+        if end > size:
+            return
+        yield (offset + CHUNK_HEADER_SIZE, chunk_header, end)
+        offset = end
+
+class ArchiveReader:
+    """
+    Reads an archive chunk by chunk.
+
+    Opening an archive builds its chunk index (offset, session and time
+    range of every chunk) by hopping over chunk headers, without
+    decompressing anything. A chunk cut short (e.g. by a crash while
+    writing) ends the index.
+    Chunks are decoded into binary_log record arrays (fields session_number,
+    log_number, timestamp, waveform), so archived and binary logs can be
+    processed the same way.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path, "rb")
+        header = read_header(self.f)
+        self.codec = int(header['codec'])
+        self.reference = int(header['reference'])
+        self.waveform_length = int(header['waveform_length'])
+        self.dtype = binary_log.record_dtype(self.waveform_length)
+        self.chunks = [] #(payload offset, chunk header)
+        for payload_offset, chunk_header, _ in iter_chunk_headers(self.f, os.path.getsize(path)):
+            self.chunks.append((payload_offset, chunk_header))
+        self.first_timestamps = np.array([float(h['first_timestamp']) for _, h in self.chunks])
+        self.last_timestamps = np.array([float(h['last_timestamp']) for _, h in self.chunks])
+
+    def __len__(self):
+        return int(sum([int(h['row_count']) for _, h in self.chunks]))
+
+    def close(self):
+        self.f.close()
+
+    def read_chunk(self, i):
+        payload_offset, chunk_header = self.chunks[i]
+        self.f.seek(payload_offset)
+        payload = decompress(self.f.read(int(chunk_header['payload_size'])), self.codec)
+        n = int(chunk_header['row_count'])
+        L = self.waveform_length
+        residual_dtype = np.dtype('<u'+str(int(chunk_header['residual_size'])))
+        log_end = 4*n
+        ts_end = log_end + 8*n
+        ref_end = ts_end + 4*L
+        records = np.zeros(n, dtype=self.dtype)
+        records['session_number'] = chunk_header['session_number']
+        records['log_number'] = np.cumsum(unshuffle(payload[:log_end], '<i4', n))
+        records['timestamp'] = np.bitwise_xor.accumulate(unshuffle(payload[log_end:ts_end], '<u8', n)).view('<f8')
+        reference = unshuffle(payload[ts_end:ref_end], '<i4', L).astype(np.int64)
+        residuals = unzigzag(unshuffle(payload[ref_end:], residual_dtype, n*L)).reshape(n, L)
+        if self.reference == REFERENCE_BASELINE:
+            records['waveform'] = residuals + reference
+        else:
+            records['waveform'] = np.cumsum(residuals, axis=0) + reference
+        return records
+
+    def find_chunks(self, session_number = None, start_time = None, end_time = None):
+        #indices of the chunks that may hold rows of the session, timestamped within [start_time, end_time]
+        keep = np.ones(len(self.chunks), dtype=bool)
+        if session_number is not None:
+            keep &= np.array([h['session_number'] == session_number for _, h in self.chunks], dtype=bool)
+        if start_time is not None:
+            keep &= self.last_timestamps >= start_time
+        if end_time is not None:
+            keep &= self.first_timestamps <= end_time
+        return np.nonzero(keep)[0]
+
+    def iter_chunks(self, session_number = None, start_time = None, end_time = None):
+        #yields record arrays one chunk at a time, trimmed to the requested range; memory use is bounded by the chunk size
+        for i in self.find_chunks(session_number, start_time, end_time):
+            records = self.read_chunk(i)
+            if start_time is not None:
+                records = records[records['timestamp'] >= start_time]
+            if end_time is not None:
+                records = records[records['timestamp'] <= end_time]
+            if len(records) > 0:
+                yield records
+
+    def read(self, session_number = None, start_time = None, end_time = None):
+        chunks = list(self.iter_chunks(session_number, start_time, end_time))
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=self.dtype)
+        return np.concatenate(chunks)
+
+def read_ungrouped(path):
+    #same layout as fault_detection.read_csv_ungrouped: one int row per waveform, [session, log, timestamp, samples...]
+    reader = ArchiveReader(path)
+    records = reader.read()
+    reader.close()
+    rows = np.empty((len(records), 3 + reader.waveform_length), dtype=int)
+    rows[:,0] = records['session_number']
+    rows[:,1] = records['log_number']
+    rows[:,2] = records['timestamp']
+    rows[:,3:] = records['waveform']
+    return rows
+
+######################################################
+##                   CONVERSION                     ##
+######################################################
+
+def iter_log_records(path, chunk_rows = DEFAULT_CHUNK_ROWS):
+    #yields binary_log record arrays from a csv or binary log, a chunk at a time
+    if binary_log.is_binary_path(path):
+        records = binary_log.open_log(path)
+        for start in range(0, len(records), chunk_rows):
+            yield records[start:start+chunk_rows]
+        return
+    with open(path, "r") as f:
+        f.readline() #header row
+        rows = []
+        fields = None #commas per row, from the first row; rows with another count (e.g. cut short by a crash) are skipped
+        for line in f:
+            if line.strip() == '':
+                continue
+            if fields is None:
+                fields = line.count(',')
+            elif line.count(',') != fields:
+                continue
+            rows.append(line)
+            if len(rows) >= chunk_rows:
+                yield parse_csv_rows(rows)
+                rows = []
+        if len(rows) > 0:
+            yield parse_csv_rows(rows)
+
+def parse_csv_rows(lines):
+    values = np.array(','.join([line.strip() for line in lines]).split(','), dtype=float).reshape(len(lines), -1)
+    records = np.zeros(len(lines), dtype=binary_log.record_dtype(values.shape[1]-3))
+    records['session_number'] = values[:,0]
+    records['log_number'] = values[:,1]
+    records['timestamp'] = values[:,2]
+    records['waveform'] = values[:,3:]
+    return records
+
+def archive_log(log_path, archive_path, codec = CODEC_ZLIB, reference = REFERENCE_PREVIOUS, chunk_rows = DEFAULT_CHUNK_ROWS):
+    #returns the number of rows archived
+    writer = None
+    count = 0
+    for records in iter_log_records(log_path, chunk_rows):
+        if writer is None:
+            writer = ArchiveWriter(archive_path, codec, reference, chunk_rows, records.dtype['waveform'].shape[0])
+        writer.write_records(records)
+        count += len(records)
+    if writer is None:
+        writer = ArchiveWriter(archive_path, codec, reference, chunk_rows)
+    writer.close()
+    return count
+
+def extract_archive(archive_path, log_path):
+    #writes every row of an archive to a csv or binary log (by extension); returns the number of rows
+    from log_writer import format_row, CSV_HEADER
+    reader = ArchiveReader(archive_path)
+    count = 0
+    binary = binary_log.is_binary_path(log_path)
+    with open(log_path, "wb") as f:
+        f.write(binary_log.header_bytes(reader.waveform_length) if binary else CSV_HEADER.encode())
+        for records in reader.iter_chunks():
+            if binary:
+                f.write(records.tobytes())
+            else:
+                f.write(''.join([format_row(int(r['session_number']), int(r['log_number']), float(r['timestamp']), r['waveform']) for r in records]).encode())
+            count += len(records)
+    reader.close()
+    return count
+
+def main():
+    if len(sys.argv) < 3:
+        print("Error: invalid input.")
+        print(USAGE_STRING)
+        return
+    in_path = sys.argv[1]
+    out_path = sys.argv[2]
+    codec = CODEC_LZMA if '-lzma' in sys.argv else CODEC_ZLIB
+    reference = REFERENCE_BASELINE if '-baseline' in sys.argv else REFERENCE_PREVIOUS
+    chunk_rows = DEFAULT_CHUNK_ROWS
+    if '-chunk' in sys.argv:
+        chunk_rows = int(sys.argv[sys.argv.index('-chunk')+1])
+    if is_archive_path(in_path):
+        count = extract_archive(in_path, out_path)
+    else:
+        count = archive_log(in_path, out_path, codec, reference, chunk_rows)
+    print("Finished. Converted "+str(count)+" rows to: "+out_path+" ("+str(os.path.getsize(out_path))+" bytes, from "+str(os.path.getsize(in_path))+")")
+
+if __name__ == '__main__':
+    main()
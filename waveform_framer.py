@@ -0,0 +1,147 @@
+#waveform_framer.py
+#assembles SSTDR correlation waveforms out of the USB packets produced by a PcapPacketReceiver.
+#the framing logic used to live inline in the SSTDR_USB main loop; it is kept here so it can be reused (and timed) on its own.
+
+######################################################
+##                 DEVICE SUPPORT                   ##
+######################################################
+
+DEVICE_PROTOTYPE = 0 #such as the UF lab's PCB SSTDR
+DEVICE_COMMERCIAL = 1 #such as the commercial devices available at the U and livewire
+
+PROTOTYPE_PREFIX = b'\xaa\xaa\xaa\xad\x00\xbf' #valid waveform regions start with this pattern
+PROTOTYPE_ENDPOINT = 0x83
+COMMERCIAL_PREFIX = b'\x7F\xF2\x7F\xF3\x7F\xF1\xFE\xFE\x01\x01' #valid waveform regions start with this pattern (kingston devices)
+COMMERCIAL_ENDPOINT = 0x86
+COMMERCIAL_PACKET_LENGTH = 512 #all data seems to come in blocks of 512 for comm. devices
+COMMERCIAL_HEADER_LENGTH = 20 #bytes in front of the samples of a commercial waveform region (includes the prefix)
+PROTOTYPE_HEADER_SAMPLES = 6 #int16 values in front of the samples of a prototype waveform region (includes the prefix)
+
+URB_FUNCTION_BULK_OR_INTERRUPT_TRANSFER = 0x09
+MAX_BYTECOUNT = 512*4 #flush payload buffer after reaching a buffer of this size
+
+#results of WaveformFramer.feed()
+FEED_IGNORED = 0 #packet was not from the device's waveform endpoint
+FEED_APPENDED = 1 #payload was appended to the buffer
+FEED_OVERFLOW = 2 #buffer was overfull; it was flushed and restarted with this payload
+FEED_FLUSHED = 3 #packet came from the device but had an invalid payload; buffer was flushed
+
+def get_device_constants(device_class):
+    #returns (waveform prefix, device endpoint) for a device class
+    if device_class == DEVICE_PROTOTYPE:
+        return (PROTOTYPE_PREFIX, PROTOTYPE_ENDPOINT)
+    else:
+        return (COMMERCIAL_PREFIX, COMMERCIAL_ENDPOINT)
+
+class WaveformFramer:
+    """
+    Buffers payloads from a device's waveform endpoint and splits them into
+    waveform regions, using the prefix that starts every region.
+
+    Usage:
+    call feed() with every PacketBlock taken from a receiver's queue. When
+    there is time to spare, call next_region(); it returns the bytes of one
+    complete waveform region (from its prefix up to the next prefix), or None
+    if no complete region is buffered yet. Regions are converted to samples
+    with region_to_waveform().
+    """
+    def __init__(self, device_class):
+        self.device_class = device_class
+        self.prefix, self.endpoint = get_device_constants(device_class)
+        self.flush()
+
+    def flush(self):
+        self.payload_string = b'' #concatenated bytes from all unprocessed packets
+        self.process_start_index = 0 #the index at which the currently considered payload string starts (inclusive).
+        self.process_end_index = 0 #the index at which the currently considered payload string ends (exclusive).
+        self.byte_count = 0
+
+    def feed(self, pBlock):
+        #if received packet may be in a waveform region of the stream:
+        #criteria: input (to host) from device endpoint and function == URB_FUNCTION_BULK_OR_INTERRUPT_TRANSFER
+        packet = pBlock.packet
+        if not (packet.endpoint == self.endpoint and packet.function == URB_FUNCTION_BULK_OR_INTERRUPT_TRANSFER and packet.info == 1 and packet.status == 0):
+            return FEED_IGNORED #if we received an unwanted payload, ignore it.
+        p = packet.payload
+        l = len(p)
+        if (self.device_class == DEVICE_PROTOTYPE or (self.device_class == DEVICE_COMMERCIAL and l == COMMERCIAL_PACKET_LENGTH)):
+            if self.byte_count + l > MAX_BYTECOUNT:
+                #if buffer overflowing, flush
+                self.payload_string = p
+                self.byte_count = l
+                self.process_start_index = 0
+                self.process_end_index = 0
+                return FEED_OVERFLOW
+            #else, append payload to buffer
+            self.payload_string = self.payload_string + p
+            self.byte_count = self.byte_count + l
+            return FEED_APPENDED
+        elif self.byte_count > 0:
+            #received packet from the device, but it's not valid; need to flush the buffer.
+            self.flush()
+            return FEED_FLUSHED
+        return FEED_IGNORED
+
+    def next_region(self):
+        if self.byte_count == 0:
+            return None
+        #check if we've started processing a waveform yet
+        if self.process_end_index == 0: #if we haven't started processing a waveform yet
+            prefix_start_index = self.payload_string.find(self.prefix)
+            if prefix_start_index != -1:
+                #waveform prefix found.
+                self.process_start_index = prefix_start_index
+                self.process_end_index = self.process_start_index + len(self.prefix)
+        #if we've started a waveform, check if we can finish one
+        if self.process_end_index > 0:
+            next_prefix_index = self.payload_string[self.process_end_index:].find(self.prefix)
+            if next_prefix_index != -1:
+                #we found the next waveform's prefix!
+                self.process_end_index = next_prefix_index + self.process_end_index
+                region = self.payload_string[self.process_start_index:self.process_end_index]
+                #prepare to process the next waveform
+                self.payload_string = self.payload_string[self.process_end_index:]
+                self.byte_count = len(self.payload_string)
+                self.process_start_index = 0
+                self.process_end_index = self.process_start_index + len(self.prefix)
+                return region
+        #no end to this waveform was found. sit on it.
+        return None
+
+    def region_to_waveform(self, region):
+        if self.device_class == DEVICE_PROTOTYPE:
+            return convert_waveform_region_prototype(region)[PROTOTYPE_HEADER_SAMPLES:-1]
+        else:
+            return convert_waveform_region(region[COMMERCIAL_HEADER_LENGTH:])
+
+def convert_waveform_region_prototype(pString):
+    """takes a bytestring of arbitrary length, converts it into little-endian int16s. ignores trailing odd bytes"""
+    N = len(pString)
+    Nh = int(N/2)
+    concat = [0]*Nh
+    for i in range(Nh):
+        vl = pString[2*i] #indexing with a scalar returns an integer
+        vr = pString[2*i+1]
+        #combine , little endian
+        value = ((vr<<8)+vl)
+        #convert to signed integer
+        if (value & 0x8000 != 0):
+            value = value - 2**16
+        concat[i] = value
+    return concat
+
+def convert_waveform_region(pString):
+    """takes a bytestring of arbitrary length, converts it into big-endian int16s. ignores trailing odd bytes"""
+    N = len(pString)
+    Nh = int(N/2)
+    concat = [0]*Nh
+    for i in range(Nh):
+        vl = pString[2*i] #indexing with a scalar returns an integer
+        vr = pString[2*i+1]
+        #combine , big endian
+        value = ((vl<<8)+vr)
+        #convert to signed integer
+        if (value & 0x8000 != 0):
+            value = value - 2**16
+        concat[i] = value
+    return concat
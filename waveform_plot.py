@@ -0,0 +1,246 @@
+#waveform_plot.py
+#draws the live correlation waveform plot straight onto a pygame surface, in place of a matplotlib figure.
+#the axes, gridlines and tick labels only change when the distance axis (or y range) changes, so they are drawn once onto
+#a background surface; each frame blits the background and draws the trace and markers on top of it.
+#Waterfall shows the recent history of the trace as a scrolling heatmap (one row per WATERFALL_ROW_INTERVAL).
+
+import time
+import numpy as np
+import pygame
+
+#constants
+PLOT_SIZE = (640, 480) #same as the default matplotlib figure, so the plot window keeps its size
+MARGIN_LEFT = 90
+MARGIN_RIGHT = 20
+MARGIN_TOP = 20
+MARGIN_BOTTOM = 60
+TICK_COUNT = 6 #at most this many ticks (and gridlines) per axis
+TICK_LENGTH = 5
+
+COLOR_BACKGROUND = (255, 255, 255)
+COLOR_AXES = (  0,   0,   0)
+COLOR_GRID = (220, 220, 220)
+COLOR_TRACE = ( 31, 119, 180) #matplotlib's first two line colors
+COLOR_MARKER = (255, 127,  14)
+TRACE_WIDTH = 2
+WATERFALL_HISTORY = 600 #rows of history shown by a Waterfall; one pixel row each
+WATERFALL_ROW_INTERVAL = 1.0 #seconds between waterfall rows, so the default history covers 10 minutes
+WATERFALL_BLS_RANGE = 400 #BLS colored from -this to +this; faults leave a few hundred counts, ~10x the detector's fault threshold
+COLORMAP_ANCHORS = [(0, 0, 96), (0, 64, 255), (255, 255, 255), (255, 64, 0), (96, 0, 0)] #negative -> zero -> positive
+
+def nice_ticks(lo, hi, count = TICK_COUNT):
+    #round tick values (multiples of 1, 2 or 5 times a power of ten) within [lo, hi]
+    span = hi - lo
+    if span <= 0:
+        return np.array([lo])
+    step = 10**np.floor(np.log10(span/count))
+    for multiple in [1, 2, 5, 10]:
+        if span/(step*multiple) <= count:
+            step = step*multiple
+            break
+    first = np.ceil(lo/step)*step
+    return np.arange(first, hi + step*1e-9, step)
+
+def make_colormap(anchors = COLORMAP_ANCHORS, size = 256):
+    #(size, 3) uint8 lookup table, interpolated evenly between the anchor colors
+    anchors = np.array(anchors, dtype=float)
+    positions = np.linspace(0, 1, len(anchors))
+    steps = np.linspace(0, 1, size)
+    return np.stack([np.interp(steps, positions, anchors[:,c]) for c in range(3)], axis=1).round().astype(np.uint8)
+
+def format_tick(value):
+    return "%g" % (round(value, 6) + 0) #+0 turns -0.0 into 0.0
+
+class WaveformPlot:
+    """
+    A line plot rendered with pygame.
+
+    Usage:
+    plot = WaveformPlot(font, xlabel, ylabel) after pygame.init();
+    then every frame, plot.draw(x, y, x_range, y_range, markers) renders
+    the trace (and vertical marker lines at the given x positions) onto
+    plot.surf. The axes are only redrawn when x_range or y_range change.
+    plot.pixels() returns the frame as an (H, W, 3) uint8 array, the image
+    format of pyformulas' screen.
+    """
+    def __init__(self, font, xlabel = "", ylabel = "", size = PLOT_SIZE):
+        self.font = font
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.surf = pygame.Surface(size)
+        self.axes_surf = pygame.Surface(size)
+        self.area = pygame.Rect(MARGIN_LEFT, MARGIN_TOP, size[0] - MARGIN_LEFT - MARGIN_RIGHT, size[1] - MARGIN_TOP - MARGIN_BOTTOM)
+        self.x_range = None
+        self.y_range = None
+
+    def to_pixels(self, x, y):
+        #data coordinates to surface pixels; y values outside the range are clipped to the plot area
+        x0, x1 = self.x_range
+        y0, y1 = self.y_range
+        px = self.area.left + (np.asarray(x, dtype=float) - x0)*(self.area.width - 1)/(x1 - x0)
+        py = self.area.bottom - 1 - (np.asarray(y, dtype=float) - y0)*(self.area.height - 1)/(y1 - y0)
+        return (px, np.clip(py, self.area.top, self.area.bottom - 1))
+
+    def set_axes(self, x_range, y_range):
+        #draws the axes, gridlines and labels onto the background surface, if the ranges have changed
+        x_range = (float(x_range[0]), float(x_range[1]))
+        y_range = (float(y_range[0]), float(y_range[1]))
+        if x_range == self.x_range and y_range == self.y_range:
+            return False
+        self.x_range = x_range
+        self.y_range = y_range
+        surf = self.axes_surf
+        surf.fill(COLOR_BACKGROUND)
+        x_ticks = nice_ticks(*x_range)
+        y_ticks = nice_ticks(*y_range)
+        tick_px, _ = self.to_pixels(x_ticks, np.zeros(len(x_ticks)))
+        _, tick_py = self.to_pixels(np.zeros(len(y_ticks)), y_ticks)
+        for value, px in zip(x_ticks, tick_px):
+            pygame.draw.line(surf, COLOR_GRID, (px, self.area.top), (px, self.area.bottom - 1))
+            pygame.draw.line(surf, COLOR_AXES, (px, self.area.bottom), (px, self.area.bottom + TICK_LENGTH))
+            label = self.font.render(format_tick(value), True, COLOR_AXES)
+            surf.blit(label, label.get_rect(midtop = (px, self.area.bottom + TICK_LENGTH + 2)))
+        for value, py in zip(y_ticks, tick_py):
+            pygame.draw.line(surf, COLOR_GRID, (self.area.left, py), (self.area.right - 1, py))
+            pygame.draw.line(surf, COLOR_AXES, (self.area.left - TICK_LENGTH, py), (self.area.left, py))
+            label = self.font.render(format_tick(value), True, COLOR_AXES)
+            surf.blit(label, label.get_rect(midright = (self.area.left - TICK_LENGTH - 2, py)))
+        pygame.draw.rect(surf, COLOR_AXES, self.area, 1)
+        label = self.font.render(self.xlabel, True, COLOR_AXES)
+        surf.blit(label, label.get_rect(midbottom = (self.area.centerx, surf.get_height() - 2)))
+        label = pygame.transform.rotate(self.font.render(self.ylabel, True, COLOR_AXES), 90)
+        surf.blit(label, label.get_rect(midleft = (2, self.area.centery)))
+        return True
+
+    def draw(self, x, y, x_range, y_range, markers = ()):
+        self.set_axes(x_range, y_range)
+        self.surf.blit(self.axes_surf, (0, 0))
+        self.surf.set_clip(self.area) #markers or traces outside the x range aren't drawn over the labels
+        px, py = self.to_pixels(x, y)
+        if len(px) > 1:
+            pygame.draw.lines(self.surf, COLOR_TRACE, False, np.column_stack((px, py)).tolist(), TRACE_WIDTH)
+        for marker in markers:
+            mx, _ = self.to_pixels([marker], [0])
+            pygame.draw.line(self.surf, COLOR_MARKER, (mx[0], self.area.top), (mx[0], self.area.bottom - 1), TRACE_WIDTH)
+        self.surf.set_clip(None)
+        return self.surf
+
+    def pixels(self):
+        #surfarray indexes pixels as [x, y]; images are [row, column]
+        return np.ascontiguousarray(pygame.surfarray.array3d(self.surf).swapaxes(0, 1))
+
+class Waterfall(WaveformPlot):
+    """
+    A scrolling heatmap of recent traces: distance across, time down, with
+    the newest trace at the top.
+
+    Usage:
+    waterfall = Waterfall(font, xlabel) after pygame.init(); call
+    add(x, y, x_range, y_range, bls) with every new trace. A row is only
+    added every row_interval seconds (the trace given at that time is used).
+    Raw traces are colored over y_range; BLS traces (bls=True) over
+    +-bls_range instead, since the plot's y range dwarfs BLS residuals.
+    Switching between raw and BLS traces clears the history, as the two
+    can't share a color scale.
+    draw() renders onto waterfall.surf, and pixels() returns it as an image.
+    Traces are kept in a preallocated (history x trace length) ring buffer.
+    Each new row is colored once, through a colormap lookup table, straight
+    into a ring of pixel rows; drawing just blits that ring in two pieces,
+    so the cost per frame doesn't grow with the history. The whole ring is
+    only recolored if the color scale (y_range) or distance axis changes.
+    """
+    def __init__(self, font, xlabel = "", history = WATERFALL_HISTORY, row_interval = WATERFALL_ROW_INTERVAL, width = PLOT_SIZE[0], bls_range = WATERFALL_BLS_RANGE):
+        WaveformPlot.__init__(self, font, xlabel, "Seconds ago", (width, history + MARGIN_TOP + MARGIN_BOTTOM))
+        self.history = history
+        self.row_interval = row_interval
+        self.bls_range = bls_range
+        self.colormap = make_colormap()
+        self.rows = None #(history, trace length) ring buffer of traces
+        self.row_count = 0 #rows filled so far
+        self.head = 0 #ring index of the newest row
+        self.last_row_time = None
+        self.ring_surf = pygame.Surface((self.area.width, history))
+        self.ring_surf.fill(COLOR_BACKGROUND)
+        self.color_range = None
+        self.trace_x_range = None
+        self.bls = None #whether the rows are BLS traces
+        self.bin_starts = None #first trace sample of each pixel column
+        self.changed = True #a row was added since the last draw()
+
+    def set_columns(self, n_samples):
+        #each pixel column shows the largest magnitude sample of its share of the trace, so narrow peaks stay visible
+        self.bin_starts = np.linspace(0, n_samples, self.area.width, endpoint=False).astype(int)
+
+    def color_rows(self, rows):
+        #(n, trace length) traces -> (width, n, 3) pixels, laid out for surfarray
+        high = np.maximum.reduceat(rows, self.bin_starts, axis=1)
+        low = np.minimum.reduceat(rows, self.bin_starts, axis=1)
+        peaks = np.where(high >= -low, high, low)
+        y0, y1 = self.color_range
+        index = np.clip((peaks - y0)*(len(self.colormap) - 1)/(y1 - y0), 0, len(self.colormap) - 1).astype(np.intp)
+        return self.colormap[index].swapaxes(0, 1)
+
+    def recolor(self):
+        #redraws every filled row, e.g. after the color scale changes
+        self.ring_surf.fill(COLOR_BACKGROUND)
+        if self.row_count == 0:
+            return
+        filled = np.arange(self.head, self.head + self.row_count) % self.history
+        pixels = pygame.surfarray.pixels3d(self.ring_surf)
+        pixels[:, filled, :] = self.color_rows(self.rows[filled])
+        del pixels #unlocks the surface
+
+    def clear(self):
+        self.row_count = 0
+        self.ring_surf.fill(COLOR_BACKGROUND)
+
+    def add(self, x, y, x_range, y_range, bls = False, now = None):
+        #returns True if a row was added
+        if now is None:
+            now = time.monotonic()
+        if self.last_row_time is not None and now - self.last_row_time < self.row_interval:
+            return False
+        self.last_row_time = now
+        y = np.asarray(y, dtype=np.float32)
+        if self.rows is None or self.rows.shape[1] != len(y):
+            self.rows = np.zeros((self.history, len(y)), dtype=np.float32)
+            self.clear()
+            self.set_columns(len(y))
+        if bls != self.bls:
+            self.clear()
+            self.bls = bls
+        x_range = (float(x_range[0]), float(x_range[1]))
+        if bls:
+            y_range = (-float(self.bls_range), float(self.bls_range))
+        else:
+            y_range = (float(y_range[0]), float(y_range[1]))
+        recolor = y_range != self.color_range or x_range != self.trace_x_range
+        self.color_range = y_range
+        self.trace_x_range = x_range
+        #newest row is written just before the previous one, so the ring reads newest-first from the head
+        self.head = (self.head - 1) % self.history
+        self.rows[self.head] = y
+        self.row_count = min(self.row_count + 1, self.history)
+        if recolor:
+            self.recolor()
+        else:
+            pixels = pygame.surfarray.pixels3d(self.ring_surf)
+            pixels[:, self.head:self.head+1, :] = self.color_rows(self.rows[self.head:self.head+1])
+            del pixels
+        self.changed = True
+        return True
+
+    def draw(self):
+        if not self.changed:
+            return self.surf
+        self.changed = False
+        x_range = self.trace_x_range if self.trace_x_range is not None else (0, 1)
+        self.set_axes(x_range, (-self.history*self.row_interval, 0))
+        self.surf.blit(self.axes_surf, (0, 0))
+        #the ring from the head down is the newest part; the rest wraps around below it
+        newest = self.history - self.head
+        self.surf.blit(self.ring_surf, (self.area.left, self.area.top), pygame.Rect(0, self.head, self.area.width, newest))
+        if self.head > 0:
+            self.surf.blit(self.ring_surf, (self.area.left, self.area.top + newest), pygame.Rect(0, 0, self.area.width, self.head))
+        pygame.draw.rect(self.surf, COLOR_AXES, self.area, 1)
+        return self.surf
@@ -0,0 +1,166 @@
+#waveform_ring.py
+#a ring buffer of int16 waveforms in shared memory (multiprocessing.shared_memory), written by one process and read by
+#any number of others. with SSTDR_USB's -mp, the capture process (capture_sources.py -ring) parses packets and frames
+#waveforms into the ring, so that work no longer competes for the GIL with detection and rendering in the main process.
+#
+#layout: a header of int64 words (see HEADER_*), then per slot: its sequence number, timestamp, sample count, and samples.
+#every waveform written gets the next sequence number (starting at 1), and goes in slot sequence % slots. the writer
+#marks a slot as being written (negative sequence number) before changing it, so a reader can tell if a slot it read
+#was overwritten underneath it. readers never lock, copy through a pipe, or pickle anything.
+#the header also carries control words written by the reader (pause, resume, stop), for the writer to check.
+
+import os
+import numpy as np
+from multiprocessing import shared_memory
+
+#constants
+DEFAULT_SLOTS = 256 #waveforms kept; about 10-25 seconds of waveforms at the probes' rates
+DEFAULT_MAX_SAMPLES = 1024 #samples per slot; waveform regions are at most waveform_framer.MAX_BYTECOUNT bytes
+RING_MAGIC = 0x53535444 #"SSTD"
+
+#header words
+HEADER_MAGIC = 0
+HEADER_SLOTS = 1
+HEADER_MAX_SAMPLES = 2
+HEADER_SEQUENCE = 3 #sequence number of the newest complete waveform (0 before the first)
+HEADER_PAUSED = 4 #set by a reader: the writer should discard packets instead of framing them
+HEADER_RESUMES = 5 #incremented by a reader when it resumes the writer, so the writer drops any partial waveform
+HEADER_STOP = 6 #set by a reader: the writer should exit
+HEADER_WORDS = 8
+
+def ring_size(slots, max_samples):
+    #bytes of shared memory for a ring; every section is 8-byte aligned
+    sample_bytes = (slots*max_samples*2 + 7)//8*8
+    return HEADER_WORDS*8 + slots*8 + slots*8 + slots*8 + sample_bytes
+
+class WaveformRing:
+    """
+    A shared memory ring of waveforms, with sequence numbers.
+
+    Usage:
+    the owner creates it with WaveformRing.create(), and passes ring.name to
+    the other processes, which open it with WaveformRing.attach(name).
+    The (single) writer calls write(timestamp, waveform). Readers poll
+    sequence() for the newest sequence number, and call read(seq) for a
+    copy of that waveform, as (timestamp, int16 array), or None if it is no
+    longer in the ring. view(seq) gives the samples without copying; check
+    valid(seq) after using them, as the writer may have reused the slot.
+    Every process calls close() when done; the owner also calls unlink().
+    """
+    def __init__(self, shm, owner = False):
+        self.shm = shm
+        self.owner = owner
+        self.name = shm.name
+        self.header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        slots = int(self.header[HEADER_SLOTS])
+        max_samples = int(self.header[HEADER_MAX_SAMPLES])
+        self.slots = slots
+        self.max_samples = max_samples
+        offset = HEADER_WORDS*8
+        self.sequences = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += slots*8
+        self.timestamps = np.ndarray((slots,), dtype=np.float64, buffer=shm.buf, offset=offset)
+        offset += slots*8
+        self.lengths = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += slots*8
+        self.samples = np.ndarray((slots, max_samples), dtype=np.int16, buffer=shm.buf, offset=offset)
+
+    @classmethod
+    def create(cls, slots = DEFAULT_SLOTS, max_samples = DEFAULT_MAX_SAMPLES):
+        shm = shared_memory.SharedMemory(create=True, size=ring_size(slots, max_samples))
+        header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[HEADER_SLOTS] = slots
+        header[HEADER_MAX_SAMPLES] = max_samples
+        header[HEADER_MAGIC] = RING_MAGIC
+        ring = cls(shm, owner=True)
+        ring.sequences[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False) #python 3.13+
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            if os.name != 'nt':
+                #before 3.13, attaching registers the memory with this process's resource tracker, which would unlink it
+                #(out from under the owner) when this process exits
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, "shared_memory")
+        ring = cls(shm)
+        if int(ring.header[HEADER_MAGIC]) != RING_MAGIC:
+            ring.close()
+            raise ValueError("shared memory '"+name+"' is not a waveform ring")
+        return ring
+
+    ######################################################
+    ##                    WRITER                        ##
+    ######################################################
+
+    def write(self, timestamp, wf):
+        #returns the waveform's sequence number. samples past max_samples are dropped
+        sequence = int(self.header[HEADER_SEQUENCE]) + 1
+        slot = sequence % self.slots
+        n = min(len(wf), self.max_samples)
+        self.sequences[slot] = -sequence #being written
+        self.samples[slot, :n] = wf[:n]
+        self.lengths[slot] = n
+        self.timestamps[slot] = timestamp
+        self.sequences[slot] = sequence
+        self.header[HEADER_SEQUENCE] = sequence
+        return sequence
+
+    def paused(self):
+        return self.header[HEADER_PAUSED] != 0
+
+    def resumes(self):
+        return int(self.header[HEADER_RESUMES])
+
+    def stopped(self):
+        return self.header[HEADER_STOP] != 0
+
+    ######################################################
+    ##                    READERS                       ##
+    ######################################################
+
+    def sequence(self):
+        return int(self.header[HEADER_SEQUENCE])
+
+    def oldest(self):
+        #sequence number of the oldest waveform that can still be in the ring
+        return max(1, self.sequence() - self.slots + 1)
+
+    def valid(self, sequence):
+        return self.sequences[sequence % self.slots] == sequence
+
+    def view(self, sequence):
+        if not self.valid(sequence):
+            return None
+        slot = sequence % self.slots
+        return (float(self.timestamps[slot]), self.samples[slot, :self.lengths[slot]])
+
+    def read(self, sequence):
+        item = self.view(sequence)
+        if item is None:
+            return None
+        item = (item[0], item[1].copy())
+        return item if self.valid(sequence) else None
+
+    def pause(self):
+        self.header[HEADER_PAUSED] = 1
+
+    def resume(self):
+        self.header[HEADER_RESUMES] += 1
+        self.header[HEADER_PAUSED] = 0
+
+    def stop(self):
+        self.header[HEADER_STOP] = 1
+
+    def close(self):
+        #numpy views hold the buffer; they have to go before the shared memory can be closed
+        self.header = self.sequences = self.timestamps = self.lengths = self.samples = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()